@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+bigip_certificates action plugin
+
+Installs certificates and keys from the controller through the shared
+api/services/certificates.py service: one read of the device's
+certificates, one bundle upload and one tmsh install per task.
+"""
+import os
+import sys
+
+from ansible.errors import AnsibleActionFail
+from ansible.module_utils.common.text.converters import to_text
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+
+# The service lives in the API package at the repository root
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from api.services.certificates import CertificateItem, CertificateService  # noqa: E402
+from api.services.f5_client import ClientPool, FileTokenCache  # noqa: E402
+
+DEFAULT_TOKEN_CACHE = "~/.ansible/tmp/bigip_rest_tokens.json"
+
+# Worker processes are short-lived, so keys are generated when needed
+_SERVICE = CertificateService(pool_size=0)
+_POOLS = {}
+
+
+def _pool(token_cache_path):
+    path = os.path.expanduser(token_cache_path)
+    if path not in _POOLS:
+        _POOLS[path] = ClientPool(token_cache=FileTokenCache(path))
+    return _POOLS[path]
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+    _VALID_ARGS = frozenset((
+        'url', 'user', 'password', 'validate_certs', 'certificates', 'partition', 'timeout', 'token_cache',
+    ))
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        args = self._task.args
+        url = args.get('url')
+        user = args.get('user')
+        password = args.get('password')
+        if not url or not user or password is None:
+            raise AnsibleActionFail("url, user and password are required")
+        try:
+            items = [CertificateItem.from_args(entry) for entry in args.get('certificates') or []]
+        except (TypeError, ValueError) as exc:
+            raise AnsibleActionFail(to_text(exc))
+
+        client = _pool(args.get('token_cache', DEFAULT_TOKEN_CACHE)).for_url(
+            url, user, password, boolean(args.get('validate_certs', False), strict=False)
+        )
+        try:
+            certificates = _SERVICE.install(
+                client, items, partition=args.get('partition', 'Common'), timeout=float(args.get('timeout', 60))
+            )
+        except Exception as exc:  # F5Error, connection refused, TLS and timeout errors
+            result.update(failed=True, status=getattr(exc, 'status_code', None) or -1,
+                          msg="Installing certificates failed: %s" % to_text(exc))
+            return result
+
+        installed = [name for name, state in certificates.items() if state == 'installed']
+        result.update(
+            changed=bool(installed),
+            status=200,
+            certificates=certificates,
+            msg="%d installed, %d already on the device" % (len(installed), len(certificates) - len(installed)),
+        )
+        return result
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+bigip_rest action plugin
+
+Sends iControl REST requests from the controller through the shared
+api/services/f5_client.py client (token auth, keep-alive connection pool).
+"""
+import json
+import os
+import sys
+
+from ansible.errors import AnsibleActionFail
+from ansible.module_utils.common.text.converters import to_text
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+
+# The client lives in the API package at the repository root
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+from api.services.f5_client import (  # noqa: E402
+    ClientPool, F5Error, FileTokenCache, response_body
+)
+
+DEFAULT_TOKEN_CACHE = "~/.ansible/tmp/bigip_rest_tokens.json"
+
+# One pool per worker process; loop items of a task share its connections
+_POOLS = {}
+
+
+def _pool(token_cache_path):
+    path = os.path.expanduser(token_cache_path)
+    if path not in _POOLS:
+        _POOLS[path] = ClientPool(token_cache=FileTokenCache(path))
+    return _POOLS[path]
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+    _VALID_ARGS = frozenset((
+        'url', 'method', 'user', 'password', 'validate_certs', 'body',
+        'body_format', 'headers', 'status_code', 'timeout', 'token_cache',
+    ))
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        args = self._task.args
+        url = args.get('url')
+        user = args.get('user')
+        password = args.get('password')
+        if not url or not user or password is None:
+            raise AnsibleActionFail("url, user and password are required")
+
+        method = args.get('method', 'GET').upper()
+        status_code = [int(code) for code in args.get('status_code', [200])]
+        body = args.get('body')
+        request_kwargs = {
+            'headers': {k: to_text(v) for k, v in (args.get('headers') or {}).items()},
+            'timeout': float(args.get('timeout', 60)),
+        }
+        if isinstance(body, str):
+            request_kwargs['content'] = body
+        elif body is not None:
+            request_kwargs['json'] = body
+
+        client = _pool(args.get('token_cache', DEFAULT_TOKEN_CACHE)).for_url(
+            url, user, password, boolean(args.get('validate_certs', False), strict=False)
+        )
+        try:
+            response = client.request(method, url, **request_kwargs)
+        except F5Error as exc:
+            result.update(failed=True, status=exc.status_code or -1, url=url, msg=to_text(exc))
+            return result
+        except Exception as exc:  # connection refused, TLS and timeout errors
+            result.update(failed=True, status=-1, url=url, msg="Request failed: %s" % to_text(exc))
+            return result
+
+        payload = response_body(response)
+        result.update(
+            status=response.status_code,
+            url=url,
+            changed=method != 'GET' and response.status_code in (200, 201, 202),
+        )
+        if payload is not None:
+            result['json'] = payload
+        else:
+            result['content'] = response.text
+
+        if response.status_code in status_code:
+            result['msg'] = "OK (%s bytes)" % len(response.content)
+        else:
+            result['failed'] = True
+            result['msg'] = "Status code was %s and not %s: %s" % (
+                response.status_code, status_code,
+                json.dumps(payload) if payload is not None else response.text,
+            )
+        return result
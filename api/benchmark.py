@@ -0,0 +1,296 @@
+"""
+Deploy/delete benchmark for F5 BIG-IP APM
+Runs each solution's deploy and delete playbooks against the mock iControl REST server and reports timings
+
+Usage:
+    python -m api.benchmark
+    python -m api.benchmark --solutions solution1 solution2 --iterations 3 --latency 0.005
+    python -m api.benchmark --json > baseline.json
+    python -m api.benchmark --baseline baseline.json --tolerance 0.25
+"""
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .models import BIGIPCredentials, DeploymentResponse, DeploymentStatus, OperationType, SolutionType
+from .services.as3 import AS3Batcher
+from .services.deployment_engine import SOLUTION_PLAYBOOKS, DeploymentEngine, DeploymentJob, connection_vars
+from .services.f5_client import ClientPool
+from .services.scheduler import JobPriority
+from .services.store import create_store
+
+# Deploy and delete playbook per solution, in dependency order
+SOLUTIONS = SOLUTION_PLAYBOOKS
+
+# Short AS3 waits so the benchmark measures our side rather than the mock's task timer
+MOCK_AS3_DURATION = 0.2
+AS3_POLL_INTERVAL = 0.1
+
+
+class TimingTransport(httpx.BaseTransport):
+    """
+    HTTP transport shared by every pooled client that records each call's latency
+
+    Clients close their transport when they are dropped from the pool, so
+    ``close()`` is a no-op and ``shutdown()`` releases the connections.
+    """
+
+    def __init__(self):
+        self._inner = httpx.HTTPTransport(verify=False, limits=httpx.Limits(max_connections=100))
+        self._lock = threading.Lock()
+        self.samples: List[float] = []
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = self._inner.handle_request(request)
+        response.read()
+        with self._lock:
+            self.samples.append(time.perf_counter() - started)
+        return response
+
+    def close(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        self._inner.close()
+
+
+@dataclass
+class PhaseResult:
+    """One deploy or delete run"""
+    solution: str
+    operation: str
+    iteration: int
+    status: str
+    wall_time: float
+    requests: int
+    p50_ms: float
+    p99_ms: float
+    peak_memory_kb: int  # Python heap growth at the phase's peak
+    message: str = ""
+
+
+def run_phase(engine: DeploymentEngine, transport: TimingTransport, credentials: BIGIPCredentials,
+              solution: str, operation: OperationType, iteration: int) -> PhaseResult:
+    """Run one playbook through the engine exactly as the API would"""
+    deploy, delete = SOLUTIONS[solution]
+    extravars = connection_vars(credentials)
+    if operation == OperationType.DELETE:
+        extravars["confirm_delete"] = True
+    record = DeploymentResponse(
+        deployment_id=str(uuid.uuid4()),
+        # Record metadata only; the playbook decides what runs
+        solution_type=SolutionType.PORTAL if solution == "solution2" else SolutionType.VPN,
+        solution_name=solution,
+        status=DeploymentStatus.PENDING,
+        message="Benchmark",
+        operation=operation,
+        target_host=credentials.host,
+    )
+    job = DeploymentJob(
+        record=record,
+        playbook=delete if operation == OperationType.DELETE else deploy,
+        credentials=credentials,
+        extravars=extravars,
+        priority=JobPriority.DELETE if operation == OperationType.DELETE else JobPriority.DEPLOY,
+    )
+    first = len(transport.samples)
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    engine.execute(job)
+    wall_time = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    latencies = sorted(transport.samples[first:])
+    message = record.message
+    if record.status == DeploymentStatus.FAILED and record.errors:
+        message = f"{message}: {record.errors[0]}"
+    return PhaseResult(
+        solution=solution,
+        operation=operation.value,
+        iteration=iteration,
+        status=record.status.value,
+        wall_time=round(wall_time, 3),
+        requests=len(latencies),
+        p50_ms=round(_percentile(latencies, 0.50) * 1000, 2),
+        p99_ms=round(_percentile(latencies, 0.99) * 1000, 2),
+        peak_memory_kb=peak // 1024,
+        message=message,
+    )
+
+
+def run_benchmark(credentials: BIGIPCredentials, solutions: List[str], iterations: int = 1) -> List[PhaseResult]:
+    """
+    Deploy every solution, then delete them in reverse order, ``iterations`` times
+
+    Solutions that build on another one (5 on 4, 11 on 10) find it deployed.
+    """
+    transport = TimingTransport()
+    clients = ClientPool(transport=transport)
+    engine = DeploymentEngine(
+        create_store("memory://"), max_workers=1, clients=clients,
+        as3=AS3Batcher(batch_window=0.0, poll_interval=AS3_POLL_INTERVAL),
+    )
+    results = []
+    tracemalloc.start()
+    try:
+        for iteration in range(1, iterations + 1):
+            phases = [(solution, OperationType.DEPLOY) for solution in solutions]
+            phases += [(solution, OperationType.DELETE) for solution in reversed(solutions)]
+            for solution, operation in phases:
+                result = run_phase(engine, transport, credentials, solution, operation, iteration)
+                results.append(result)
+                _progress(result)
+    finally:
+        tracemalloc.stop()
+        engine.shutdown()
+        clients.close_all()
+        transport.shutdown()
+    return results
+
+
+def _progress(result: PhaseResult) -> None:
+    sys.stderr.write(
+        f"  {result.solution:<11} {result.operation:<7} {result.status:<10} {result.wall_time:7.2f}s "
+        f"{result.requests:5d} calls\n"
+    )
+
+
+def summarize(results: List[PhaseResult]) -> List[Dict[str, Any]]:
+    """Median per solution and operation over the iterations"""
+    groups: Dict[tuple, List[PhaseResult]] = {}
+    for result in results:
+        groups.setdefault((result.solution, result.operation), []).append(result)
+    summary = []
+    for (solution, operation), runs in groups.items():
+        summary.append({
+            "solution": solution,
+            "operation": operation,
+            "runs": len(runs),
+            "failed": sum(1 for run in runs if run.status != DeploymentStatus.COMPLETED.value),
+            "wall_time": round(statistics.median(run.wall_time for run in runs), 3),
+            "requests": max(run.requests for run in runs),
+            "p50_ms": round(statistics.median(run.p50_ms for run in runs), 2),
+            "p99_ms": round(statistics.median(run.p99_ms for run in runs), 2),
+            "peak_memory_kb": max(run.peak_memory_kb for run in runs),
+        })
+    return summary
+
+
+def regressions(summary: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Rows slower or chattier than the baseline by more than ``tolerance`` (AS3 polling varies a little)"""
+    previous = {(row["solution"], row["operation"]): row for row in baseline}
+    found = []
+    for row in summary:
+        before = previous.get((row["solution"], row["operation"]))
+        if before is None:
+            continue
+        name = f"{row['solution']} {row['operation']}"
+        if row["wall_time"] > before["wall_time"] * (1 + tolerance):
+            found.append(f"{name}: {row['wall_time']:.2f}s vs {before['wall_time']:.2f}s")
+        if row["requests"] > before["requests"] * (1 + tolerance):
+            found.append(f"{name}: {row['requests']} calls vs {before['requests']}")
+        if row["failed"] > before.get("failed", 0):
+            found.append(f"{name}: {row['failed']} failed run(s)")
+    return found
+
+
+def start_mock(args: argparse.Namespace) -> "tuple[subprocess.Popen, int]":
+    """Run the mock in its own process so its work is not counted against ours"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    command = [
+        sys.executable, "-m", "api.mock_bigip", "--port", str(port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--as3-duration", str(MOCK_AS3_DURATION), "--seed", "1",
+    ]
+    process = subprocess.Popen(command, cwd=Path(__file__).resolve().parents[1],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"https://127.0.0.1:{port}/mock/stats", verify=False, timeout=1.0)
+            return process, port
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock BIG-IP did not start")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the deploy/delete playbooks against a mock BIG-IP")
+    parser.add_argument("--solutions", nargs="+", default=list(SOLUTIONS), choices=list(SOLUTIONS),
+                        metavar="SOLUTION", help="Solutions to run (default: all)")
+    parser.add_argument("--iterations", type=int, default=1, help="Deploy/delete rounds per solution")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock latency per call, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Mock latency jitter, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock calls that fail")
+    parser.add_argument("--target", metavar="HOST:PORT",
+                        help="Use an already running mock instead of starting one")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON (usable as --baseline)")
+    parser.add_argument("--baseline", type=Path, help="Earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed wall-time growth over the baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        host, port = host or "127.0.0.1", int(port)
+    else:
+        process, port = start_mock(args)
+        host = "127.0.0.1"
+    credentials = BIGIPCredentials(host=host, port=port, username="admin", password="admin")
+    try:
+        results = run_benchmark(credentials, args.solutions, args.iterations)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    summary = summarize(results)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{'solution':<11} {'op':<7} {'wall s':>8} {'calls':>6} {'p50 ms':>8} {'p99 ms':>8} {'peak KiB':>9}  failed")
+        for row in summary:
+            print(
+                f"{row['solution']:<11} {row['operation']:<7} {row['wall_time']:8.2f} {row['requests']:6d} "
+                f"{row['p50_ms']:8.2f} {row['p99_ms']:8.2f} {row['peak_memory_kb']:9d}  {row['failed']}"
+            )
+        for result in results:
+            if result.status != DeploymentStatus.COMPLETED.value:
+                print(f"{result.solution} {result.operation} #{result.iteration}: {result.message}")
+
+    failed = any(row["failed"] for row in summary)
+    if args.baseline:
+        found = regressions(summary, json.loads(args.baseline.read_text()), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        failed = failed or bool(found)
+    return 1 if failed else 0
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Fleet deploy CLI for F5 BIG-IP APM
+Applies one solution definition to every BIG-IP in inventory.yml (or a device list) in parallel
+
+Usage:
+    python -m api.fleet_cli --type portal --solution portal.yml
+    python -m api.fleet_cli --type vpn --solution vpn.json --limit 'edge-*' --concurrency 50 --fail-fast
+"""
+import argparse
+import fnmatch
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+from pydantic import ValidationError
+
+from .models import BIGIPCredentials, DeployMode, FailurePolicy, FleetDeployRequest, SolutionType
+from .services.deployment_engine import DeploymentEngine
+from .services.f5_client import ClientPool
+from .services.fleet import DEFAULT_FLEET_CONCURRENCY, FleetRunner, describe_validation_error
+from .services.store import create_store
+
+
+def inventory_devices(path: Path, group: str = "bigip", limit: Optional[str] = None) -> List[BIGIPCredentials]:
+    """Credentials of every host in ``group`` of an inventory.yml-style file"""
+    inventory = yaml.safe_load(path.read_text()) or {}
+    groups = (inventory.get("all") or {}).get("children") or inventory
+    section = groups.get(group) or {}
+    group_vars = section.get("vars") or {}
+    devices = []
+    for name, host_vars in (section.get("hosts") or {}).items():
+        if limit and not fnmatch.fnmatch(name, limit):
+            continue
+        merged = {**group_vars, **(host_vars or {})}
+        devices.append(BIGIPCredentials(
+            host=str(merged.get("ansible_host", name)),
+            port=int(merged.get("bigip_port", 443)),
+            username=merged.get("bigip_user", "admin"),
+            password=str(merged.get("bigip_pass", "")),
+            validate_certs=bool(merged.get("validate_certs", False)),
+        ))
+    return devices
+
+
+def load_definition(path: Path) -> Dict[str, Any]:
+    """Solution definition from a JSON or YAML file"""
+    text = path.read_text()
+    return json.loads(text) if path.suffix == ".json" else yaml.safe_load(text)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Deploy one APM solution to many BIG-IPs")
+    parser.add_argument("--type", required=True, choices=[t.value for t in SolutionType],
+                        help="Solution type")
+    parser.add_argument("--solution", required=True, type=Path,
+                        help="Solution 1/2 request body (JSON or YAML) without credentials")
+    parser.add_argument("--inventory", type=Path, default=Path("inventory.yml"),
+                        help="Inventory with the devices (default: inventory.yml)")
+    parser.add_argument("--group", default="bigip", help="Inventory group (default: bigip)")
+    parser.add_argument("--limit", help="Only hosts whose inventory name matches this glob")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_FLEET_CONCURRENCY,
+                        help=f"Devices deployed at once (default: {DEFAULT_FLEET_CONCURRENCY})")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="Start no further devices after the first failure")
+    parser.add_argument("--mode", default=DeployMode.FULL.value, choices=[m.value for m in DeployMode])
+    parser.add_argument("--executor", default="native", choices=DeploymentEngine.BACKENDS)
+    parser.add_argument("--store", default="memory://",
+                        help="Deployment store URL, e.g. sqlite:///apm_deployments.db (default: memory://)")
+    parser.add_argument("--json", action="store_true", help="Print the aggregated result as JSON")
+    args = parser.parse_args(argv)
+
+    devices = inventory_devices(args.inventory, args.group, args.limit)
+    if not devices:
+        parser.error(f"No hosts in group '{args.group}' of {args.inventory}")
+    try:
+        request = FleetDeployRequest(
+            solution_type=SolutionType(args.type),
+            solution=load_definition(args.solution),
+            devices=devices,
+            max_concurrency=args.concurrency,
+            failure_policy=FailurePolicy.FAIL_FAST if args.fail_fast else FailurePolicy.CONTINUE,
+            mode=DeployMode(args.mode),
+        )
+    except ValidationError as exc:
+        parser.error(describe_validation_error(exc))
+
+    store = create_store(args.store)
+    clients = ClientPool()
+    engine = DeploymentEngine(store, backend=args.executor, clients=clients)
+    runner = FleetRunner(engine, max_concurrency=args.concurrency)
+
+    def progress(device):
+        if not args.json:
+            sys.stdout.write(
+                f"  {device.host:<30} {device.status:<10} {device.duration or 0:7.1f}s  {device.message or ''}\n"
+            )
+
+    try:
+        result = runner.run(request, on_device=progress)
+    except ValidationError as exc:
+        print(f"Invalid {args.type} solution definition: {describe_validation_error(exc)}", file=sys.stderr)
+        return 2
+    finally:
+        runner.shutdown()
+        engine.shutdown()
+        clients.close_all()
+        store.close()
+
+    if args.json:
+        print(result.model_dump_json(indent=2))
+    else:
+        for device in result.devices:
+            if device.status == "skipped":
+                progress(device)
+        print(result.message)
+    return 0 if result.failed == 0 and result.skipped == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,18 +2,51 @@
 F5 BIG-IP APM REST API Service
 FastAPI-based REST API for deploying and managing F5 APM solutions
 """
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import json
+import httpx
+import logging
+import os
 import time
 import uuid
-from typing import Dict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, ValidationError
 
 from .models import (
     Solution1Request, Solution2Request, DeleteRequest,
     DeploymentResponse, DeleteResponse, HealthResponse,
-    BIGIPInfo, DeploymentStatus, SolutionType
+    BIGIPInfo, BIGIPCredentials, DeploymentStatus, SolutionType, OperationType,
+    DeploymentList, FleetDeployRequest, FleetResponse, SchedulerStats, CompiledPlanResponse,
+    BulkDeployRequest, BulkResponse, DriftReport, DriftSummary, SnapshotRequest, RollbackRequest
+)
+from .services import metrics
+from .services.addresses import AddressAllocator
+from .services.as3 import AS3Batcher
+from .services.bulk import BulkRunner, BulkValidationError
+from .services.certificates import CertificateService
+from .services.compiler import PlanCompiler
+from .services.deployment_engine import (
+    PLAYBOOKS, SOLUTION_PLAYBOOKS, DeploymentEngine, EngineBusyError, deployment_job,
+    rollback_job, snapshot_job, solution1_vars, solution2_vars
 )
+from .services.device_info import DeviceInfoCache
+from .services.drift import DriftMonitor
+from .services.events import EventBroker, parse_last_event_id
+from .services.f5_client import ClientPool, F5AuthError, F5Error
+from .services.fleet import FleetRunner, describe_validation_error
+from .services.gslb import GTMTopologyCache
+from .services.idempotency import IdempotencyConflict, IdempotencyGone, IdempotencyGuard
+from .services.policy_apply import PolicyApplyCoordinator
+from .services.store import MAX_PAGE_SIZE, RetentionPolicy, create_store
+from .services.throttle import DeviceLimiters, RetryPolicy
+
+logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -33,10 +66,181 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global state (use Redis/database in production)
-deployments: Dict[str, DeploymentResponse] = {}
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """Count and time every request by route template (not raw path, which carries IDs)"""
+    started = time.monotonic()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.API_REQUESTS.labels(method=request.method, route=route, status=str(response.status_code)).inc()
+    metrics.API_LATENCY.labels(method=request.method, route=route).observe(time.monotonic() - started)
+    return response
+
+# Deployment records (SQLite by default, shared by every worker on the host)
+deployments = create_store()
+retention = RetentionPolicy.from_env()
+RETENTION_INTERVAL = float(os.getenv("APM_RETENTION_INTERVAL", "3600"))
 start_time = time.time()
 
+# Pooled, token-authenticated iControl REST clients (one per device), calls in flight per device
+# bounded by an adaptive limit and calls restjavad turns away retried with jitter
+clients = ClientPool(
+    limiters=DeviceLimiters(
+        initial=int(os.getenv("APM_DEVICE_CONCURRENCY", "8")),
+        max_limit=int(os.getenv("APM_DEVICE_MAX_CONCURRENCY", "20")),
+    ),
+    retry=RetryPolicy(retries=int(os.getenv("APM_REQUEST_RETRIES", "3"))),
+)
+
+# Device/AS3 info per BIG-IP, shared by /bigip/info and the playbooks' connectivity checks
+device_info = DeviceInfoCache(
+    ttl=float(os.getenv("APM_DEVICE_INFO_TTL", "300")),
+    max_entries=int(os.getenv("APM_DEVICE_INFO_CACHE_SIZE", "1024")),
+)
+
+# GTM datacenters/servers/virtual servers per DNS server, read once by the GSLB tasks
+gtm = GTMTopologyCache(ttl=float(os.getenv("APM_GTM_TOPOLOGY_TTL", "300")))
+
+# VIPs handed out from a local pool per address manager scope, refilled APM_ADDRESS_BLOCK_SIZE at a time
+addresses = AddressAllocator(
+    block_size=int(os.getenv("APM_ADDRESS_BLOCK_SIZE", "16")),
+    status_ttl=float(os.getenv("APM_ADDRESS_STATUS_TTL", "30")),
+    hold_wait=float(os.getenv("APM_ADDRESS_HOLD_WAIT", "5")),
+)
+
+# RSA keys generated ahead in worker processes for self-signed certificate installs
+certificates = CertificateService(
+    pool_size=int(os.getenv("APM_CERT_POOL_SIZE", "8")),
+    workers=int(os.getenv("APM_CERT_WORKERS", "2")),
+)
+
+# Offline plans per solution definition; with APM_PREFLIGHT deploys are validated against them first
+compiler = PlanCompiler(max_entries=int(os.getenv("APM_PLAN_CACHE_SIZE", "256")))
+PREFLIGHT = os.getenv("APM_PREFLIGHT", "true").lower() in ("1", "true", "yes")
+
+# Idempotency-Key replay and coalescing of identical in-flight deploys (keys kept in the store)
+idempotency = IdempotencyGuard(deployments, ttl=float(os.getenv("APM_IDEMPOTENCY_TTL", "86400")))
+
+# Objects of completed deploys, checked for drift every APM_DRIFT_INTERVAL seconds (0 disables)
+drift = DriftMonitor(
+    deployments, clients,
+    interval=float(os.getenv("APM_DRIFT_INTERVAL", "300")),
+    concurrency=int(os.getenv("APM_DRIFT_CONCURRENCY", "20")),
+)
+
+# Live task events for streaming clients
+events = EventBroker(max_finished=int(os.getenv("APM_EVENT_HISTORY", "1000")))
+
+# Bounded playbook job engine
+engine = DeploymentEngine(
+    deployments,
+    max_workers=int(os.getenv("APM_MAX_CONCURRENT_DEPLOYMENTS", "8")),
+    max_pending=int(os.getenv("APM_MAX_PENDING_DEPLOYMENTS", "500")),
+    max_suspended=int(os.getenv("APM_MAX_SUSPENDED_DEPLOYMENTS", "32")),
+    backend=os.getenv("APM_EXECUTOR", "native"),
+    clients=clients,
+    staging_concurrency=int(os.getenv("APM_TRANSACTION_CONCURRENCY", "8")),
+    teardown_concurrency=int(os.getenv("APM_TEARDOWN_CONCURRENCY", "8")),
+    events=events,
+    as3=AS3Batcher(batch_window=float(os.getenv("APM_AS3_BATCH_WINDOW", "0.5"))),
+    applies=PolicyApplyCoordinator(window=float(os.getenv("APM_POLICY_APPLY_WINDOW", "0.5"))),
+    device_info=device_info,
+    compiler=compiler if PREFLIGHT else None,
+    gtm=gtm,
+    addresses=addresses,
+    certificates=certificates,
+    drift=drift,
+)
+
+# Fleet fan-out (one job per device at a time, APM_FLEET_CONCURRENCY devices at once)
+fleet = FleetRunner(engine, max_concurrency=int(os.getenv("APM_FLEET_CONCURRENCY", "20")))
+
+# Bulk deploys (mixed solutions grouped per device, devices prepared APM_FLEET_CONCURRENCY at a time)
+bulk = BulkRunner(engine, max_concurrency=int(os.getenv("APM_FLEET_CONCURRENCY", "20")))
+
+
+async def retention_loop():
+    """Compact and expire old deployment records"""
+    while True:
+        try:
+            await run_in_threadpool(deployments.apply_retention, retention)
+        except Exception:
+            logger.exception("Deployment retention failed")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_retention():
+    app.state.retention_task = asyncio.create_task(retention_loop())
+
+
+async def drift_loop():
+    """Check every watched device for drift"""
+    while True:
+        await asyncio.sleep(drift.interval)
+        try:
+            await run_in_threadpool(drift.run_once)
+        except Exception:
+            logger.exception("Drift check failed")
+
+
+@app.on_event("startup")
+async def start_drift_checks():
+    app.state.drift_task = asyncio.create_task(drift_loop()) if drift.interval > 0 else None
+
+
+@app.on_event("startup")
+async def start_certificate_keys():
+    """Start generating keys for self-signed certificates"""
+    certificates.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_engine():
+    """Let running playbooks finish before the process exits"""
+    app.state.retention_task.cancel()
+    if app.state.drift_task is not None:
+        app.state.drift_task.cancel()
+    fleet.shutdown(wait=True)
+    bulk.shutdown(wait=True)
+    engine.shutdown(wait=True)
+    drift.shutdown(wait=True)
+    clients.close_all()
+    deployments.close()
+
+
+async def submit_job(job) -> DeploymentResponse:
+    """Queue a job off the event loop (it saves the record), translating a full queue into HTTP 503"""
+    try:
+        return await run_in_threadpool(engine.submit, job)
+    except EngineBusyError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(exc)
+        )
+
+
+async def submit_idempotent(endpoint: str, request: BaseModel, job, idempotency_key: Optional[str],
+                            http_response: Response) -> DeploymentResponse:
+    """Submit a deploy unless its Idempotency-Key or an identical in-flight request already started one"""
+    try:
+        claim = await run_in_threadpool(
+            idempotency.claim, endpoint, request.model_dump(mode="json"), job.record, idempotency_key
+        )
+    except IdempotencyConflict as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc))
+    except IdempotencyGone as exc:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(exc))
+    if claim.existing is not None:
+        http_response.headers["Idempotent-Replayed"] = "true"
+        return claim.existing
+    try:
+        return await submit_job(job)
+    except HTTPException:
+        await run_in_threadpool(idempotency.release, claim, job.record)
+        raise
+
 
 @app.get("/", tags=["Health"])
 async def root():
@@ -59,24 +263,51 @@ async def health_check():
     )
 
 
+@app.get("/metrics", tags=["Health"], include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus metrics (API, deployments, tasks, iControl REST calls, AS3)"""
+    body, content_type = metrics.render()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+
 @app.post("/api/v1/bigip/info", response_model=BIGIPInfo, tags=["BIG-IP"])
-async def get_bigip_info(request: dict):
+async def get_bigip_info(
+    request: BIGIPCredentials,
+    refresh: bool = Query(False, description="Query the device even if a cached result is fresh")
+):
     """
     Get BIG-IP system information
 
     - **host**: BIG-IP management IP/hostname
     - **username**: Admin username
     - **password**: Admin password
+
+    Results are cached per device for `APM_DEVICE_INFO_TTL` seconds.
     """
-    # TODO: Implement F5 API call to get system info
-    raise HTTPException(
-        status_code=status.HTTP_501_NOT_IMPLEMENTED,
-        detail="Endpoint not yet implemented. Use Ansible playbooks for now."
+    client = clients.for_credentials(request)
+    try:
+        info = await run_in_threadpool(device_info.get, client, refresh)
+    except F5AuthError as exc:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc))
+    except (F5Error, httpx.HTTPError) as exc:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(exc))
+
+    return BIGIPInfo(
+        version=info.get("version", ""),
+        build=info.get("build", ""),
+        hostname=info.get("hostname"),
+        platform=info.get("platform"),
+        as3_installed=info.get("as3Version") is not None,
+        as3_version=info.get("as3Version")
     )
 
 
 @app.post("/api/v1/deploy/solution1", response_model=DeploymentResponse, tags=["Deployment"])
-async def deploy_solution1(request: Solution1Request):
+async def deploy_solution1(
+    request: Solution1Request,
+    http_response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     """
     Deploy Solution 1: VPN with Network Access
 
@@ -86,27 +317,35 @@ async def deploy_solution1(request: Solution1Request):
     - Network access resource with IP lease pool
     - Webtop user portal
     - Access policy with logon page and AD auth
+
+    Retries with the same `Idempotency-Key`, or identical requests while
+    the first is still running, return the existing deployment.
     """
     deployment_id = str(uuid.uuid4())
 
-    # TODO: Implement Ansible playbook execution
-    # For now, return a mock response
     response = DeploymentResponse(
         deployment_id=deployment_id,
         solution_type=SolutionType.VPN,
         solution_name=request.solution_name,
         status=DeploymentStatus.PENDING,
-        message="Deployment queued. Use Ansible playbooks for actual deployment.",
+        message="Deployment queued",
+        target_host=request.credentials.host,
         created_resources={}
     )
 
-    deployments[deployment_id] = response
-
-    return response
+    return await submit_idempotent(
+        "solution1", request,
+        deployment_job(response, request.credentials, solution1_vars(request), request.mode),
+        idempotency_key, http_response,
+    )
 
 
 @app.post("/api/v1/deploy/solution2", response_model=DeploymentResponse, tags=["Deployment"])
-async def deploy_solution2(request: Solution2Request):
+async def deploy_solution2(
+    request: Solution2Request,
+    http_response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
     """
     Deploy Solution 2: Portal Access with AD Group Mapping
 
@@ -116,34 +355,266 @@ async def deploy_solution2(request: Solution2Request):
     - AD group-based dynamic resource assignment
     - Webtop with group-specific resources
     - Optional VPN access for specific groups
+
+    Deduplicated like Solution 1 (`Idempotency-Key`, identical in-flight requests).
     """
     deployment_id = str(uuid.uuid4())
 
-    # TODO: Implement Ansible playbook execution
     response = DeploymentResponse(
         deployment_id=deployment_id,
         solution_type=SolutionType.PORTAL,
         solution_name=request.solution_name,
         status=DeploymentStatus.PENDING,
-        message="Deployment queued. Use Ansible playbooks for actual deployment.",
+        message="Deployment queued",
+        target_host=request.credentials.host,
         created_resources={}
     )
 
-    deployments[deployment_id] = response
+    return await submit_idempotent(
+        "solution2", request,
+        deployment_job(response, request.credentials, solution2_vars(request), request.mode),
+        idempotency_key, http_response,
+    )
+
+
+async def compiled_plan(playbook: str, extravars: Dict[str, Any], bodies: bool) -> CompiledPlanResponse:
+    plan = await run_in_threadpool(compiler.compile, playbook, extravars)
+    return CompiledPlanResponse(**plan.as_dict(bodies))
+
+
+@app.post("/api/v1/plan/solution1", response_model=CompiledPlanResponse, tags=["Plan"])
+async def plan_solution1(
+    request: Solution1Request,
+    bodies: bool = Query(True, description="Include request bodies (secrets masked)")
+):
+    """
+    Compile Solution 1 into its iControl REST calls without contacting the device
+
+    Returns every call in order with its transaction group and checks the
+    references between the objects (policy items, agents, customization
+    groups). Credentials are not used.
+    """
+    return await compiled_plan(
+        PLAYBOOKS[SolutionType.VPN][OperationType.DEPLOY], solution1_vars(request), bodies
+    )
+
+
+@app.post("/api/v1/plan/solution2", response_model=CompiledPlanResponse, tags=["Plan"])
+async def plan_solution2(
+    request: Solution2Request,
+    bodies: bool = Query(True, description="Include request bodies (secrets masked)")
+):
+    """Compile Solution 2 into its iControl REST calls without contacting the device"""
+    return await compiled_plan(
+        PLAYBOOKS[SolutionType.PORTAL][OperationType.DEPLOY], solution2_vars(request), bodies
+    )
+
+
+@app.get("/api/v1/plan/{solution}", response_model=CompiledPlanResponse, tags=["Plan"])
+async def plan_solution_vars(
+    solution: str,
+    bodies: bool = Query(True, description="Include request bodies (secrets masked)")
+):
+    """Compile a solution's deploy playbook as configured in vars/solutionN.yml"""
+    if solution not in SOLUTION_PLAYBOOKS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown solution '{solution}' (expected one of {', '.join(SOLUTION_PLAYBOOKS)})"
+        )
+    return await compiled_plan(SOLUTION_PLAYBOOKS[solution][0], {}, bodies)
+
+
+@app.get("/api/v1/scheduler", response_model=SchedulerStats, tags=["Deployment"])
+async def scheduler_stats():
+    """
+    Per-device job queues
+
+    Jobs on one BIG-IP run one at a time (deletes and rollbacks first);
+    shows queue depth and how long jobs waited for their device, and each
+    device's adaptive iControl REST concurrency limit.
+    """
+    return {**engine.scheduler.stats(), "concurrency": clients.limiters.snapshot()}
+
+
+@app.post("/api/v1/fleet/deploy", response_model=FleetResponse, tags=["Fleet"])
+async def deploy_fleet(request: FleetDeployRequest):
+    """
+    Deploy one solution definition to many BIG-IPs
+
+    Devices are deployed in parallel (up to ``max_concurrency``, capped by
+    the server), never more than one job per device at a time. With
+    ``fail_fast`` no further devices are started after the first failure.
+    Each device gets its own deployment record and event stream.
+    """
+    try:
+        return await run_in_threadpool(fleet.submit, request)
+    except ValidationError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid {request.solution_type.value} solution definition: "
+                   f"{describe_validation_error(exc)}"
+        )
+
+
+@app.get("/api/v1/fleet/{fleet_id}", response_model=FleetResponse, tags=["Fleet"])
+async def get_fleet_status(fleet_id: str):
+    """Aggregated status of a fleet deploy"""
+    result = fleet.get(fleet_id)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Fleet deploy {fleet_id} not found"
+        )
+    return result
 
-    return response
+
+@app.post("/api/v1/deploy/bulk", response_model=BulkResponse, tags=["Deployment"])
+async def deploy_bulk(request: BulkDeployRequest):
+    """
+    Deploy many Solution 1/2 requests in one call
+
+    Every item is validated before anything starts (422 lists the invalid
+    items). Items are grouped by device: each device is logged into and
+    checked once, and the AS3 declarations of its items go out as one AS3
+    run. Each item gets its own deployment record; the batch status is at
+    ``GET /api/v1/deploy/bulk/{batch_id}``.
+    """
+    try:
+        return await run_in_threadpool(bulk.submit, request)
+    except BulkValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=exc.errors)
+    except EngineBusyError as exc:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc))
+
+
+@app.get("/api/v1/deploy/bulk/{batch_id}", response_model=BulkResponse, tags=["Deployment"])
+async def get_bulk_status(batch_id: str):
+    """Per-item status of a bulk deploy"""
+    result = bulk.get(batch_id)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Bulk deploy {batch_id} not found"
+        )
+    return result
 
 
 @app.get("/api/v1/deploy/{deployment_id}", response_model=DeploymentResponse, tags=["Deployment"])
 async def get_deployment_status(deployment_id: str):
     """Get deployment status by ID"""
-    if deployment_id not in deployments:
+    record = await run_in_threadpool(deployments.get, deployment_id)
+    if record is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Deployment {deployment_id} not found"
         )
 
-    return deployments[deployment_id]
+    return record
+
+
+async def _stored_events(deployment_id: str):
+    """
+    Snapshots from the store for deployments this process is not running
+
+    Used when the job runs in another worker or its event history has
+    expired; these events carry no ID and cannot be resumed.
+    """
+    last = None
+    while True:
+        record = await run_in_threadpool(deployments.get, deployment_id)
+        if record is None:
+            return
+        state = (record.status, len(record.tasks), record.message)
+        if state != last:
+            last = state
+            yield "snapshot", record.model_dump(mode="json")
+        if record.status not in (DeploymentStatus.PENDING, DeploymentStatus.IN_PROGRESS):
+            yield "end", {"status": record.status.value, "message": record.message,
+                          "errors": record.errors}
+            return
+        await asyncio.sleep(engine.save_interval)
+
+
+async def _event_source(deployment_id: str, last_event_id: Optional[str]):
+    """Stream for a deployment, or 404/400 before any event is sent"""
+    try:
+        after = parse_last_event_id(last_event_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    stream = events.get(deployment_id)
+    if stream is None and await run_in_threadpool(deployments.get, deployment_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Deployment {deployment_id} not found"
+        )
+    return stream, after
+
+
+@app.get("/api/v1/deploy/{deployment_id}/events", tags=["Deployment"])
+async def stream_deployment_events(
+    deployment_id: str,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    after: Optional[str] = Query(None, alias="last_event_id", description="Resume after this event ID"),
+):
+    """
+    Server-Sent Events stream of a deployment's progress
+
+    Emits ``status``, ``task_start``, ``task_end`` (with duration and HTTP
+    status code) and a final ``end`` event. Reconnecting with the
+    ``Last-Event-ID`` header replays only the events that were missed.
+    """
+    stream, start = await _event_source(deployment_id, last_event_id or after)
+
+    async def frames():
+        if stream is None:
+            async for event, data in _stored_events(deployment_id):
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+            return
+        async for event in stream.follow(start):
+            yield event.sse() if event is not None else ": keepalive\n\n"
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/api/v1/deploy/{deployment_id}/ws")
+async def deployment_events_websocket(websocket: WebSocket, deployment_id: str,
+                                      last_event_id: Optional[str] = None):
+    """WebSocket variant of the event stream: one JSON message per event"""
+    try:
+        stream, start = await _event_source(deployment_id, last_event_id)
+    except HTTPException as exc:
+        await websocket.close(code=4000 + exc.status_code, reason=str(exc.detail))
+        return
+    await websocket.accept()
+    try:
+        if stream is None:
+            async for event, data in _stored_events(deployment_id):
+                await websocket.send_json({"id": None, "event": event, "data": data})
+        else:
+            async for event in stream.follow(start):
+                if event is None:
+                    await websocket.send_json({"event": "keepalive"})
+                else:
+                    await websocket.send_text(json.dumps(event.as_dict(), default=str))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/api/v1/deploy/{deployment_id}/drift", response_model=DriftReport, tags=["Drift"])
+async def get_deployment_drift(deployment_id: str):
+    """Latest drift check of a deployment (404 until its device has been checked)"""
+    report = drift.report(deployment_id)
+    if report is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No drift check of deployment {deployment_id} yet"
+        )
+    return report
 
 
 @app.delete("/api/v1/deploy/{solution_name}", response_model=DeleteResponse, tags=["Deployment"])
@@ -164,24 +635,179 @@ async def delete_solution(solution_name: str, request: DeleteRequest):
             detail="Deletion requires confirmation. Set 'confirm': true"
         )
 
-    # TODO: Implement Ansible delete playbook execution
-    response = DeleteResponse(
+    solution_type = request.solution_type or await run_in_threadpool(
+        _last_solution_type, solution_name
+    )
+    record = DeploymentResponse(
+        deployment_id=str(uuid.uuid4()),
+        solution_type=solution_type,
         solution_name=solution_name,
         status=DeploymentStatus.PENDING,
-        message="Deletion queued. Use Ansible playbooks for actual deletion.",
+        message="Deletion queued",
+        operation=OperationType.DELETE,
+        target_host=request.credentials.host
+    )
+    await submit_job(deployment_job(record, request.credentials))
+
+    return DeleteResponse(
+        solution_name=solution_name,
+        deployment_id=record.deployment_id,
+        status=record.status,
+        message=f"{record.message}. Track progress at /api/v1/deploy/{record.deployment_id}",
         deleted_resources={}
     )
 
-    return response
 
+@app.post("/api/v1/snapshots", response_model=DeploymentResponse, tags=["Snapshots"])
+async def create_snapshot(request: SnapshotRequest):
+    """
+    Snapshot a deployed solution before changing it
 
-@app.get("/api/v1/deployments", tags=["Deployment"])
-async def list_deployments():
-    """List all deployments"""
-    return {
-        "total": len(deployments),
-        "deployments": list(deployments.values())
-    }
+    Captures the objects the solution's last deploy created (AAA servers,
+    policies, policy items, resources, profiles, ...) as they are on the
+    device, with one read per collection. The snapshot is stored in the
+    returned record (``snapshot``); its ``deployment_id`` is the snapshot ID.
+    """
+    solution_type = await run_in_threadpool(_last_solution_type, request.solution_name)
+    record = DeploymentResponse(
+        deployment_id=str(uuid.uuid4()),
+        solution_type=solution_type,
+        solution_name=request.solution_name,
+        status=DeploymentStatus.PENDING,
+        message="Snapshot queued",
+        operation=OperationType.SNAPSHOT,
+        target_host=request.credentials.host
+    )
+    return await submit_job(snapshot_job(record, request.credentials))
+
+
+@app.post("/api/v1/snapshots/{snapshot_id}/rollback", response_model=DeploymentResponse, tags=["Snapshots"])
+async def rollback_snapshot(snapshot_id: str, request: RollbackRequest):
+    """
+    Restore a solution to a snapshot
+
+    The device is diffed against the snapshot: objects deleted since are
+    re-created, changed ones get a PATCH of the changed fields and objects
+    added since are deleted, all in one transaction, followed by one apply
+    of the access policy. Rollbacks run ahead of other jobs queued on the
+    device.
+    """
+    if not request.confirm:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Rollback requires confirmation. Set 'confirm': true"
+        )
+    snapshot = await run_in_threadpool(deployments.get, snapshot_id)
+    if snapshot is None or snapshot.operation != OperationType.SNAPSHOT:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Snapshot {snapshot_id} not found"
+        )
+    if snapshot.status != DeploymentStatus.COMPLETED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Snapshot {snapshot_id} is {snapshot.status.value}"
+        )
+    if (snapshot.target_host or "").lower() != request.credentials.host.lower():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Snapshot {snapshot_id} was taken on {snapshot.target_host}"
+        )
+    record = DeploymentResponse(
+        deployment_id=str(uuid.uuid4()),
+        solution_type=snapshot.solution_type,
+        solution_name=snapshot.solution_name,
+        status=DeploymentStatus.PENDING,
+        message="Rollback queued",
+        operation=OperationType.ROLLBACK,
+        target_host=request.credentials.host,
+        snapshot_id=snapshot_id
+    )
+    return await submit_job(rollback_job(record, request.credentials))
+
+
+def _last_solution_type(solution_name: str) -> SolutionType:
+    """Solution type of the most recent deployment of ``solution_name``"""
+    record = deployments.latest(solution_name=solution_name, operation=OperationType.DEPLOY)
+    if record is not None:
+        return record.solution_type
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Unknown solution '{solution_name}'. Set 'solution_type' in the request"
+    )
+
+
+@app.get("/api/v1/deployments", response_model=DeploymentList, tags=["Deployment"])
+async def list_deployments(
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    solution_name: Optional[str] = None,
+    solution_type: Optional[SolutionType] = None,
+    operation: Optional[OperationType] = None,
+    deployment_status: Optional[DeploymentStatus] = Query(None, alias="status"),
+    host: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include_tasks: bool = Query(False, description="Include per-task results and snapshot contents"),
+):
+    """
+    List deployments, newest first
+
+    Pass ``next_cursor`` back as ``cursor`` to fetch the following page.
+    """
+    try:
+        page = await run_in_threadpool(
+            deployments.list,
+            limit=limit,
+            cursor=cursor,
+            created_after=created_after,
+            created_before=created_before,
+            solution_name=solution_name,
+            solution_type=solution_type,
+            operation=operation,
+            status=deployment_status,
+            host=host,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    items = page.items if include_tasks else [
+        record.model_copy(update={"tasks": [], "snapshot": None}) for record in page.items
+    ]
+    return DeploymentList(total=page.total, next_cursor=page.next_cursor, deployments=items)
+
+
+@app.get("/api/v1/drift", response_model=DriftSummary, tags=["Drift"])
+async def drift_summary(
+    host: Optional[str] = None,
+    drifted_only: bool = Query(False, description="Only solutions that drifted or could not be checked"),
+):
+    """
+    Drift of every watched solution
+
+    Completed deploys are watched until their solution is deleted; each
+    device is checked every ``APM_DRIFT_INTERVAL`` seconds by polling the
+    generations of the collections holding its objects and re-reading only
+    objects that changed.
+    """
+    reports = [
+        report for report in drift.reports(host)
+        if not drifted_only or not report.in_sync
+    ]
+    return DriftSummary(**drift.summary(), reports=reports)
+
+
+@app.post("/api/v1/drift/check", response_model=DriftSummary, tags=["Drift"])
+async def check_drift(request: BIGIPCredentials):
+    """
+    Check one BIG-IP for drift now
+
+    Solutions the store records as deployed on the device are watched from
+    then on (after a restart, watches only come back this way or with the
+    next deploy).
+    """
+    reports = await run_in_threadpool(drift.adopt, request)
+    return DriftSummary(**drift.summary(), reports=reports)
 
 
 # Error handlers
@@ -0,0 +1,618 @@
+"""
+Mock iControl REST server for F5 BIG-IP
+In-memory stand-in for the endpoints the playbooks call, with injectable latency and errors
+
+Usage:
+    python -m api.mock_bigip --port 8443
+    python -m api.mock_bigip --port 8443 --latency 0.02 --jitter 0.01 --error-rate 0.01
+"""
+import argparse
+import itertools
+import json
+import logging
+import random
+import re
+import secrets
+import shlex
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .services.certificates import BUNDLE_MARKER, FAILED_MARKER, cert_fingerprint, tmsh_installs
+from .services.policy_apply import APPLY_FAILED_MARKER
+from .services.transactions import COORDINATION_HEADER
+
+logger = logging.getLogger(__name__)
+
+# LTM collections AS3 materialises a declaration's classes into
+AS3_LTM_CLASSES = {
+    "Service_HTTP": "/mgmt/tm/ltm/virtual",
+    "Service_HTTPS": "/mgmt/tm/ltm/virtual",
+    "Service_TCP": "/mgmt/tm/ltm/virtual",
+    "Service_UDP": "/mgmt/tm/ltm/virtual",
+    "Service_Generic": "/mgmt/tm/ltm/virtual",
+    "Service_L4": "/mgmt/tm/ltm/virtual",
+    "Pool": "/mgmt/tm/ltm/pool",
+    "iRule": "/mgmt/tm/ltm/rule",
+}
+
+# Reported by the device-info, sys/version and AS3 info endpoints
+MOCK_VERSION = "17.1.1"
+MOCK_BUILD = "0.0.2"
+MOCK_AS3_VERSION = "3.50.0"
+
+Response = Tuple[int, Any]
+
+_TMSH_APPLY = re.compile(r"tmsh modify apm profile access \{ (.*?) \} generation-action increment")
+
+
+@dataclass
+class MockConfig:
+    """Latency and failure injection"""
+    latency: float = 0.0  # seconds added to every call
+    jitter: float = 0.0  # plus up to this many seconds at random
+    error_rate: float = 0.0  # share of calls answered with error_status
+    error_status: int = 503
+    fail_paths: List[str] = field(default_factory=list)  # regexes always answered with error_status
+    capacity: Optional[int] = None  # calls in flight beyond this are answered 503 (restjavad overloaded)
+    as3_duration: float = 1.0  # seconds an async AS3 task stays "in progress"
+    seed: Optional[int] = None
+
+
+class MockBigIP:
+    """
+    iControl REST semantics without a device
+
+    Objects live in a dict per collection path, keyed by ``fullPath``
+    (``/Partition/name``, addressed as ``~Partition~name``). POST creates
+    (409 if it exists), GET/PATCH/PUT/DELETE act on one object (writes bump
+    its ``generation``) and GET on a collection lists it (``$select``
+    honoured). Calls with ``X-F5-REST-Coordination-Id`` are queued into
+    their transaction and applied in ``evalOrder`` on commit, all or
+    nothing; PATCHing a command's ``evalOrder`` moves it there and
+    renumbers the others, as BIG-IP does. AS3 deploys work synchronously
+    or as ``async=true`` tasks per tenant.
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None):
+        self.config = config or MockConfig()
+        self.objects: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.transactions: Dict[str, List[Dict[str, Any]]] = {}
+        self.tenants: Dict[str, Any] = {}
+        self.as3_tasks: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        self.calls: Counter = Counter()
+        self.rejected = 0  # calls turned away over capacity
+        self.files: Dict[str, str] = {}  # uploaded to /var/config/rest/downloads
+        self._ids = itertools.count(1000)
+        self._random = random.Random(self.config.seed)
+        self._fail = [re.compile(pattern) for pattern in self.config.fail_paths]
+        self._lock = threading.RLock()
+        self._in_flight = 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self.objects.clear()
+            self.transactions.clear()
+            self.tenants.clear()
+            self.as3_tasks.clear()
+            self.calls.clear()
+            self.rejected = 0
+            self.files.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "objects": sum(len(items) for items in self.objects.values()),
+                "rejected": self.rejected,
+                "tenants": sorted(self.tenants),
+                "open_transactions": len(self.transactions),
+            }
+
+    # Dispatch
+
+    def handle(self, method: str, url: str, headers: Dict[str, str], body: Any) -> Response:
+        """Answer one request; ``headers`` keys are lower-case"""
+        parts = urlsplit(url)
+        path = parts.path.rstrip("/") or "/"
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if path == "/mgmt/shared/authn/login":
+            return 200, {"token": {"token": f"mock-{next(self._ids)}", "timeout": 1200}}
+        if path.startswith("/mock/"):
+            return self._control(method, path)
+
+        with self._lock:
+            self._in_flight += 1
+            overloaded = self.config.capacity is not None and self._in_flight > self.config.capacity
+        try:
+            self._delay()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self.calls[method] += 1
+            self.rejected += overloaded
+        if overloaded:
+            return 503, {"code": 503, "message": "restjavad is overloaded, try again later"}
+        if any(pattern.search(path) for pattern in self._fail) or \
+                (self.config.error_rate and self._random.random() < self.config.error_rate):
+            return self.config.error_status, {
+                "code": self.config.error_status,
+                "message": "Injected failure: restjavad is busy",
+            }
+
+        with self._lock:
+            coordination = headers.get(COORDINATION_HEADER.lower())
+            if coordination:
+                return self._stage(coordination, method, path, body)
+            if path.startswith("/mgmt/tm/transaction"):
+                return self._transaction(method, path, body)
+            if path.startswith("/mgmt/shared/appsvcs"):
+                return self._as3(method, path, query, body)
+            if path.startswith("/mgmt/shared/authz/tokens"):
+                return 200, {}
+            if path == "/mgmt/shared/identified-devices/config/device-info":
+                return 200, {
+                    "version": MOCK_VERSION, "build": MOCK_BUILD, "hostname": "bigip-mock.local",
+                    "platform": "Z100", "product": "BIG-IP",
+                }
+            if path == "/mgmt/tm/sys/version":
+                return 200, {"entries": {"https://localhost/mgmt/tm/sys/version/0": {"nestedStats": {
+                    "entries": {"Version": {"description": MOCK_VERSION}, "Build": {"description": MOCK_BUILD}}
+                }}}}
+            if path.startswith("/mgmt/shared/file-transfer/uploads/"):
+                name = path.rsplit("/", 1)[1]
+                size = len(body) if isinstance(body, (str, bytes)) else 0
+                self._store_file(name, body)
+                return 200, {"remainingByteCount": 0, "usedChunks": {"0": size},
+                             "totalByteCount": size, "localFilePath": f"/var/config/rest/downloads/{name}"}
+            if path == "/mgmt/tm/util/bash":
+                return self._bash(body)
+            if method == "GET" and path == "/mgmt/tm/gtm/server" and query.get("expandSubcollections") == "true":
+                return self._gtm_servers()
+            status_code, payload = self._apply(method, path, body)
+            if method == "GET" and query.get("$select") and isinstance(payload, dict) and "items" in payload:
+                fields = query["$select"].split(",")
+                payload = {**payload, "items": [
+                    {key: item[key] for key in fields if key in item} for item in payload["items"]
+                ]}
+            return status_code, payload
+
+    def _delay(self) -> None:
+        delay = self.config.latency
+        if self.config.jitter:
+            delay += self._random.uniform(0, self.config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _control(self, method: str, path: str) -> Response:
+        if path == "/mock/stats" and method == "GET":
+            return 200, self.stats()
+        if path == "/mock/reset" and method == "POST":
+            self.reset()
+            return 200, {}
+        return 404, {"code": 404, "message": f"Unknown mock endpoint {path}"}
+
+    # Configuration objects
+
+    def _apply(self, method: str, path: str, body: Any) -> Response:
+        collection, _, last = path.rpartition("/")
+        item = self._find(collection, last)
+        if item is None and method == "POST":
+            return self._create(path, body)
+        if item is None and method == "GET" and not last.startswith("~"):
+            return 200, {"kind": _kind(path, "collectionstate"), "items": list(self.objects.get(path, {}).values())}
+        if item is None:
+            return 404, {"code": 404, "message": f"01020036:3: The requested object ({_full_path(last)}) was not found."}
+        key, current = item
+        if method == "GET":
+            return 200, current
+        if method == "DELETE":
+            del self.objects[collection][key]
+            # Subcollections (portal access items, ...) go with their object
+            for child in [child for child in self.objects if child.startswith(path + "/")]:
+                del self.objects[child]
+            return 200, {}
+        if method in ("PATCH", "PUT"):
+            updated = {**current, **(body if isinstance(body, dict) else {})}
+            updated.pop("generationAction", None)
+            updated["generation"] = current.get("generation", 0) + 1
+            self.objects[collection][key] = updated
+            return 200, updated
+        return 405, {"code": 405, "message": f"{method} not supported on {path}"}
+
+    def _find(self, collection: str, last: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        items = self.objects.get(collection)
+        if not items:
+            return None
+        key = _full_path(last) if last.startswith("~") else last
+        if key in items:
+            return key, items[key]
+        for key, value in items.items():  # id-addressed objects (OIDC discovery tasks, ...)
+            if str(value.get("id")) == last:
+                return key, value
+        return None
+
+    def _create(self, path: str, body: Any) -> Response:
+        items = self.objects.setdefault(path, {})
+        if not isinstance(body, dict):
+            return 200, {}
+        if body.get("command") and body.get("command") != "create":
+            # sys/crypto installs and similar commands replace whatever is there
+            if body.get("name"):
+                key = _object_path(body)
+                items[key] = {**body, "fullPath": key, "kind": _kind(path, "state")}
+            return 200, body
+        if not body.get("name"):
+            entry_id = str(next(self._ids))
+            items[entry_id] = {**body, "id": entry_id, "kind": _kind(path, "state")}
+            return 200, items[entry_id]
+        key = _object_path(body)
+        if key in items:
+            partition = key.split("/")[1]
+            return 409, {
+                "code": 409,
+                "message": f"01020066:3: The requested object ({key}) already exists in partition {partition}.",
+            }
+        items[key] = {**body, "fullPath": key, "generation": 1, "kind": _kind(path, "state")}
+        if path.endswith("/oauth-client-app"):
+            # The device generates the client's credentials
+            items[key].setdefault("clientId", secrets.token_hex(16))
+            items[key].setdefault("clientSecret", secrets.token_hex(24))
+        return 200, items[key]
+
+    def _store_file(self, name: str, body: Any) -> None:
+        """Keep an upload; certificate bundles are split into their files as the install script does"""
+        content = body.decode("utf-8", "replace") if isinstance(body, bytes) else str(body or "")
+        self.files[name] = content
+        current = None
+        for line in content.splitlines():
+            if line.startswith(BUNDLE_MARKER):
+                current = line[len(BUNDLE_MARKER):].strip()
+                self.files[current] = ""
+            elif current:
+                self.files[current] += line + "\n"
+
+    def _bash(self, body: Any) -> Response:
+        """``util/bash`` runs; ``tmsh install sys crypto`` of uploaded files and policy applies are applied"""
+        command = body.get("utilCmdArgs", "") if isinstance(body, dict) else ""
+        applied = _TMSH_APPLY.search(" ".join(shlex.split(command)))
+        if applied:
+            return self._apply_policies(shlex.split(applied.group(1)))
+        for collection, target, source in tmsh_installs(command):
+            kind = collection.rsplit("/", 1)[-1]
+            content = self.files.get(source.rsplit("/", 1)[-1])
+            if content is None:
+                return 200, {"kind": "tm:util:bash:runstate", "command": "run",
+                             "commandResult": f"{FAILED_MARKER}{kind} {target}\nFile not found: {source}"}
+            _, partition, name = target.split("/", 2)
+            item = {"name": name, "partition": partition, "fullPath": target,
+                    "kind": f"tm:sys:crypto:{kind}:{kind}state"}
+            if kind == "cert":
+                item["fingerprint"] = cert_fingerprint(content)
+            self.objects.setdefault(collection, {})[target] = item
+        return 200, {"kind": "tm:util:bash:runstate", "command": "run", "commandResult": ""}
+
+    def _apply_policies(self, profiles: List[str]) -> Response:
+        """One tmsh modify of several access profiles, falling back to one at a time as the script does"""
+        collection = self.objects.get("/mgmt/tm/apm/profile/access", {})
+        output = []
+        for profile in profiles:
+            if profile in collection:
+                collection[profile]["generation"] = collection[profile].get("generation", 0) + 1
+            else:
+                output.append(f"01020036:3: The requested access profile ({profile}) was not found.")
+                output.append(f"{APPLY_FAILED_MARKER}{profile}")
+        return 200, {"kind": "tm:util:bash:runstate", "command": "run", "commandResult": "\n".join(output)}
+
+    def _gtm_servers(self) -> Response:
+        """GTM servers with their virtual servers inlined, as ``expandSubcollections`` returns them"""
+        items = []
+        for key, server in self.objects.get("/mgmt/tm/gtm/server", {}).items():
+            collection = f"/mgmt/tm/gtm/server/{key.replace('/', '~')}/virtual-servers"
+            items.append({**server, "virtualServersReference": {
+                "isSubcollection": True, "items": list(self.objects.get(collection, {}).values()),
+            }})
+        return 200, {"kind": "tm:gtm:server:servercollectionstate", "items": items}
+
+    # Transactions
+
+    def _stage(self, trans_id: str, method: str, path: str, body: Any) -> Response:
+        commands = self.transactions.get(trans_id)
+        if commands is None:
+            return 404, {"code": 404, "message": f"Transaction {trans_id} not found"}
+        command = {
+            "commandId": next(self._ids), "method": method, "uri": f"https://localhost{path}",
+            "body": body, "evalOrder": len(commands) + 1,
+        }
+        commands.append(command)
+        return 200, {**(body if isinstance(body, dict) else {}), "commandId": command["commandId"]}
+
+    def _transaction(self, method: str, path: str, body: Any) -> Response:
+        if path == "/mgmt/tm/transaction" and method == "POST":
+            trans_id = str(next(self._ids))
+            self.transactions[trans_id] = []
+            return 200, {"transId": int(trans_id), "state": "STARTED"}
+        match = re.match(r"^/mgmt/tm/transaction/(\d+)(?:/commands(?:/(\d+))?)?$", path)
+        if not match or match.group(1) not in self.transactions:
+            return 404, {"code": 404, "message": "Transaction not found"}
+        trans_id, command_id = match.group(1), match.group(2)
+        commands = self.transactions[trans_id]
+        if path.endswith("/commands") and method == "GET":
+            return 200, {"items": commands}
+        if command_id:
+            for command in commands:
+                if str(command["commandId"]) == command_id:
+                    if method in ("PATCH", "PUT") and isinstance(body, dict) and "evalOrder" in body:
+                        _move_command(commands, command, int(body["evalOrder"]))
+                    elif method == "DELETE":
+                        commands.remove(command)
+                        _renumber(commands)
+                    return 200, command
+            return 404, {"code": 404, "message": f"Command {command_id} not found"}
+        if method == "DELETE":
+            del self.transactions[trans_id]
+            return 200, {}
+        if method in ("PATCH", "PUT") and isinstance(body, dict) and body.get("state") == "VALIDATING":
+            return self._commit(trans_id)
+        return 200, {"transId": int(trans_id), "state": "STARTED"}
+
+    def _commit(self, trans_id: str) -> Response:
+        commands = sorted(self.transactions.pop(trans_id), key=lambda command: command["evalOrder"])
+        saved = {path: dict(items) for path, items in self.objects.items()}
+        for command in commands:
+            status_code, payload = self._apply(command["method"], urlsplit(command["uri"]).path, command["body"])
+            if status_code >= 400:
+                self.objects = saved
+                message = payload.get("message") if isinstance(payload, dict) else str(payload)
+                return 400, {"code": 400, "message": f"transaction failed:{message}", "errorStack": []}
+        return 200, {"transId": int(trans_id), "state": "COMPLETED"}
+
+    # AS3
+
+    def _as3(self, method: str, path: str, query: Dict[str, str], body: Any) -> Response:
+        if path == "/mgmt/shared/appsvcs/info":
+            return 200, {"version": MOCK_AS3_VERSION, "release": "5", "schemaCurrent": MOCK_AS3_VERSION}
+        task = re.match(r"^/mgmt/shared/appsvcs/task/(\w+)$", path)
+        if task:
+            if task.group(1) not in self.as3_tasks:
+                return 404, {"code": 404, "message": "task not found"}
+            due, results = self.as3_tasks[task.group(1)]
+            if time.monotonic() < due:
+                return 200, {"id": task.group(1), "results": [{"message": "in progress", "code": 0}]}
+            return 200, {"id": task.group(1), "results": results}
+        if not path.startswith("/mgmt/shared/appsvcs/declare"):
+            return 404, {"code": 404, "message": f"Unknown AS3 endpoint {path}"}
+        tenant_path = path[len("/mgmt/shared/appsvcs/declare/"):] if path.count("/") > 4 else ""
+        if method == "GET":
+            if tenant_path:
+                found = {name: self.tenants[name] for name in tenant_path.split(",") if name in self.tenants}
+                return (200, {"class": "ADC", **found}) if found else (404, {"code": 404, "message": "no declaration"})
+            return 200, {"class": "ADC", "schemaVersion": MOCK_AS3_VERSION, **self.tenants}
+        if method == "DELETE":
+            names = tenant_path.split(",") if tenant_path else list(self.tenants)
+            results = []
+            for name in names:
+                if self.tenants.pop(name, None) is not None:
+                    self._materialise(name, None)
+                    results.append({"code": 200, "message": "success", "tenant": name})
+            return (200, {"results": results}) if results or not tenant_path else \
+                (404, {"code": 404, "message": "no declaration"})
+        if method != "POST" or not isinstance(body, dict):
+            return 400, {"code": 400, "message": "Invalid AS3 request"}
+        declaration = body["declaration"] if isinstance(body.get("declaration"), dict) else body
+        if declaration.get("class") != "ADC":
+            return 422, {"code": 422, "message": "declaration is invalid", "errors": ["/class: should be ADC"]}
+        tenants = {
+            name: value for name, value in declaration.items()
+            if isinstance(value, dict) and value.get("class") == "Tenant"
+        }
+        self.tenants.update(tenants)
+        for name, tenant in tenants.items():
+            self._materialise(name, tenant)
+        results = [{"code": 200, "message": "success", "tenant": name, "runTime": 1000} for name in tenants]
+        if query.get("async") == "true":
+            task_id = str(next(self._ids))
+            self.as3_tasks[task_id] = (time.monotonic() + self.config.as3_duration, results)
+            return 202, {"id": task_id, "results": [{"message": "Declaration successfully submitted", "code": 0}]}
+        return 200, {"results": results, "declaration": declaration}
+
+    def _materialise(self, name: str, tenant: Optional[Dict[str, Any]]) -> None:
+        """Replace tenant ``name``'s LTM objects with those ``tenant`` declares (None removes them)"""
+        prefix = f"/{name}/"
+        for path in set(AS3_LTM_CLASSES.values()):
+            items = self.objects.get(path, {})
+            for key in [key for key in items if key.startswith(prefix)]:
+                del items[key]
+        for app_name, app in (tenant or {}).items():
+            if not (isinstance(app, dict) and app.get("class") == "Application"):
+                continue
+            for item_name, item in app.items():
+                path = AS3_LTM_CLASSES.get(item.get("class")) if isinstance(item, dict) else None
+                if path is None:
+                    continue
+                key = f"/{name}/{app_name}/{item_name}"
+                self.objects.setdefault(path, {})[key] = {
+                    "name": item_name, "partition": name, "subPath": app_name, "fullPath": key,
+                    "kind": _kind(path, "state"),
+                }
+
+
+def _move_command(commands: List[Dict[str, Any]], command: Dict[str, Any], eval_order: int) -> None:
+    """BIG-IP moves a command to the ``evalOrder`` it is given and renumbers the others"""
+    ordered = sorted(commands, key=lambda item: item["evalOrder"])
+    ordered.remove(command)
+    ordered.insert(max(0, min(eval_order - 1, len(ordered))), command)
+    commands[:] = ordered
+    for position, item in enumerate(commands, start=1):
+        item["evalOrder"] = position
+
+
+def _renumber(commands: List[Dict[str, Any]]) -> None:
+    commands.sort(key=lambda item: item["evalOrder"])
+    for position, item in enumerate(commands, start=1):
+        item["evalOrder"] = position
+
+
+def _full_path(segment: str) -> str:
+    return segment.replace("~", "/")
+
+
+def _object_path(body: Dict[str, Any]) -> str:
+    if body.get("fullPath"):
+        return body["fullPath"]
+    name = str(body["name"])
+    if name.startswith("/"):
+        return name
+    partition = body.get("partition") or "Common"
+    sub_path = f"/{body['subPath']}" if body.get("subPath") else ""
+    return f"/{partition}{sub_path}/{name}"
+
+
+def _kind(path: str, suffix: str) -> str:
+    segments = [segment for segment in path.split("/")[2:] if segment and not segment.startswith("~")]
+    return ":".join(segments + [f"{segments[-1] if segments else 'item'}{suffix}"])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock: MockBigIP
+
+    def setup(self) -> None:
+        super().setup()
+        # Small JSON answers must not wait for the client's delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body: Any = None
+        if raw:
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                body = raw.decode("utf-8", "replace")
+        headers = {key.lower(): value for key, value in self.headers.items()}
+        try:
+            status_code, payload = self.mock.handle(self.command, self.path, headers, body)
+        except Exception as exc:  # report bugs as a device would, keep serving
+            logger.exception("Mock failed on %s %s", self.command, self.path)
+            status_code, payload = 500, {"code": 500, "message": str(exc)}
+        content = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+
+class MockServer:
+    """A ``MockBigIP`` served over HTTPS (self-signed) or HTTP on a background thread"""
+
+    def __init__(self, mock: Optional[MockBigIP] = None, host: str = "127.0.0.1", port: int = 0,
+                 tls: bool = True):
+        self.mock = mock or MockBigIP()
+        handler = type("MockHandler", (_Handler,), {"mock": self.mock})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._tmp: Optional[tempfile.TemporaryDirectory] = None
+        if tls:
+            self._tmp = tempfile.TemporaryDirectory(prefix="mock-bigip-")
+            cert, key = _self_signed_cert(Path(self._tmp.name))
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.scheme = "https" if tls else "http"
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"{self.scheme}://{self.host}:{self.port}"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-bigip", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._tmp is not None:
+            self._tmp.cleanup()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def _self_signed_cert(directory: Path) -> Tuple[str, str]:
+    cert, key = directory / "mock.crt", directory / "mock.key"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    return str(cert), str(key)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a mock BIG-IP iControl REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--http", action="store_true", help="Serve plain HTTP instead of HTTPS")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=503, help="Status of injected failures")
+    parser.add_argument("--fail-path", action="append", default=[],
+                        help="Regex of paths that always fail (repeatable)")
+    parser.add_argument("--capacity", type=int, help="Calls in flight before the mock answers 503")
+    parser.add_argument("--as3-duration", type=float, default=1.0, help="Seconds an async AS3 task runs")
+    parser.add_argument("--seed", type=int, help="Seed for jitter and error injection")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    config = MockConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        error_status=args.error_status, fail_paths=args.fail_path, capacity=args.capacity,
+        as3_duration=args.as3_duration, seed=args.seed,
+    )
+    server = MockServer(MockBigIP(config), args.host, args.port, tls=not args.http)
+    logger.info("Mock BIG-IP listening on %s", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
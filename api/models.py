@@ -1,11 +1,61 @@
 """
 Pydantic models for F5 BIG-IP APM API
 """
+import json
+from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field, validator
 from enum import Enum
 
 
+def unique_by_name(entries: List[BaseModel], kind: str) -> List[BaseModel]:
+    """Drop repeated identical entries; the same name with different settings is an error"""
+    seen: Dict[str, str] = {}
+    result = []
+    for entry in entries:
+        canonical = json.dumps(entry.model_dump(mode="json"), sort_keys=True)
+        previous = seen.get(entry.name)
+        if previous is None:
+            seen[entry.name] = canonical
+            result.append(entry)
+        elif previous != canonical:
+            raise ValueError(f"{kind} '{entry.name}' is defined twice with different settings")
+    return result
+
+
+def tcl_syntax_error(expression: str) -> Optional[str]:
+    """
+    Why ``expression`` is not well-formed Tcl (unbalanced braces, brackets
+    or quotes), or None; one pass over the text
+    """
+    if not expression.strip():
+        return "expression is empty"
+    closing = {"}": "{", "]": "["}
+    stack: List[str] = []
+    escaped = False
+    for position, char in enumerate(expression):
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == '"' and (not stack or stack[-1] != "{"):
+            if stack and stack[-1] == '"':
+                stack.pop()
+            else:
+                stack.append(char)
+        elif stack and stack[-1] == '"' and char in "{}":
+            continue
+        elif char in "{[":
+            stack.append(char)
+        elif char in closing:
+            if not stack or stack[-1] != closing[char]:
+                return f"unexpected '{char}' at position {position}"
+            stack.pop()
+    if stack:
+        return f"unclosed '{stack[-1]}'"
+    return None
+
+
 class SolutionType(str, Enum):
     """APM solution types"""
     VPN = "vpn"
@@ -18,6 +68,13 @@ class CustomizationType(str, Enum):
     STANDARD = "standard"
 
 
+class DeployMode(str, Enum):
+    """How a deployment is applied"""
+    FULL = "full"  # run every playbook call as written
+    DIFF = "diff"  # read current config, send only the changes
+    PLAN = "plan"  # compute the changes without sending them
+
+
 class BIGIPCredentials(BaseModel):
     """BIG-IP connection credentials"""
     host: str = Field(..., description="BIG-IP management IP or hostname")
@@ -74,6 +131,10 @@ class PortalResource(BaseModel):
     def set_caption(cls, v, values):
         return v or values.get('name')
 
+    @validator('items')
+    def unique_items(cls, v):
+        return unique_by_name(v, "Portal resource item")
+
 
 class ADGroupMapping(BaseModel):
     """AD group to resource mapping"""
@@ -84,6 +145,13 @@ class ADGroupMapping(BaseModel):
     webtop: str = Field(..., description="Webtop resource path")
     webtop_sections: Optional[List[str]] = Field(default=None)
 
+    @validator('expression')
+    def check_expression(cls, v):
+        error = tcl_syntax_error(v)
+        if error:
+            raise ValueError(f"invalid group expression: {error}")
+        return v
+
 
 class Solution1Request(BaseModel):
     """Solution 1: VPN with Network Access deployment request"""
@@ -108,6 +176,8 @@ class Solution1Request(BaseModel):
     as3_virtual_ip: Optional[str] = None
     as3_virtual_port: int = 443
 
+    mode: DeployMode = Field(DeployMode.FULL, description="full, diff or plan")
+
 
 class Solution2Request(BaseModel):
     """Solution 2: Portal Access with AD Group Mapping deployment request"""
@@ -137,6 +207,34 @@ class Solution2Request(BaseModel):
     as3_virtual_ip: Optional[str] = None
     as3_virtual_port: int = 443
 
+    mode: DeployMode = Field(DeployMode.FULL, description="full, diff or plan")
+
+    @validator('portal_resources')
+    def unique_portal_resources(cls, v):
+        return unique_by_name(v, "Portal resource")
+
+    @validator('ad_group_mappings')
+    def check_ad_group_mappings(cls, v, values):
+        # Identical mappings are sent once; references to this solution's
+        # portal resources must name one of them
+        seen, mappings = set(), []
+        for mapping in v:
+            canonical = json.dumps(mapping.model_dump(mode="json"), sort_keys=True)
+            if canonical not in seen:
+                seen.add(canonical)
+                mappings.append(mapping)
+        if "portal_resources" not in values or "solution_name" not in values:
+            return mappings
+        prefix = f"/Common/{values['solution_name']}-"
+        defined = {prefix + resource.name for resource in values["portal_resources"]}
+        for index, mapping in enumerate(mappings):
+            for resource in mapping.portal_access_resources or []:
+                if resource.startswith(prefix) and resource not in defined:
+                    raise ValueError(
+                        f"mapping {index} ({mapping.description}) assigns unknown portal resource '{resource}'"
+                    )
+        return mappings
+
 
 class DeploymentStatus(str, Enum):
     """Deployment status"""
@@ -146,6 +244,14 @@ class DeploymentStatus(str, Enum):
     FAILED = "failed"
 
 
+class OperationType(str, Enum):
+    """Deployment job operation"""
+    DEPLOY = "deploy"
+    DELETE = "delete"
+    SNAPSHOT = "snapshot"
+    ROLLBACK = "rollback"
+
+
 class TaskResult(BaseModel):
     """Individual task result"""
     task_name: str
@@ -154,6 +260,12 @@ class TaskResult(BaseModel):
     details: Optional[Dict[str, Any]] = None
 
 
+class TrackedObject(BaseModel):
+    """Configuration object a deployment created or modified, as declared"""
+    generation: Optional[int] = Field(None, description="Object generation the device last answered with")
+    declared: Dict[str, Any] = Field(default_factory=dict, description="Fields sent to the device (secrets left out)")
+
+
 class DeploymentResponse(BaseModel):
     """Deployment response"""
     deployment_id: str
@@ -161,21 +273,217 @@ class DeploymentResponse(BaseModel):
     solution_name: str
     status: DeploymentStatus
     message: str
+    operation: OperationType = OperationType.DEPLOY
+    target_host: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
     tasks: List[TaskResult] = Field(default_factory=list)
     created_resources: Dict[str, List[str]] = Field(default_factory=dict)
+    deleted_resources: Dict[str, List[str]] = Field(default_factory=dict)
+    tracked_objects: Dict[str, TrackedObject] = Field(
+        default_factory=dict, description="Objects watched for drift, by iControl REST path"
+    )
     errors: List[str] = Field(default_factory=list)
+    plan: Optional[Dict[str, Any]] = None
+    snapshot: Optional[Dict[str, Dict[str, Any]]] = Field(
+        None, description="Objects a snapshot captured, by iControl REST path"
+    )
+    snapshot_id: Optional[str] = Field(None, description="Snapshot a rollback restored")
+
+
+class CompiledPlanResponse(BaseModel):
+    """Offline plan: the iControl REST calls a deploy makes against an empty device"""
+    playbook: str
+    key: str = Field(..., description="Cache key of the compiled plan")
+    valid: bool
+    cached: bool
+    compile_seconds: float
+    summary: Dict[str, int]
+    errors: List[str] = Field(default_factory=list, description="Tasks that failed while compiling")
+    issues: List[Dict[str, Any]] = Field(default_factory=list, description="Unresolved references")
+    calls: List[Dict[str, Any]] = Field(default_factory=list)
+
+
+class DeploymentList(BaseModel):
+    """Page of deployments, newest first"""
+    total: int
+    next_cursor: Optional[str] = None
+    deployments: List[DeploymentResponse]
+
+
+class FailurePolicy(str, Enum):
+    """What a fleet deploy does when a device fails"""
+    CONTINUE = "continue"    # deploy to every device regardless
+    FAIL_FAST = "fail_fast"  # start no further devices after the first failure
+
+
+class FleetDeployRequest(BaseModel):
+    """One solution definition applied to many BIG-IPs"""
+    solution_type: SolutionType
+    solution: Dict[str, Any] = Field(
+        ..., description="Solution 1/2 request body without credentials"
+    )
+    devices: List[BIGIPCredentials] = Field(..., min_items=1)
+    max_concurrency: Optional[int] = Field(
+        None, ge=1, description="Devices deployed at once (capped by the server limit)"
+    )
+    failure_policy: FailurePolicy = FailurePolicy.CONTINUE
+    mode: DeployMode = Field(DeployMode.FULL, description="full, diff or plan")
+
+
+class FleetDeviceResult(BaseModel):
+    """Outcome on one device of a fleet deploy"""
+    host: str
+    deployment_id: Optional[str] = None
+    status: str
+    message: Optional[str] = None
+    duration: Optional[float] = None
+
+
+class FleetResponse(BaseModel):
+    """Aggregated fleet deploy result"""
+    fleet_id: str
+    solution_type: SolutionType
+    solution_name: str
+    status: DeploymentStatus
+    message: str
+    failure_policy: FailurePolicy
+    max_concurrency: int
+    total: int
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    devices: List[FleetDeviceResult] = Field(default_factory=list)
+
+
+class BulkDeployItem(BaseModel):
+    """One solution in a bulk deploy"""
+    solution_type: SolutionType
+    solution: Dict[str, Any] = Field(
+        ..., description="Solution 1/2 request body (credentials default to the batch's)"
+    )
+
+
+class BulkDeployRequest(BaseModel):
+    """Many solutions, for one or more BIG-IPs, deployed as one batch"""
+    items: List[BulkDeployItem] = Field(..., min_items=1)
+    credentials: Optional[BIGIPCredentials] = Field(
+        None, description="Device for items that do not name their own"
+    )
+    mode: Optional[DeployMode] = Field(None, description="Overrides each item's mode")
+
+
+class BulkItemResult(BaseModel):
+    """Outcome of one bulk deploy item"""
+    index: int
+    solution_type: SolutionType
+    solution_name: str
+    host: str
+    deployment_id: Optional[str] = None
+    status: str
+    message: Optional[str] = None
+
+
+class BulkResponse(BaseModel):
+    """Aggregated bulk deploy result"""
+    batch_id: str
+    status: DeploymentStatus
+    message: str
+    total: int
+    devices: int
+    succeeded: int = 0
+    failed: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: Optional[datetime] = None
+    items: List[BulkItemResult] = Field(default_factory=list)
+
+
+class DeviceQueue(BaseModel):
+    """Jobs queued and running on one BIG-IP"""
+    device: str
+    running: Optional[str] = Field(None, description="Deployment ID of the running job")
+    queued: int
+    oldest_wait_seconds: float
+    completed: int
+    avg_wait_seconds: float
+    max_wait_seconds: float
+
+
+class SchedulerStats(BaseModel):
+    """Per-device scheduler queue depth and wait times"""
+    running: int
+    queued: int
+    suspended: int = Field(0, description="Jobs waiting on their device's AS3 task")
+    completed: int
+    wait_p50_seconds: float
+    wait_p95_seconds: float
+    wait_max_seconds: float
+    devices: List[DeviceQueue] = Field(default_factory=list)
+    concurrency: Dict[str, Dict[str, float]] = Field(
+        default_factory=dict,
+        description="Adaptive iControl REST limit, calls in flight and limit decreases per device (host:port)"
+    )
+
+
+class ObjectDrift(BaseModel):
+    """One object that no longer matches its deployment"""
+    path: str = Field(..., description="iControl REST path of the object")
+    change: str = Field(..., description="modified or missing")
+    fields: Dict[str, Dict[str, Any]] = Field(
+        default_factory=dict, description="Declared and actual value of each differing field"
+    )
+
+
+class DriftReport(BaseModel):
+    """Latest drift check of one deployed solution"""
+    deployment_id: str
+    solution_name: str
+    target_host: Optional[str] = None
+    checked_at: datetime
+    objects: int = Field(..., description="Objects watched")
+    in_sync: bool
+    drifted: List[ObjectDrift] = Field(default_factory=list)
+    error: Optional[str] = Field(None, description="Why the device could not be checked")
+
+
+class DriftSummary(BaseModel):
+    """Drift of every watched solution"""
+    devices: int
+    solutions: int
+    drifted: int = Field(..., description="Solutions with at least one drifted object")
+    last_pass_at: Optional[datetime] = None
+    last_pass_seconds: Optional[float] = None
+    reports: List[DriftReport] = Field(default_factory=list)
 
 
 class DeleteRequest(BaseModel):
     """Deletion request"""
     credentials: BIGIPCredentials
     solution_name: str = Field(..., description="Solution name to delete")
+    solution_type: Optional[SolutionType] = Field(
+        None, description="Solution type (defaults to the type of the last deployment)"
+    )
+    confirm: bool = Field(False, description="Confirmation flag")
+
+
+class SnapshotRequest(BaseModel):
+    """Snapshot of a deployed solution"""
+    credentials: BIGIPCredentials
+    solution_name: str = Field(..., description="Solution to capture")
+
+
+class RollbackRequest(BaseModel):
+    """Restore of a solution snapshot"""
+    credentials: BIGIPCredentials
     confirm: bool = Field(False, description="Confirmation flag")
 
 
 class DeleteResponse(BaseModel):
     """Deletion response"""
     solution_name: str
+    deployment_id: Optional[str] = None
     status: DeploymentStatus
     message: str
     deleted_resources: Dict[str, List[str]] = Field(default_factory=dict)
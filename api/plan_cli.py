@@ -0,0 +1,105 @@
+"""
+Offline plan CLI for F5 BIG-IP APM
+Compiles a solution into the iControl REST calls its deploy makes and validates them, without a device
+
+Usage:
+    python -m api.plan_cli solution3
+    python -m api.plan_cli --type vpn --solution vpn.json
+    python -m api.plan_cli solution7 --json > solution7-plan.json
+    python -m api.plan_cli deploy_apm_vpn.yml -e vs1_name=edge01 --quiet
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+from pydantic import ValidationError
+
+from .fleet_cli import load_definition
+from .models import BIGIPCredentials, OperationType, SolutionType
+from .services.compiler import OFFLINE_HOST, CompiledPlan, PlanCompiler
+from .services.deployment_engine import PLAYBOOKS, SOLUTION_PLAYBOOKS
+from .services.fleet import SOLUTION_REQUESTS, describe_validation_error
+
+# Credentials filled in when a solution definition has none (they are not used)
+PLACEHOLDER_CREDENTIALS = {"host": OFFLINE_HOST, "password": "offline"}
+
+
+def parse_extravars(values: List[str]) -> Dict[str, Any]:
+    """``-e key=value`` pairs (values parsed as YAML, so numbers and booleans keep their type)"""
+    extravars = {}
+    for value in values:
+        key, sep, raw = value.partition("=")
+        if not sep:
+            raise ValueError(f"Expected key=value, got '{value}'")
+        extravars[key] = yaml.safe_load(raw)
+    return extravars
+
+
+def print_plan(plan: CompiledPlan, quiet: bool = False) -> None:
+    if not quiet:
+        for call in plan.calls:
+            group = f"T{call.transaction}" if call.transaction else "  "
+            print(f"{call.index:4d} {group:>4} {call.method:6} {call.path}  [{call.task or ''}]")
+        print()
+    for issue in plan.issues:
+        print(f"{issue.severity.upper():7} call {issue.call}: {issue.message}")
+    for error in plan.errors:
+        print(f"FAILED  {error}")
+    print(f"{plan.playbook}: {plan.describe()} in {plan.compile_seconds * 1000:.0f} ms")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compile an APM solution into its iControl REST calls")
+    parser.add_argument("target", nargs="?",
+                        help=f"Solution ({', '.join(SOLUTION_PLAYBOOKS)}) or deploy playbook")
+    parser.add_argument("--type", choices=[t.value for t in SolutionType],
+                        help="Solution type of --solution")
+    parser.add_argument("--solution", type=Path,
+                        help="Solution 1/2 request body (JSON or YAML); credentials are optional")
+    parser.add_argument("-e", "--extra-var", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra variable for the playbook (repeatable)")
+    parser.add_argument("--json", action="store_true", help="Print the plan as JSON")
+    parser.add_argument("--no-bodies", action="store_true", help="Leave request bodies out of --json")
+    parser.add_argument("--quiet", action="store_true", help="Only print problems and the summary")
+    args = parser.parse_args(argv)
+
+    try:
+        extravars = parse_extravars(args.extra_var)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    if args.solution:
+        if not args.type:
+            parser.error("--solution needs --type")
+        solution_type = SolutionType(args.type)
+        model, build_vars = SOLUTION_REQUESTS[solution_type]
+        definition = load_definition(args.solution)
+        definition.setdefault("credentials", BIGIPCredentials(**PLACEHOLDER_CREDENTIALS).model_dump())
+        try:
+            request = model.model_validate(definition)
+        except ValidationError as exc:
+            print(f"Invalid {solution_type.value} solution definition: {describe_validation_error(exc)}",
+                  file=sys.stderr)
+            return 2
+        playbook = PLAYBOOKS[solution_type][OperationType.DEPLOY]
+        extravars = {**build_vars(request), **extravars}
+    elif args.target in SOLUTION_PLAYBOOKS:
+        playbook = SOLUTION_PLAYBOOKS[args.target][0]
+    elif args.target:
+        playbook = args.target
+    else:
+        parser.error("give a solution, a playbook or --type/--solution")
+
+    plan = PlanCompiler().compile(playbook, extravars)
+    if args.json:
+        print(json.dumps(plan.as_dict(bodies=not args.no_bodies), indent=2, default=str))
+    else:
+        print_plan(plan, quiet=args.quiet)
+    return 0 if plan.valid else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Address allocation for F5 BIG-IP APM
+Local per-scope pool in front of the address manager's scope-status/available/checkout calls
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+SCOPE_STATUS_PATH = "/addr/scope-status"
+AVAILABLE_PATH = "/addr/available"
+CHECKOUT_PATH = "/addr/checkout"
+
+# Addresses asked for per refill of a scope's pool (count= on /addr/available)
+DEFAULT_BLOCK_SIZE = 16
+
+# Seconds a scope's assignments (scope-status) are trusted without re-reading them
+DEFAULT_STATUS_TTL = 30.0
+
+# Seconds an address handed out waits for its checkout before going back to the pool
+DEFAULT_HOLD_TIMEOUT = 600.0
+
+# Seconds a refill that only offers held addresses waits for their checkouts before failing
+DEFAULT_HOLD_WAIT = 5.0
+
+# Scopes kept; the least recently used one without held addresses is dropped beyond this
+DEFAULT_MAX_SCOPES = 1024
+
+Answer = Tuple[int, Any]
+
+
+def assignments(payload: Any) -> Dict[str, str]:
+    """``{name: address}`` from a scope-status answer (one assignment object or a list of them)"""
+    entries = payload if isinstance(payload, list) else [payload] if isinstance(payload, dict) else []
+    found = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        address = entry.get("IPAddress")
+        address = address.get("IPAddressToString") if isinstance(address, dict) else address
+        if entry.get("Description") and address:
+            found[str(entry["Description"])] = str(address)
+    return found
+
+
+def offered(payload: Any) -> List[str]:
+    """Addresses in an /addr/available answer (``addresses`` for a block, ``address`` for one)"""
+    if not isinstance(payload, dict):
+        return []
+    if isinstance(payload.get("addresses"), list):
+        return [str(address) for address in payload["addresses"] if address]
+    return [str(payload["address"])] if payload.get("address") else []
+
+
+@dataclass
+class _Scope:
+    """Local view of one address manager scope"""
+    lock: threading.Condition = field(default_factory=threading.Condition)
+    assigned: Dict[str, str] = field(default_factory=dict)  # name -> address checked out
+    status: Optional[Answer] = None  # the manager's last scope-status answer (200 or 404)
+    status_at: float = float("-inf")
+    free: Deque[str] = field(default_factory=deque)  # offered by the manager, not handed out yet
+    held: Dict[str, float] = field(default_factory=dict)  # handed out, waiting for checkout -> deadline
+
+
+class AddressAllocator:
+    """
+    Thread-safe VIP allocation per address manager scope
+
+    The playbooks look up a scope's assignments, ask for the next available
+    address and check it out under the virtual server's name. Run
+    separately, parallel deploys are all offered the same "next available"
+    address. Here the calls for one scope are serialised and answered from
+    a local pool:
+
+    - scope-status is read once per ``status_ttl`` seconds and kept current
+      with the checkouts made through the allocator
+    - /addr/available is asked for ``block_size`` addresses at a time
+      (``count=``); a manager that answers with one address refills the pool
+      one address per call
+    - an address is handed out once; it stays held until its checkout
+      answers (then it is assigned) or the deploy ends without checking it
+      out (then it goes back to the pool)
+    - a refill that only offers held addresses waits up to ``hold_wait``
+      seconds for their checkouts instead of handing the same address out
+      twice, then answers 503 (pool exhausted): the waiting deploy holds its
+      device slot, so it does not wait out the others' ``hold_timeout``
+
+    Checkouts still go to the manager one per application, since they
+    record the virtual server's name. Any other answer of the manager (an
+    error, an empty scope) reaches the playbook as the manager sent it.
+    """
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE, status_ttl: float = DEFAULT_STATUS_TTL,
+                 hold_timeout: float = DEFAULT_HOLD_TIMEOUT, hold_wait: float = DEFAULT_HOLD_WAIT,
+                 max_scopes: int = DEFAULT_MAX_SCOPES):
+        self.block_size = block_size
+        self.status_ttl = status_ttl
+        self.hold_timeout = hold_timeout
+        self.hold_wait = hold_wait
+        self.max_scopes = max_scopes
+        self._scopes: "OrderedDict[Tuple[str, str], _Scope]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @staticmethod
+    def handles(method: str, url: str) -> bool:
+        path = urlsplit(url).path.rstrip("/")
+        return (method, path) in (("GET", SCOPE_STATUS_PATH), ("GET", AVAILABLE_PATH), ("POST", CHECKOUT_PATH))
+
+    def answer(self, client: httpx.Client, method: str, url: str, body: Any,
+               timeout: Optional[float] = None) -> Optional[Answer]:
+        """``(status, body)`` for a scope-status/available call, else None (send it; checkouts always are)"""
+        parts = urlsplit(url)
+        path = parts.path.rstrip("/")
+        scope_name = (parse_qs(parts.query).get("scope") or [""])[-1]
+        if method != "GET" or not scope_name:
+            return None
+        base = f"{parts.scheme}://{parts.netloc}"
+        scope = self._scope(base, scope_name)
+        with scope.lock:
+            failed = self._refresh_status(client, base, scope_name, scope, timeout)
+            if failed is not None:
+                return failed
+            if path == SCOPE_STATUS_PATH:
+                if not scope.assigned:
+                    return scope.status
+                return 200, [
+                    {"Description": name, "IPAddress": {"IPAddressToString": address}}
+                    for name, address in scope.assigned.items()
+                ]
+            return self._take(client, base, scope_name, scope, timeout)
+
+    def checked_out(self, url: str, body: Any, status_code: Optional[int], payload: Any) -> None:
+        """Fold a checkout that went to the manager into its scope (``status_code`` None: it failed)"""
+        if not isinstance(body, dict) or not body.get("scope") or not body.get("address"):
+            return
+        parts = urlsplit(url)
+        scope = self._scope(f"{parts.scheme}://{parts.netloc}", str(body["scope"]))
+        address = str(body["address"])
+        failed = status_code not in (200, 201) or (isinstance(payload, dict) and payload.get("status") == "Fail")
+        with scope.lock:
+            scope.held.pop(address, None)
+            if not failed:
+                scope.assigned[str(body.get("name", address))] = address
+            else:
+                # Taken behind our back (or the manager is unhappy): re-read before handing more out
+                scope.status_at = float("-inf")
+            scope.lock.notify_all()
+
+    def release(self, url: str, scope_name: str, addresses: List[str]) -> None:
+        """Put addresses handed out but never checked out back into the pool"""
+        parts = urlsplit(url)
+        scope = self._scope(f"{parts.scheme}://{parts.netloc}", scope_name)
+        with scope.lock:
+            for address in addresses:
+                if scope.held.pop(address, None) is not None and address not in scope.assigned.values():
+                    scope.free.appendleft(address)
+            scope.lock.notify_all()
+
+    def _scope(self, base: str, name: str) -> _Scope:
+        with self._lock:
+            key = (base, name)
+            scope = self._scopes.get(key)
+            if scope is None:
+                scope = self._scopes[key] = _Scope()
+                self._evict()
+            self._scopes.move_to_end(key)
+            return scope
+
+    def _evict(self) -> None:
+        """Drop least recently used scopes without held addresses beyond ``max_scopes`` (lock held)"""
+        for key in list(self._scopes):
+            if len(self._scopes) <= self.max_scopes:
+                return
+            if not self._scopes[key].held:
+                del self._scopes[key]
+
+    def _refresh_status(self, client: httpx.Client, base: str, name: str, scope: _Scope,
+                        timeout: Optional[float]) -> Optional[Answer]:
+        """Re-read the scope's assignments if they are stale; the manager's answer if it was an error"""
+        if time.monotonic() - scope.status_at < self.status_ttl:
+            return None
+        response = self._get(client, f"{base}{SCOPE_STATUS_PATH}", {"scope": name}, timeout)
+        payload = _body(response)
+        if response.status_code not in (200, 404):
+            return response.status_code, payload
+        scope.status = (response.status_code, payload)
+        scope.assigned = assignments(payload) if response.status_code == 200 else {}
+        taken = set(scope.assigned.values())
+        scope.free = deque(address for address in scope.free if address not in taken)
+        scope.status_at = time.monotonic()
+        return None
+
+    def _take(self, client: httpx.Client, base: str, name: str, scope: _Scope,
+              timeout: Optional[float]) -> Answer:
+        """Next free address of ``scope``, refilling the pool from the manager (scope lock held)"""
+        give_up = time.monotonic() + self.hold_wait
+        while True:
+            now = time.monotonic()
+            for address, deadline in list(scope.held.items()):
+                if deadline < now:  # its deploy never checked it out nor ended
+                    del scope.held[address]
+            unavailable: Set[str] = set(scope.assigned.values()) | set(scope.held)
+            while scope.free:
+                address = scope.free.popleft()
+                if address not in unavailable:
+                    scope.held[address] = now + self.hold_timeout
+                    return 200, {"address": address}
+            response = self._get(client, f"{base}{AVAILABLE_PATH}",
+                                 {"scope": name, "count": str(self.block_size)}, timeout)
+            payload = _body(response)
+            if response.status_code != 200:
+                return response.status_code, payload
+            block = [address for address in offered(payload) if address not in unavailable]
+            if block:
+                scope.free.extend(dict.fromkeys(block))
+                logger.debug("Address scope %s: %d address(es) added to the pool", name, len(block))
+                continue
+            if not scope.held:
+                return response.status_code, payload  # the scope is exhausted
+            # The manager keeps offering addresses we handed out: wait (briefly) for their checkouts
+            if now >= give_up:
+                return 503, {
+                    "status": "Fail",
+                    "message": f"Address pool exhausted for scope {name}: every address offered "
+                               f"({len(scope.held)} held) is awaiting another deploy's checkout",
+                }
+            scope.lock.wait(timeout=min(min(scope.held.values()), give_up) - now)
+
+    def _get(self, client: httpx.Client, url: str, params: Dict[str, str],
+             timeout: Optional[float]) -> httpx.Response:
+        self.calls += 1
+        return client.get(url, params=params, timeout=timeout)
+
+
+def _body(response: httpx.Response) -> Any:
+    """Decoded JSON body, or the text when the manager did not answer JSON"""
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
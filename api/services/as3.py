@@ -0,0 +1,371 @@
+"""
+Batched AS3 declarations for F5 BIG-IP
+Merges the tenant declarations pending for a device into one async AS3 run and splits the results back
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional, Set, Tuple
+
+import httpx
+
+from . import metrics
+from .f5_client import F5Client, F5Error, response_body
+
+logger = logging.getLogger(__name__)
+
+DECLARE_PATH = "/mgmt/shared/appsvcs/declare"
+TASK_PATH = "/mgmt/shared/appsvcs/task"
+
+# Seconds a device's first declaration waits for others to join its batch
+DEFAULT_BATCH_WINDOW = 0.5
+
+# Task polling backoff and overall limit, in seconds
+DEFAULT_POLL_INTERVAL = 1.0
+MAX_POLL_INTERVAL = 10.0
+DEFAULT_AS3_TIMEOUT = 900.0
+
+# Seconds a held AS3 run keeps waiting for expected declarations after the last one arrived
+DEFAULT_HOLD_TIMEOUT = 60.0
+
+# ADC properties that may differ between merged declarations
+_ADC_METADATA = ("class", "schemaVersion", "id", "label", "remark")
+
+
+@dataclass
+class AS3Submission:
+    """One deployment's declaration waiting for its device's next AS3 run"""
+    body: Dict[str, Any]
+    tenants: Dict[str, Any]
+    future: "Future[Tuple[int, Any]]" = field(default_factory=Future)
+    submitted_at: float = field(default_factory=time.monotonic)
+
+
+def declaration_parts(body: Any) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    ``(adc, tenants)`` of a declaration that can share an AS3 run, else None
+
+    Accepts a bare ADC declaration or one wrapped in an AS3 request (or the
+    ADC-with-inner-declaration form the task files use) as long as it is a
+    plain deploy of whole tenants.
+    """
+    if not isinstance(body, dict):
+        return None
+    adc = body
+    if isinstance(body.get("declaration"), dict):
+        if body.get("action", "deploy") != "deploy":
+            return None
+        adc = body["declaration"]
+    if adc.get("class") != "ADC":
+        return None
+    tenants = {}
+    for key, value in adc.items():
+        if key in _ADC_METADATA:
+            continue
+        if not (isinstance(value, dict) and value.get("class") == "Tenant"):
+            # controls, updateMode, ... apply to the whole run
+            return None
+        tenants[key] = value
+    return (adc, tenants) if tenants else None
+
+
+def merge_declarations(submissions: List[AS3Submission]) -> Dict[str, Any]:
+    """One multi-tenant AS3 request deploying every submission's tenants"""
+    versions = [s.body.get("declaration", s.body).get("schemaVersion", "3.0.0") for s in submissions]
+    declaration: Dict[str, Any] = {
+        "class": "ADC",
+        "schemaVersion": max(versions, key=_version_key),
+        "id": f"apm-batch-{int(time.time() * 1000)}",
+    }
+    for submission in submissions:
+        declaration.update(submission.tenants)
+    return {
+        "class": "AS3",
+        "action": "deploy",
+        "persist": any(s.body.get("persist", True) for s in submissions),
+        "declaration": declaration,
+    }
+
+
+def _version_key(version: str) -> Tuple[int, ...]:
+    try:
+        return tuple(int(part) for part in str(version).split("."))
+    except ValueError:
+        return (0,)
+
+
+class _DeviceQueue:
+    def __init__(self, client: F5Client):
+        self.client = client
+        self.pending: List[AS3Submission] = []
+        self.running = False
+        self.expected: Set[str] = set()
+        self.held_until = 0.0
+        self.exclusive: Optional[Callable[[], ContextManager[None]]] = None
+
+
+class AS3Batcher:
+    """
+    Per-device AS3 submission layer
+
+    AS3 processes one declaration at a time per device and each run takes
+    seconds to minutes, so declarations are queued per device (and account,
+    ``F5Client.account``; a queue is dropped once idle): the first one
+    waits ``batch_window`` for company, then everything pending is merged
+    into one multi-tenant declaration, POSTed with ``async=true`` and the
+    task polled with backoff. Declarations arriving meanwhile form the next
+    batch. Each submitter gets back the per-tenant results for its own
+    tenants; if the device rejects a merged declaration outright, it is
+    split in halves and retried so a bad declaration only fails its own
+    deploy.
+
+    Submitters that stepped off their device to wait pass ``exclusive``,
+    which takes the device back from the POST until the task finished; the
+    batch is taken once the device is held, so the jobs queued on the device
+    ahead of the run declare first and join it.
+
+    Callers outside the scheduler that know more declarations are coming
+    for a device register them with ``expect``; the device's next run then
+    waits until each has been submitted or withdrawn, so they share one AS3
+    run, giving up ``hold_timeout`` seconds after the last one arrived. A
+    run taken with ``exclusive`` does not wait for them: the device queue
+    already orders it, and a job still waiting for a worker slot must not
+    hold it up.
+    """
+
+    def __init__(
+        self,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        max_poll_interval: float = MAX_POLL_INTERVAL,
+        timeout: float = DEFAULT_AS3_TIMEOUT,
+        max_devices: int = 32,
+        hold_timeout: float = DEFAULT_HOLD_TIMEOUT,
+    ):
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.hold_timeout = hold_timeout
+        self._queues: Dict[str, _DeviceQueue] = {}  # by client account, while a run is pending
+        self._expected: Dict[str, _DeviceQueue] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pool = ThreadPoolExecutor(max_workers=max_devices, thread_name_prefix="as3-batch")
+        self.runs = 0
+        self.declarations = 0
+
+    def submit(self, client: F5Client, body: Dict[str, Any], token: Optional[str] = None,
+               exclusive: Optional[Callable[[], ContextManager[None]]] = None) -> "Future[Tuple[int, Any]]":
+        """
+        Queue a declaration; the future resolves to ``(status_code, response body)``
+
+        ``token`` names the declaration if it was announced with ``expect``;
+        ``exclusive`` holds the submitter's device for the AS3 run.
+        """
+        parts = declaration_parts(body)
+        if parts is None:
+            raise ValueError("Declaration cannot be batched")
+        submission = AS3Submission(body, parts[1])
+        with self._lock:
+            queue = self._queue(client)
+            queue.pending.append(submission)
+            queue.exclusive = exclusive or queue.exclusive
+            if token is not None:
+                self._arrived(token)
+            start = not queue.running
+            queue.running = True
+        if start:
+            self._pool.submit(self._drain, queue)
+        return submission.future
+
+    def expect(self, client: F5Client, tokens: Iterable[str]) -> None:
+        """Hold ``client``'s next AS3 run until a declaration for every token arrives or is withdrawn"""
+        with self._lock:
+            queue = self._queue(client)
+            for token in tokens:
+                queue.expected.add(token)
+                self._expected[token] = queue
+            queue.held_until = time.monotonic() + self.hold_timeout
+
+    def withdraw(self, token: str) -> None:
+        """No declaration is coming for ``token`` (its job ended); no-op if none was expected"""
+        with self._lock:
+            self._arrived(token)
+
+    def _queue(self, client: F5Client) -> _DeviceQueue:
+        """Lock held"""
+        queue = self._queues.get(client.account)
+        if queue is None:
+            queue = self._queues[client.account] = _DeviceQueue(client)
+        queue.client = client  # the newest of the account's pooled clients
+        return queue
+
+    def _forget(self, queue: _DeviceQueue) -> None:
+        """Drop ``queue`` once nothing is pending, running or expected for it (lock held)"""
+        if not (queue.running or queue.pending or queue.expected) \
+                and self._queues.get(queue.client.account) is queue:
+            del self._queues[queue.client.account]
+
+    def _arrived(self, token: str) -> None:
+        """Lock held"""
+        queue = self._expected.pop(token, None)
+        if queue is not None:
+            queue.expected.discard(token)
+            queue.held_until = time.monotonic() + self.hold_timeout
+            self._changed.notify_all()
+            self._forget(queue)
+
+    def _wait_for_expected(self, queue: _DeviceQueue) -> None:
+        """Block until no declaration is expected for the device or the hold times out (lock held)"""
+        while queue.expected:
+            remaining = queue.held_until - time.monotonic()
+            if remaining <= 0:
+                logger.warning(
+                    "AS3 run on %s stopped waiting for %d expected declaration(s)",
+                    queue.client.host, len(queue.expected),
+                )
+                for token in queue.expected:
+                    self._expected.pop(token, None)
+                queue.expected.clear()
+                return
+            self._changed.wait(remaining)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+    def _drain(self, queue: _DeviceQueue) -> None:
+        """Run batches for one device until nothing is pending"""
+        if self.batch_window > 0:
+            time.sleep(self.batch_window)
+        while True:
+            with self._lock:
+                if queue.exclusive is None:
+                    self._wait_for_expected(queue)
+                if not queue.pending:
+                    queue.running = False
+                    self._forget(queue)
+                    return
+                exclusive = queue.exclusive
+            with exclusive() if exclusive else nullcontext():
+                with self._lock:
+                    batch = self._take(queue)
+                try:
+                    self._run(queue.client, batch)
+                except Exception as exc:  # never leave a deployment waiting forever
+                    logger.exception("AS3 batch on %s failed", queue.client.host)
+                    for submission in batch:
+                        if not submission.future.done():
+                            submission.future.set_result((-1, {"message": f"AS3 batch failed: {exc}"}))
+
+    @staticmethod
+    def _take(queue: _DeviceQueue) -> List[AS3Submission]:
+        """Pending submissions with disjoint tenants; a later one for a taken tenant waits (lock held)"""
+        batch, seen, rest = [], set(), []
+        for submission in queue.pending:
+            if seen & submission.tenants.keys():
+                rest.append(submission)
+            else:
+                seen |= submission.tenants.keys()
+                batch.append(submission)
+        queue.pending = rest
+        return batch
+
+    def _run(self, client: F5Client, batch: List[AS3Submission]) -> None:
+        with self._lock:
+            self.runs += 1
+            self.declarations += len(batch)
+        request = merge_declarations(batch) if len(batch) > 1 else batch[0].body
+        started = time.monotonic()
+        status_code, payload = self._declare(client, request)
+        metrics.AS3_LATENCY.labels(status=str(status_code)).observe(time.monotonic() - started)
+        metrics.AS3_BATCH.observe(len(batch))
+        results = payload.get("results") if isinstance(payload, dict) else None
+        per_tenant = any(isinstance(r, dict) and r.get("tenant") for r in results or [])
+        if len(batch) > 1 and status_code not in (200, 201) and not per_tenant:
+            # Rejected as a whole - bisect so only the bad declaration fails
+            logger.warning(
+                "Merged AS3 declaration of %d deployments on %s rejected (HTTP %s), splitting",
+                len(batch), client.host, status_code,
+            )
+            middle = len(batch) // 2
+            self._run(client, batch[:middle])
+            self._run(client, batch[middle:])
+            return
+        logger.info(
+            "AS3 run on %s: %d declaration(s), %d tenant(s), HTTP %s in %.1fs",
+            client.host, len(batch), sum(len(s.tenants) for s in batch), status_code,
+            time.monotonic() - started,
+        )
+        for submission in batch:
+            submission.future.set_result(_split(status_code, payload, submission, len(batch)))
+
+    def _declare(self, client: F5Client, request: Dict[str, Any]) -> Tuple[int, Any]:
+        """POST with async=true and poll the task to completion"""
+        try:
+            response = client.post(DECLARE_PATH, json=request, params={"async": "true"}, timeout=60.0)
+        except (F5Error, httpx.HTTPError) as exc:
+            return -1, {"message": f"Request failed: {exc}"}
+        payload = response_body(response)
+        if response.status_code != 202:
+            # Synchronous answer (older AS3) or the declaration was rejected
+            return response.status_code, payload
+        task_id = payload.get("id") if isinstance(payload, dict) else None
+        if not task_id:
+            return -1, {"message": "AS3 accepted the declaration without a task ID"}
+        return self._poll(client, task_id)
+
+    def _poll(self, client: F5Client, task_id: str) -> Tuple[int, Any]:
+        deadline = time.monotonic() + self.timeout
+        interval = self.poll_interval
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            interval = min(interval * 1.5, self.max_poll_interval)
+            try:
+                response = client.get(f"{TASK_PATH}/{task_id}")
+            except (F5Error, httpx.HTTPError) as exc:
+                logger.warning("Polling AS3 task %s on %s failed: %s", task_id, client.host, exc)
+                continue
+            payload = response_body(response)
+            if response.status_code != 200 or not isinstance(payload, dict):
+                continue
+            results = payload.get("results") or []
+            if results and all(r.get("message") != "in progress" for r in results):
+                codes = [r.get("code", 200) for r in results]
+                failed = [code for code in codes if code not in (200, 201)]
+                return (failed[0] if failed else 200), payload
+        return -1, {"message": f"AS3 task {task_id} did not finish within {self.timeout:.0f}s"}
+
+
+def _split(status_code: int, payload: Any, submission: AS3Submission, batch_size: int) -> Tuple[int, Any]:
+    """The part of a (merged) AS3 response that belongs to one submission"""
+    if batch_size == 1 or not isinstance(payload, dict):
+        return status_code, payload
+    results = [
+        r for r in payload.get("results") or []
+        if r.get("tenant") in submission.tenants
+    ]
+    if not results:
+        return status_code, payload
+    failed = [r.get("code") for r in results if r.get("code", 200) not in (200, 201)]
+    body = {key: value for key, value in payload.items() if key not in ("results", "declaration")}
+    body["results"] = results
+    body["batch"] = {"declarations": batch_size, "task_id": payload.get("id")}
+    return (failed[0] if failed else 200), body
+
+
+def parse_declaration(kwargs: Dict[str, Any]) -> Any:
+    """Declaration of a ``uri`` call (``json=`` or a JSON string body)"""
+    if kwargs.get("json") is not None:
+        return kwargs["json"]
+    content = kwargs.get("content")
+    if content is None:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
@@ -0,0 +1,254 @@
+"""
+Bulk deploys for F5 BIG-IP APM
+Deploys a batch of mixed solutions grouped per device: one token, one connectivity check and one AS3 run each
+"""
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from pydantic import BaseModel, ValidationError
+
+from ..models import (
+    BulkDeployRequest, BulkItemResult, BulkResponse, DeploymentResponse, DeploymentStatus,
+    OperationType, SolutionType
+)
+from .deployment_engine import DeploymentEngine, DeploymentJob, EngineBusyError, deployment_job
+from .f5_client import F5Error
+from .fleet import DEFAULT_FLEET_CONCURRENCY, DEFAULT_MAX_FLEETS, SOLUTION_REQUESTS, describe_validation_error
+from .scheduler import device_key
+
+logger = logging.getLogger(__name__)
+
+# Deployment states an item does not leave
+FINISHED_STATUSES = (DeploymentStatus.COMPLETED, DeploymentStatus.FAILED)
+
+
+class BulkValidationError(Exception):
+    """One or more bulk items are not valid solution requests"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def bulk_requests(request: BulkDeployRequest) -> List[BaseModel]:
+    """
+    Every item validated as its Solution 1/2 request
+
+    All items are checked before anything is deployed; raises
+    ``BulkValidationError`` listing each invalid item, including two items
+    deploying the same solution name to the same device.
+    """
+    solutions, errors = [], []
+    seen: Dict[str, int] = {}
+    for index, item in enumerate(request.items):
+        model, _ = SOLUTION_REQUESTS[item.solution_type]
+        definition = dict(item.solution)
+        if "credentials" not in definition and request.credentials is not None:
+            definition["credentials"] = request.credentials.model_dump()
+        if request.mode is not None:
+            definition["mode"] = request.mode
+        try:
+            solution = model.model_validate(definition)
+        except ValidationError as exc:
+            errors.append(f"items[{index}]: {describe_validation_error(exc)}")
+            continue
+        target = f"{device_key(solution.credentials)}/{solution.solution_name}"
+        if target in seen:
+            errors.append(
+                f"items[{index}]: solution_name '{solution.solution_name}' is already deployed to "
+                f"{solution.credentials.host} by items[{seen[target]}]"
+            )
+            continue
+        seen[target] = index
+        solutions.append(solution)
+    if errors:
+        raise BulkValidationError(errors)
+    return solutions
+
+
+@dataclass
+class BulkItem:
+    """One solution of a batch and the deployment made for it"""
+    index: int
+    solution_type: SolutionType
+    request: BaseModel
+    record: Optional[DeploymentResponse] = None
+    error: Optional[str] = None
+
+    @property
+    def host(self) -> str:
+        return self.request.credentials.host
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return DeploymentStatus.FAILED.value
+        if self.record is None:
+            return DeploymentStatus.PENDING.value
+        return self.record.status.value
+
+    @property
+    def finished(self) -> bool:
+        return self.error is not None or (self.record is not None and self.record.status in FINISHED_STATUSES)
+
+    def result(self) -> BulkItemResult:
+        return BulkItemResult(
+            index=self.index,
+            solution_type=self.solution_type,
+            solution_name=self.request.solution_name,
+            host=self.host,
+            deployment_id=self.record.deployment_id if self.record else None,
+            status=self.status,
+            message=self.error or (self.record.message if self.record else "Waiting for device check"),
+        )
+
+
+class BulkRun:
+    """State of one bulk deploy"""
+
+    def __init__(self, items: List[BulkItem]):
+        self.batch_id = str(uuid.uuid4())
+        self.items = items
+        self.created_at = datetime.now(timezone.utc)
+
+    def groups(self) -> List[List[BulkItem]]:
+        """Items grouped by management endpoint, in request order"""
+        groups: "OrderedDict[str, List[BulkItem]]" = OrderedDict()
+        for item in self.items:
+            groups.setdefault(device_key(item.request.credentials), []).append(item)
+        return list(groups.values())
+
+    def snapshot(self) -> BulkResponse:
+        results = [item.result() for item in self.items]
+        finished = sum(1 for item in self.items if item.finished)
+        succeeded = sum(1 for r in results if r.status == DeploymentStatus.COMPLETED.value)
+        failed = sum(1 for r in results if r.status == DeploymentStatus.FAILED.value)
+        if finished < len(results):
+            started = any(r.status != DeploymentStatus.PENDING.value for r in results)
+            status = DeploymentStatus.IN_PROGRESS if started else DeploymentStatus.PENDING
+            message = f"{finished}/{len(results)} items finished ({failed} failed)"
+        else:
+            status = DeploymentStatus.COMPLETED if succeeded == len(results) else DeploymentStatus.FAILED
+            message = f"{succeeded}/{len(results)} items succeeded, {failed} failed"
+        return BulkResponse(
+            batch_id=self.batch_id,
+            status=status,
+            message=message,
+            total=len(results),
+            devices=len(self.groups()),
+            succeeded=succeeded,
+            failed=failed,
+            created_at=self.created_at,
+            updated_at=datetime.now(timezone.utc),
+            items=results,
+        )
+
+
+class BulkRunner:
+    """
+    Many solutions in one request, grouped by device
+
+    All items are validated up front and the batch is refused if the
+    engine cannot queue every item. Devices are prepared in parallel (up to
+    ``max_concurrency``): each device's pooled client logs in once and its
+    connectivity is checked once through the device info cache (which also
+    answers the playbooks' own checks); an unreachable device fails its
+    items without queuing them. The items of a device are then queued on the
+    engine together, so the AS3 batcher and the policy apply coordinator
+    merge what they send to the device.
+    """
+
+    def __init__(self, engine: DeploymentEngine, max_concurrency: int = DEFAULT_FLEET_CONCURRENCY,
+                 max_batches: int = DEFAULT_MAX_FLEETS):
+        self.engine = engine
+        self.max_concurrency = max_concurrency
+        self.max_batches = max_batches
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="apm-bulk")
+        self._batches: "OrderedDict[str, BulkRun]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, request: BulkDeployRequest) -> BulkResponse:
+        """Validate a batch and start deploying it in the background"""
+        solutions = bulk_requests(request)
+        free = self.engine.max_pending - self.engine.active_jobs
+        if len(solutions) > free:
+            raise EngineBusyError(
+                f"Deployment queue has room for {max(free, 0)} jobs, the batch has {len(solutions)}"
+            )
+        run = BulkRun([
+            BulkItem(index, item.solution_type, solution)
+            for index, (item, solution) in enumerate(zip(request.items, solutions))
+        ])
+        with self._lock:
+            self._batches[run.batch_id] = run
+            while len(self._batches) > self.max_batches:
+                self._batches.popitem(last=False)
+        for group in run.groups():
+            self._pool.submit(self._run_group, run, group)
+        return run.snapshot()
+
+    def get(self, batch_id: str) -> Optional[BulkResponse]:
+        with self._lock:
+            run = self._batches.get(batch_id)
+        return run.snapshot() if run else None
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _run_group(self, run: BulkRun, group: List[BulkItem]) -> None:
+        """Check one device and queue its items"""
+        try:
+            jobs = self._prepare_group(run, group)
+        except Exception as exc:  # never leave a batch pending forever
+            logger.exception("Bulk deploy %s: preparing %s failed", run.batch_id, group[0].host)
+            for item in group:
+                item.error = f"Not started: {exc}"
+            return
+        for item, job in jobs:
+            try:
+                item.record = self.engine.submit(job)
+            except EngineBusyError as exc:
+                item.error = str(exc)
+
+    def _prepare_group(self, run: BulkRun, group: List[BulkItem]) -> List[Tuple[BulkItem, DeploymentJob]]:
+        """Connectivity check per client, then one job per reachable item"""
+        reachable: Dict[str, Optional[str]] = {}  # by client account
+        for item in group:
+            client = self.engine.clients.for_credentials(item.request.credentials)
+            if client.account not in reachable:
+                try:
+                    self.engine.device_info.get(client)
+                    reachable[client.account] = None
+                except (F5Error, httpx.HTTPError) as exc:
+                    reachable[client.account] = f"Device check on {item.host} failed: {exc}"
+        jobs = []
+        for item in group:
+            error = reachable[self.engine.clients.for_credentials(item.request.credentials).account]
+            if error:
+                item.error = error
+                continue
+            jobs.append((item, self._job(run, item)))
+        logger.info("Bulk deploy %s: queuing %d item(s) on %s", run.batch_id, len(jobs), group[0].host)
+        return jobs
+
+    @staticmethod
+    def _job(run: BulkRun, item: BulkItem) -> DeploymentJob:
+        request = item.request
+        _, build_vars = SOLUTION_REQUESTS[item.solution_type]
+        record = DeploymentResponse(
+            deployment_id=str(uuid.uuid4()),
+            solution_type=item.solution_type,
+            solution_name=request.solution_name,
+            status=DeploymentStatus.PENDING,
+            message=f"Deployment queued (batch {run.batch_id})",
+            operation=OperationType.DEPLOY,
+            target_host=request.credentials.host,
+        )
+        return deployment_job(record, request.credentials, build_vars(request), request.mode)
@@ -0,0 +1,346 @@
+"""
+Certificate installs for F5 BIG-IP APM
+Pre-generated RSA keys, self-signed certificates and one upload-plus-install per batch of PEM files
+"""
+import datetime
+import logging
+import multiprocessing
+import re
+import shlex
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from .f5_client import F5Client, F5Error, response_body
+
+logger = logging.getLogger(__name__)
+
+CERT_PATH = "/mgmt/tm/sys/crypto/cert"
+KEY_PATH = "/mgmt/tm/sys/crypto/key"
+UPLOAD_PATH = "/mgmt/shared/file-transfer/uploads"
+BASH_PATH = "/mgmt/tm/util/bash"
+DOWNLOADS_DIR = "/var/config/rest/downloads"
+
+# Line starting each file of an uploaded bundle: "# apm-bundle <file name>"
+BUNDLE_MARKER = "# apm-bundle "
+
+# Printed by the install script for each object tmsh refused
+FAILED_MARKER = "apm-bundle-failed "
+
+# RSA key size and validity of the self-signed certificates
+DEFAULT_KEY_BITS = 2048
+DEFAULT_DAYS = 365
+
+# Keys kept ready and processes generating them
+DEFAULT_POOL_SIZE = 8
+DEFAULT_KEY_WORKERS = 2
+
+# util/bash answers meaning the account may not run shell commands
+SHELL_DENIED_STATUSES = (401, 403)
+
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+_TMSH_INSTALL = re.compile(r"tmsh install sys crypto (key|cert) (/[^/\s]+/[^\s]+) from-local-file (\S+)")
+
+
+def generate_key(bits: int = DEFAULT_KEY_BITS) -> str:
+    """Unencrypted PEM (PKCS#8) RSA private key"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=bits)
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+def self_signed_cert(key_pem: str, common_name: str, days: int = DEFAULT_DAYS) -> str:
+    """PEM certificate for ``common_name`` signed by ``key_pem`` (what ``openssl req -x509`` makes)"""
+    key = serialization.load_pem_private_key(key_pem.encode(), password=None)
+    subject = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "State"),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, "City"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Organization"),
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+    ])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    return cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def cert_fingerprint(cert_pem: str) -> Optional[str]:
+    """SHA-256 fingerprint as BIG-IP reports it (``SHA256/AB:CD:...``); None if not a PEM certificate"""
+    try:
+        cert = x509.load_pem_x509_certificate(cert_pem.strip().encode() + b"\n")
+    except ValueError:
+        return None
+    digest = cert.fingerprint(hashes.SHA256()).hex().upper()
+    return "SHA256/" + ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+
+def tmsh_installs(command: str) -> List[Tuple[str, str, str]]:
+    """``(collection path, fullPath, source file)`` of each crypto install in a ``util/bash`` command"""
+    return [
+        (f"/mgmt/tm/sys/crypto/{kind}", target, source)
+        for kind, target, source in _TMSH_INSTALL.findall(command)
+    ]
+
+
+class KeyPool:
+    """
+    RSA keys generated ahead of time in worker processes
+
+    Up to ``size`` keys are kept generating or ready; ``take()`` hands out
+    the oldest and starts a replacement, so a deploy only waits for key
+    generation when a burst empties the pool. ``size=0`` generates each key
+    in the calling thread.
+    """
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, bits: int = DEFAULT_KEY_BITS,
+                 workers: int = DEFAULT_KEY_WORKERS):
+        self.size = size
+        self.bits = bits
+        self.workers = workers
+        self._ready: Deque["Future[str]"] = deque()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.taken = 0
+        self.waited = 0
+
+    def start(self) -> None:
+        """Start the worker processes and fill the pool"""
+        with self._lock:
+            self._fill()
+
+    def take(self) -> str:
+        if self.size <= 0:
+            return generate_key(self.bits)
+        with self._lock:
+            self._fill()
+            future = self._ready.popleft()
+            self._fill()
+            self.taken += 1
+            if not future.done():
+                self.waited += 1
+        return future.result()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            for future in self._ready:
+                future.cancel()
+            self._ready.clear()
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _fill(self) -> None:
+        if self.size <= 0:
+            return
+        if self._pool is None:
+            # spawn: forking the threaded API process is not safe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        while len(self._ready) < self.size:
+            self._ready.append(self._pool.submit(generate_key, self.bits))
+
+
+@dataclass
+class CertificateItem:
+    """One certificate (and optionally its key) to have on a device under ``name``"""
+    name: str
+    cert: Optional[str] = None  # PEM; None with common_name: self-signed on install
+    key: Optional[str] = None
+    common_name: Optional[str] = None
+    days: int = DEFAULT_DAYS
+
+    @classmethod
+    def from_args(cls, entry: Dict[str, Any]) -> "CertificateItem":
+        name = str(entry.get("name", ""))
+        if not _SAFE_NAME.match(name):
+            raise ValueError(f"Invalid certificate name '{name}'")
+        item = cls(
+            name=name,
+            cert=entry.get("cert") or entry.get("content"),
+            key=entry.get("key"),
+            common_name=entry.get("common_name"),
+            days=int(entry.get("days", DEFAULT_DAYS)),
+        )
+        if not item.cert and not item.common_name:
+            raise ValueError(f"Certificate '{name}' needs cert content or a common_name to self-sign")
+        return item
+
+
+class CertificateService:
+    """
+    Certificates and keys installed in batches
+
+    ``install()`` reads the device's certificates once. A certificate
+    whose name already holds the same fingerprint is skipped, and so is a
+    self-signed one whose name already exists (re-deploys keep the
+    certificate the device has, as the 409 of the old create did). The
+    rest, keys included, are uploaded as a single bundle file and installed
+    with one ``util/bash`` call running ``tmsh install sys crypto``. Keys
+    for self-signed certificates come from the ``KeyPool``.
+
+    Whether a device's account may use ``util/bash`` is probed once per
+    account (``-c true``); where it may not (401/403), each file is uploaded
+    on its own and installed through ``sys/crypto`` REST commands, as the
+    playbooks did before.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, key_bits: int = DEFAULT_KEY_BITS,
+                 workers: int = DEFAULT_KEY_WORKERS):
+        self.keys = KeyPool(pool_size, key_bits, workers)
+        self._shell: Dict[str, bool] = {}  # client account -> may use util/bash
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self.keys.start()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.keys.shutdown(wait=wait)
+
+    def self_signed(self, common_name: str, days: int = DEFAULT_DAYS) -> Tuple[str, str]:
+        """(key PEM, certificate PEM)"""
+        key = self.keys.take()
+        return key, self_signed_cert(key, common_name, days)
+
+    def install(self, client: F5Client, items: List[CertificateItem],
+                partition: str = "Common", timeout: float = 60.0) -> Dict[str, str]:
+        """``{name: "installed" | "exists"}`` for each item; raises F5Error if the device refuses any"""
+        if not _SAFE_NAME.match(partition):
+            raise ValueError(f"Invalid partition '{partition}'")
+        existing = self._existing(client, partition)
+        results: Dict[str, str] = {}
+        pending: List[CertificateItem] = []
+        for item in items:
+            if item.cert is None and item.name in existing:
+                results[item.name] = "exists"
+                continue
+            if item.cert is None:
+                item.key, item.cert = self.self_signed(item.common_name, item.days)
+            fingerprint = cert_fingerprint(item.cert)
+            if fingerprint is not None and existing.get(item.name) == fingerprint:
+                results[item.name] = "exists"
+                continue
+            pending.append(item)
+        if pending:
+            if self._shell_allowed(client, timeout):
+                self._upload_and_install(client, pending, partition, timeout)
+            else:
+                self._install_rest(client, pending, partition, timeout)
+            results.update({item.name: "installed" for item in pending})
+        return results
+
+    @staticmethod
+    def _existing(client: F5Client, partition: str) -> Dict[str, Optional[str]]:
+        """``{name: fingerprint}`` of the certificates in ``partition``"""
+        response = client.get(CERT_PATH, params={"$select": "name,partition,fingerprint"})
+        if response.status_code != 200:
+            raise F5Error(f"GET {CERT_PATH} on {client.host} returned HTTP {response.status_code}",
+                          response.status_code)
+        return {
+            item["name"]: item.get("fingerprint")
+            for item in (response_body(response) or {}).get("items", [])
+            if item.get("partition", "Common") == partition and item.get("name")
+        }
+
+    def _shell_allowed(self, client: F5Client, timeout: float) -> bool:
+        with self._lock:
+            allowed = self._shell.get(client.account)
+        if allowed is None:
+            response = client.request("POST", BASH_PATH, timeout=timeout,
+                                      json={"command": "run", "utilCmdArgs": "-c true"})
+            allowed = response.status_code not in SHELL_DENIED_STATUSES
+            if not allowed:
+                logger.info("%s refused util/bash (HTTP %d): installing certificates over REST",
+                            client.host, response.status_code)
+            with self._lock:
+                self._shell[client.account] = allowed
+        return allowed
+
+    @staticmethod
+    def _files(items: List[CertificateItem]) -> List[Tuple[str, str]]:
+        """``(file name, PEM)`` of every key and certificate, each key before its certificate"""
+        files: List[Tuple[str, str]] = []
+        for item in items:
+            if item.key:
+                files.append((f"{item.name}.key", item.key))
+            files.append((f"{item.name}.crt", item.cert))
+        return files
+
+    @staticmethod
+    def _upload(client: F5Client, name: str, content: str, timeout: float) -> None:
+        size = len(content.encode())
+        response = client.request(
+            "POST", f"{UPLOAD_PATH}/{name}", content=content, timeout=timeout,
+            headers={"Content-Type": "application/octet-stream", "Content-Range": f"0-{size - 1}/{size}"},
+        )
+        if response.status_code not in (200, 201):
+            raise F5Error(f"Uploading {name} to {client.host} returned HTTP {response.status_code}",
+                          response.status_code)
+
+    def _install_rest(self, client: F5Client, items: List[CertificateItem],
+                      partition: str, timeout: float) -> None:
+        """One upload and one ``sys/crypto`` install command per file"""
+        for name, pem in self._files(items):
+            self._upload(client, name, pem.strip() + "\n", timeout)
+            kind_path = KEY_PATH if name.endswith(".key") else CERT_PATH
+            response = client.post(kind_path, timeout=timeout, json={
+                "command": "install", "name": name.rsplit(".", 1)[0], "partition": partition,
+                "from-local-file": f"{DOWNLOADS_DIR}/{name}",
+            })
+            if response.status_code != 200:
+                raise F5Error(f"Installing {name} on {client.host} returned HTTP {response.status_code}: "
+                              f"{str(response_body(response))[:500]}", response.status_code)
+        logger.info("Installed %d certificate file(s) on %s over REST", len(self._files(items)), client.host)
+
+    def _upload_and_install(self, client: F5Client, items: List[CertificateItem],
+                            partition: str, timeout: float) -> None:
+        files = self._files(items)
+        bundle_name = f"apm-bundle-{uuid.uuid4().hex[:12]}.pem"
+        content = "".join(f"{BUNDLE_MARKER}{name}\n{pem.strip()}\n" for name, pem in files)
+        self._upload(client, bundle_name, content, timeout)
+
+        script = [
+            f"cd {shlex.quote(DOWNLOADS_DIR)}",
+            f"awk '/^{BUNDLE_MARKER}/ {{ f = $3; next }} f {{ print > f }}' {shlex.quote(bundle_name)}",
+        ]
+        for name, _ in files:
+            kind = "key" if name.endswith(".key") else "cert"
+            target = f"/{partition}/{name.rsplit('.', 1)[0]}"
+            script.append(
+                f"tmsh install sys crypto {kind} {shlex.quote(target)} from-local-file "
+                f"{shlex.quote(f'{DOWNLOADS_DIR}/{name}')} 2>&1"
+                f" || echo {shlex.quote(f'{FAILED_MARKER}{kind} {target}')}"
+            )
+        script.append("rm -f " + " ".join(shlex.quote(name) for name in [bundle_name] + [name for name, _ in files]))
+        response = client.request(
+            "POST", BASH_PATH, timeout=timeout,
+            json={"command": "run", "utilCmdArgs": f"-c {shlex.quote('; '.join(script))}"},
+        )
+        if response.status_code != 200:
+            raise F5Error(f"Installing {bundle_name} on {client.host} returned HTTP {response.status_code}",
+                          response.status_code)
+        output = str((response_body(response) or {}).get("commandResult", ""))
+        failed = [line[len(FAILED_MARKER):] for line in output.splitlines() if line.startswith(FAILED_MARKER)]
+        if failed:
+            raise F5Error(f"tmsh refused {', '.join(failed)} on {client.host}: {output.strip()[:500]}")
+        logger.info("Installed %d certificate file(s) on %s in one batch", len(files), client.host)
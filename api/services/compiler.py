@@ -0,0 +1,524 @@
+"""
+Offline plan compiler for F5 BIG-IP APM playbooks
+Renders a deploy into its ordered iControl REST calls without a device and checks the references between objects
+"""
+import copy
+import dataclasses
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from ..mock_bigip import MockBigIP
+from .certificates import (
+    BASH_PATH, DEFAULT_DAYS, CertificateService, generate_key, self_signed_cert, tmsh_installs,
+)
+from .f5_client import ClientPool
+from .planner import split_object_path
+from .resources import is_secret
+from .task_executor import PROJECT_DIR, TaskExecutor
+from .transactions import COORDINATION_HEADER, TRANSACTION_PATH, commit_transaction_id
+
+logger = logging.getLogger(__name__)
+
+# Connection variables every plan is compiled with, so one plan serves any device
+OFFLINE_HOST = "bigip.offline"
+OFFLINE_CONNECTION = {
+    "bigip_mgmt": OFFLINE_HOST,
+    "bigip_port": 443,
+    "bigip_username": "admin",
+    "bigip_password": "offline",
+    "bigip_validate_certs": False,
+    "validate_certs": False,
+}
+OFFLINE_HOST_VARS = {"ansible_host": OFFLINE_HOST, "bigip_user": "admin", "bigip_pass": "offline"}
+
+# Compiled plans kept in memory
+DEFAULT_MAX_PLANS = 256
+
+# Deploys that build on another solution's objects, and the deploys creating them:
+# those run against the offline device first and their calls are not part of the plan
+PREREQUISITES = {
+    "deploy_apm_oauth_client.yml": ("deploy_apm_oauth_as_rsa.yml",),  # solution 11 on solution 10
+}
+
+# Calls that are part of talking to a device rather than of the deploy
+_SESSION_PATHS = ("/mgmt/shared/authn/login", "/mgmt/shared/authz/tokens")
+
+# Project files a plan depends on (playbooks, task files, vars, templates)
+_SOURCE_GLOBS = ("*.yml", "tasks/*.yml", "vars/*.yml", "templates/*")
+
+POLICY_ITEM_PATH = "/mgmt/tm/apm/policy/policy-item"
+ACCESS_POLICY_PATH = "/mgmt/tm/apm/policy/access-policy"
+AGENT_PATH = "/mgmt/tm/apm/policy/agent"
+CUSTOMIZATION_GROUP_PATH = "/mgmt/tm/apm/policy/customization-group"
+
+# Objects every BIG-IP ships with; AS3 pointers to them are not reported
+BUILTIN_OBJECTS = {
+    "/Common/default.crt", "/Common/default.key", "/Common/clientssl", "/Common/serverssl",
+    "/Common/http", "/Common/tcp", "/Common/udp", "/Common/websecurity", "/Common/rba",
+    "/Common/ca-bundle.crt", "/Common/f5-ca-bundle.crt",
+}
+
+_MASK = "********"
+
+
+@dataclass
+class CompiledCall:
+    """One iControl REST call the deploy makes, in order"""
+    index: int
+    method: str
+    path: str
+    body: Any = None
+    task: Optional[str] = None
+    transaction: Optional[int] = None  # transaction group, numbered in the order they are opened
+    status_code: Optional[int] = None  # answer from an empty device
+    external: bool = False  # not a BIG-IP call (address manager, ...) - not sent while planning
+
+    def as_dict(self, bodies: bool = True) -> Dict[str, Any]:
+        data = {
+            "index": self.index,
+            "method": self.method,
+            "path": self.path,
+            "task": self.task,
+            "transaction": self.transaction,
+            "status_code": self.status_code,
+        }
+        if self.external:
+            data["external"] = True
+        if bodies:
+            data["body"] = mask_secrets(self.body)
+        return data
+
+
+@dataclass
+class ReferenceIssue:
+    """A reference from one object to another that the plan does not create"""
+    severity: str  # error or warning
+    call: int
+    field: str
+    target: str
+    message: str
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+
+@dataclass
+class CompiledPlan:
+    """Ordered calls of one playbook run offline, and what is wrong with them"""
+    playbook: str
+    key: str
+    calls: List[CompiledCall] = field(default_factory=list)
+    issues: List[ReferenceIssue] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    tasks: int = 0
+    compile_seconds: float = 0.0
+    cached: bool = False
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors and not any(issue.severity == "error" for issue in self.issues)
+
+    def summary(self) -> Dict[str, int]:
+        writes = [call for call in self.calls if call.method != "GET" and not call.external]
+        return {
+            "calls": len(self.calls),
+            "writes": len(writes),
+            "transactions": len({call.transaction for call in self.calls if call.transaction}),
+            "external": sum(1 for call in self.calls if call.external),
+            "errors": len(self.errors) + sum(1 for issue in self.issues if issue.severity == "error"),
+            "warnings": sum(1 for issue in self.issues if issue.severity == "warning"),
+        }
+
+    def describe(self) -> str:
+        summary = self.summary()
+        return (
+            f"{summary['calls']} calls ({summary['writes']} writes, {summary['transactions']} transactions), "
+            f"{summary['errors']} error(s), {summary['warnings']} warning(s)"
+        )
+
+    def problems(self) -> List[str]:
+        """Compile failures and reference errors, one line each"""
+        return self.errors + [
+            f"call {issue.call}: {issue.message}" for issue in self.issues if issue.severity == "error"
+        ]
+
+    def as_dict(self, bodies: bool = True) -> Dict[str, Any]:
+        return {
+            "playbook": self.playbook,
+            "key": self.key,
+            "valid": self.valid,
+            "cached": self.cached,
+            "compile_seconds": round(self.compile_seconds, 4),
+            "summary": self.summary(),
+            "errors": self.errors,
+            "issues": [issue.as_dict() for issue in self.issues],
+            "calls": [call.as_dict(bodies) for call in self.calls],
+        }
+
+
+class _OfflineTransport(httpx.BaseTransport):
+    """
+    Answers every request from an in-memory ``MockBigIP`` and records it
+
+    BIG-IP calls become ``CompiledCall``s grouped by transaction; calls to
+    other hosts (made without BIG-IP credentials) are recorded as external
+    and answered 503, since planning must not reach any real service.
+    """
+
+    def __init__(self, calls: List[CompiledCall], external: bool = False):
+        self.device = MockBigIP()
+        self.calls = calls
+        self.external = external
+        self.task: Optional[str] = None
+        self.recording = True
+        self._groups: Dict[str, int] = {}
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        body = _decode(request.content)
+        headers = {key.lower(): value for key, value in request.headers.items()}
+        if self.external:
+            status_code, payload = 503, {"message": "Not contacted while planning"}
+        else:
+            status_code, payload = self.device.handle(request.method, str(request.url), headers, body)
+        if self.recording and not path.startswith(_SESSION_PATHS):
+            query = request.url.query.decode()
+            target = f"{path}?{query}" if query else path
+            self.calls.append(CompiledCall(
+                index=len(self.calls) + 1,
+                method=request.method,
+                path=str(request.url) if self.external else target,
+                body=copy.deepcopy(body),
+                task=self.task,
+                transaction=self._group(request.method, path, headers, body, payload),
+                status_code=status_code,
+                external=self.external,
+            ))
+        return httpx.Response(status_code, json=payload, request=request)
+
+    def _group(self, method: str, path: str, headers: Dict[str, str], body: Any, payload: Any) -> Optional[int]:
+        coordination = headers.get(COORDINATION_HEADER.lower())
+        if coordination:
+            return self._groups.get(coordination)
+        if method == "POST" and path.rstrip("/") == TRANSACTION_PATH and isinstance(payload, dict):
+            trans_id = str(payload.get("transId"))
+            self._groups[trans_id] = len(self._groups) + 1
+            return self._groups[trans_id]
+        trans_id = commit_transaction_id(method, path, body)
+        return self._groups.get(trans_id) if trans_id else None
+
+
+class _OfflineCertificates(CertificateService):
+    """
+    Certificate installs while planning
+
+    Plans mask keys and certificates, so every compile signs with the same
+    throwaway key and reuses the certificate issued for a common name
+    rather than spending a key generation per deploy.
+    """
+
+    def __init__(self, issued: "OrderedDict[Tuple[str, int], Tuple[str, str]]", lock: threading.Lock,
+                 max_entries: int = DEFAULT_MAX_PLANS):
+        super().__init__(pool_size=0)
+        self.issued = issued
+        self.issued_lock = lock
+        self.max_entries = max_entries
+
+    def self_signed(self, common_name: str, days: int = DEFAULT_DAYS) -> Tuple[str, str]:
+        with self.issued_lock:
+            pair = self.issued.get((common_name, days))
+            if pair is None:
+                key = next(iter(self.issued.values()))[0] if self.issued else generate_key()
+                pair = (key, self_signed_cert(key, common_name, days))
+                self.issued[(common_name, days)] = pair
+                while len(self.issued) > self.max_entries:
+                    self.issued.popitem(last=False)
+            else:
+                self.issued.move_to_end((common_name, days))
+        return pair
+
+
+class PlanCompiler:
+    """
+    Offline compilation of the deploy playbooks
+
+    ``compile()`` runs a playbook through the native executor against an
+    empty in-memory device (calls made one at a time, nothing batched) and
+    returns every iControl REST call it made in order, with bodies and
+    transaction groups, then checks the references between the objects it
+    creates. Deploys listed in ``PREREQUISITES`` run after the solutions
+    they build on have been applied to the same device. Plans are compiled
+    with placeholder connection variables and cached by playbook, variables
+    and the modification times of the project files, so the same solution
+    compiles once for any number of devices.
+    """
+
+    def __init__(self, project_dir: Path = PROJECT_DIR, max_entries: int = DEFAULT_MAX_PLANS):
+        self.project_dir = Path(project_dir)
+        self.max_entries = max_entries
+        self._plans: "OrderedDict[str, CompiledPlan]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._issued: "OrderedDict[Tuple[str, int], Tuple[str, str]]" = OrderedDict()
+        self._issued_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, playbook: str, extravars: Optional[Dict[str, Any]] = None) -> str:
+        """Cache key: playbook, non-connection variables and project file versions"""
+        variables = {k: v for k, v in (extravars or {}).items() if k not in OFFLINE_CONNECTION}
+        material = json.dumps(
+            {"playbook": playbook, "vars": variables, "sources": self._sources()},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(material.encode()).hexdigest()[:32]
+
+    def compile(self, playbook: str, extravars: Optional[Dict[str, Any]] = None) -> CompiledPlan:
+        """Compiled plan for ``playbook`` with ``extravars`` (connection variables are ignored)"""
+        key = self.key(playbook, extravars)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return dataclasses.replace(plan, cached=True)
+            self.misses += 1
+        plan = self._compile(playbook, key, extravars or {})
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _compile(self, playbook: str, key: str, extravars: Dict[str, Any]) -> CompiledPlan:
+        started = time.monotonic()
+        calls: List[CompiledCall] = []
+        transport = _OfflineTransport(calls)
+        external = _OfflineTransport(calls, external=True)
+
+        def track(event: Dict[str, Any]) -> None:
+            if event.get("event") == "task_start":
+                transport.task = external.task = event.get("task")
+
+        clients = ClientPool(transport=transport)
+        certificates = _OfflineCertificates(self._issued, self._issued_lock, self.max_entries)
+
+        def run(name: str, variables: Dict[str, Any]):
+            executor = TaskExecutor(
+                clients, self.project_dir, event_handler=track, staging_concurrency=1,
+                anonymous_transport=external, certificates=certificates,
+            )
+            return executor.run_playbook(name, extravars=variables, host_vars=OFFLINE_HOST_VARS)
+
+        errors: List[str] = []
+        try:
+            transport.recording = external.recording = False
+            for prerequisite in PREREQUISITES.get(playbook, ()):
+                setup = run(prerequisite, dict(OFFLINE_CONNECTION))
+                errors.extend(f"{prerequisite}: {error}" for error in setup.errors)
+            transport.recording = external.recording = True
+            result = run(playbook, {**extravars, **OFFLINE_CONNECTION})
+        finally:
+            clients.close_all()
+        plan = CompiledPlan(
+            playbook=playbook, key=key, calls=calls, errors=errors + list(result.errors),
+            tasks=len(result.tasks),
+        )
+        plan.issues = validate_references(calls)
+        plan.compile_seconds = time.monotonic() - started
+        logger.info("Compiled %s: %s in %.3fs", playbook, plan.describe(), plan.compile_seconds)
+        return plan
+
+    def _sources(self) -> Tuple[int, int]:
+        """(file count, newest mtime) of the project files a plan is built from"""
+        count, newest = 0, 0
+        for pattern in _SOURCE_GLOBS:
+            for path in self.project_dir.glob(pattern):
+                count += 1
+                newest = max(newest, path.stat().st_mtime_ns)
+        return count, newest
+
+
+# Reference validation
+
+def validate_references(calls: List[CompiledCall]) -> List[ReferenceIssue]:
+    """
+    References between the objects a plan creates
+
+    Errors: a policy item's ``nextItem`` or agent, an access policy's items,
+    ``startItem`` or ``defaultEnding``, a profile's ``accessPolicy`` or any
+    ``*ustomizationGroup`` field naming something the plan never creates.
+    Warnings: policy items unreachable from the start item and AS3
+    ``bigip`` pointers to objects outside the plan (they may be built in).
+    """
+    defined = _defined_objects(calls)
+    everything = set(BUILTIN_OBJECTS).union(
+        *(names for collection, names in defined.items() if collection != "_next")
+    )
+    issues: List[ReferenceIssue] = []
+
+    def require(call: CompiledCall, collection: str, name_field: str, target: Any, kind: str,
+                partition: str = "Common") -> None:
+        full_path = _reference(target, partition)
+        if full_path and full_path not in defined.get(collection, set()):
+            issues.append(ReferenceIssue(
+                "error", call.index, name_field, full_path,
+                f"{_label(call)} references {kind} {full_path}, which the plan does not create",
+            ))
+
+    for call in calls:
+        if call.method not in ("POST", "PUT", "PATCH") or call.status_code is None or call.status_code >= 400:
+            continue
+        body = call.body
+        if not isinstance(body, dict):
+            continue
+        collection, _ = split_object_path(call.path.split("?", 1)[0])
+        partition = body.get("partition") or "Common"
+        if collection == POLICY_ITEM_PATH:
+            for rule in body.get("rules") or []:
+                if isinstance(rule, dict) and rule.get("nextItem"):
+                    require(call, POLICY_ITEM_PATH, "rules.nextItem", rule["nextItem"], "policy item", partition)
+            for agent in body.get("agents") or []:
+                if isinstance(agent, dict) and agent.get("name") and agent.get("type"):
+                    require(call, f"{AGENT_PATH}/{agent['type']}", "agents", agent["name"],
+                            f"{agent['type']} agent", agent.get("partition") or partition)
+        if collection == ACCESS_POLICY_PATH:
+            issues.extend(_check_policy(call, body, defined, partition))
+        if collection.startswith("/mgmt/tm/apm/profile/") and body.get("accessPolicy"):
+            require(call, ACCESS_POLICY_PATH, "accessPolicy", body["accessPolicy"], "access policy", partition)
+        for name_field, value in body.items():
+            if name_field.endswith("ustomizationGroup") and isinstance(value, str) and value not in ("", "none"):
+                require(call, CUSTOMIZATION_GROUP_PATH, name_field, value, "customization group", partition)
+        if call.path.startswith("/mgmt/shared/appsvcs/declare"):
+            for pointer in _as3_pointers(body):
+                if pointer not in everything:
+                    issues.append(ReferenceIssue(
+                        "warning", call.index, "bigip", pointer,
+                        f"AS3 declaration points at {pointer}, which the plan does not create",
+                    ))
+    return issues
+
+
+def _check_policy(call: CompiledCall, body: Dict[str, Any], defined: Dict[str, Set[str]],
+                  partition: str) -> List[ReferenceIssue]:
+    issues = []
+    items = [
+        _reference(item.get("name"), item.get("partition") or partition)
+        for item in body.get("items") or [] if isinstance(item, dict)
+    ]
+    for item in items:
+        if item and item not in defined.get(POLICY_ITEM_PATH, set()):
+            issues.append(ReferenceIssue(
+                "error", call.index, "items", item,
+                f"{_label(call)} lists policy item {item}, which the plan does not create",
+            ))
+    for name_field in ("startItem", "defaultEnding"):
+        target = _reference(body.get(name_field), partition)
+        if target and items and target not in items:
+            issues.append(ReferenceIssue(
+                "error", call.index, name_field, target,
+                f"{_label(call)} {name_field} {target} is not one of its items",
+            ))
+    start = _reference(body.get("startItem"), partition)
+    if start and items:
+        reachable = _reachable(start, defined.get("_next", {}))
+        for item in items:
+            if item not in reachable:
+                issues.append(ReferenceIssue(
+                    "warning", call.index, "items", item,
+                    f"{_label(call)} item {item} cannot be reached from {start}",
+                ))
+    return issues
+
+
+def _defined_objects(calls: List[CompiledCall]) -> Dict[str, Any]:
+    """Objects each collection holds once the plan has run (fullPath sets), plus policy edges"""
+    defined: Dict[str, Any] = {}
+    edges: Dict[str, List[str]] = {}
+    for call in calls:
+        if call.external or call.status_code is None or call.status_code >= 400:
+            continue
+        path = call.path.split("?", 1)[0]
+        collection, full_path = split_object_path(path)
+        body = call.body if isinstance(call.body, dict) else {}
+        if call.method == "POST" and full_path is None and body.get("name"):
+            full_path = _reference(body["name"], body.get("partition") or "Common")
+        if call.method == "POST" and path == BASH_PATH:
+            for installed, target, _ in tmsh_installs(str(body.get("utilCmdArgs", ""))):
+                defined.setdefault(installed, set()).add(target)
+        if full_path is None or call.method not in ("POST", "PUT", "PATCH"):
+            continue
+        defined.setdefault(collection, set()).add(full_path)
+        if collection == POLICY_ITEM_PATH and body.get("rules") is not None:
+            edges[full_path] = [
+                _reference(rule.get("nextItem"), body.get("partition") or "Common")
+                for rule in body["rules"] if isinstance(rule, dict) and rule.get("nextItem")
+            ]
+    defined["_next"] = edges
+    return defined
+
+
+def _reachable(start: str, edges: Dict[str, List[str]]) -> Set[str]:
+    seen, stack = set(), [start]
+    while stack:
+        item = stack.pop()
+        if item in seen:
+            continue
+        seen.add(item)
+        stack.extend(edges.get(item, []))
+    return seen
+
+
+def _as3_pointers(value: Any) -> List[str]:
+    """``{"bigip": "/Common/..."}`` references anywhere in an AS3 declaration"""
+    found = []
+    if isinstance(value, dict):
+        pointer = value.get("bigip")
+        if isinstance(pointer, str) and len(value) == 1:
+            found.append(pointer)
+        for child in value.values():
+            found.extend(_as3_pointers(child))
+    elif isinstance(value, list):
+        for child in value:
+            found.extend(_as3_pointers(child))
+    return found
+
+
+def _reference(name: Any, partition: str = "Common") -> Optional[str]:
+    if not isinstance(name, str) or not name:
+        return None
+    return name if name.startswith("/") else f"/{partition}/{name}"
+
+
+def _label(call: CompiledCall) -> str:
+    name = call.body.get("name") if isinstance(call.body, dict) else None
+    return f"{call.method} {call.path.split('?', 1)[0]}" + (f" ({name})" if name else "")
+
+
+def mask_secrets(value: Any) -> Any:
+    """Copy of a request body with passwords, secrets and passphrases masked"""
+    if isinstance(value, dict):
+        return {
+            key: _MASK if is_secret(key) and isinstance(child, str) else mask_secrets(child)
+            for key, child in value.items()
+        }
+    if isinstance(value, list):
+        return [mask_secrets(child) for child in value]
+    return value
+
+
+def _decode(content: bytes) -> Any:
+    if not content:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content.decode(errors="replace")
@@ -0,0 +1,801 @@
+"""
+Deployment engine for F5 BIG-IP APM API
+Runs the deploy/delete playbooks (in-process or through ansible-runner) on a bounded worker pool
+"""
+import copy
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from ..models import (
+    DeploymentResponse, DeploymentStatus, DeployMode, OperationType, SolutionType,
+    Solution1Request, Solution2Request, BIGIPCredentials, TaskResult
+)
+from . import metrics
+from .addresses import AddressAllocator
+from .as3 import AS3Batcher
+from .certificates import CertificateService
+from .compiler import PlanCompiler
+from .device_info import DeviceInfoCache
+from .drift import DriftMonitor
+from .events import EventBroker
+from .f5_client import ClientPool
+from .gslb import GTMTopologyCache
+from .planner import Planner
+from .policy_apply import PolicyApplyCoordinator
+from .teardown import DEFAULT_TEARDOWN_CONCURRENCY, Teardown
+from .resources import record_resource, track_object
+from .scheduler import DeviceScheduler, JobPriority, device_key
+from .snapshots import RollbackError, SnapshotService, deployed_record
+from .store import DeploymentStore
+from .task_executor import ExecutionResult, TaskExecutor
+from .transactions import DEFAULT_STAGING_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Repository root - playbooks, tasks/ and vars/ live here
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+
+PLAYBOOKS = {
+    SolutionType.VPN: {
+        OperationType.DEPLOY: "deploy_apm_vpn.yml",
+        OperationType.DELETE: "delete_apm_vpn.yml",
+    },
+    SolutionType.PORTAL: {
+        OperationType.DEPLOY: "deploy_apm_portal.yml",
+        OperationType.DELETE: "delete_apm_portal.yml",
+    },
+}
+
+# Deploy and delete playbook per solution number (vars/solutionN.yml; solution 1 uses
+# vars/main.yml), in dependency order
+SOLUTION_PLAYBOOKS = {
+    "solution1": ("deploy_apm_vpn.yml", "delete_apm_vpn.yml"),
+    "solution2": ("deploy_apm_portal.yml", "delete_apm_portal.yml"),
+    "solution3": ("deploy_apm_saml.yml", "delete_apm_saml.yml"),
+    "solution4": ("deploy_apm_saml_idp.yml", "delete_apm_saml_idp.yml"),
+    "solution5": ("deploy_apm_saml_sp_internal.yml", "delete_apm_saml_sp_internal.yml"),
+    "solution6": ("deploy_apm_cert_kerb.yml", "delete_apm_cert_kerb.yml"),
+    "solution7": ("deploy_apm_sideband.yml", "delete_apm_sideband.yml"),
+    "solution8": ("deploy_apm_oauth_as.yml", "delete_apm_oauth_as.yml"),
+    "solution9": ("deploy_apm_oauth_rs.yml", "delete_apm_oauth_rs.yml"),
+    "solution10": ("deploy_apm_oauth_as_rsa.yml", "delete_apm_oauth_as_rsa.yml"),
+    "solution11": ("deploy_apm_oauth_client.yml", "delete_apm_oauth_client.yml"),
+    "solution12": ("deploy_apm_rdg.yml", "delete_apm_rdg.yml"),
+    "solution14": ("deploy_apm_saml_sp_azure.yml", "delete_apm_saml_sp_azure.yml"),
+}
+
+# ansible-runner events that carry a per-host task result
+TASK_RESULT_EVENTS = {
+    "runner_on_ok": "ok",
+    "runner_on_failed": "failed",
+    "runner_on_skipped": "skipped",
+    "runner_on_unreachable": "unreachable",
+}
+
+TASK_START_EVENT = "playbook_on_task_start"
+
+
+class EngineBusyError(Exception):
+    """Raised when the deployment queue is full"""
+
+
+@dataclass
+class DeploymentJob:
+    """A queued playbook run and the record it reports into"""
+    record: DeploymentResponse
+    playbook: str
+    credentials: BIGIPCredentials
+    extravars: Dict[str, Any] = field(default_factory=dict)
+    mode: DeployMode = DeployMode.FULL
+    priority: JobPriority = JobPriority.DEPLOY
+
+    @property
+    def device(self) -> str:
+        return device_key(self.credentials)
+
+
+def connection_vars(credentials: BIGIPCredentials) -> Dict[str, Any]:
+    """Map API credentials onto the bigip_* variables used by vars/*.yml"""
+    return {
+        "bigip_mgmt": credentials.host,
+        "bigip_port": credentials.port,
+        "bigip_username": credentials.username,
+        "bigip_password": credentials.password,
+        "bigip_validate_certs": credentials.validate_certs,
+        "validate_certs": credentials.validate_certs,
+    }
+
+
+def naming_vars(solution_name: str) -> Dict[str, Any]:
+    """Object prefix variables shared by every playbook"""
+    return {
+        "vs1_name": solution_name,
+        "partition_name": solution_name,
+        "path_name": solution_name,
+    }
+
+
+def solution1_vars(request: Solution1Request) -> Dict[str, Any]:
+    """Extra vars for deploy_apm_vpn.yml"""
+    extravars = {
+        **connection_vars(request.credentials),
+        **naming_vars(request.solution_name),
+        "dns1_name": request.dns_name,
+        "custom_type": request.customization_type.value,
+        "ad_server_ip": request.ad_config.ip,
+        "ad_domain": request.ad_config.domain,
+        "ad_admin_user": request.ad_config.admin_user,
+        "ad_admin_password": request.ad_config.admin_password,
+        "vpn_lease_pool_start": request.vpn_config.lease_pool_start,
+        "vpn_lease_pool_end": request.vpn_config.lease_pool_end,
+        "vpn_split_tunnel_networks": request.vpn_config.split_tunnel_networks,
+        "enable_compression": request.vpn_config.enable_compression,
+        "create_connectivity_profile": request.create_connectivity_profile,
+        "create_network_access": request.create_network_access,
+        "create_webtop": request.create_webtop,
+        "deploy_application_via_as3": request.deploy_as3,
+        "app_vs_port": request.as3_virtual_port,
+    }
+    if request.as3_virtual_ip:
+        extravars["app_vs_address"] = request.as3_virtual_ip
+    return extravars
+
+
+def solution2_vars(request: Solution2Request) -> Dict[str, Any]:
+    """Extra vars for deploy_apm_portal.yml"""
+    extravars = {
+        **connection_vars(request.credentials),
+        **naming_vars(request.solution_name),
+        "dns1_name": request.dns_name,
+        "custom_type": request.customization_type.value,
+        "ad_server_ip": request.ad_config.ip,
+        "ad_domain": request.ad_config.domain,
+        "ad_admin_user": request.ad_config.admin_user,
+        "ad_admin_password": request.ad_config.admin_password,
+        "create_portal_resources": bool(request.portal_resources),
+        "portal_resources": [r.model_dump() for r in request.portal_resources],
+        "ad_group_mappings": [
+            m.model_dump(exclude_none=True) for m in request.ad_group_mappings
+        ],
+        "create_network_access": request.create_network_access,
+        "create_webtop": request.create_webtop,
+        "create_as3_application": request.deploy_as3,
+        "deploy_application_via_as3": request.deploy_as3,
+        "app_vs_port": request.as3_virtual_port,
+    }
+    if request.vpn_config:
+        extravars.update({
+            "vpn_lease_pool_start": request.vpn_config.lease_pool_start,
+            "vpn_lease_pool_end": request.vpn_config.lease_pool_end,
+            "vpn_split_tunnel_networks": request.vpn_config.split_tunnel_networks,
+            "enable_compression": request.vpn_config.enable_compression,
+        })
+    if request.as3_virtual_ip:
+        extravars["app_vs_address"] = request.as3_virtual_ip
+    return extravars
+
+
+def host_vars(credentials: BIGIPCredentials) -> Dict[str, Any]:
+    """Per-host inventory variables, as in inventory.yml"""
+    return {
+        "ansible_host": credentials.host,
+        "bigip_user": credentials.username,
+        "bigip_pass": credentials.password,
+    }
+
+
+def build_inventory(credentials: BIGIPCredentials) -> Dict[str, Any]:
+    """Single-host inventory equivalent to inventory.yml"""
+    return {
+        "all": {
+            "children": {
+                "bigip": {
+                    "hosts": {
+                        credentials.host: host_vars(credentials)
+                    },
+                    "vars": {
+                        "ansible_connection": "local",
+                        "ansible_python_interpreter": "{{ ansible_playbook_python }}",
+                    },
+                }
+            }
+        }
+    }
+
+
+class DeploymentEngine:
+    """
+    Bounded playbook job engine
+
+    At most ``max_workers`` playbooks run at once and at most one per
+    BIG-IP: jobs wait in their device's queue in the ``scheduler`` (deletes
+    and rollbacks first, up to ``max_pending`` in total) without touching
+    the FastAPI event loop or holding a worker. Records are saved to ``store`` when queued, at most every
+    ``save_interval`` seconds while running and when finished; every task
+    start/end is also published to ``events`` for streaming clients.
+    ``backend`` selects how a playbook runs:
+
+    - ``native``: in-process ``TaskExecutor`` over the shared client pool;
+      AS3 declarations go through the per-device ``as3`` batcher, device
+      probes are answered from ``device_info``, GTM topology reads from
+      ``gtm``, VIPs come from the ``addresses`` pool, certificate keys from
+      ``certificates``, access policy applies are coalesced per device by
+      ``applies`` and deletes run as a dependency-graph ``Teardown``
+    - ``ansible``: ansible-playbook via ansible-runner
+
+    Snapshot jobs capture a deployed solution's objects with ``snapshots``;
+    rollback jobs restore one as a single transaction through the
+    ``Planner``. Finished jobs are handed to ``drift``, which watches the
+    objects of completed deploys and rollbacks until their solution is
+    deleted.
+
+    With a ``compiler``, deploys are first compiled offline (cached per
+    solution definition) and rejected before touching the device if the
+    plan references objects it never creates.
+    """
+
+    BACKENDS = ("native", "ansible")
+
+    def __init__(
+        self,
+        store: DeploymentStore,
+        max_workers: int = 8,
+        max_pending: int = 500,
+        max_suspended: int = 32,
+        project_dir: Path = PROJECT_DIR,
+        backend: str = "native",
+        clients: Optional[ClientPool] = None,
+        staging_concurrency: int = DEFAULT_STAGING_CONCURRENCY,
+        teardown_concurrency: int = DEFAULT_TEARDOWN_CONCURRENCY,
+        save_interval: float = 1.0,
+        events: Optional[EventBroker] = None,
+        as3: Optional[AS3Batcher] = None,
+        device_info: Optional[DeviceInfoCache] = None,
+        compiler: Optional[PlanCompiler] = None,
+        gtm: Optional[GTMTopologyCache] = None,
+        addresses: Optional[AddressAllocator] = None,
+        certificates: Optional[CertificateService] = None,
+        applies: Optional[PolicyApplyCoordinator] = None,
+        drift: Optional[DriftMonitor] = None,
+        snapshots: Optional[SnapshotService] = None,
+    ):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown executor backend '{backend}' (expected one of {self.BACKENDS})")
+        self.store = store
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.project_dir = project_dir
+        self.backend = backend
+        self.clients = clients or ClientPool()
+        self.staging_concurrency = staging_concurrency
+        self.teardown_concurrency = teardown_concurrency
+        self.save_interval = save_interval
+        self._saved_at: Dict[str, float] = {}
+        self.events = events or EventBroker()
+        self.as3 = as3 or AS3Batcher()
+        self.device_info = device_info or DeviceInfoCache()
+        self.compiler = compiler
+        self.gtm = gtm or GTMTopologyCache()
+        self.addresses = addresses or AddressAllocator()
+        self.certificates = certificates or CertificateService(pool_size=0)
+        self.applies = applies or PolicyApplyCoordinator()
+        self.drift = drift
+        self.snapshots = snapshots or SnapshotService()
+        self._published: Dict[str, int] = {}
+        # Queued jobs wait in the scheduler (at most max_pending) without a
+        # thread; the pool only needs threads for running jobs and for those
+        # that gave their slot back while suspended on an AS3 run or apply
+        self.max_suspended = max_suspended
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers + self.max_suspended, thread_name_prefix="apm-deploy"
+        )
+        self.scheduler = DeviceScheduler(self._executor, max_running=max_workers,
+                                         max_suspended=self.max_suspended)
+        self._lock = threading.Lock()
+        self._active = 0
+
+    @property
+    def active_jobs(self) -> int:
+        """Jobs queued or running"""
+        with self._lock:
+            return self._active
+
+    def submit(self, job: DeploymentJob) -> DeploymentResponse:
+        """Register a job as PENDING and queue it for execution"""
+        self._admit()
+        ahead = self.scheduler.ahead(job.device, job.priority)
+        if ahead:
+            job.record.message = f"Queued behind {ahead} job(s) on {job.credentials.host}"
+        self._register(job)
+        self.scheduler.submit(job.device, job.priority, self._run, job, label=job.record.deployment_id,
+                              group=job.record.solution_name)
+        return job.record
+
+    def execute(self, job: DeploymentJob) -> DeploymentResponse:
+        """
+        Run a job in the calling thread and return its finished record
+
+        For callers that bring their own concurrency limit (fleet deploys);
+        the job is stored and streamed exactly like a submitted one, and
+        counts against ``max_pending`` like one.
+        """
+        self._admit()
+        self._register(job)
+        self.scheduler.run(job.device, job.priority, self._run, job, label=job.record.deployment_id,
+                           group=job.record.solution_name)
+        return job.record
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._active >= self.max_pending:
+                raise EngineBusyError(
+                    f"Deployment queue is full ({self.max_pending} jobs pending)"
+                )
+            self._active += 1
+
+    def _register(self, job: DeploymentJob) -> None:
+        metrics.QUEUED.inc()
+        self.store.track(job.record)
+        self.events.open(job.record.deployment_id)
+        self._save(job.record)
+        self._publish_status(job.record)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs and optionally wait for queued and running ones"""
+        dropped = self.scheduler.close(cancel=not wait)
+        if dropped:
+            logger.warning("Dropped %d queued deployment(s) on shutdown", dropped)
+        if wait:
+            self.scheduler.join()
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        self.as3.shutdown(wait=wait)
+        self.applies.shutdown(wait=wait)
+        self.device_info.shutdown(wait=wait)
+        self.certificates.shutdown(wait=wait)
+
+    def _run(self, job: DeploymentJob) -> None:
+        record = job.record
+        metrics.QUEUED.dec()
+        metrics.IN_FLIGHT.inc()
+        started = time.monotonic()
+        record.status = DeploymentStatus.IN_PROGRESS
+        record.message = f"Running {job.playbook}"
+        self._save(record)
+        self._publish_status(record)
+        try:
+            if not self._preflight(job):
+                return
+            if record.operation == OperationType.SNAPSHOT:
+                self._run_snapshot(job)
+            elif record.operation == OperationType.ROLLBACK:
+                self._run_rollback(job)
+            elif job.mode != DeployMode.FULL:
+                self._run_diff(job)
+            elif self.backend == "native" and record.operation == OperationType.DELETE:
+                self._run_teardown(job)
+            elif self.backend == "native":
+                self._run_native(job)
+            else:
+                self._run_playbook(job)
+        except Exception as exc:  # keep the worker alive whatever happens
+            logger.exception("Deployment %s crashed", record.deployment_id)
+            record.errors.append(str(exc))
+            record.status = DeploymentStatus.FAILED
+            record.message = f"{job.playbook} failed: {exc}"
+        finally:
+            self._watch(job)
+            self._save(record)
+            self.as3.withdraw(record.deployment_id)
+            self.store.untrack(record.deployment_id)
+            self._saved_at.pop(record.deployment_id, None)
+            self._publish_tasks(record)
+            self._published.pop(record.deployment_id, None)
+            self.events.close(
+                record.deployment_id, status=record.status.value,
+                message=record.message, errors=record.errors,
+            )
+            metrics.IN_FLIGHT.dec()
+            metrics.DEPLOYMENT_LATENCY.labels(
+                operation=record.operation.value, status=record.status.value
+            ).observe(time.monotonic() - started)
+            with self._lock:
+                self._active -= 1
+
+    def _watch(self, job: DeploymentJob) -> None:
+        if self.drift is None:
+            return
+        try:
+            self.drift.observe(job.record, job.credentials)
+        except Exception:  # drift bookkeeping must not fail the job
+            logger.exception("Could not watch deployment %s for drift", job.record.deployment_id)
+
+    def _save(self, record: DeploymentResponse) -> None:
+        record.updated_at = datetime.now(timezone.utc)
+        self._saved_at[record.deployment_id] = time.monotonic()
+        try:
+            self.store.save(record)
+        except Exception:  # a store outage must not kill the job
+            logger.exception("Could not save deployment %s", record.deployment_id)
+
+    def _progress(self, record: DeploymentResponse) -> None:
+        """Throttled save so other workers see task progress"""
+        if time.monotonic() - self._saved_at.get(record.deployment_id, 0.0) >= self.save_interval:
+            self._save(record)
+
+    def _publish_status(self, record: DeploymentResponse) -> None:
+        self.events.publish(
+            record.deployment_id, "status", status=record.status.value, message=record.message
+        )
+
+    def _publish_tasks(self, record: DeploymentResponse) -> None:
+        """Publish a task_end event for every task recorded since the last call"""
+        published = self._published.get(record.deployment_id, 0)
+        for index, task in enumerate(record.tasks[published:], published):
+            details = task.details or {}
+            metrics.TASK_RESULTS.labels(operation=record.operation.value, status=task.status).inc()
+            if details.get("duration") is not None:
+                # Task names are templated (one per application): label by module to bound the series
+                metrics.TASK_LATENCY.labels(
+                    operation=record.operation.value, module=details.get("module", "unknown")
+                ).observe(details["duration"])
+            self.events.publish(
+                record.deployment_id, "task_end", index=index, task=task.task_name,
+                status=task.status, message=task.message,
+                duration=details.get("duration"), status_code=details.get("status_code"),
+            )
+        self._published[record.deployment_id] = len(record.tasks)
+
+    def _task_event(self, record: DeploymentResponse, event: Dict[str, Any]) -> None:
+        """Native executor event callback"""
+        if event.get("event") == "task_start":
+            self.events.publish(
+                record.deployment_id, "task_start", task=event.get("task"), module=event.get("module")
+            )
+        else:
+            self._publish_tasks(record)
+        self._progress(record)
+
+    def _preflight(self, job: DeploymentJob) -> bool:
+        """Validate a deploy's compiled plan; False (record failed) on reference errors"""
+        record = job.record
+        if self.compiler is None or record.operation != OperationType.DEPLOY:
+            return True
+        try:
+            plan = self.compiler.compile(job.playbook, job.extravars)
+        except Exception:
+            logger.exception("Compiling %s for deployment %s failed", job.playbook, record.deployment_id)
+            return True
+        errors = [issue for issue in plan.issues if issue.severity == "error"]
+        if not errors:
+            # Run-time failures against an empty device are not conclusive:
+            # the target may already hold what the playbook expects
+            return True
+        record.errors.extend(f"call {issue.call}: {issue.message}" for issue in errors)
+        record.status = DeploymentStatus.FAILED
+        record.message = (
+            f"Plan validation failed for {job.playbook}: {len(errors)} unresolved reference(s); "
+            "nothing was sent to the device"
+        )
+        return False
+
+    def _run_native(self, job: DeploymentJob) -> None:
+        record = job.record
+        # The executor appends straight into the record so polling sees progress
+        result = ExecutionResult(
+            tasks=record.tasks,
+            created_resources=record.created_resources,
+            deleted_resources=record.deleted_resources,
+            tracked_objects=record.tracked_objects,
+            errors=record.errors,
+        )
+        executor = TaskExecutor(
+            self.clients, self.project_dir,
+            event_handler=lambda event: self._task_event(record, event),
+            staging_concurrency=self.staging_concurrency,
+            as3=self.as3,
+            blocking=lambda wait: self.scheduler.suspend(job.device, wait),
+            exclusive=lambda: self.scheduler.exclusive(job.device, label=f"{record.deployment_id} (device write)"),
+            device_info=self.device_info,
+            as3_token=record.deployment_id,
+            gtm=self.gtm,
+            addresses=self.addresses,
+            certificates=self.certificates,
+            applies=self.applies,
+        )
+        executor.run_playbook(
+            job.playbook,
+            extravars=job.extravars,
+            host_vars=host_vars(job.credentials),
+            result=result,
+        )
+        if result.failed:
+            record.status = DeploymentStatus.FAILED
+            record.message = f"{job.playbook} failed after {result.duration:.1f}s"
+        else:
+            record.status = DeploymentStatus.COMPLETED
+            record.message = (
+                f"{job.playbook} completed successfully in {result.duration:.1f}s "
+                f"({result.request_count} REST calls)"
+            )
+
+    def _run_diff(self, job: DeploymentJob) -> None:
+        """Plan against the device's current config and (in diff mode) apply it"""
+        record = job.record
+        planner = Planner(self.clients, self.project_dir)
+        plan, planned = planner.plan(job.playbook, extravars=job.extravars,
+                                     host_vars=host_vars(job.credentials))
+        record.plan = plan.as_dict()
+        if planned.failed:
+            record.errors.extend(planned.errors)
+            record.status = DeploymentStatus.FAILED
+            record.message = f"Planning {job.playbook} failed"
+            return
+        if job.mode == DeployMode.PLAN:
+            record.status = DeploymentStatus.COMPLETED
+            record.message = f"Plan for {job.playbook}: {plan.describe()}"
+            return
+
+        result = ExecutionResult(
+            tasks=record.tasks,
+            created_resources=record.created_resources,
+            deleted_resources=record.deleted_resources,
+            tracked_objects=record.tracked_objects,
+            errors=record.errors,
+        )
+        planner.apply(plan, result, staging_concurrency=self.staging_concurrency)
+        if result.failed:
+            record.status = DeploymentStatus.FAILED
+            record.message = f"Applying {job.playbook} failed ({plan.describe()})"
+        else:
+            record.status = DeploymentStatus.COMPLETED
+            record.message = f"{job.playbook} applied: {plan.describe()}"
+
+    def _run_teardown(self, job: DeploymentJob) -> None:
+        """Delete the playbook's objects by dependency level instead of one by one"""
+        record = job.record
+        teardown = Teardown(self.clients, self.project_dir, self.teardown_concurrency)
+        graph, planned = teardown.plan(job.playbook, extravars=job.extravars,
+                                       host_vars=host_vars(job.credentials))
+        if planned.failed:
+            record.errors.extend(planned.errors)
+            record.status = DeploymentStatus.FAILED
+            record.message = f"Planning {job.playbook} failed"
+            return
+        result = ExecutionResult(
+            tasks=record.tasks,
+            created_resources=record.created_resources,
+            deleted_resources=record.deleted_resources,
+            errors=record.errors,
+        )
+        teardown.run(graph, result)
+        levels = len(graph.levels())
+        summary = (
+            f"{len(graph.nodes)} objects in {levels} levels, "
+            f"{len(graph.skipped)} already absent ({graph.plan.reads} reads)"
+        )
+        if result.failed:
+            record.status = DeploymentStatus.FAILED
+            record.message = f"{job.playbook} failed: {summary}"
+        else:
+            record.status = DeploymentStatus.COMPLETED
+            record.message = f"{job.playbook} completed successfully: {summary}"
+
+    def _run_snapshot(self, job: DeploymentJob) -> None:
+        """Capture the objects of the solution's last deploy as they are on the device"""
+        record = job.record
+        started = time.monotonic()
+        deployed = deployed_record(self.store, job.credentials.host, record.solution_name)
+        if deployed is None:
+            record.status = DeploymentStatus.FAILED
+            record.message = f"No completed deploy of {record.solution_name} recorded on {job.credentials.host}"
+            return
+        if not deployed.tracked_objects:
+            # ansible-runner deploys record no objects; nothing to capture or restore
+            record.status = DeploymentStatus.FAILED
+            record.message = (
+                f"Deployment {deployed.deployment_id} of {record.solution_name} recorded no objects to "
+                "snapshot (run through ansible-runner?); re-deploy it with the native executor first"
+            )
+            return
+        client = self.clients.for_credentials(job.credentials)
+        record.snapshot = self.snapshots.take(client, deployed.tracked_objects)
+        record.tracked_objects = copy.deepcopy(deployed.tracked_objects)
+        record.status = DeploymentStatus.COMPLETED
+        record.message = (
+            f"Captured {len(record.snapshot)} object(s) of {record.solution_name} "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+        tenants = deployed.created_resources.get("as3_tenants")
+        if tenants:
+            record.message += f"; AS3 tenant(s) {', '.join(tenants)} not included"
+
+    def _run_rollback(self, job: DeploymentJob) -> None:
+        """Restore a snapshot with one transaction and one policy apply"""
+        record = job.record
+        started = time.monotonic()
+        snapshot = self.store.get(record.snapshot_id)
+        if snapshot is None or snapshot.snapshot is None:
+            record.status = DeploymentStatus.FAILED
+            record.message = f"Snapshot {record.snapshot_id} not found"
+            return
+        client = self.clients.for_credentials(job.credentials)
+        deployed = deployed_record(self.store, job.credentials.host, record.solution_name)
+        try:
+            plan = self.snapshots.plan_rollback(
+                client, snapshot.snapshot, deployed.tracked_objects if deployed is not None else []
+            )
+        except RollbackError as exc:
+            record.errors.append(str(exc))
+            record.status = DeploymentStatus.FAILED
+            record.message = f"Rollback to snapshot {record.snapshot_id} refused: {exc}"
+            return
+        record.plan = plan.as_dict()
+        result = ExecutionResult(
+            tasks=record.tasks,
+            created_resources=record.created_resources,
+            deleted_resources=record.deleted_resources,
+            errors=record.errors,
+        )
+        Planner(self.clients, self.project_dir).apply(plan, result, staging_concurrency=self.staging_concurrency)
+        if result.failed:
+            record.status = DeploymentStatus.FAILED
+            record.message = f"Rollback to snapshot {record.snapshot_id} failed ({plan.describe()})"
+            return
+        record.tracked_objects = copy.deepcopy(snapshot.tracked_objects)
+        record.status = DeploymentStatus.COMPLETED
+        record.message = (
+            f"Rolled back to snapshot {record.snapshot_id} in {time.monotonic() - started:.1f}s: "
+            f"{plan.describe()}"
+        )
+
+    def _run_playbook(self, job: DeploymentJob) -> None:
+        try:
+            import ansible_runner
+        except ImportError:
+            raise RuntimeError(
+                "ansible-runner is not installed (pip install -r requirements-api.txt)"
+            ) from None
+
+        record = job.record
+        private_data_dir = tempfile.mkdtemp(prefix="apm-runner-")
+        try:
+            result = ansible_runner.run(
+                private_data_dir=private_data_dir,
+                project_dir=str(self.project_dir),
+                playbook=job.playbook,
+                inventory=build_inventory(job.credentials),
+                extravars=job.extravars,
+                event_handler=lambda event: self._handle_event(record, event),
+                quiet=True,
+                json_mode=False,
+            )
+        finally:
+            shutil.rmtree(private_data_dir, ignore_errors=True)
+
+        if result.status == "successful" and not record.errors:
+            record.status = DeploymentStatus.COMPLETED
+            record.message = f"{job.playbook} completed successfully"
+        else:
+            record.status = DeploymentStatus.FAILED
+            record.message = f"{job.playbook} finished with status {result.status} (rc={result.rc})"
+
+    def _handle_event(self, record: DeploymentResponse, event: Dict[str, Any]) -> bool:
+        """ansible-runner event callback - returning True keeps the event on disk"""
+        data = event.get("event_data", {})
+        if event.get("event") == TASK_START_EVENT:
+            self.events.publish(
+                record.deployment_id, "task_start", task=data.get("task", ""),
+                module=data.get("task_action"),
+            )
+            return False
+        task_status = TASK_RESULT_EVENTS.get(event.get("event"))
+        if task_status is None:
+            return False
+
+        res = data.get("res") or {}
+        ignored = bool(data.get("ignore_errors"))
+        if task_status == "failed" and ignored:
+            task_status = "ignored"
+
+        details = {}
+        if "status" in res:
+            details["status_code"] = res["status"]
+        if data.get("duration") is not None:
+            details["duration"] = round(data["duration"], 3)
+        if data.get("task_action"):
+            details["module"] = str(data["task_action"]).rsplit(".", 1)[-1]
+        record.tasks.append(TaskResult(
+            task_name=data.get("task", ""),
+            status=task_status,
+            message=res.get("msg"),
+            details=details or None,
+        ))
+
+        if task_status in ("failed", "unreachable"):
+            record.errors.append(f"{data.get('task', '')}: {res.get('msg', task_status)}")
+
+        resources = (
+            record.deleted_resources
+            if record.operation == OperationType.DELETE
+            else record.created_resources
+        )
+        for item in res.get("results") or [res]:
+            self._record_call(resources, record.tracked_objects, item)
+        self._publish_tasks(record)
+        self._progress(record)
+        return False
+
+    @staticmethod
+    def _record_call(resources: Dict[str, Any], tracked: Dict[str, Any], res: Dict[str, Any]) -> None:
+        url = res.get("url")
+        if not url or "status" not in res:
+            return
+        args = (res.get("invocation") or {}).get("module_args") or {}
+        parts = urlsplit(url)
+        if parts.path.startswith("/mgmt/"):
+            # Calls made by ansible-playbook never pass through our F5Client
+            metrics.observe_bigip_call(
+                f"{parts.hostname}:{parts.port or 443}", str(args.get("method", "GET")).upper(), parts.path,
+                res["status"] if res["status"] != -1 else None, float(res.get("elapsed") or 0),
+            )
+        record_resource(
+            resources,
+            method=args.get("method", "GET"),
+            url=url,
+            status_code=res["status"],
+            body=args.get("body"),
+            response=res.get("json"),
+        )
+        track_object(
+            tracked,
+            method=args.get("method", "GET"),
+            url=url,
+            status_code=res["status"],
+            body=args.get("body"),
+            response=res.get("json"),
+        )
+
+
+def snapshot_job(record: DeploymentResponse, credentials: BIGIPCredentials) -> DeploymentJob:
+    """Build a job capturing ``record.solution_name`` on the device"""
+    return DeploymentJob(record=record, playbook="snapshot", credentials=credentials)
+
+
+def rollback_job(record: DeploymentResponse, credentials: BIGIPCredentials) -> DeploymentJob:
+    """Build a job restoring snapshot ``record.snapshot_id``; it runs ahead of anything queued on the device"""
+    return DeploymentJob(record=record, playbook="rollback", credentials=credentials,
+                         priority=JobPriority.ROLLBACK)
+
+
+def deployment_job(
+    record: DeploymentResponse,
+    credentials: BIGIPCredentials,
+    extravars: Optional[Dict[str, Any]] = None,
+    mode: DeployMode = DeployMode.FULL,
+) -> DeploymentJob:
+    """Build a job for ``record`` using the playbook for its type and operation"""
+    playbook = PLAYBOOKS[record.solution_type][record.operation]
+    if record.operation == OperationType.DELETE:
+        extravars = {
+            **connection_vars(credentials),
+            **naming_vars(record.solution_name),
+            "confirm_delete": True,
+            **(extravars or {}),
+        }
+    return DeploymentJob(
+        record=record,
+        playbook=playbook,
+        credentials=credentials,
+        extravars=extravars or {},
+        mode=mode,
+        priority=JobPriority.DELETE if record.operation == OperationType.DELETE else JobPriority.DEPLOY,
+    )
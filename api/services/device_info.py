@@ -0,0 +1,118 @@
+"""
+Cached BIG-IP device information
+Per-device TTL cache for the device-info/AS3 info lookups, refreshed in the background
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from .f5_client import F5AuthError, F5Client
+
+logger = logging.getLogger(__name__)
+
+# Seconds a lookup is served from cache
+DEFAULT_INFO_TTL = 300.0
+
+# Devices remembered before the least recently used is dropped
+DEFAULT_MAX_DEVICES = 1024
+
+# Fraction of the TTL after which a hit also refreshes the entry in the background
+REFRESH_AFTER = 0.8
+
+
+@dataclass
+class _Entry:
+    info: Dict[str, Any]
+    fetched_at: float
+
+
+class DeviceInfoCache:
+    """
+    ``F5Client.device_info()`` results per device, user and password
+
+    A hit younger than ``ttl`` is answered from memory; once it is older
+    than ``refresh_after * ttl`` the entry is also re-fetched in the
+    background, so a device that is queried regularly never makes a caller
+    wait. Concurrent misses for one device share a single lookup. At most
+    ``max_entries`` devices are kept (least recently used dropped first).
+    Failures are not cached, and an entry whose background refresh is
+    refused with 401 is dropped so changed credentials are noticed.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_INFO_TTL,
+        max_entries: int = DEFAULT_MAX_DEVICES,
+        refresh_after: float = REFRESH_AFTER,
+        max_refreshes: int = 4,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh_after = refresh_after
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, "Future[Dict[str, Any]]"] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_refreshes, thread_name_prefix="apm-info")
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    @staticmethod
+    def key(client: F5Client) -> str:
+        """Cache key; the password digest keeps one caller's result from another's wrong password"""
+        digest = hashlib.sha256(client.password.encode()).hexdigest()[:16]
+        return f"{client.base_url}|{client.username}|{digest}"
+
+    def get(self, client: F5Client, refresh: bool = False) -> Dict[str, Any]:
+        """Device info for ``client``'s device; ``refresh`` skips the cached copy"""
+        key = self.key(client)
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.monotonic() - entry.fetched_at if entry else None
+            if entry is not None and not refresh and age < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if age >= self.ttl * self.refresh_after and key not in self._inflight:
+                    self.refreshes += 1
+                    future = self._inflight[key] = Future()
+                    self._pool.submit(self._fetch, key, client, future)
+                return dict(entry.info)
+            self.misses += 1
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if owner:
+            self._fetch(key, client, future)
+        return dict(future.result())
+
+    def invalidate(self, client: F5Client) -> None:
+        with self._lock:
+            self._entries.pop(self.key(client), None)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+    def _fetch(self, key: str, client: F5Client, future: "Future[Dict[str, Any]]") -> None:
+        try:
+            info = client.device_info()
+        except Exception as exc:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if isinstance(exc, F5AuthError):
+                    self._entries.pop(key, None)
+            logger.debug("Device info lookup on %s failed: %s", client.host, exc)
+            future.set_exception(exc)
+            return
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._entries[key] = _Entry(info, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(info)
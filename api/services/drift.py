@@ -0,0 +1,289 @@
+"""
+Configuration drift detection for F5 BIG-IP APM
+Polls object generations per collection and re-reads only the objects that changed since the last check
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from ..models import (
+    BIGIPCredentials, DeploymentResponse, DeploymentStatus, DriftReport, ObjectDrift,
+    OperationType, TrackedObject
+)
+from . import metrics
+from .f5_client import ClientPool, F5Client, F5Error, response_body
+from .planner import diff_fields, object_segment, split_object_path
+from .scheduler import device_key
+from .store import MAX_PAGE_SIZE, DeploymentStore
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the whole fleet
+DEFAULT_DRIFT_INTERVAL = 300.0
+
+# Devices checked at once
+DEFAULT_DRIFT_CONCURRENCY = 20
+
+# Seconds one read may take
+DEFAULT_DRIFT_TIMEOUT = 30.0
+
+# Fields a collection poll asks for ($select)
+POLL_FIELDS = "fullPath,generation"
+
+
+@dataclass
+class _Watched:
+    """A deployed solution and the credentials its device is checked with"""
+    record: DeploymentResponse
+    credentials: BIGIPCredentials
+
+
+class DriftMonitor:
+    """
+    Background reconciler for deployed solutions
+
+    Each completed deploy hands its record to ``observe``: the objects it
+    created or modified (``tracked_objects``: iControl REST path, declared
+    fields and the generation the device answered with) are watched until
+    the solution is deleted. A redeploy replaces the watch, keeping objects
+    of earlier deploys the new one did not write (diff mode only sends
+    changes); a rollback replaces it with the objects of its snapshot.
+
+    A check reads each watched collection of a device once with
+    ``$select=fullPath,generation``. Objects whose generation is the one
+    seen at the previous check keep their previous result; the others are
+    read and their declared fields compared with the device's
+    (``diff_fields``, the comparison diff mode uses). Objects no longer
+    listed are reported missing. Once every object has been read, a device
+    costs one small GET per collection per pass however many solutions it
+    holds.
+
+    Each check takes its client from the pool for the credentials of the
+    device's latest completed job, so a password change picked up by a
+    deploy carries over to every watch on the device.
+
+    Watches live in memory, so after a restart a device is watched again
+    once something is deployed to it or it is checked through ``adopt``.
+    """
+
+    def __init__(
+        self,
+        store: DeploymentStore,
+        clients: ClientPool,
+        interval: float = DEFAULT_DRIFT_INTERVAL,
+        concurrency: int = DEFAULT_DRIFT_CONCURRENCY,
+        timeout: float = DEFAULT_DRIFT_TIMEOUT,
+    ):
+        self.store = store
+        self.clients = clients
+        self.interval = interval
+        self.timeout = timeout
+        self._watched: Dict[Tuple[str, str], _Watched] = {}  # (device, solution) -> watch
+        self._seen: Dict[Tuple[str, str], Tuple[Optional[int], Optional[ObjectDrift]]] = {}
+        self._reports: Dict[Tuple[str, str], DriftReport] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="drift")
+        self.last_pass_at: Optional[datetime] = None
+        self.last_pass_seconds: Optional[float] = None
+
+    def observe(self, record: DeploymentResponse, credentials: BIGIPCredentials) -> None:
+        """Watch a completed deploy's or rollback's objects, or stop watching a deleted solution"""
+        if record.status != DeploymentStatus.COMPLETED or record.operation == OperationType.SNAPSHOT:
+            return
+        key = (device_key(credentials), record.solution_name)
+        if record.operation == OperationType.DELETE:
+            with self._lock:
+                self._forget(key)
+            return
+        if not record.tracked_objects:
+            return  # plan mode, or nothing written
+        with self._lock:
+            for (device, _), watch in self._watched.items():
+                if device == key[0]:
+                    watch.credentials = credentials
+            previous = self._watched.get(key)
+            if previous is not None and record.operation == OperationType.DEPLOY:
+                for path, tracked in previous.record.tracked_objects.items():
+                    current = record.tracked_objects.setdefault(path, tracked)
+                    if current is not tracked:
+                        current.declared = {**tracked.declared, **current.declared}
+            self._forget(key)
+            self._watched[key] = _Watched(record, credentials)
+
+    def adopt(self, credentials: BIGIPCredentials) -> List[DriftReport]:
+        """Watch the solutions the store says are deployed on a device, check it and return its reports"""
+        device = device_key(credentials)
+        latest: Dict[str, Optional[DeploymentResponse]] = {}
+        cursor = None
+        while True:
+            page = self.store.list(limit=MAX_PAGE_SIZE, cursor=cursor, host=credentials.host)
+            for record in page.items:
+                if record.solution_name in latest or record.status != DeploymentStatus.COMPLETED \
+                        or record.operation == OperationType.SNAPSHOT:
+                    continue
+                # Newest completed job per solution: a delete means nothing is deployed
+                latest[record.solution_name] = record if record.operation != OperationType.DELETE else None
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        with self._lock:
+            for solution_name, record in latest.items():
+                if record is not None and record.tracked_objects and (device, solution_name) not in self._watched:
+                    self._watched[(device, solution_name)] = _Watched(record, credentials)
+        return self.check_device(device)
+
+    def run_once(self) -> Dict[str, int]:
+        """Check every watched device; counts of solutions in sync, drifted and not checked"""
+        started = time.monotonic()
+        with self._lock:
+            devices = sorted({device for device, _ in self._watched})
+        counts = {"in_sync": 0, "drifted": 0, "errors": 0}
+        for reports in self._pool.map(self.check_device, devices):
+            for report in reports:
+                counts["errors" if report.error else "in_sync" if report.in_sync else "drifted"] += 1
+        self.last_pass_at = datetime.now(timezone.utc)
+        self.last_pass_seconds = round(time.monotonic() - started, 3)
+        with self._lock:
+            metrics.DRIFTED_OBJECTS.set(sum(len(report.drifted) for report in self._reports.values()))
+        if counts["drifted"] or counts["errors"]:
+            logger.info(
+                "Drift check of %d device(s) in %.1fs: %d solution(s) drifted, %d not checked",
+                len(devices), self.last_pass_seconds, counts["drifted"], counts["errors"],
+            )
+        return counts
+
+    def check_device(self, device: str) -> List[DriftReport]:
+        """Check every solution watched on ``device`` and return their reports"""
+        with self._lock:
+            watched = {key: watch for key, watch in self._watched.items() if key[0] == device}
+        if not watched:
+            return []
+        started = time.monotonic()
+        client = self.clients.for_credentials(next(iter(watched.values())).credentials)
+        paths = {path for watch in watched.values() for path in watch.record.tracked_objects}
+        try:
+            listed = self._poll(client, paths)
+            drifts = {
+                path: self._object_drift(client, device, path, generation, self._tracked(watched, path))
+                for path, generation in listed.items()
+            }
+            error = None
+        except (F5Error, httpx.HTTPError) as exc:
+            drifts, error = {}, f"Checking {client.host} failed: {exc}"
+        metrics.DRIFT_CHECK_LATENCY.labels(result="error" if error else "ok").observe(time.monotonic() - started)
+
+        now = datetime.now(timezone.utc)
+        reports = []
+        with self._lock:
+            for key, watch in watched.items():
+                if self._watched.get(key) is not watch:
+                    continue  # redeployed or deleted meanwhile
+                record = watch.record
+                drifted = [] if error else [
+                    drifts.get(path) or ObjectDrift(path=path, change="missing")
+                    for path in sorted(record.tracked_objects)
+                    if path not in drifts or drifts[path] is not None
+                ]
+                report = self._reports[key] = DriftReport(
+                    deployment_id=record.deployment_id, solution_name=record.solution_name,
+                    target_host=record.target_host, checked_at=now, objects=len(record.tracked_objects),
+                    in_sync=not error and not drifted, drifted=drifted, error=error,
+                )
+                reports.append(report)
+        return reports
+
+    def report(self, deployment_id: str) -> Optional[DriftReport]:
+        with self._lock:
+            for report in self._reports.values():
+                if report.deployment_id == deployment_id:
+                    return report
+        return None
+
+    def reports(self, host: Optional[str] = None) -> List[DriftReport]:
+        with self._lock:
+            return [
+                report for report in self._reports.values()
+                if host is None or (report.target_host or "").lower() == host.lower()
+            ]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "devices": len({device for device, _ in self._watched}),
+                "solutions": len(self._watched),
+                "drifted": sum(1 for report in self._reports.values() if not report.in_sync and not report.error),
+                "last_pass_at": self.last_pass_at,
+                "last_pass_seconds": self.last_pass_seconds,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+    def _forget(self, key: Tuple[str, str]) -> None:
+        """Lock held"""
+        watch = self._watched.pop(key, None)
+        self._reports.pop(key, None)
+        if watch is not None:
+            for path in watch.record.tracked_objects:
+                self._seen.pop((key[0], path), None)
+
+    @staticmethod
+    def _tracked(watched: Dict[Tuple[str, str], _Watched], path: str) -> TrackedObject:
+        """Declared fields of ``path`` across the solutions that wrote it"""
+        tracked = [watch.record.tracked_objects[path] for watch in watched.values()
+                   if path in watch.record.tracked_objects]
+        if len(tracked) == 1:
+            return tracked[0]
+        declared: Dict[str, Any] = {}
+        for item in tracked:
+            declared.update(item.declared)
+        return TrackedObject(declared=declared)
+
+    def _poll(self, client: F5Client, paths: set) -> Dict[str, Optional[int]]:
+        """``{path: generation}`` of the watched objects still on the device, one GET per collection"""
+        collections = {split_object_path(path)[0] for path in paths}
+        listed: Dict[str, Optional[int]] = {}
+        for collection in sorted(collections):
+            metrics.DRIFT_READS.labels(kind="collection").inc()
+            response = client.get(collection, params={"$select": POLL_FIELDS}, timeout=self.timeout)
+            if response.status_code == 404:
+                continue  # the collection's parent object is gone
+            if response.status_code != 200:
+                raise F5Error(f"GET {collection} on {client.host} returned HTTP {response.status_code}",
+                              response.status_code)
+            for item in (response_body(response) or {}).get("items", []):
+                path = f"{collection}/{object_segment(item.get('fullPath', ''))}"
+                if path in paths:
+                    listed[path] = item.get("generation")
+        return listed
+
+    def _object_drift(self, client: F5Client, device: str, path: str, generation: Optional[int],
+                      tracked: TrackedObject) -> Optional[ObjectDrift]:
+        """How ``path`` differs from its declared fields (None: it does not), reading it only if it changed"""
+        with self._lock:
+            seen = self._seen.get((device, path))
+        if seen is not None and generation is not None and seen[0] == generation:
+            return seen[1]
+        metrics.DRIFT_READS.labels(kind="object").inc()
+        response = client.get(path, timeout=self.timeout)
+        if response.status_code == 404:
+            drift = ObjectDrift(path=path, change="missing")
+        elif response.status_code != 200:
+            raise F5Error(f"GET {path} on {client.host} returned HTTP {response.status_code}",
+                          response.status_code)
+        else:
+            current = response_body(response) or {}
+            delta = diff_fields(tracked.declared, current)
+            drift = ObjectDrift(path=path, change="modified", fields={
+                key: {"declared": want, "actual": current.get(key)} for key, want in delta.items()
+            }) if delta else None
+            generation = current.get("generation", generation)
+        with self._lock:
+            self._seen[(device, path)] = (generation, drift)
+        return drift
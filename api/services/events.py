@@ -0,0 +1,153 @@
+"""
+Deployment event streams
+Per-deployment task events with replay from a last-event ID, for SSE and WebSocket clients
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+# Finished streams kept for late subscribers and reconnects
+DEFAULT_MAX_FINISHED = 1000
+
+# Seconds of silence before a keepalive is sent
+DEFAULT_KEEPALIVE = 15.0
+
+
+@dataclass
+class DeploymentEvent:
+    """One event in a deployment's stream; ``id`` counts from 1 per deployment"""
+    id: int
+    event: str
+    data: Dict[str, Any]
+    timestamp: float = field(default_factory=time.time)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "event": self.event, "timestamp": self.timestamp, "data": self.data}
+
+    def sse(self) -> str:
+        """Server-Sent Events frame"""
+        return f"id: {self.id}\nevent: {self.event}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+
+class EventStream:
+    """
+    Append-only event log of one deployment
+
+    Written from engine worker threads, read by any number of subscribers on
+    event loops; appends wake the waiting subscribers thread-safely.
+    """
+
+    def __init__(self, deployment_id: str):
+        self.deployment_id = deployment_id
+        self.events: List[DeploymentEvent] = []
+        self.closed = False
+        self._lock = threading.Lock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def append(self, event: str, data: Dict[str, Any], close: bool = False) -> Optional[DeploymentEvent]:
+        with self._lock:
+            if self.closed:
+                return None
+            entry = DeploymentEvent(len(self.events) + 1, event, data)
+            self.events.append(entry)
+            self.closed = close
+            waiters = list(self._waiters)
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:  # subscriber's loop already closed
+                pass
+        return entry
+
+    def since(self, last_event_id: int) -> Tuple[List[DeploymentEvent], bool]:
+        """Events after ``last_event_id`` and whether the stream has ended"""
+        with self._lock:
+            return self.events[max(last_event_id, 0):], self.closed
+
+    async def follow(self, last_event_id: int = 0,
+                     keepalive: float = DEFAULT_KEEPALIVE) -> AsyncIterator[Optional[DeploymentEvent]]:
+        """
+        Replay events after ``last_event_id``, then yield new ones until the end
+
+        Yields None after ``keepalive`` seconds without events so transports
+        can send a heartbeat.
+        """
+        waiter = asyncio.Event()
+        token = (asyncio.get_running_loop(), waiter)
+        with self._lock:
+            self._waiters.add(token)
+        try:
+            while True:
+                waiter.clear()
+                events, closed = self.since(last_event_id)
+                for event in events:
+                    last_event_id = event.id
+                    yield event
+                if closed:
+                    return
+                try:
+                    await asyncio.wait_for(waiter.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._waiters.discard(token)
+
+
+class EventBroker:
+    """
+    Event streams of the deployments this process runs
+
+    Streams are opened when a job is queued and kept after it finishes, up to
+    ``max_finished`` of them, so a client that reconnects with its last event
+    ID gets exactly the events it missed.
+    """
+
+    def __init__(self, max_finished: int = DEFAULT_MAX_FINISHED):
+        self.max_finished = max_finished
+        self._streams: Dict[str, EventStream] = {}
+        self._finished: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, deployment_id: str) -> EventStream:
+        with self._lock:
+            stream = self._streams.get(deployment_id)
+            if stream is None:
+                stream = self._streams[deployment_id] = EventStream(deployment_id)
+            return stream
+
+    def get(self, deployment_id: str) -> Optional[EventStream]:
+        with self._lock:
+            return self._streams.get(deployment_id)
+
+    def publish(self, deployment_id: str, event: str, **data: Any) -> Optional[DeploymentEvent]:
+        stream = self.get(deployment_id)
+        if stream is None:
+            return None
+        return stream.append(event, data)
+
+    def close(self, deployment_id: str, **data: Any) -> None:
+        """Publish the final ``end`` event and retire the stream"""
+        stream = self.get(deployment_id)
+        if stream is None:
+            return
+        stream.append("end", data, close=True)
+        with self._lock:
+            self._finished[deployment_id] = None
+            while len(self._finished) > self.max_finished:
+                expired, _ = self._finished.popitem(last=False)
+                self._streams.pop(expired, None)
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """``Last-Event-ID`` header / query value as an event ID (0 = from the start)"""
+    if not value:
+        return 0
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        raise ValueError(f"Invalid last event ID '{value}'") from None
@@ -0,0 +1,540 @@
+"""
+iControl REST client for F5 BIG-IP
+Token-authenticated, keep-alive (HTTP/2 when available) client with a per-device pool
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from . import metrics
+from .throttle import AdaptiveLimiter, DeviceLimiters, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+LOGIN_PATH = "/mgmt/shared/authn/login"
+TOKENS_PATH = "/mgmt/shared/authz/tokens"
+DEVICE_INFO_PATH = "/mgmt/shared/identified-devices/config/device-info"
+AS3_INFO_PATH = "/mgmt/shared/appsvcs/info"
+
+# BIG-IP default token lifetime is 1200s; refresh this long before expiry
+TOKEN_REFRESH_MARGIN = 60.0
+
+# A refused login is tried once more after this many seconds before it counts
+LOGIN_RETRY_DELAY = 1.0
+
+# Retired clients are closed once idle this long; callers holding one keep using it until then
+RETIRED_IDLE_CLOSE = 300.0
+
+
+class F5Error(Exception):
+    """iControl REST call failed"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class F5AuthError(F5Error):
+    """Login to the BIG-IP failed"""
+
+
+class TokenCache:
+    """In-process token store (one per client by default)"""
+
+    def __init__(self):
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            return self._tokens.get(key)
+
+    def set(self, key: str, token: str, expires_at: float) -> None:
+        with self._lock:
+            self._tokens[key] = (token, expires_at)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._tokens.pop(key, None)
+
+
+class FileTokenCache(TokenCache):
+    """
+    Token store shared between processes through a 0600 JSON file
+
+    Ansible forks a worker per task, so the action plugin uses this to log in
+    once per token lifetime instead of once per task.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, data: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as handle:
+            json.dump(data, handle)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        entry = self._load().get(key)
+        return (entry[0], entry[1]) if entry else None
+
+    def set(self, key: str, token: str, expires_at: float) -> None:
+        with self._lock:
+            data = self._load()
+            data[key] = [token, expires_at]
+            self._save(data)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            data = self._load()
+            if data.pop(key, None) is not None:
+                self._save(data)
+
+
+class F5Client:
+    """
+    iControl REST client for a single BIG-IP
+
+    Logs in once for an ``X-F5-Auth-Token``, refreshes it shortly before it
+    expires (or after a 401) and keeps connections alive between calls.
+    Thread-safe: one client may be shared by every job targeting the device.
+    With a ``limiter``, calls wait for a slot of the device's adaptive
+    concurrency limit; calls restjavad turns away are retried per ``retry``.
+    ``on_login`` is told whether each login succeeded or the device refused
+    the credentials (twice, ``LOGIN_RETRY_DELAY`` apart). Tokens are cached
+    per URL, user and password, so a wrong password never picks up the
+    token of a right one.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 443,
+        username: str = "admin",
+        password: str = "",
+        validate_certs: bool = False,
+        scheme: str = "https",
+        login_provider: str = "tmos",
+        timeout: float = 60.0,
+        max_connections: int = 20,
+        http2: bool = True,
+        token_cache: Optional[TokenCache] = None,
+        transport: Optional[httpx.BaseTransport] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+        retry: Optional[RetryPolicy] = None,
+        on_login: Optional[Callable[["F5Client", bool], None]] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.login_provider = login_provider
+        self.base_url = f"{scheme}://{host}:{port}"
+        self.token_cache = token_cache or TokenCache()
+        self.limiter = limiter
+        self.retry = retry or RetryPolicy()
+        self.on_login = on_login
+        self._token_key = f"{self.base_url}|{username}|{_password_hash(password)}"
+        self._token_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._in_flight = 0
+        self._idle_since = time.monotonic()
+        self._retired = self._closed = False
+        self._http = httpx.Client(
+            base_url=self.base_url,
+            verify=validate_certs,
+            http2=http2 and HTTP2_AVAILABLE,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=30.0,
+            ),
+            transport=transport,
+        )
+
+    @property
+    def device(self) -> str:
+        """``host:port`` label of this device in the metrics"""
+        return f"{self.host}:{self.port}"
+
+    @property
+    def account(self) -> str:
+        """Device, user and password digest; clients with the same account act alike"""
+        return self._token_key
+
+    @classmethod
+    def from_credentials(cls, credentials, **kwargs) -> "F5Client":
+        """Build a client from a ``BIGIPCredentials`` model"""
+        return cls(
+            host=credentials.host,
+            port=credentials.port,
+            username=credentials.username,
+            password=credentials.password,
+            validate_certs=credentials.validate_certs,
+            **kwargs,
+        )
+
+    def __enter__(self) -> "F5Client":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # Authentication
+
+    def login(self) -> str:
+        """Fetch a fresh auth token and store it in the token cache"""
+        credentials = {
+            "username": self.username,
+            "password": self.password,
+            "loginProviderName": self.login_provider,
+        }
+        response = self._http.post(LOGIN_PATH, json=credentials)
+        if response.status_code in (401, 403):
+            # restjavad refuses logins now and then under load; one refusal is not proof
+            time.sleep(LOGIN_RETRY_DELAY)
+            response = self._http.post(LOGIN_PATH, json=credentials)
+        if response.status_code != 200:
+            if response.status_code in (401, 403):
+                self._logged_in(False)
+            raise F5AuthError(
+                f"Login to {self.host} failed: HTTP {response.status_code}",
+                response.status_code,
+            )
+        token_info = response.json().get("token", {})
+        token = token_info.get("token")
+        if not token:
+            raise F5AuthError(f"Login to {self.host} returned no token")
+        self._logged_in(True)
+        lifetime = float(token_info.get("timeout", 1200))
+        self.token_cache.set(self._token_key, token, time.time() + lifetime)
+        logger.debug("Logged in to %s (token valid for %.0fs)", self.host, lifetime)
+        return token
+
+    def token(self, force_refresh: bool = False) -> str:
+        """Current auth token, logging in again if it is missing or about to expire"""
+        cached = None if force_refresh else self.token_cache.get(self._token_key)
+        if cached and cached[1] - time.time() > TOKEN_REFRESH_MARGIN:
+            return cached[0]
+        with self._token_lock:
+            # Another thread may have refreshed while we waited
+            cached = None if force_refresh else self.token_cache.get(self._token_key)
+            if cached and cached[1] - time.time() > TOKEN_REFRESH_MARGIN:
+                return cached[0]
+            return self.login()
+
+    # Requests
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        json: Any = None,
+        content: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> httpx.Response:
+        """
+        Send an authenticated request
+
+        ``path`` may be a full URL (as written in the task files); only its
+        path and query are used. A 401 triggers one re-login and retry;
+        overload answers and connection failures are retried per ``retry``.
+        """
+        with self._state_lock:
+            if self._closed:
+                raise F5Error(f"Client for {self.host} was retired (login refused or password changed)")
+            self._in_flight += 1
+        try:
+            return self._request(method, self._path(path), json, content, params, headers, timeout)
+        finally:
+            with self._state_lock:
+                self._in_flight -= 1
+                if not self._in_flight:
+                    self._idle_since = time.monotonic()
+
+    def _request(self, method: str, path: str, json: Any, content: Optional[str],
+                 params: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]],
+                 timeout: Optional[float]) -> httpx.Response:
+        kwargs: Dict[str, Any] = {"params": params}
+        if content is not None:
+            kwargs["content"] = content
+        elif json is not None:
+            kwargs["json"] = json
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        attempt = 0
+        reauthenticated = refresh = False
+        while True:
+            request_headers = dict(headers or {})
+            request_headers["X-F5-Auth-Token"] = self.token(force_refresh=refresh)
+            refresh = False
+            if content is not None:
+                request_headers.setdefault("Content-Type", "application/json")
+            try:
+                response = self._send(method, path, request_headers, kwargs)
+            except httpx.HTTPError as exc:
+                if not self.retry.retry_error(method, exc, attempt):
+                    raise
+                delay = self.retry.delay(attempt)
+                metrics.RETRIES.labels(device=self.device, reason=type(exc).__name__).inc()
+                logger.debug("%s %s on %s failed (%s), retrying in %.1fs", method, path, self.host, exc, delay)
+            else:
+                if response.status_code == 401 and not reauthenticated:
+                    reauthenticated = refresh = True
+                    continue
+                if not self.retry.retry_status(method, response.status_code, attempt):
+                    return response
+                delay = self.retry.delay(attempt, response)
+                metrics.RETRIES.labels(device=self.device, reason=str(response.status_code)).inc()
+                logger.debug("%s %s on %s answered HTTP %d, retrying in %.1fs",
+                             method, path, self.host, response.status_code, delay)
+            attempt += 1
+            time.sleep(delay)
+
+    def _send(self, method: str, path: str, headers: Dict[str, str], kwargs: Dict[str, Any]) -> httpx.Response:
+        """One call, inside a slot of the device's concurrency limit"""
+        started = self.limiter.acquire() if self.limiter is not None else time.monotonic()
+        status_code = None
+        try:
+            response = self._http.request(method, path, headers=headers, **kwargs)
+            status_code = response.status_code
+            return response
+        finally:
+            if self.limiter is not None:
+                self.limiter.release(started, metrics.endpoint_path(path), status_code)
+            metrics.observe_bigip_call(self.device, method, path, status_code, time.monotonic() - started)
+
+    def get(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def patch(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("DELETE", path, **kwargs)
+
+    def get_json(self, path: str, **kwargs) -> Dict[str, Any]:
+        """GET ``path`` and return the decoded body, raising F5Error on non-200"""
+        response = self.get(path, **kwargs)
+        if response.status_code != 200:
+            raise F5Error(
+                f"GET {self._path(path)} on {self.host} returned HTTP {response.status_code}",
+                response.status_code,
+            )
+        return response.json()
+
+    def device_info(self) -> Dict[str, Any]:
+        """
+        Version/build/platform plus AS3 version (None when AS3 is not installed)
+
+        ``as3Info`` keeps the whole AS3 info body for callers that probe it.
+        """
+        info = self.get_json(DEVICE_INFO_PATH)
+        as3 = self.get(AS3_INFO_PATH)
+        as3_info = response_body(as3) if as3.status_code == 200 else None
+        info["as3Version"] = as3_info.get("version") if isinstance(as3_info, dict) else None
+        info["as3Info"] = as3_info
+        return info
+
+    def retire(self) -> None:
+        """Stop handing the client out; callers holding it keep using it until ``close_if_idle``"""
+        with self._state_lock:
+            self._retired = True
+
+    def close_if_idle(self, idle_for: float) -> bool:
+        """Close a retired client no call has used for ``idle_for`` seconds; True once closed"""
+        with self._state_lock:
+            if self._closed:
+                return True
+            if not self._retired or self._in_flight or time.monotonic() - self._idle_since < idle_for:
+                return False
+            self._closed = True
+        self._release()
+        return True
+
+    def close(self) -> None:
+        """Release the auth token on the device and close pooled connections"""
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._release()
+
+    def _release(self) -> None:
+        cached = self.token_cache.get(self._token_key)
+        if cached and not isinstance(self.token_cache, FileTokenCache):
+            try:
+                self._http.delete(
+                    f"{TOKENS_PATH}/{cached[0]}",
+                    headers={"X-F5-Auth-Token": cached[0]},
+                )
+            except httpx.HTTPError:
+                pass
+            self.token_cache.delete(self._token_key)
+        self._http.close()
+
+    def _logged_in(self, succeeded: bool) -> None:
+        if self.on_login is not None:
+            self.on_login(self, succeeded)
+
+    @staticmethod
+    def _path(path: str) -> str:
+        if path.startswith(("http://", "https://")):
+            parts = urlsplit(path)
+            return parts.path + (f"?{parts.query}" if parts.query else "")
+        return path
+
+
+def response_body(response: httpx.Response) -> Any:
+    """Decoded JSON body, or None when the response is not JSON"""
+    if not response.content:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+class ClientPool:
+    """
+    One ``F5Client`` per (scheme, host, port, username, validate_certs, password)
+
+    Every caller targeting the same device with the same credentials shares
+    its token and keep-alive connections, and every client of a device
+    shares its adaptive concurrency limit from ``limiters``.
+
+    A caller with another password gets a client of its own, so a wrong
+    password never disturbs the clients in use. Once a password logs in,
+    the clients of the same user with other passwords are retired, and so
+    is a client whose login is refused: the pool stops handing them out,
+    jobs already holding one keep using it, and it is closed once nobody
+    has used it for ``retired_idle_close`` seconds. Failed logins therefore
+    neither pile up in the pool nor fail the jobs running on a client.
+    """
+
+    def __init__(self, limiters: Optional[DeviceLimiters] = None,
+                 retired_idle_close: float = RETIRED_IDLE_CLOSE, **client_kwargs):
+        self.limiters = limiters or DeviceLimiters()
+        self.retired_idle_close = retired_idle_close
+        self.client_kwargs = client_kwargs
+        self._clients: Dict[Tuple[str, str, int, str, bool, str], F5Client] = {}
+        self._retired: List[F5Client] = []
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        host: str,
+        port: int = 443,
+        username: str = "admin",
+        password: str = "",
+        validate_certs: bool = False,
+        scheme: str = "https",
+    ) -> F5Client:
+        key = (scheme, host, int(port), username, bool(validate_certs), _password_hash(password))
+        if self._retired:
+            self._close_idle_retired()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+            client = F5Client(
+                host=host,
+                port=int(port),
+                username=username,
+                password=password,
+                validate_certs=validate_certs,
+                scheme=scheme,
+                limiter=self.limiters.get(f"{host}:{int(port)}"),
+                on_login=lambda logged_in, succeeded: self._logged_in(key, logged_in, succeeded),
+                **self.client_kwargs,
+            )
+            self._clients[key] = client
+            return client
+
+    def for_credentials(self, credentials) -> F5Client:
+        """Pooled client for a ``BIGIPCredentials`` model"""
+        return self.get(
+            credentials.host,
+            credentials.port,
+            credentials.username,
+            credentials.password,
+            credentials.validate_certs,
+        )
+
+    def for_url(self, url: str, username: str, password: str, validate_certs: bool = False) -> F5Client:
+        """Pooled client for the device addressed by a full iControl REST URL"""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return self.get(parts.hostname, port, username, password, validate_certs, parts.scheme)
+
+    def close_all(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()) + self._retired, {}
+            self._retired = []
+        for client in clients:
+            client.close()
+
+    def _close_idle_retired(self) -> None:
+        with self._lock:
+            retired, self._retired = self._retired, []
+        still_used = [client for client in retired if not client.close_if_idle(self.retired_idle_close)]
+        if still_used:
+            with self._lock:
+                self._retired.extend(still_used)
+
+    def _logged_in(self, key: Tuple[str, str, int, str, bool, str], client: F5Client, succeeded: bool) -> None:
+        """Retire ``client`` if its login failed, else the clients it replaces"""
+        with self._lock:
+            if self._clients.get(key) is not client:
+                return  # already retired
+            if succeeded:
+                retired: List[F5Client] = []
+                for other_key, other in list(self._clients.items()):
+                    if other_key[:4] == key[:4] and other_key[5] != key[5]:
+                        retired.append(self._clients.pop(other_key))
+            else:
+                retired = [self._clients.pop(key)]
+            self._retired.extend(retired)
+        for stale in retired:
+            logger.info("Retiring client for %s@%s (%s)", stale.username, stale.host,
+                        "login failed" if stale is client else "password changed")
+            stale.retire()
+
+
+def _password_hash(password: str) -> str:
+    """Pool key part telling passwords apart without keeping them in the key"""
+    return hashlib.sha256(password.encode()).hexdigest()
@@ -0,0 +1,271 @@
+"""
+Fleet deploys for F5 BIG-IP APM
+Applies one solution definition to many BIG-IPs in parallel, one job per device at a time
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from ..models import (
+    DeploymentResponse, DeploymentStatus, FailurePolicy,
+    FleetDeployRequest, FleetDeviceResult, FleetResponse, OperationType,
+    Solution1Request, Solution2Request, SolutionType
+)
+from .deployment_engine import (
+    DeploymentEngine, EngineBusyError, deployment_job, solution1_vars, solution2_vars,
+)
+from .scheduler import device_key
+
+logger = logging.getLogger(__name__)
+
+# Devices deployed at once across all fleets
+DEFAULT_FLEET_CONCURRENCY = 20
+
+# Fleet results kept for GET /api/v1/fleet/{fleet_id}
+DEFAULT_MAX_FLEETS = 1000
+
+# Request model and extra-vars builder per solution type
+SOLUTION_REQUESTS = {
+    SolutionType.VPN: (Solution1Request, solution1_vars),
+    SolutionType.PORTAL: (Solution2Request, solution2_vars),
+}
+
+
+def solution_requests(request: FleetDeployRequest) -> List[BaseModel]:
+    """
+    The solution definition validated once per device
+
+    Raises pydantic's ValidationError when the definition is not a valid
+    Solution 1/2 request.
+    """
+    model, _ = SOLUTION_REQUESTS[request.solution_type]
+    definition = {k: v for k, v in request.solution.items() if k != "credentials"}
+    return [
+        model.model_validate({**definition, "credentials": device.model_dump(), "mode": request.mode})
+        for device in request.devices
+    ]
+
+
+def describe_validation_error(exc: ValidationError) -> str:
+    """Field errors without the input values (which carry device passwords)"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+    )
+
+
+@dataclass
+class FleetDevice:
+    """One device of a fleet and the job run against it"""
+    request: BaseModel
+    record: Optional[DeploymentResponse] = None
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    skipped: bool = False
+
+    @property
+    def host(self) -> str:
+        return self.request.credentials.host
+
+    @property
+    def status(self) -> str:
+        if self.skipped:
+            return "skipped"
+        if self.record is None:
+            return DeploymentStatus.PENDING.value
+        return self.record.status.value
+
+    def result(self) -> FleetDeviceResult:
+        duration = None
+        if self.started is not None:
+            duration = round((self.finished or time.monotonic()) - self.started, 3)
+        message = self.record.message if self.record else None
+        if self.skipped:
+            message = "Not started: an earlier device failed (fail_fast)"
+        return FleetDeviceResult(
+            host=self.host,
+            deployment_id=self.record.deployment_id if self.record else None,
+            status=self.status,
+            message=message,
+            duration=duration,
+        )
+
+
+class FleetRun:
+    """State of one fleet deploy"""
+
+    def __init__(self, request: FleetDeployRequest, devices: List[FleetDevice], max_concurrency: int,
+                 on_device: Optional[Callable[[FleetDeviceResult], None]] = None):
+        self.fleet_id = str(uuid.uuid4())
+        self.request = request
+        self.devices = devices
+        self.max_concurrency = max_concurrency
+        self.on_device = on_device
+        self.stopped = False
+        self.done = threading.Event()
+        self.created_at = datetime.now(timezone.utc)
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def solution_name(self) -> str:
+        return self.devices[0].request.solution_name
+
+    def groups(self) -> List[List[FleetDevice]]:
+        """Devices grouped by management endpoint, in request order"""
+        groups: "OrderedDict[str, List[FleetDevice]]" = OrderedDict()
+        for device in self.devices:
+            groups.setdefault(device_key(device.request.credentials), []).append(device)
+        return list(groups.values())
+
+    def snapshot(self) -> FleetResponse:
+        results = [device.result() for device in self.devices]
+        succeeded = sum(1 for r in results if r.status == DeploymentStatus.COMPLETED.value)
+        failed = sum(1 for r in results if r.status == DeploymentStatus.FAILED.value)
+        skipped = sum(1 for r in results if r.status == "skipped")
+        if not self.done.is_set():
+            status = DeploymentStatus.IN_PROGRESS if self.started else DeploymentStatus.PENDING
+            message = f"{succeeded + failed}/{len(results)} devices finished ({failed} failed)"
+        else:
+            status = DeploymentStatus.COMPLETED if succeeded == len(results) else DeploymentStatus.FAILED
+            message = (
+                f"{succeeded}/{len(results)} devices succeeded, {failed} failed, {skipped} skipped "
+                f"in {self.finished - self.started:.1f}s"
+            )
+        return FleetResponse(
+            fleet_id=self.fleet_id,
+            solution_type=self.request.solution_type,
+            solution_name=self.solution_name,
+            status=status,
+            message=message,
+            failure_policy=self.request.failure_policy,
+            max_concurrency=self.max_concurrency,
+            total=len(results),
+            succeeded=succeeded,
+            failed=failed,
+            skipped=skipped,
+            created_at=self.created_at,
+            updated_at=datetime.now(timezone.utc),
+            devices=results,
+        )
+
+
+class FleetRunner:
+    """
+    Fan-out of one solution to many devices
+
+    A shared pool of ``max_concurrency`` workers bounds the devices being
+    deployed across all fleets; a fleet may ask for fewer. Jobs for the same
+    management endpoint run one after another, since concurrent restjavad
+    transactions on one device conflict. Device jobs go through the engine
+    (``DeploymentEngine.execute``), so each one is stored, streamed and
+    serialised against other jobs on its device like a single deploy.
+    """
+
+    def __init__(self, engine: DeploymentEngine, max_concurrency: int = DEFAULT_FLEET_CONCURRENCY,
+                 max_fleets: int = DEFAULT_MAX_FLEETS):
+        self.engine = engine
+        self.max_concurrency = max_concurrency
+        self.max_fleets = max_fleets
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="apm-fleet")
+        self._fleets: "OrderedDict[str, FleetRun]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, request: FleetDeployRequest,
+               on_device: Optional[Callable[[FleetDeviceResult], None]] = None) -> FleetResponse:
+        """Start a fleet deploy in the background"""
+        run = self._prepare(request, on_device)
+        threading.Thread(target=self._run, args=(run,), name=f"apm-fleet-{run.fleet_id[:8]}",
+                         daemon=True).start()
+        return run.snapshot()
+
+    def run(self, request: FleetDeployRequest,
+            on_device: Optional[Callable[[FleetDeviceResult], None]] = None) -> FleetResponse:
+        """Deploy to the whole fleet and return the aggregated result"""
+        run = self._prepare(request, on_device)
+        self._run(run)
+        return run.snapshot()
+
+    def get(self, fleet_id: str) -> Optional[FleetResponse]:
+        with self._lock:
+            run = self._fleets.get(fleet_id)
+        return run.snapshot() if run else None
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _prepare(self, request: FleetDeployRequest,
+                 on_device: Optional[Callable[[FleetDeviceResult], None]]) -> FleetRun:
+        devices = [FleetDevice(solution) for solution in solution_requests(request)]
+        limit = min(request.max_concurrency or self.max_concurrency, self.max_concurrency)
+        run = FleetRun(request, devices, limit, on_device)
+        with self._lock:
+            self._fleets[run.fleet_id] = run
+            while len(self._fleets) > self.max_fleets:
+                self._fleets.popitem(last=False)
+        return run
+
+    def _run(self, run: FleetRun) -> None:
+        run.started = time.monotonic()
+        slots = threading.Semaphore(run.max_concurrency)
+        futures = []
+        try:
+            for group in run.groups():
+                slots.acquire()
+                if run.stopped:
+                    slots.release()
+                    break
+                future = self._pool.submit(self._run_group, run, group)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+            wait(futures)
+        finally:
+            for device in run.devices:
+                if device.record is None:
+                    device.skipped = True
+            run.finished = time.monotonic()
+            run.done.set()
+            logger.info("Fleet %s: %s", run.fleet_id, run.snapshot().message)
+
+    def _run_group(self, run: FleetRun, group: List[FleetDevice]) -> None:
+        """Deploy to the devices behind one management endpoint, one at a time"""
+        _, build_vars = SOLUTION_REQUESTS[run.request.solution_type]
+        for device in group:
+            if run.stopped:
+                return
+            request = device.request
+            device.record = DeploymentResponse(
+                deployment_id=str(uuid.uuid4()),
+                solution_type=run.request.solution_type,
+                solution_name=request.solution_name,
+                status=DeploymentStatus.PENDING,
+                message=f"Deployment queued (fleet {run.fleet_id})",
+                operation=OperationType.DEPLOY,
+                target_host=request.credentials.host,
+            )
+            device.started = time.monotonic()
+            try:
+                self.engine.execute(
+                    deployment_job(device.record, request.credentials, build_vars(request), request.mode)
+                )
+            except EngineBusyError as exc:
+                device.record.status = DeploymentStatus.FAILED
+                device.record.message = str(exc)
+                device.record.errors.append(str(exc))
+            finally:
+                device.finished = time.monotonic()
+            if device.record.status == DeploymentStatus.FAILED and \
+                    run.request.failure_policy == FailurePolicy.FAIL_FAST:
+                run.stopped = True
+            if run.on_device is not None:
+                try:
+                    run.on_device(device.result())
+                except Exception:
+                    logger.exception("Fleet progress callback failed")
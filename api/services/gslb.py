@@ -0,0 +1,214 @@
+"""
+Cached GTM topology for F5 BIG-IP DNS
+Datacenters, servers and their virtual servers read once per DNS server and kept current as deploys add to them
+"""
+import copy
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .device_info import DeviceInfoCache
+from .f5_client import F5Client, response_body
+
+logger = logging.getLogger(__name__)
+
+DATACENTER_PATH = "/mgmt/tm/gtm/datacenter"
+SERVER_PATH = "/mgmt/tm/gtm/server"
+GTM_PATH = "/mgmt/tm/gtm/"
+
+# Seconds a DNS server's topology is trusted without re-reading it
+DEFAULT_TOPOLOGY_TTL = 300.0
+
+# DNS servers remembered before the least recently used is dropped
+DEFAULT_MAX_DNS_SERVERS = 64
+
+_VIRTUAL_SERVERS = re.compile(r"^/mgmt/tm/gtm/server/~([^/~]+)~([^/]+)/virtual-servers/?$")
+
+
+def _full_path(body: Dict[str, Any]) -> str:
+    name = str(body.get("name", ""))
+    return name if name.startswith("/") else f"/{body.get('partition') or 'Common'}/{name}"
+
+
+@dataclass
+class _Topology:
+    datacenters: Dict[str, Dict[str, Any]]  # fullPath -> datacenter
+    servers: Dict[str, Dict[str, Any]]  # fullPath -> server, virtual servers expanded
+    fetched_at: float
+
+
+class GTMTopologyCache:
+    """
+    GTM datacenters, servers and server virtual servers per DNS server
+
+    The GSLB tasks read the topology and then create what is missing. The
+    first read of a DNS server (two GETs, virtual servers expanded) is kept
+    for ``ttl`` seconds: later reads are answered from memory, and POSTs of
+    objects the topology already holds are answered 409 locally (only where
+    the task accepts 409, as "already exists"). Concurrent jobs creating the
+    same object send one POST; the others wait for it. Successful creates
+    are added to the cached topology; any other datacenter/server write
+    drops it.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TOPOLOGY_TTL, max_entries: int = DEFAULT_MAX_DNS_SERVERS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Topology]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, "Future[Optional[_Topology]]"] = {}
+        self._creating: Dict[Tuple[str, str, str], threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def handles(path: str) -> bool:
+        return path.startswith(GTM_PATH)
+
+    def answer(self, client: F5Client, method: str, path: str, body: Any,
+               status_codes) -> Optional[Tuple[int, Any]]:
+        """``(status, body)`` for a call the cached topology settles, else None (send it)"""
+        base = path.split("?", 1)[0].rstrip("/")
+        if method == "GET" and base in (DATACENTER_PATH, SERVER_PATH):
+            topology = self._topology(client)
+            if topology is None:
+                return None
+            objects = topology.datacenters if base == DATACENTER_PATH else topology.servers
+            kind = "datacenter" if base == DATACENTER_PATH else "server"
+            with self._lock:
+                items = copy.deepcopy(list(objects.values()))
+            return 200, {"kind": f"tm:gtm:{kind}:{kind}collectionstate", "items": items}
+        if method != "POST" or 409 not in status_codes or not isinstance(body, dict) or "name" not in body:
+            return None
+        if base not in (DATACENTER_PATH, SERVER_PATH) and not _VIRTUAL_SERVERS.match(base):
+            return None
+        target = (DeviceInfoCache.key(client), base, str(body["name"]))
+        while True:
+            if self._exists(client, base, body):
+                return 409, {
+                    "code": 409,
+                    "message": f"The requested GTM object ({body['name']}) already exists (cached topology)",
+                }
+            with self._lock:
+                creating = self._creating.get(target)
+                if creating is None:
+                    # This caller creates it; the others wait for its answer
+                    self._creating[target] = threading.Event()
+                    return None
+            creating.wait()
+
+    def record(self, client: F5Client, method: str, path: str, body: Any, status_code: Optional[int]) -> None:
+        """Fold a GTM call that went to the device into the cached topology (``status_code`` None: it failed)"""
+        key = DeviceInfoCache.key(client)
+        base = path.split("?", 1)[0].rstrip("/")
+        with self._lock:
+            if method == "POST" and isinstance(body, dict):
+                creating = self._creating.pop((key, base, str(body.get("name"))), None)
+                if creating is not None:
+                    creating.set()
+            topology = self._entries.get(key)
+            if topology is None or method == "GET" or not base.startswith((DATACENTER_PATH, SERVER_PATH)):
+                return  # pools and wide IPs are not cached
+            if method != "POST" or status_code not in (200, 201, 409) or not isinstance(body, dict):
+                self._entries.pop(key, None)
+                return
+            if base == DATACENTER_PATH:
+                topology.datacenters.setdefault(_full_path(body), dict(body, fullPath=_full_path(body)))
+            elif base == SERVER_PATH:
+                server = dict(body, fullPath=_full_path(body))
+                server.setdefault("virtualServersReference", {"items": []})
+                topology.servers.setdefault(_full_path(body), server)
+            else:
+                server = self._server(topology, base)
+                if server is None:
+                    self._entries.pop(key, None)
+                    return
+                items = server.setdefault("virtualServersReference", {}).setdefault("items", [])
+                if not any(vs.get("name") == body.get("name") for vs in items):
+                    items.append(dict(body))
+
+    def invalidate(self, client: F5Client) -> None:
+        with self._lock:
+            self._entries.pop(DeviceInfoCache.key(client), None)
+
+    def _exists(self, client: F5Client, base: str, body: Dict[str, Any]) -> bool:
+        if base == DATACENTER_PATH or base == SERVER_PATH:
+            topology = self._topology(client)
+            if topology is None:
+                return False
+            objects = topology.datacenters if base == DATACENTER_PATH else topology.servers
+            with self._lock:
+                return _full_path(body) in objects
+        if not _VIRTUAL_SERVERS.match(base):
+            return False
+        topology = self._topology(client)
+        if topology is None:
+            return False
+        with self._lock:
+            server = self._server(topology, base)
+            items = ((server or {}).get("virtualServersReference") or {}).get("items") or []
+            return any(vs.get("name") == body["name"] for vs in items)
+
+    @staticmethod
+    def _server(topology: _Topology, path: str) -> Optional[Dict[str, Any]]:
+        match = _VIRTUAL_SERVERS.match(path)
+        if not match:
+            return None
+        return topology.servers.get(f"/{match.group(1)}/{match.group(2)}")
+
+    def _topology(self, client: F5Client) -> Optional[_Topology]:
+        """
+        Cached topology of ``client``'s DNS server, read on a miss; None if it
+        cannot be read. Concurrent misses share one read.
+        """
+        key = DeviceInfoCache.key(client)
+        with self._lock:
+            topology = self._entries.get(key)
+            if topology is not None and time.monotonic() - topology.fetched_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return topology
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        topology = None
+        try:
+            topology = self._read(client)
+        finally:
+            with self._lock:
+                if topology is not None:
+                    self._entries[key] = topology
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                self._inflight.pop(key, None)
+            future.set_result(topology)
+        return topology
+
+    @staticmethod
+    def _read(client: F5Client) -> Optional[_Topology]:
+        try:
+            datacenters = client.get(DATACENTER_PATH)
+            servers = client.get(SERVER_PATH, params={"expandSubcollections": "true"})
+        except Exception as exc:  # the live request reports the failure
+            logger.debug("Reading GTM topology of %s failed: %s", client.host, exc)
+            return None
+        if datacenters.status_code != 200 or servers.status_code != 200:
+            return None
+        topology = _Topology(
+            datacenters={_full_path(obj): obj for obj in (response_body(datacenters) or {}).get("items", [])},
+            servers={_full_path(obj): obj for obj in (response_body(servers) or {}).get("items", [])},
+            fetched_at=time.monotonic(),
+        )
+        logger.info("GTM topology of %s: %d datacenter(s), %d server(s)",
+                    client.host, len(topology.datacenters), len(topology.servers))
+        return topology
@@ -0,0 +1,138 @@
+"""
+Idempotent deploy requests for F5 BIG-IP APM API
+Idempotency-Key replay and coalescing of identical in-flight deploys onto one job
+"""
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from ..models import DeploymentResponse
+from . import metrics
+from .store import ACTIVE_STATUSES, DeploymentStore
+
+logger = logging.getLogger(__name__)
+
+# Seconds an Idempotency-Key keeps answering with its deployment
+DEFAULT_IDEMPOTENCY_TTL = 86400.0
+
+# Longest Idempotency-Key accepted
+MAX_KEY_LENGTH = 255
+
+# Seconds a claimed key's deployment may take to reach the store (another worker is saving it)
+RECORD_WAIT = 2.0
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused for a different request"""
+
+
+class IdempotencyGone(Exception):
+    """The deployment an Idempotency-Key points at was purged from the store"""
+
+
+@dataclass
+class Claim:
+    """Outcome of ``IdempotencyGuard.claim``"""
+    existing: Optional[DeploymentResponse] = None  # deployment the request attaches to
+    keys: List[str] = field(default_factory=list)  # keys claimed for the new deployment
+
+
+def request_fingerprint(endpoint: str, body: Dict[str, Any]) -> str:
+    """Hash of an endpoint and its (JSON-mode) request body, independent of key order"""
+    canonical = json.dumps({"endpoint": endpoint, "body": body}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class IdempotencyGuard:
+    """
+    Keeps retried deploy requests from starting the same deploy twice
+
+    - ``Idempotency-Key``: the first request with a key starts a deployment;
+      repeats within ``ttl`` seconds get that deployment back, whatever its
+      state. Reusing a key for a different request is a conflict.
+      A key whose deployment was purged by retention raises
+      ``IdempotencyGone`` rather than describing a deployment that is not
+      there.
+    - Coalescing: an identical request (same endpoint and body, so the same
+      host and solution) arriving while an earlier one is still pending or
+      running attaches to it instead of queuing another job.
+
+    Keys live in the deployment store, so every worker sharing it agrees.
+    """
+
+    def __init__(self, store: DeploymentStore, ttl: float = DEFAULT_IDEMPOTENCY_TTL):
+        self.store = store
+        self.ttl = ttl
+
+    def claim(self, endpoint: str, body: Dict[str, Any], record: DeploymentResponse,
+              idempotency_key: Optional[str] = None) -> Claim:
+        """Attach to an existing deployment, or claim the keys for ``record`` (submit it, then)"""
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            raise IdempotencyConflict(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+        fingerprint = request_fingerprint(endpoint, body)
+        expires_at = time.time() + self.ttl
+        claim = Claim()
+
+        if idempotency_key is not None:
+            key = f"key:{idempotency_key}"
+            found = self.store.claim_key(key, fingerprint, record.deployment_id, expires_at)
+            if found is not None:
+                if found.fingerprint != fingerprint:
+                    raise IdempotencyConflict(
+                        f"Idempotency-Key '{idempotency_key}' was already used for a different request"
+                    )
+                existing = self._record(found.deployment_id)
+                if existing is None:
+                    raise IdempotencyGone(
+                        f"Deployment {found.deployment_id} of Idempotency-Key '{idempotency_key}' "
+                        "no longer exists; send the request with a new key to deploy again"
+                    )
+                metrics.DEDUPLICATED.labels(reason="idempotency_key").inc()
+                return Claim(existing=existing)
+            claim.keys.append(key)
+
+        inflight = f"inflight:{record.target_host}/{record.solution_name}:{fingerprint}"
+        for _ in range(3):
+            found = self.store.claim_key(inflight, fingerprint, record.deployment_id, expires_at)
+            if found is None:
+                claim.keys.append(inflight)
+                return claim
+            existing = self._record(found.deployment_id)
+            if existing is not None and existing.status.value in ACTIVE_STATUSES:
+                for key in claim.keys:
+                    # A retry with the same key should find the job it was coalesced onto
+                    self.store.replace_key(key, record.deployment_id, fingerprint,
+                                           existing.deployment_id, expires_at)
+                metrics.DEDUPLICATED.labels(reason="inflight").inc()
+                logger.info("Coalesced deploy of %s on %s onto %s",
+                            record.solution_name, record.target_host, existing.deployment_id)
+                return Claim(existing=existing)
+            # The earlier deploy has finished (or was purged since): this request is a new one
+            if self.store.replace_key(inflight, found.deployment_id, fingerprint,
+                                      record.deployment_id, expires_at):
+                claim.keys.append(inflight)
+                return claim
+        return claim
+
+    def release(self, claim: Claim, record: DeploymentResponse) -> None:
+        """Give the keys back when ``record`` could not be submitted"""
+        for key in claim.keys:
+            self.store.release_key(key, record.deployment_id)
+
+    def _record(self, deployment_id: str) -> Optional[DeploymentResponse]:
+        """
+        Stored record of ``deployment_id``, None if it is not in the store
+
+        Another worker may have claimed the key but not saved its record
+        yet, so a missing record is looked up again for ``RECORD_WAIT``
+        seconds before it counts as purged.
+        """
+        deadline = time.monotonic() + RECORD_WAIT
+        while True:
+            record = self.store.get(deployment_id)
+            if record is not None or time.monotonic() >= deadline:
+                return record
+            time.sleep(0.05)
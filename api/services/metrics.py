@@ -0,0 +1,127 @@
+"""
+Prometheus metrics for F5 BIG-IP APM
+API, deployment, task, iControl REST, AS3, policy apply and drift check timings exported on /metrics
+"""
+import os
+import re
+from typing import Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# restjavad answers in milliseconds when healthy; commits and applies take seconds
+CALL_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Whole deployments, queue waits and AS3 runs
+JOB_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# Path segments that name an object rather than an endpoint
+_OBJECT_SEGMENT = re.compile(r"^(~.*|\d+|[0-9a-f]{8}-[0-9a-f-]{27}|[0-9a-f]{24,})$")
+_NAMED_CHILDREN = {"uploads": "{file}", "declare": "{tenant}", "task": "{id}", "discover": "{id}"}
+
+API_REQUESTS = Counter(
+    "apm_api_requests_total", "API requests by route and status", ["method", "route", "status"]
+)
+API_LATENCY = Histogram(
+    "apm_api_request_duration_seconds", "API request handling time", ["method", "route"],
+    buckets=CALL_BUCKETS,
+)
+BIGIP_REQUESTS = Counter(
+    "apm_bigip_requests_total", "iControl REST answers by endpoint and status", ["endpoint", "status"]
+)
+BIGIP_LATENCY = Histogram(
+    "apm_bigip_request_duration_seconds", "iControl REST call latency by endpoint", ["method", "endpoint"],
+    buckets=CALL_BUCKETS,
+)
+DEVICE_LATENCY = Histogram(
+    "apm_bigip_device_request_duration_seconds", "iControl REST call latency by device", ["device"],
+    buckets=CALL_BUCKETS,
+)
+DEVICE_ERRORS = Counter(
+    "apm_bigip_device_errors_total", "5xx answers and failed connections by device", ["device", "status"]
+)
+DEVICE_CONCURRENCY = Gauge(
+    "apm_bigip_concurrency_limit", "Adaptive limit of iControl REST calls in flight by device", ["device"],
+    multiprocess_mode="livemax",
+)
+RETRIES = Counter("apm_bigip_retries_total", "Retried iControl REST calls by device and cause", ["device", "reason"])
+TASK_LATENCY = Histogram(
+    "apm_task_duration_seconds", "Playbook task duration by module", ["operation", "module"], buckets=CALL_BUCKETS
+)
+TASK_RESULTS = Counter("apm_task_results_total", "Playbook task results", ["operation", "status"])
+DEPLOYMENT_LATENCY = Histogram(
+    "apm_deployment_duration_seconds", "Deploy/delete job run time", ["operation", "status"],
+    buckets=JOB_BUCKETS,
+)
+QUEUE_WAIT = Histogram(
+    "apm_queue_wait_seconds", "Time a job waited for its device and a worker", buckets=JOB_BUCKETS
+)
+DEDUPLICATED = Counter(
+    "apm_deduplicated_requests_total", "Deploy requests answered with an existing deployment", ["reason"]
+)
+IN_FLIGHT = Gauge("apm_deployments_in_flight", "Jobs running", multiprocess_mode="livesum")
+QUEUED = Gauge(
+    "apm_deployments_queued", "Jobs waiting for their device or a worker", multiprocess_mode="livesum"
+)
+AS3_LATENCY = Histogram(
+    "apm_as3_task_duration_seconds", "AS3 declare-to-result time per run", ["status"], buckets=JOB_BUCKETS
+)
+AS3_BATCH = Histogram(
+    "apm_as3_batch_declarations", "Declarations merged into one AS3 run",
+    buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+POLICY_APPLY_LATENCY = Histogram(
+    "apm_policy_apply_duration_seconds", "Coalesced access policy apply time per run", ["status"],
+    buckets=JOB_BUCKETS,
+)
+POLICY_APPLY_BATCH = Histogram(
+    "apm_policy_apply_batch_profiles", "Access profiles applied by one tmsh run",
+    buckets=(1, 2, 5, 10, 20, 50, 100),
+)
+
+DRIFT_CHECK_LATENCY = Histogram(
+    "apm_drift_check_duration_seconds", "Drift check time per device", ["result"], buckets=CALL_BUCKETS,
+)
+DRIFT_READS = Counter("apm_drift_reads_total", "Reads made by drift checks", ["kind"])
+DRIFTED_OBJECTS = Gauge(
+    "apm_drifted_objects", "Watched objects that no longer match their deployment", multiprocess_mode="livesum"
+)
+
+
+def endpoint_path(path: str) -> str:
+    """
+    iControl REST path with object names replaced, e.g.
+    ``/mgmt/tm/apm/profile/access/{name}`` for ``.../access/~Common~vpn-psp``
+    """
+    segments = path.split("?", 1)[0].rstrip("/").split("/")
+    normalized = []
+    for index, segment in enumerate(segments):
+        previous = segments[index - 1] if index else ""
+        if previous in _NAMED_CHILDREN and index == len(segments) - 1 and segment:
+            normalized.append(_NAMED_CHILDREN[previous])
+        elif _OBJECT_SEGMENT.match(segment):
+            normalized.append("{name}" if segment.startswith("~") else "{id}")
+        else:
+            normalized.append(segment)
+    return "/".join(normalized) or "/"
+
+
+def observe_bigip_call(device: str, method: str, path: str, status_code: Optional[int], seconds: float) -> None:
+    """Record one iControl REST call; ``status_code`` None means the request itself failed"""
+    endpoint = endpoint_path(path)
+    status = str(status_code) if status_code is not None else "error"
+    BIGIP_REQUESTS.labels(endpoint=endpoint, status=status).inc()
+    BIGIP_LATENCY.labels(method=method, endpoint=endpoint).observe(seconds)
+    DEVICE_LATENCY.labels(device=device).observe(seconds)
+    if status_code is None or status_code >= 500:
+        DEVICE_ERRORS.labels(device=device, status=status).inc()
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition-format body and content type for /metrics (all workers with PROMETHEUS_MULTIPROC_DIR)"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
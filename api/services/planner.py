@@ -0,0 +1,551 @@
+"""
+Diff-based plan/apply for F5 BIG-IP APM playbooks
+Captures the writes a playbook would make, diffs them against one bulk read per
+collection and sends only the creates/updates/deletes that are needed
+"""
+import copy
+import json
+import logging
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from ..models import TaskResult
+from .f5_client import ClientPool, F5Client, F5Error, response_body
+from .resources import is_secret, record_resource, track_object
+from .task_executor import PROJECT_DIR, ExecutionResult, TaskExecutor
+from .transactions import (
+    COORDINATION_HEADER, DEFAULT_STAGING_CONCURRENCY, TRANSACTION_PATH,
+    Transaction, TransactionError, commit_transaction_id,
+)
+
+logger = logging.getLogger(__name__)
+
+AS3_DECLARE_PATH = "/mgmt/shared/appsvcs/declare"
+
+# Fields that identify an object rather than configure it
+IDENTITY_FIELDS = {"name", "partition", "subPath", "fullPath", "kind", "selfLink", "generation"}
+
+# Equivalent spellings of the same flag across requests and responses
+_FLAG_VALUES = {"enabled": "true", "yes": "true", "on": "true",
+                "disabled": "false", "no": "false", "off": "false"}
+
+# Bare object names, which BIG-IP reports back qualified with /Common
+_NAME = re.compile(r"^[A-Za-z_][\w.\-]*$")
+
+_MISSING = object()
+
+
+@dataclass
+class Change:
+    """One write from the playbook and what the plan does with it"""
+    action: str  # create, update, delete, send or noop
+    method: str
+    path: str
+    body: Any = None
+    name: Optional[str] = None
+    transactional: bool = False
+    reason: str = ""
+    client: Optional[F5Client] = field(default=None, repr=False, compare=False)
+    # Object as it is on the device before the change (update/delete/noop)
+    current: Any = field(default=None, repr=False, compare=False)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "action": self.action,
+            "method": self.method,
+            "path": self.path,
+            "name": self.name,
+            "transactional": self.transactional,
+            "reason": self.reason,
+        }
+
+
+@dataclass
+class Plan:
+    """Ordered changes for one playbook run and the reads it took to compute them"""
+    changes: List[Change] = field(default_factory=list)
+    reads: int = 0
+
+    @property
+    def pending(self) -> List[Change]:
+        return [change for change in self.changes if change.action != "noop"]
+
+    def summary(self) -> Dict[str, int]:
+        counts = Counter(change.action for change in self.changes)
+        return {action: counts.get(action, 0) for action in ("create", "update", "delete", "send", "noop")}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "summary": self.summary(),
+            "reads": self.reads,
+            "changes": [change.as_dict() for change in self.pending],
+        }
+
+    def describe(self) -> str:
+        summary = self.summary()
+        return (
+            f"{summary['create']} to create, {summary['update']} to update, "
+            f"{summary['delete']} to delete, {summary['send']} to send, "
+            f"{summary['noop']} unchanged ({self.reads} reads)"
+        )
+
+
+class ConfigSnapshot:
+    """
+    Lazily-read device configuration, one GET per collection
+
+    Collections are read with ``expandSubcollections=true`` the first time
+    any object in them is needed, so a re-run costs O(collections) reads
+    however many objects the playbook touches.
+    """
+
+    def __init__(self, client: F5Client):
+        self.client = client
+        self.reads = 0
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._as3: Optional[Dict[str, Any]] = None
+
+    def collection(self, path: str) -> Dict[str, Dict[str, Any]]:
+        """Objects of the collection at ``path`` keyed by fullPath"""
+        if path not in self._collections:
+            self.reads += 1
+            response = self.client.get(path, params={"expandSubcollections": "true"})
+            if response.status_code == 404:
+                items = []  # the collection's parent object is not there yet
+            elif response.status_code == 200:
+                items = (response_body(response) or {}).get("items", [])
+            else:
+                # Planning against an unreadable collection would turn every object into a create
+                raise F5Error(f"GET {path} on {self.client.host} returned HTTP {response.status_code}",
+                              response.status_code)
+            self._collections[path] = {full_path(item): item for item in items}
+        return self._collections[path]
+
+    def as3_tenants(self) -> Dict[str, Any]:
+        """Current AS3 declaration, by tenant"""
+        if self._as3 is None:
+            self.reads += 1
+            response = self.client.get(AS3_DECLARE_PATH)
+            if response.status_code not in (200, 204, 404):  # 204/404: nothing declared
+                raise F5Error(f"GET {AS3_DECLARE_PATH} on {self.client.host} returned HTTP "
+                              f"{response.status_code}", response.status_code)
+            body = response_body(response) if response.status_code == 200 else None
+            self._as3 = _as3_tenants(body) if isinstance(body, dict) else {}
+        return self._as3
+
+
+class PlanningClient:
+    """
+    Stand-in for ``F5Client`` while a playbook is planned
+
+    Reads are served from the snapshot (plus the writes planned so far) or
+    passed through to the device; writes are recorded as changes and answered
+    the way the device would, so the task files run unmodified.
+    """
+
+    def __init__(self, client: F5Client, plan: Plan):
+        self.client = client
+        self.host = client.host
+        self.plan = plan
+        self.snapshot = ConfigSnapshot(client)
+        self._state: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._trans_ids = 0
+        self._apply_requests: List[Change] = []
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        json: Any = None,
+        content: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> httpx.Response:
+        method = method.upper()
+        path = F5Client._path(path)
+        bare = path.split("?", 1)[0].rstrip("/")
+        body = json if json is not None else _decode(content)
+        transactional = any(key.lower() == COORDINATION_HEADER.lower() for key in (headers or {}))
+
+        if method == "GET":
+            return self._read(method, path, bare, params, timeout)
+        if method == "POST" and bare == TRANSACTION_PATH:
+            self._trans_ids += 1
+            return _response(method, path, 200, {"transId": self._trans_ids, "state": "STARTED"})
+        if commit_transaction_id(method, bare, body):
+            return _response(method, path, 200, {"state": "COMPLETED"})
+        if method == "POST" and bare == AS3_DECLARE_PATH:
+            return self._plan_as3(method, path, body)
+        if method == "DELETE" and bare.startswith(f"{AS3_DECLARE_PATH}/"):
+            return self._plan_as3_delete(method, path, bare)
+        if method == "PATCH" and isinstance(body, dict) and set(body) == {"generationAction"}:
+            # Applying a policy is only needed when something in it changed
+            change = self._add("send", method, bare, body, _object_name(bare), transactional,
+                               "apply access policy")
+            self._apply_requests.append(change)
+            return _response(method, path, 200, body)
+        if bare.startswith("/mgmt/tm/"):
+            return self._plan_object(method, path, bare, body, transactional)
+
+        self._add("send", method, bare, body, None, transactional, "not diffable")
+        return _response(method, path, 200, body if isinstance(body, dict) else {})
+
+    def finish(self) -> None:
+        """Drop policy applies when nothing under /mgmt/tm/apm changed"""
+        changed_apm = any(
+            change.action in ("create", "update", "delete") and change.path.startswith("/mgmt/tm/apm/")
+            for change in self.plan.changes
+        )
+        if not changed_apm:
+            for change in self._apply_requests:
+                change.action = "noop"
+                change.reason = "access policy unchanged"
+        self.plan.reads += self.snapshot.reads
+
+    # Reads
+
+    def _read(self, method: str, path: str, bare: str, params, timeout) -> httpx.Response:
+        if bare.startswith("/mgmt/tm/") and "?" not in path and not params:
+            collection, full_path = split_object_path(bare)
+            if full_path is None:
+                items = list(self._collection(bare).values())
+                return _response(method, path, 200, {"kind": "collection", "items": items})
+            current = self._collection(collection).get(full_path)
+            if current is not None:
+                return _response(method, path, 200, current)
+            return _response(method, path, 404, {
+                "code": 404, "message": f"01020036:3: The requested object ({full_path}) was not found.",
+            })
+        # Anything else (device info, AS3 info, filtered queries) is safe to read live
+        return self.client.request(method, path, params=params, timeout=timeout)
+
+    def _collection(self, path: str) -> Dict[str, Dict[str, Any]]:
+        if path not in self._state:
+            self._state[path] = copy.deepcopy(self.snapshot.collection(path))
+        return self._state[path]
+
+    # Writes
+
+    def _plan_object(self, method: str, path: str, bare: str, body: Any, transactional: bool) -> httpx.Response:
+        collection, object_path = split_object_path(bare)
+        if method == "POST" and object_path is None and isinstance(body, dict) and body.get("name"):
+            object_path = full_path(body)
+            objects = self._collection(bare)
+            current = objects.get(object_path)
+            if current is None:
+                self._add("create", "POST", bare, body, object_path, transactional, "not on device")
+                objects[object_path] = {**body, "fullPath": object_path}
+                return _response(method, path, 200, objects[object_path])
+            delta = diff_fields(body, current)
+            if not delta:
+                self._add("noop", "POST", bare, body, object_path, transactional, "up to date", current)
+                return _response(method, path, 200, current)
+            self._add("update", "PATCH", f"{bare}/{object_segment(object_path)}", delta, object_path,
+                      transactional, f"differs in {', '.join(sorted(delta))}", copy.deepcopy(current))
+            current.update(delta)
+            return _response(method, path, 200, current)
+
+        if object_path is not None and method in ("PATCH", "PUT"):
+            current = self._collection(collection).get(object_path)
+            if current is None:
+                self._add("send", method, bare, body, object_path, transactional, "object not found")
+                return _response(method, path, 404, {"code": 404, "message": f"{object_path} was not found"})
+            delta = diff_fields(body, current) if isinstance(body, dict) else body
+            if not delta:
+                self._add("noop", method, bare, body, object_path, transactional, "up to date", current)
+                return _response(method, path, 200, current)
+            self._add("update", method, bare, body if method == "PUT" else delta, object_path,
+                      transactional, "differs", copy.deepcopy(current))
+            if isinstance(delta, dict):
+                current.update(delta)
+            return _response(method, path, 200, current)
+
+        if object_path is not None and method == "DELETE":
+            objects = self._collection(collection)
+            current = objects.pop(object_path, None)
+            if current is None:
+                self._add("noop", method, bare, None, object_path, transactional, "already absent")
+                return _response(method, path, 404, {"code": 404, "message": f"{object_path} was not found"})
+            self._add("delete", method, bare, None, object_path, transactional, "on device", current)
+            return _response(method, path, 200, {})
+
+        self._add("send", method, bare, body, object_path, transactional, "not diffable")
+        return _response(method, path, 200, body if isinstance(body, dict) else {})
+
+    def _plan_as3(self, method: str, path: str, body: Any) -> httpx.Response:
+        desired = _as3_tenants(body) if isinstance(body, dict) else {}
+        current = self.snapshot.as3_tenants()
+        changed = sorted(t for t, decl in desired.items() if current.get(t) != decl)
+        tenants = ", ".join(sorted(desired)) or None
+        if desired and not changed:
+            self._add("noop", method, AS3_DECLARE_PATH, body, tenants, False, "tenants up to date")
+        else:
+            self._add("send", method, AS3_DECLARE_PATH, body, tenants, False,
+                      f"tenants changed: {', '.join(changed)}" if changed else "not diffable")
+        results = [{"code": 200, "message": "success", "tenant": tenant} for tenant in desired]
+        return _response(method, path, 200, {"results": results, "declaration": body})
+
+    def _plan_as3_delete(self, method: str, path: str, bare: str) -> httpx.Response:
+        tenant = bare.rsplit("/", 1)[-1]
+        current = self.snapshot.as3_tenants().pop(tenant, None)
+        if current is None:
+            self._add("noop", method, bare, None, tenant, False, "tenant not deployed")
+            return _response(method, path, 404, {"code": 404, "message": f"tenant {tenant} not found"})
+        self._add("delete", method, bare, None, tenant, False, "tenant deployed", current)
+        return _response(method, path, 200, {"results": [{"code": 200, "message": "success"}]})
+
+    def _add(self, action: str, method: str, path: str, body: Any, name: Optional[str],
+             transactional: bool, reason: str, current: Any = None) -> Change:
+        change = Change(action, method, path, body, name, transactional, reason,
+                        client=self.client, current=current)
+        self.plan.changes.append(change)
+        return change
+
+
+class _PlanningPool:
+    """``ClientPool`` look-alike handing out planning clients"""
+
+    def __init__(self, clients: ClientPool, plan: Plan):
+        self.clients = clients
+        self.plan = plan
+        self.planning: Dict[int, PlanningClient] = {}
+
+    def for_url(self, url: str, username: str, password: str, validate_certs: bool = False) -> PlanningClient:
+        client = self.clients.for_url(url, username, password, validate_certs)
+        if id(client) not in self.planning:
+            self.planning[id(client)] = PlanningClient(client, self.plan)
+        return self.planning[id(client)]
+
+
+class Planner:
+    """
+    Plan/apply mode for the deploy playbooks
+
+    ``plan()`` runs the playbook through the native executor with every
+    BIG-IP write intercepted, then diffs each one against the device's
+    current configuration. ``apply()`` sends only the pending changes,
+    staging the ones that came from a transaction into a fresh one.
+    """
+
+    def __init__(self, clients: ClientPool, project_dir: Path = PROJECT_DIR):
+        self.clients = clients
+        self.project_dir = project_dir
+
+    def plan(
+        self,
+        playbook: str,
+        extravars: Optional[Dict[str, Any]] = None,
+        host_vars: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[Plan, ExecutionResult]:
+        """Changes ``playbook`` would make, and the (dry) run that produced them"""
+        plan = Plan()
+        pool = _PlanningPool(self.clients, plan)
+        executor = TaskExecutor(pool, self.project_dir, staging_concurrency=1)
+        result = executor.run_playbook(playbook, extravars=extravars, host_vars=host_vars)
+        for planning_client in pool.planning.values():
+            planning_client.finish()
+        return plan, result
+
+    def apply(
+        self,
+        plan: Plan,
+        result: Optional[ExecutionResult] = None,
+        staging_concurrency: int = DEFAULT_STAGING_CONCURRENCY,
+    ) -> ExecutionResult:
+        """Send the pending changes of ``plan``"""
+        result = result or ExecutionResult()
+        batch: List[Change] = []
+        for change in plan.pending:
+            if change.transactional and (not batch or batch[0].client is change.client):
+                batch.append(change)
+                continue
+            if batch:
+                self._commit(batch, result, staging_concurrency)
+                batch = []
+            if change.transactional:
+                batch.append(change)
+            else:
+                self._send(change, result)
+            if result.failed:
+                return result
+        if batch:
+            self._commit(batch, result, staging_concurrency)
+        return result
+
+    def _send(self, change: Change, result: ExecutionResult) -> None:
+        json_body, content = _payload(change.body)
+        result.request_count += 1
+        try:
+            response = change.client.request(change.method, change.path, json=json_body, content=content)
+        except (F5Error, httpx.HTTPError) as exc:
+            self._record(change, result, "failed", f"Request failed: {exc}")
+            return
+        accepted = {
+            "create": (200, 201, 202, 409),
+            "delete": (200, 202, 204, 404),
+        }.get(change.action, (200, 201, 202))
+        if response.status_code not in accepted:
+            self._record(change, result, "failed",
+                         f"Status code was {response.status_code}: {response.text[:500]}",
+                         response.status_code)
+            return
+        self._record(change, result, "changed", change.reason, response.status_code, response_body(response))
+
+    def _commit(self, batch: List[Change], result: ExecutionResult, concurrency: int) -> None:
+        try:
+            transaction = Transaction.begin(batch[0].client, concurrency)
+            for change in batch:
+                json_body, content = _payload(change.body)
+                transaction.stage(change.method, change.path, json=json_body, content=content,
+                                  expected_status=(200, 201, 202))
+            result.request_count += len(batch) + 2
+            transaction.commit()
+        except TransactionError as exc:
+            for error in exc.command_errors:
+                result.errors.append(f"{error['method']} {error['name'] or error['uri']}: {error['error']}")
+            for change in batch:
+                self._record(change, result, "failed", str(exc), exc.status_code, errors=False)
+            return
+        except (F5Error, httpx.HTTPError) as exc:
+            for change in batch:
+                self._record(change, result, "failed", f"Transaction failed: {exc}")
+            return
+        for change in batch:
+            self._record(change, result, "changed", change.reason, 200, change.body)
+
+    @staticmethod
+    def _record(change: Change, result: ExecutionResult, status: str, message: str,
+                status_code: Optional[int] = None, response: Any = None, errors: bool = True) -> None:
+        task_name = f"{change.action} {change.name or change.path}"
+        result.tasks.append(TaskResult(
+            task_name=task_name, status=status, message=message,
+            details={"status_code": status_code} if status_code is not None else None,
+        ))
+        if status == "failed":
+            result.failed = True
+            if errors:
+                result.errors.append(f"{task_name}: {message}")
+            return
+        method = "POST" if change.action == "create" else change.method
+        target = result.deleted_resources if method == "DELETE" else result.created_resources
+        record_resource(target, method, change.path, status_code or 200,
+                        change.body if isinstance(change.body, dict) else None, response)
+        track_object(result.tracked_objects, method, change.path, status_code or 200, change.body, response)
+
+
+# Diffing
+
+def diff_fields(desired: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Desired fields whose value on the device differs"""
+    delta = {}
+    for key, want in desired.items():
+        if key in IDENTITY_FIELDS or key == "type" or is_secret(key):
+            continue
+        have = current.get(key, _MISSING)
+        if have is _MISSING and isinstance(current.get(f"{key}Reference"), dict):
+            have = current[f"{key}Reference"].get("items", [])
+        if not equivalent(want, have):
+            delta[key] = want
+    return delta
+
+
+def equivalent(want: Any, have: Any) -> bool:
+    """Loose equality between a request value and what BIG-IP reports back"""
+    if have is _MISSING or have is None:
+        return want in (None, "", [], {}, "none")
+    if isinstance(want, dict):
+        return isinstance(have, dict) and all(
+            equivalent(value, have.get(key, _MISSING))
+            for key, value in want.items()
+            if key not in IDENTITY_FIELDS and not is_secret(key)
+        )
+    if isinstance(want, list):
+        if not isinstance(have, list) or len(want) != len(have):
+            return False
+        if all(isinstance(item, dict) and item.get("name") for item in want):
+            by_name = {_norm(item.get("name")): item for item in have if isinstance(item, dict)}
+            return all(
+                equivalent(item, by_name.get(_norm(item["name"]), _MISSING)) for item in want
+            )
+        if all(not isinstance(item, (dict, list)) for item in want):
+            return sorted(map(_norm, want)) == sorted(map(_norm, have))
+        return all(equivalent(w, h) for w, h in zip(want, have))
+    return _norm(want) == _norm(have)
+
+
+def _norm(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    text = str(value).strip()
+    lowered = text.lower()
+    if lowered in _FLAG_VALUES:
+        return _FLAG_VALUES[lowered]
+    if _NAME.match(text):
+        # name and /Common/name refer to the same object; /Other/name does not
+        return f"/Common/{text}"
+    return text
+
+
+# Paths and payloads
+
+def split_object_path(path: str) -> Tuple[str, Optional[str]]:
+    """(collection path, object fullPath or None) for an iControl REST path"""
+    collection, _, last = path.rstrip("/").rpartition("/")
+    if last.startswith("~"):
+        return collection, last.replace("~", "/")
+    return path.rstrip("/"), None
+
+
+def object_segment(full_path: str) -> str:
+    """``/Common/name`` -> ``~Common~name``"""
+    return full_path.replace("/", "~")
+
+
+def full_path(item: Dict[str, Any]) -> str:
+    """``/Partition[/subPath]/name`` of an object as listed or declared"""
+    if item.get("fullPath"):
+        return item["fullPath"]
+    name = str(item.get("name", ""))
+    if name.startswith("/"):
+        return name
+    parts = [item.get("partition") or "Common", item.get("subPath"), name]
+    return "/" + "/".join(part for part in parts if part)
+
+
+def _object_name(path: str) -> Optional[str]:
+    return split_object_path(path)[1]
+
+
+def _as3_tenants(declaration: Dict[str, Any]) -> Dict[str, Any]:
+    # Wrapped requests (class AS3, or ADC with an inner declaration) nest it
+    if isinstance(declaration.get("declaration"), dict):
+        declaration = declaration["declaration"]
+    return {
+        key: value for key, value in declaration.items()
+        if isinstance(value, dict) and value.get("class") == "Tenant"
+    }
+
+
+def _decode(content: Optional[str]) -> Any:
+    if content is None:
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content
+
+
+def _payload(body: Any) -> Tuple[Any, Optional[str]]:
+    if isinstance(body, str):
+        return None, body
+    return body, None
+
+
+def _response(method: str, path: str, status_code: int, body: Any) -> httpx.Response:
+    return httpx.Response(status_code, json=body, request=httpx.Request(method, f"https://bigip{path}"))
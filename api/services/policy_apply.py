@@ -0,0 +1,227 @@
+"""
+Coalesced access policy applies for F5 BIG-IP APM
+Collects the access profiles deploys apply on a device and applies them together in one tmsh run
+"""
+import logging
+import re
+import shlex
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from . import metrics
+from .certificates import BASH_PATH
+from .f5_client import F5Client, F5Error, response_body
+
+logger = logging.getLogger(__name__)
+
+# Printed by the apply script for each profile tmsh refused
+APPLY_FAILED_MARKER = "apm-apply-failed "
+
+# Seconds a device's first apply waits for others to join it
+DEFAULT_APPLY_WINDOW = 0.5
+
+# Seconds the tmsh run may take
+DEFAULT_APPLY_TIMEOUT = 300.0
+
+# util/bash answers meaning the account may not run shell commands
+SHELL_DENIED_STATUSES = (401, 403)
+
+ACCESS_PROFILE_PATH = "/mgmt/tm/apm/profile/access"
+
+_PROFILE = re.compile(r"^/mgmt/tm/apm/profile/access/~([^/~]+)~([^/]+)$")
+
+Answer = Tuple[int, Any]
+
+
+def apply_target(method: str, path: str, body: Any) -> Optional[str]:
+    """fullPath of the access profile a policy apply (``generationAction: increment``) is for, else None"""
+    if method != "PATCH" or body != {"generationAction": "increment"}:
+        return None
+    match = _PROFILE.match(path.split("?", 1)[0].rstrip("/"))
+    return f"/{match.group(1)}/{match.group(2)}" if match else None
+
+
+def apply_script(profiles: List[str]) -> str:
+    """
+    Shell command applying ``profiles`` with one ``tmsh modify``; if tmsh
+    refuses the list, each profile is retried alone and the ones still
+    refused are reported with ``APPLY_FAILED_MARKER``
+    """
+    names = " ".join(shlex.quote(profile) for profile in profiles)
+    modify = "tmsh modify apm profile access {} generation-action increment 2>&1"
+    return (
+        f"{modify.format('{ ' + names + ' }')} || for p in {names}; do "
+        f"{modify.format('$p')} || echo \"{APPLY_FAILED_MARKER}$p\"; done"
+    )
+
+
+class _DeviceApplies:
+    def __init__(self, client: F5Client):
+        self.client = client
+        self.pending: Dict[str, List["Future[Answer]"]] = {}  # profile -> callers waiting for it
+        self.running = False
+        self.exclusive: Optional[Callable[[], ContextManager[None]]] = None
+
+
+class PolicyApplyCoordinator:
+    """
+    Per-device access policy applies
+
+    Every solution ends by applying its access profile, and each apply is a
+    device-wide operation. Applies are queued per device (and account,
+    ``F5Client.account``) instead: the first
+    one waits ``window`` seconds for company, then every profile pending for
+    the device is applied with a single ``util/bash`` call running one
+    ``tmsh modify apm profile access { ... } generation-action increment``.
+    Applies arriving meanwhile form the next batch; a profile requested by
+    several deploys is applied once for all of them. Each caller gets the
+    outcome for its own profile once the batch finished; a profile the
+    device refuses fails only its own callers. A queue is dropped once
+    nothing is pending for it.
+
+    Callers that stepped off their device to wait pass ``exclusive``, which
+    takes the device back for the duration of the apply; the batch is
+    taken once the device is held, so the jobs queued on the device ahead
+    of the apply join it.
+
+    A batch of one profile is applied with the REST call the playbooks
+    make (``PATCH`` of ``generationAction``). So is every batch on a
+    device that refused ``util/bash`` (401/403): accounts without
+    advanced-shell rights deploy as they did before, one PATCH per profile.
+    """
+
+    def __init__(
+        self,
+        window: float = DEFAULT_APPLY_WINDOW,
+        timeout: float = DEFAULT_APPLY_TIMEOUT,
+        max_devices: int = 32,
+    ):
+        self.window = window
+        self.timeout = timeout
+        self._queues: Dict[str, _DeviceApplies] = {}  # by client account, while applies are pending
+        self._no_shell: Set[str] = set()  # accounts that may not use util/bash
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_devices, thread_name_prefix="policy-apply")
+        self.runs = 0
+        self.applies = 0
+
+    def submit(self, client: F5Client, profile: str,
+               exclusive: Optional[Callable[[], ContextManager[None]]] = None) -> "Future[Answer]":
+        """Queue an apply of ``profile``; the future resolves to ``(status_code, body)``"""
+        future: "Future[Answer]" = Future()
+        with self._lock:
+            queue = self._queue(client)
+            queue.pending.setdefault(profile, []).append(future)
+            queue.exclusive = exclusive or queue.exclusive
+            start = not queue.running
+            queue.running = True
+        if start:
+            self._pool.submit(self._drain, queue)
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+    def _queue(self, client: F5Client) -> _DeviceApplies:
+        """Lock held"""
+        queue = self._queues.get(client.account)
+        if queue is None:
+            queue = self._queues[client.account] = _DeviceApplies(client)
+        queue.client = client  # the newest of the account's pooled clients
+        return queue
+
+    def _drain(self, queue: _DeviceApplies) -> None:
+        """Apply batches for one device until nothing is pending"""
+        if self.window > 0:
+            time.sleep(self.window)
+        while True:
+            with self._lock:
+                if not queue.pending:
+                    queue.running = False
+                    del self._queues[queue.client.account]
+                    return
+                exclusive = queue.exclusive
+            with exclusive() if exclusive else nullcontext():
+                with self._lock:
+                    batch, queue.pending = queue.pending, {}
+                try:
+                    answers = self._apply(queue.client, list(batch))
+                except Exception as exc:  # never leave a deployment waiting forever
+                    logger.exception("Policy apply on %s failed", queue.client.host)
+                    answers = {profile: (-1, {"message": f"Policy apply failed: {exc}"}) for profile in batch}
+                for profile, futures in batch.items():
+                    for future in futures:
+                        future.set_result(answers[profile])
+
+    def _apply(self, client: F5Client, profiles: List[str]) -> Dict[str, Answer]:
+        """``{profile: (status, body)}`` after one tmsh run applying every profile"""
+        with self._lock:
+            self.runs += 1
+            self.applies += len(profiles)
+            no_shell = client.account in self._no_shell
+        if len(profiles) == 1 or no_shell:
+            return self._apply_rest(client, profiles)
+        started = time.monotonic()
+        try:
+            response = client.request(
+                "POST", BASH_PATH, timeout=self.timeout,
+                json={"command": "run", "utilCmdArgs": f"-c {shlex.quote(apply_script(profiles))}"},
+            )
+        except (F5Error, httpx.HTTPError) as exc:
+            return {profile: (-1, {"message": f"Request failed: {exc}"}) for profile in profiles}
+        if response.status_code in SHELL_DENIED_STATUSES:
+            logger.info("%s refused util/bash (HTTP %d): applying policies one PATCH at a time",
+                        client.host, response.status_code)
+            with self._lock:
+                self._no_shell.add(client.account)
+            return self._apply_rest(client, profiles)
+        payload = response_body(response)
+        metrics.POLICY_APPLY_LATENCY.labels(status=str(response.status_code)).observe(time.monotonic() - started)
+        metrics.POLICY_APPLY_BATCH.observe(len(profiles))
+        if response.status_code != 200:
+            return {profile: (response.status_code, payload) for profile in profiles}
+        output = str((payload or {}).get("commandResult", "")) if isinstance(payload, dict) else ""
+        refused = {
+            line[len(APPLY_FAILED_MARKER):].strip()
+            for line in output.splitlines() if line.startswith(APPLY_FAILED_MARKER)
+        }
+        logger.info(
+            "Policy apply on %s: %d profile(s), %d refused, in %.1fs",
+            client.host, len(profiles), len(refused), time.monotonic() - started,
+        )
+        batch = {"profiles": len(profiles)}
+        answers: Dict[str, Answer] = {}
+        for profile in profiles:
+            if profile not in refused:
+                answers[profile] = (200, {"fullPath": profile, "generationAction": "increment", "batch": batch})
+            elif any(f"({profile})" in line and "not found" in line for line in output.splitlines()):
+                answers[profile] = (404, {
+                    "code": 404, "message": f"01020036:3: The requested object ({profile}) was not found.",
+                })
+            else:
+                answers[profile] = (400, {"code": 400, "message": output.strip()[:500]})
+        return answers
+
+    def _apply_rest(self, client: F5Client, profiles: List[str]) -> Dict[str, Answer]:
+        """``{profile: (status, body)}`` after one ``generationAction`` PATCH per profile"""
+        answers: Dict[str, Answer] = {}
+        for profile in profiles:
+            started = time.monotonic()
+            try:
+                response = client.patch(
+                    f"{ACCESS_PROFILE_PATH}/{profile.replace('/', '~')}",
+                    json={"generationAction": "increment"}, timeout=self.timeout,
+                )
+            except (F5Error, httpx.HTTPError) as exc:
+                answers[profile] = (-1, {"message": f"Request failed: {exc}"})
+                continue
+            metrics.POLICY_APPLY_LATENCY.labels(status=str(response.status_code)).observe(
+                time.monotonic() - started)
+            metrics.POLICY_APPLY_BATCH.observe(1)
+            answers[profile] = (response.status_code, response_body(response))
+        return answers
@@ -0,0 +1,152 @@
+"""
+Resource bookkeeping helpers
+Maps iControl REST calls to the resource categories reported in API responses
+"""
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from ..models import TrackedObject
+
+# Ordered (path prefix, category) pairs - first match wins
+RESOURCE_CATEGORIES = [
+    ("/mgmt/tm/apm/profile/", "profiles"),
+    ("/mgmt/tm/apm/policy/access-policy", "policies"),
+    ("/mgmt/tm/apm/policy/policy-item", "policy_items"),
+    ("/mgmt/tm/apm/policy/agent/", "agents"),
+    ("/mgmt/tm/apm/policy/customization-group", "customization_groups"),
+    ("/mgmt/tm/apm/resource/", "resources"),
+    ("/mgmt/tm/apm/aaa/", "aaa_servers"),
+    ("/mgmt/tm/apm/", "apm"),
+    ("/mgmt/tm/ltm/", "ltm"),
+    ("/mgmt/tm/net/", "network"),
+    ("/mgmt/tm/sys/crypto/", "certificates"),
+    ("/mgmt/tm/sys/file/", "files"),
+    ("/mgmt/tm/gtm/", "gslb"),
+    ("/mgmt/shared/appsvcs/declare", "as3_tenants"),
+]
+
+# Fields BIG-IP never returns in clear text - never diffed nor kept in records
+SECRET_MARKERS = ("password", "secret", "passphrase", "Encrypted")
+
+# Calls that never create or delete configuration objects
+IGNORED_PATHS = (
+    "/mgmt/tm/transaction",
+    "/mgmt/shared/appsvcs/info",
+    "/mgmt/shared/appsvcs/task",
+    "/mgmt/shared/authn",
+    "/mgmt/shared/file-transfer",
+)
+
+
+def resource_category(url: str) -> Optional[str]:
+    """Return the resource category for an iControl REST URL, if any"""
+    path = urlsplit(url).path
+    if path.startswith(IGNORED_PATHS):
+        return None
+    for prefix, category in RESOURCE_CATEGORIES:
+        if path.startswith(prefix):
+            return category
+    return None
+
+
+def resource_names(method: str, url: str, body: Any = None, response: Any = None) -> List[str]:
+    """
+    Best-effort list of object names touched by a successful call
+
+    Prefers the device's view (fullPath / AS3 tenant results) and falls back
+    to the request body or the ~Partition~name URL segment.
+    """
+    path = urlsplit(url).path.rstrip("/")
+
+    if path.startswith("/mgmt/shared/appsvcs/declare"):
+        if method == "DELETE":
+            return [path.rsplit("/", 1)[-1]]
+        results = response.get("results", []) if isinstance(response, dict) else []
+        return sorted({r["tenant"] for r in results if isinstance(r, dict) and r.get("tenant")})
+
+    if isinstance(response, dict) and response.get("fullPath"):
+        return [response["fullPath"]]
+
+    if method == "POST" and isinstance(body, dict) and body.get("name"):
+        partition = body.get("partition", "Common")
+        return [f"/{partition}/{body['name']}"]
+
+    segment = path.rsplit("/", 1)[-1]
+    if segment.startswith("~"):
+        return ["/" + segment[1:].replace("~", "/")]
+    return []
+
+
+def record_resource(
+    resources: Dict[str, List[str]],
+    method: str,
+    url: str,
+    status_code: int,
+    body: Any = None,
+    response: Any = None,
+) -> None:
+    """Add the object(s) touched by a successful create/delete call to ``resources``"""
+    method = method.upper()
+    if method not in ("POST", "DELETE") or status_code not in (200, 201, 202):
+        return
+    category = resource_category(url)
+    if category is None:
+        return
+    bucket = resources.setdefault(category, [])
+    for name in resource_names(method, url, body, response):
+        if name not in bucket:
+            bucket.append(name)
+
+
+def track_object(
+    objects: Dict[str, TrackedObject],
+    method: str,
+    url: str,
+    status_code: int,
+    body: Any = None,
+    response: Any = None,
+) -> None:
+    """
+    Remember the fields a successful create/modify call declared for its
+    object, keyed by the object's iControl REST path
+
+    Creates answered 409 count too: the object exists with the declared
+    name. Later writes to the same object are merged in; secrets and
+    policy applies (``generationAction``) are left out.
+    """
+    method = method.upper()
+    accepted = (200, 201, 202, 409) if method == "POST" else (200, 201, 202)
+    if method not in ("POST", "PATCH", "PUT") or status_code not in accepted or not isinstance(body, dict):
+        return
+    if body.get("command") or resource_category(url) is None or not urlsplit(url).path.startswith("/mgmt/tm/"):
+        return
+    path = urlsplit(url).path.rstrip("/")
+    if method == "POST":
+        names = resource_names(method, url, body, response if status_code != 409 else None)
+        if not names:
+            return
+        path = f"{path}/{names[0].replace('/', '~')}"
+    elif not path.rsplit("/", 1)[-1].startswith("~"):
+        return
+    declared = {key: value for key, value in declared_fields(body).items() if key != "generationAction"}
+    tracked = objects.get(path)
+    if tracked is None:
+        if not declared:
+            return
+        tracked = objects[path] = TrackedObject()
+    tracked.declared.update(declared)
+    if isinstance(response, dict) and isinstance(response.get("generation"), int):
+        tracked.generation = response["generation"]
+
+
+def declared_fields(value: Any) -> Any:
+    """``value`` without secret fields, at any depth"""
+    if isinstance(value, dict):
+        return {key: declared_fields(child) for key, child in value.items() if not is_secret(key)}
+    if isinstance(value, list):
+        return [declared_fields(child) for child in value]
+    return value
+
+
+def is_secret(key: str) -> bool:
+    return any(marker.lower() in key.lower() for marker in SECRET_MARKERS)
@@ -0,0 +1,371 @@
+"""
+Per-device job scheduler for F5 BIG-IP APM
+Serialises config writes per management host, by priority, while different devices run in parallel
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from ..models import BIGIPCredentials
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Recent queue waits kept for the percentiles
+WAIT_SAMPLES = 1000
+
+
+class JobPriority(IntEnum):
+    """Lower runs first on a device"""
+    RESUME = -1  # a job taking its device back after waiting on it
+    ROLLBACK = 0
+    DELETE = 10
+    DEPLOY = 20
+
+
+def device_key(credentials: BIGIPCredentials) -> str:
+    """Identity of a management endpoint; jobs on the same key never overlap"""
+    return f"{credentials.host.lower()}:{credentials.port}"
+
+
+@dataclass(order=True)
+class _Entry:
+    priority: int
+    sequence: int
+    queued_at: float = field(compare=False)
+    start: Callable[["_Entry"], None] = field(compare=False)
+    label: str = field(compare=False, default="")
+    group: Optional[str] = field(compare=False, default=None)
+    pooled: bool = field(compare=False, default=True)
+    waited: float = field(compare=False, default=0.0)
+    event: Optional[threading.Event] = field(compare=False, default=None)
+    cancelled: bool = field(compare=False, default=False)
+    exclusive: bool = field(compare=False, default=False)  # a suspended job's write, see exclusive()
+    slotted: bool = field(compare=False, default=False)  # resuming with the pool slot it kept
+
+
+@dataclass
+class _Device:
+    key: str
+    queue: List[_Entry] = field(default_factory=list)
+    running: Optional[_Entry] = None
+    held: List[Optional[str]] = field(default_factory=list)  # groups of the jobs suspended on it
+    completed: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    idle_since: float = field(default_factory=time.monotonic)
+
+
+class DeviceScheduler:
+    """
+    Per-device priority queues in front of a shared worker pool
+
+    Each management host runs at most one job at a time and at most
+    ``max_running`` pooled jobs run overall. Queued jobs wait in their
+    device's heap (lowest ``JobPriority`` first, then FIFO) without holding
+    a worker; whenever a device or a slot frees up, the best head-of-queue
+    job among the idle devices is handed to the pool, so a burst against one
+    device never starves the others. ``run()`` takes a device slot for work
+    done in the caller's own thread (fleet workers bring their own limit),
+    and ``suspend()`` lets a running job step aside while it waits on the
+    device.
+
+    While a job is suspended its device only starts jobs of other
+    ``group``s (the engine groups jobs by solution): a job of the same
+    group, or one without a group, waits until every suspended job has
+    taken the device back and finished, so a solution is never written
+    by two jobs at once. What the suspended job waits for (an AS3 run, a
+    policy apply) takes the device back through ``exclusive()`` before it
+    writes, so other jobs only run while nothing is being written for it.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, max_running: int, idle_ttl: float = 300.0,
+                 max_suspended: Optional[int] = None):
+        self.executor = executor
+        self.max_running = max_running
+        self.max_suspended = max_running if max_suspended is None else max_suspended
+        self.idle_ttl = idle_ttl
+        self._devices: Dict[str, _Device] = {}
+        self._lock = threading.Condition()
+        self._sequence = itertools.count()
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._running = 0
+        self._suspended = 0
+        self._parked = 0  # suspended pooled jobs that gave their slot back
+        self._completed = 0
+        self._closed = False
+
+    def submit(self, key: str, priority: int, fn: Callable[..., Any], *args: Any, label: str = "",
+               group: Optional[str] = None) -> None:
+        """Queue ``fn(*args)`` for device ``key``; it runs on the pool when the device is free"""
+        def start(entry: _Entry) -> None:
+            self.executor.submit(self._call, key, entry, fn, args)
+
+        self._enqueue(key, priority, start, label, group=group)
+
+    def run(self, key: str, priority: int, fn: Callable[..., Any], *args: Any, label: str = "",
+            group: Optional[str] = None) -> Any:
+        """Wait for device ``key`` to be free, then run ``fn(*args)`` in this thread"""
+        event = threading.Event()
+        entry = self._enqueue(key, priority, _wake, label, event, pooled=False, group=group)
+        event.wait()
+        if entry.cancelled:
+            raise RuntimeError("Scheduler is shut down")
+        return self._call(key, entry, fn, args)
+
+    def suspend(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Give device ``key`` (and the job's slot) away while ``fn()`` waits, then take it back
+
+        For a running job that waits on the device itself (an AS3 task or a
+        policy apply) between writes that are each complete in themselves.
+        Only jobs of other groups run meanwhile (see the class docstring),
+        and only until the awaited work takes the device with ``exclusive()``.
+
+        The job's pool slot is given away too, unless ``max_suspended`` jobs
+        already gave theirs: a pool of ``max_running + max_suspended``
+        threads then never runs short.
+        """
+        with self._lock:
+            device = self._devices[key]
+            entry = device.running
+            group = entry.group if entry else None
+            pooled = entry.pooled if entry else True
+            parked = pooled and self._parked < self.max_suspended
+            if parked:
+                self._parked += 1
+                self._vacate(device)
+            else:  # keep the slot, give only the device away
+                device.running = None
+                device.idle_since = time.monotonic()
+            device.held.append(group)
+            self._suspended += 1
+            self._dispatch()
+        try:
+            return fn()
+        finally:
+            event = threading.Event()
+            with self._lock:
+                self._suspended -= 1
+                device.held.remove(group)
+            self._enqueue(key, JobPriority.RESUME, _wake, entry.label if entry else "", event,
+                          pooled=pooled, force=True, group=group, slotted=pooled and not parked)
+            event.wait()
+            if parked:
+                with self._lock:
+                    self._parked -= 1
+
+    @contextmanager
+    def exclusive(self, key: str, label: str = "") -> Iterator[None]:
+        """
+        Hold device ``key`` in this thread for a write made on behalf of suspended jobs
+
+        Queued like a deploy (jobs queued earlier run first, so they can
+        add their own work to the write), but it may start while jobs are
+        suspended on the device. Holds no worker slot and does not count as
+        a job.
+        """
+        event = threading.Event()
+        self._enqueue(key, JobPriority.DEPLOY, _wake, label, event, pooled=False, force=True,
+                      exclusive=True)
+        event.wait()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._vacate(self._devices[key])
+                self._dispatch()
+                self._lock.notify_all()
+
+    def _enqueue(self, key: str, priority: int, start: Callable[[_Entry], None], label: str,
+                 event: Optional[threading.Event] = None, pooled: bool = True,
+                 force: bool = False, group: Optional[str] = None, exclusive: bool = False,
+                 slotted: bool = False) -> _Entry:
+        entry = _Entry(int(priority), next(self._sequence), time.monotonic(), start, label,
+                       group=group, pooled=pooled, event=event, exclusive=exclusive, slotted=slotted)
+        with self._lock:
+            if self._closed and not force:
+                raise RuntimeError("Scheduler is shut down")
+            device = self._devices.get(key)
+            if device is None:
+                device = self._devices[key] = _Device(key)
+            heapq.heappush(device.queue, entry)
+            self._dispatch()
+        return entry
+
+    def _dispatch(self) -> None:
+        """Start head-of-queue jobs of idle devices, best first, while slots last (lock held)"""
+        slots = self._running < self.max_running
+        ready = sorted(
+            ((entry, device) for device in self._devices.values() if device.running is None
+             for entry in [self._next(device, slots)] if entry is not None),
+            key=lambda item: item[0],
+        )
+        for entry, device in ready:
+            if entry.pooled and not entry.slotted and self._running >= self.max_running:
+                continue
+            if entry is device.queue[0]:
+                heapq.heappop(device.queue)
+            else:
+                device.queue.remove(entry)
+                heapq.heapify(device.queue)
+            entry.waited = time.monotonic() - entry.queued_at
+            device.running = entry
+            if entry.pooled and not entry.slotted:
+                self._running += 1
+            if entry.priority != JobPriority.RESUME and not entry.exclusive:
+                device.wait_total += entry.waited
+                device.wait_max = max(device.wait_max, entry.waited)
+                self._waits.append(entry.waited)
+                metrics.QUEUE_WAIT.observe(entry.waited)
+            if entry.waited > 1.0:
+                logger.info("%s waited %.1fs for %s", entry.label or "Job", entry.waited, device.key)
+            try:
+                entry.start(entry)
+            except RuntimeError:  # pool shut down underneath us
+                self._vacate(device)
+                logger.warning("Could not start %s on %s: worker pool is shut down", entry.label, device.key)
+
+    @staticmethod
+    def _next(device: _Device, slots: bool) -> Optional[_Entry]:
+        """Best queued job ``device`` may start now; ``slots`` tells if a pool slot is free (lock held)"""
+        if not device.queue:
+            return None
+        head = device.queue[0]
+        if not device.held and (slots or not head.pooled or head.slotted):
+            return head
+        waiting = False  # a better job waits for a slot: only work already under way may pass it
+        for entry in sorted(device.queue):
+            under_way = entry.priority == JobPriority.RESUME or entry.exclusive
+            if waiting and not under_way:
+                continue
+            if entry.pooled and not entry.slotted and not slots:
+                waiting = True
+                continue
+            if under_way or not device.held or (entry.group is not None and entry.group not in device.held):
+                return entry
+        return None
+
+    def _vacate(self, device: _Device) -> None:
+        """Mark ``device`` idle and free its job's slot (lock held)"""
+        if device.running is not None and device.running.pooled:
+            self._running -= 1
+        device.running = None
+        device.idle_since = time.monotonic()
+
+    def _call(self, key: str, entry: _Entry, fn: Callable[..., Any], args: Any) -> Any:
+        try:
+            return fn(*args)
+        finally:
+            self._release(key)
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            device = self._devices[key]
+            self._vacate(device)
+            device.completed += 1
+            self._completed += 1
+            self._dispatch()
+            self._prune()
+            self._lock.notify_all()
+
+    def _prune(self) -> None:
+        """Forget devices idle for longer than ``idle_ttl`` (lock held)"""
+        now = time.monotonic()
+        stale = [
+            key for key, device in self._devices.items()
+            if device.running is None and not device.queue and not device.held
+            and now - device.idle_since > self.idle_ttl
+        ]
+        for key in stale:
+            del self._devices[key]
+
+    def ahead(self, key: str, priority: int) -> int:
+        """Jobs a new ``priority`` job on ``key`` would wait for"""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                return 0
+            queued = sum(1 for entry in device.queue if entry.priority <= priority)
+            return queued + (1 if device.running else 0)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued job has run; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._suspended or any(device.running or device.queue for device in self._devices.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+    def close(self, cancel: bool = False) -> int:
+        """Stop accepting jobs; with ``cancel`` drop the queued ones. Returns jobs dropped"""
+        with self._lock:
+            self._closed = True
+            if not cancel:
+                return 0
+            dropped = 0
+            for device in self._devices.values():
+                keep = []
+                for entry in device.queue:
+                    if entry.priority == JobPriority.RESUME or entry.exclusive:
+                        keep.append(entry)
+                        continue
+                    dropped += 1
+                    entry.cancelled = True
+                    if entry.event is not None:
+                        entry.event.set()
+                heapq.heapify(keep)
+                device.queue = keep
+            self._lock.notify_all()
+            return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and wait times, overall and per device"""
+        now = time.monotonic()
+        with self._lock:
+            waits = sorted(self._waits)
+            devices = []
+            for device in self._devices.values():
+                if device.running is None and not device.queue:
+                    continue
+                oldest = min((entry.queued_at for entry in device.queue), default=None)
+                devices.append({
+                    "device": device.key,
+                    "running": device.running.label if device.running else None,
+                    "queued": len(device.queue),
+                    "oldest_wait_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+                    "completed": device.completed,
+                    "avg_wait_seconds": round(device.wait_total / device.completed, 3) if device.completed else 0.0,
+                    "max_wait_seconds": round(device.wait_max, 3),
+                })
+            return {
+                "running": sum(1 for d in self._devices.values() if d.running is not None),
+                "queued": sum(len(d.queue) for d in self._devices.values()),
+                "suspended": self._suspended,
+                "completed": self._completed,
+                "wait_p50_seconds": round(_percentile(waits, 0.50), 3),
+                "wait_p95_seconds": round(_percentile(waits, 0.95), 3),
+                "wait_max_seconds": round(waits[-1], 3) if waits else 0.0,
+                "devices": sorted(devices, key=lambda d: -d["queued"]),
+            }
+
+
+def _wake(entry: _Entry) -> None:
+    entry.event.set()
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
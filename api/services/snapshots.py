@@ -0,0 +1,184 @@
+"""
+Solution snapshots for F5 BIG-IP APM
+Bulk reads of a deployed solution's objects and their restore through one diff-driven transaction
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from ..models import DeploymentResponse, DeploymentStatus, OperationType
+from .f5_client import F5Client, F5Error, response_body
+from .planner import Change, Plan, diff_fields, full_path, split_object_path
+from .resources import is_secret
+from .store import MAX_PAGE_SIZE, DeploymentStore
+
+logger = logging.getLogger(__name__)
+
+ACCESS_PROFILE_PATH = "/mgmt/tm/apm/profile/access"
+
+# Collections read at once while a snapshot is taken or a rollback planned
+DEFAULT_SNAPSHOT_CONCURRENCY = 8
+
+# Fields BIG-IP computes itself; never sent back
+READ_ONLY_FIELDS = {"kind", "selfLink", "generation", "lastUpdateMicros", "fullPath"}
+
+# Operations after which a solution's objects are the record's tracked_objects
+DEPLOYING_OPERATIONS = (OperationType.DEPLOY, OperationType.ROLLBACK)
+
+
+class RollbackError(Exception):
+    """A snapshot cannot be restored faithfully"""
+
+
+def deployed_record(store: DeploymentStore, host: str, solution_name: str) -> Optional[DeploymentResponse]:
+    """
+    Newest completed deploy or rollback of ``solution_name`` on ``host``;
+    None if there is none or a delete came after it. Its ``tracked_objects``
+    are empty when the deploy ran through ansible-runner.
+    """
+    cursor = None
+    while True:
+        page = store.list(limit=MAX_PAGE_SIZE, cursor=cursor, host=host, solution_name=solution_name,
+                          status=DeploymentStatus.COMPLETED)
+        for record in page.items:
+            if record.operation == OperationType.DELETE:
+                return None
+            if record.operation in DEPLOYING_OPERATIONS:
+                return record
+        cursor = page.next_cursor
+        if cursor is None:
+            return None
+
+
+def restorable(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    An object as read from the device turned into a create body: computed
+    fields dropped, expanded subcollections (``fooReference.items``) inlined
+    as ``foo`` and bare links dropped
+    """
+    body = {}
+    for key, value in item.items():
+        if key in READ_ONLY_FIELDS:
+            continue
+        if key.endswith("Reference") and isinstance(value, dict):
+            if isinstance(value.get("items"), list) and key[:-len("Reference")] not in item:
+                body[key[:-len("Reference")]] = [
+                    restorable(child) if isinstance(child, dict) else child for child in value["items"]
+                ]
+            continue
+        body[key] = value
+    return body
+
+
+def secret_fields(value: Any, prefix: str = "") -> List[str]:
+    """Names of the password/secret/passphrase fields in a create body, nested ones dotted"""
+    found = []
+    if isinstance(value, dict):
+        for key, child in value.items():
+            name = f"{prefix}{key}"
+            found.extend([name] if is_secret(key) else secret_fields(child, f"{name}."))
+    elif isinstance(value, list):
+        for child in value:
+            found.extend(secret_fields(child, prefix))
+    return found
+
+
+class SnapshotService:
+    """
+    Snapshot and rollback of one solution on one device
+
+    ``take()`` reads every collection holding the solution's objects (the
+    ``tracked_objects`` of its last deploy) once, ``concurrency`` at a time,
+    and keeps those objects as create bodies. ``plan_rollback()`` reads the
+    same collections again and diffs: objects gone since the snapshot are
+    created, objects that differ get a PATCH of the differing fields, and
+    objects the solution gained since are deleted (newest first). All of it
+    is transactional, so ``Planner.apply`` sends it as one transaction,
+    followed by a single apply of the access profile if anything under APM
+    changed.
+
+    Secrets are kept as the device returned them (encrypted), so a deleted
+    object with a password, secret or passphrase cannot be re-created from
+    the snapshot: such a rollback raises ``RollbackError`` instead of
+    restoring the object with a wrong secret. Secrets of objects that still
+    exist are never diffed nor sent.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_SNAPSHOT_CONCURRENCY):
+        self.concurrency = concurrency
+
+    def take(self, client: F5Client, paths: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """``{path: create body}`` of the objects at ``paths`` that exist on the device, in order"""
+        paths = list(paths)
+        collections = self.read(client, {split_object_path(path)[0] for path in paths})
+        objects = {}
+        for path in paths:
+            collection, full_path = split_object_path(path)
+            item = collections[collection].get(full_path)
+            if item is not None:
+                objects[path] = restorable(item)
+        return objects
+
+    def plan_rollback(self, client: F5Client, snapshot: Dict[str, Dict[str, Any]],
+                      current_paths: Iterable[str]) -> Plan:
+        """Changes taking the device from its current state back to ``snapshot``; RollbackError if unsafe"""
+        current_paths = list(current_paths)
+        collections = self.read(
+            client, {split_object_path(path)[0] for path in list(snapshot) + current_paths}
+        )
+        plan = Plan(reads=len(collections))
+        creates: List[Change] = []
+        updates: List[Change] = []
+        for path, body in snapshot.items():
+            collection, full_path = split_object_path(path)
+            current = collections[collection].get(full_path)
+            if current is None:
+                creates.append(Change("create", "POST", collection, body, full_path, True,
+                                      "missing since the snapshot", client))
+                continue
+            delta = diff_fields(body, current)
+            if delta:
+                updates.append(Change("update", "PATCH", path, delta, full_path, True,
+                                      f"differs in {', '.join(sorted(delta))}", client, current))
+            else:
+                plan.changes.append(Change("noop", "PATCH", path, None, full_path, True,
+                                           "as in the snapshot", client, current))
+        secrets = {change.name: secret_fields(change.body) for change in creates}
+        secrets = {name: fields for name, fields in secrets.items() if fields}
+        if secrets:
+            raise RollbackError(
+                "Cannot re-create object(s) deleted since the snapshot with the secrets it holds "
+                "(encrypted as read from the device): "
+                + "; ".join(f"{name} ({', '.join(fields)})" for name, fields in sorted(secrets.items()))
+                + ". Re-deploy the solution with its credentials instead"
+            )
+        deletes = []
+        for path in reversed(current_paths):
+            collection, full_path = split_object_path(path)
+            if path not in snapshot and full_path in collections[collection]:
+                deletes.append(Change("delete", "DELETE", path, None, full_path, True,
+                                      "created after the snapshot", client, collections[collection][full_path]))
+        plan.changes.extend(creates + updates + deletes)
+        if any(change.path.startswith("/mgmt/tm/apm/") for change in creates + updates + deletes):
+            for path in snapshot:
+                collection, full_path = split_object_path(path)
+                if collection == ACCESS_PROFILE_PATH:
+                    plan.changes.append(Change("send", "PATCH", path, {"generationAction": "increment"},
+                                               full_path, False, "apply access policy", client))
+        return plan
+
+    def read(self, client: F5Client, collections: Iterable[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """``{collection: {fullPath: object}}``, one ``expandSubcollections`` GET per collection"""
+        collections = sorted(collections)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(collections)))) as pool:
+            return dict(zip(collections, pool.map(lambda path: self._collection(client, path), collections)))
+
+    @staticmethod
+    def _collection(client: F5Client, path: str) -> Dict[str, Dict[str, Any]]:
+        response = client.get(path, params={"expandSubcollections": "true"})
+        if response.status_code == 404:
+            return {}  # the collection's parent object is gone
+        if response.status_code != 200:
+            raise F5Error(f"GET {path} on {client.host} returned HTTP {response.status_code}",
+                          response.status_code)
+        return {full_path(item): item for item in (response_body(response) or {}).get("items", [])}
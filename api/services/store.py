@@ -0,0 +1,505 @@
+"""
+Deployment store for F5 BIG-IP APM API
+Persistent, indexed deployment records with cursor pagination and retention
+"""
+import base64
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..models import DeploymentResponse, DeploymentStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Records that may still change - never compacted or expired
+ACTIVE_STATUSES = (DeploymentStatus.PENDING.value, DeploymentStatus.IN_PROGRESS.value)
+
+# Filters accepted by list(), mapped to their column
+FILTER_COLUMNS = {
+    "solution_name": "solution_name",
+    "solution_type": "solution_type",
+    "operation": "operation",
+    "status": "status",
+    "host": "host",
+}
+
+
+@dataclass
+class DeploymentPage:
+    """One page of deployments, newest first"""
+    items: List[DeploymentResponse]
+    next_cursor: Optional[str]
+    total: int
+
+
+@dataclass
+class IdempotencyRecord:
+    """Deployment an idempotency or coalescing key points at"""
+    fingerprint: str
+    deployment_id: str
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    How long finished deployments are kept
+
+    Records older than ``compact_after_days`` lose their per-task detail,
+    records older than ``max_age_days`` are deleted, and only the newest
+    ``max_records`` are kept. ``None`` disables a rule.
+    """
+    max_age_days: Optional[float] = 90.0
+    max_records: Optional[int] = 100_000
+    compact_after_days: Optional[float] = 7.0
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        def number(name: str, default: Optional[float], cast=float):
+            value = os.getenv(name)
+            if value is None:
+                return default
+            return cast(value) if value.strip() not in ("", "0", "none") else None
+        return cls(
+            max_age_days=number("APM_RETENTION_DAYS", cls.max_age_days),
+            max_records=number("APM_RETENTION_MAX_RECORDS", cls.max_records, int),
+            compact_after_days=number("APM_RETENTION_COMPACT_DAYS", cls.compact_after_days),
+        )
+
+
+def encode_cursor(seq: int) -> str:
+    return base64.urlsafe_b64encode(str(seq).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor '{cursor}'") from None
+
+
+def _timestamp(value: Optional[datetime]) -> float:
+    if value is None:
+        return time.time()
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _compacted(record: DeploymentResponse) -> DeploymentResponse:
+    return record.model_copy(update={"tasks": []})
+
+
+class DeploymentStore:
+    """
+    Base class for deployment stores
+
+    Records of jobs running in this process are kept live (``track``) so
+    ``get`` returns their in-flight state without a round trip; everything
+    else comes from the backing store, which other workers share.
+    """
+
+    def __init__(self):
+        self._live: Dict[str, DeploymentResponse] = {}
+        self._live_lock = threading.Lock()
+
+    def track(self, record: DeploymentResponse) -> None:
+        with self._live_lock:
+            self._live[record.deployment_id] = record
+
+    def untrack(self, deployment_id: str) -> None:
+        with self._live_lock:
+            self._live.pop(deployment_id, None)
+
+    def get(self, deployment_id: str) -> Optional[DeploymentResponse]:
+        with self._live_lock:
+            record = self._live.get(deployment_id)
+        return record if record is not None else self._load(deployment_id)
+
+    def __contains__(self, deployment_id: str) -> bool:
+        return self.get(deployment_id) is not None
+
+    def latest(self, **filters: Any) -> Optional[DeploymentResponse]:
+        """Most recent record matching ``filters``"""
+        page = self.list(limit=1, **filters)
+        return page.items[0] if page.items else None
+
+    # Backend interface
+
+    def save(self, record: DeploymentResponse) -> None:
+        raise NotImplementedError
+
+    def list(
+        self,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        **filters: Any,
+    ) -> DeploymentPage:
+        raise NotImplementedError
+
+    def apply_retention(self, policy: RetentionPolicy) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def claim_key(self, key: str, fingerprint: str, deployment_id: str,
+                  expires_at: float) -> Optional[IdempotencyRecord]:
+        """
+        Point ``key`` at ``deployment_id`` unless an unexpired entry exists
+
+        Returns None when the key was claimed, else the existing entry.
+        Atomic across every worker sharing the store.
+        """
+        raise NotImplementedError
+
+    def replace_key(self, key: str, expected_deployment_id: str, fingerprint: str,
+                    deployment_id: str, expires_at: float) -> bool:
+        """Repoint ``key`` if it still points at ``expected_deployment_id`` (compare-and-swap)"""
+        raise NotImplementedError
+
+    def release_key(self, key: str, deployment_id: str) -> None:
+        """Drop ``key`` if it points at ``deployment_id``"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def _load(self, deployment_id: str) -> Optional[DeploymentResponse]:
+        raise NotImplementedError
+
+
+class MemoryStore(DeploymentStore):
+    """Process-local store (tests, single worker without persistence)"""
+
+    def __init__(self):
+        super().__init__()
+        self._records: Dict[str, Tuple[int, DeploymentResponse]] = {}
+        self._keys: Dict[str, Tuple[IdempotencyRecord, float]] = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def save(self, record: DeploymentResponse) -> None:
+        with self._lock:
+            seq = self._records.get(record.deployment_id, (None,))[0]
+            if seq is None:
+                self._seq += 1
+                seq = self._seq
+            self._records[record.deployment_id] = (seq, record)
+
+    def _load(self, deployment_id: str) -> Optional[DeploymentResponse]:
+        entry = self._records.get(deployment_id)
+        return entry[1] if entry else None
+
+    def list(self, limit=DEFAULT_PAGE_SIZE, cursor=None, created_after=None,
+             created_before=None, **filters) -> DeploymentPage:
+        before = decode_cursor(cursor) if cursor else None
+        for key, value in filters.items():
+            if value is not None and key not in FILTER_COLUMNS:
+                raise ValueError(f"Unknown filter '{key}'")
+        with self._lock:
+            entries = sorted(self._records.values(), key=lambda entry: entry[0], reverse=True)
+        matched = [
+            (seq, record) for seq, record in entries
+            if self._matches(record, created_after, created_before, filters)
+        ]
+        remaining = [entry for entry in matched if before is None or entry[0] < before]
+        page = remaining[:limit]
+        next_cursor = encode_cursor(page[-1][0]) if len(remaining) > limit else None
+        return DeploymentPage([record for _, record in page], next_cursor, len(matched))
+
+    @staticmethod
+    def _matches(record, created_after, created_before, filters) -> bool:
+        values = {
+            "solution_name": record.solution_name,
+            "solution_type": record.solution_type.value,
+            "operation": record.operation.value,
+            "status": record.status.value,
+            "host": record.target_host,
+        }
+        for key, value in filters.items():
+            if value is not None and values[key] != getattr(value, "value", value):
+                return False
+        created = _timestamp(record.created_at)
+        if created_after and created < _timestamp(created_after):
+            return False
+        if created_before and created >= _timestamp(created_before):
+            return False
+        return True
+
+    def apply_retention(self, policy: RetentionPolicy) -> Dict[str, int]:
+        now = time.time()
+        stats = {"compacted": 0, "deleted": 0}
+        with self._lock:
+            finished = sorted(
+                (entry for entry in self._records.values() if entry[1].status.value not in ACTIVE_STATUSES),
+                key=lambda entry: entry[0],
+            )
+            for seq, record in finished:
+                age_days = (now - _timestamp(record.created_at)) / 86400
+                if policy.max_age_days is not None and age_days > policy.max_age_days:
+                    del self._records[record.deployment_id]
+                    stats["deleted"] += 1
+                elif policy.compact_after_days is not None and age_days > policy.compact_after_days and record.tasks:
+                    self._records[record.deployment_id] = (seq, _compacted(record))
+                    stats["compacted"] += 1
+            if policy.max_records is not None and len(self._records) > policy.max_records:
+                excess = len(self._records) - policy.max_records
+                for seq, record in sorted(self._records.values(), key=lambda entry: entry[0]):
+                    if excess <= 0:
+                        break
+                    if record.status.value in ACTIVE_STATUSES:
+                        continue
+                    del self._records[record.deployment_id]
+                    stats["deleted"] += 1
+                    excess -= 1
+            expired = [key for key, (_, expires_at) in self._keys.items() if expires_at < now]
+            for key in expired:
+                del self._keys[key]
+            stats["expired_keys"] = len(expired)
+        return stats
+
+    def claim_key(self, key, fingerprint, deployment_id, expires_at) -> Optional[IdempotencyRecord]:
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and entry[1] >= time.time():
+                return entry[0]
+            self._keys[key] = (IdempotencyRecord(fingerprint, deployment_id), expires_at)
+            return None
+
+    def replace_key(self, key, expected_deployment_id, fingerprint, deployment_id, expires_at) -> bool:
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None or entry[0].deployment_id != expected_deployment_id:
+                return False
+            self._keys[key] = (IdempotencyRecord(fingerprint, deployment_id), expires_at)
+            return True
+
+    def release_key(self, key, deployment_id) -> None:
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and entry[0].deployment_id == deployment_id:
+                del self._keys[key]
+
+
+class SQLiteStore(DeploymentStore):
+    """
+    SQLite-backed store shared by every worker on the host
+
+    WAL mode lets uvicorn workers read while one writes. Listing walks the
+    ``seq`` primary key (newest first) through the filter indexes, so a page
+    costs the same with 100 or 100k rows.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS deployments (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            deployment_id TEXT NOT NULL UNIQUE,
+            solution_name TEXT NOT NULL,
+            solution_type TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            status TEXT NOT NULL,
+            host TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            compacted INTEGER NOT NULL DEFAULT 0,
+            record TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_deployments_solution ON deployments (solution_name, seq);
+        CREATE INDEX IF NOT EXISTS ix_deployments_status ON deployments (status, seq);
+        CREATE INDEX IF NOT EXISTS ix_deployments_host ON deployments (host, seq);
+        CREATE INDEX IF NOT EXISTS ix_deployments_created ON deployments (created_at);
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            deployment_id TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_idempotency_expires ON idempotency_keys (expires_at);
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, record: DeploymentResponse) -> None:
+        now = time.time()
+        row = (
+            record.deployment_id, record.solution_name, record.solution_type.value,
+            record.operation.value, record.status.value, record.target_host,
+            _timestamp(record.created_at), now, record.model_dump_json(),
+        )
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                """
+                INSERT INTO deployments (deployment_id, solution_name, solution_type, operation,
+                                         status, host, created_at, updated_at, record)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(deployment_id) DO UPDATE SET
+                    status = excluded.status, host = excluded.host,
+                    updated_at = excluded.updated_at, record = excluded.record
+                """,
+                row,
+            )
+            conn.commit()
+
+    def _load(self, deployment_id: str) -> Optional[DeploymentResponse]:
+        row = self._conn().execute(
+            "SELECT record FROM deployments WHERE deployment_id = ?", (deployment_id,)
+        ).fetchone()
+        return DeploymentResponse.model_validate_json(row[0]) if row else None
+
+    def list(self, limit=DEFAULT_PAGE_SIZE, cursor=None, created_after=None,
+             created_before=None, **filters) -> DeploymentPage:
+        where, params = [], []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key not in FILTER_COLUMNS:
+                raise ValueError(f"Unknown filter '{key}'")
+            where.append(f"{FILTER_COLUMNS[key]} = ?")
+            params.append(getattr(value, "value", value))
+        if created_after is not None:
+            where.append("created_at >= ?")
+            params.append(_timestamp(created_after))
+        if created_before is not None:
+            where.append("created_at < ?")
+            params.append(_timestamp(created_before))
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM deployments {clause}", params).fetchone()[0]
+        page_where = list(where)
+        page_params = list(params)
+        if cursor:
+            page_where.append("seq < ?")
+            page_params.append(decode_cursor(cursor))
+        page_clause = f"WHERE {' AND '.join(page_where)}" if page_where else ""
+        rows = conn.execute(
+            f"SELECT seq, record FROM deployments {page_clause} ORDER BY seq DESC LIMIT ?",
+            page_params + [limit + 1],
+        ).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+        items = [DeploymentResponse.model_validate_json(record) for _, record in rows[:limit]]
+        return DeploymentPage(items, next_cursor, total)
+
+    def apply_retention(self, policy: RetentionPolicy) -> Dict[str, int]:
+        now = time.time()
+        stats = {"compacted": 0, "deleted": 0}
+        active = ",".join("?" * len(ACTIVE_STATUSES))
+        with self._write_lock:
+            conn = self._conn()
+            if policy.max_age_days is not None:
+                cur = conn.execute(
+                    f"DELETE FROM deployments WHERE created_at < ? AND status NOT IN ({active})",
+                    (now - policy.max_age_days * 86400, *ACTIVE_STATUSES),
+                )
+                stats["deleted"] += cur.rowcount
+            if policy.max_records is not None:
+                cur = conn.execute(
+                    f"""
+                    DELETE FROM deployments WHERE status NOT IN ({active}) AND seq <= (
+                        SELECT seq FROM deployments ORDER BY seq DESC LIMIT 1 OFFSET ?
+                    )
+                    """,
+                    (*ACTIVE_STATUSES, policy.max_records),
+                )
+                stats["deleted"] += cur.rowcount
+            if policy.compact_after_days is not None:
+                rows = conn.execute(
+                    f"SELECT seq, record FROM deployments WHERE compacted = 0 AND created_at < ? "
+                    f"AND status NOT IN ({active})",
+                    (now - policy.compact_after_days * 86400, *ACTIVE_STATUSES),
+                ).fetchall()
+                for seq, raw in rows:
+                    record = _compacted(DeploymentResponse.model_validate_json(raw))
+                    conn.execute(
+                        "UPDATE deployments SET record = ?, compacted = 1 WHERE seq = ?",
+                        (record.model_dump_json(), seq),
+                    )
+                stats["compacted"] += len(rows)
+            cur = conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+            stats["expired_keys"] = cur.rowcount
+            conn.commit()
+        if any(stats.values()):
+            logger.info("Deployment retention: %s", stats)
+        return stats
+
+    def claim_key(self, key, fingerprint, deployment_id, expires_at) -> Optional[IdempotencyRecord]:
+        with self._write_lock:
+            conn = self._conn()
+            # One write transaction, so workers in other processes see claim-or-existing atomically
+            conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires_at < ?", (key, time.time()))
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, deployment_id, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, fingerprint, deployment_id, expires_at),
+            )
+            row = None if cur.rowcount else conn.execute(
+                "SELECT fingerprint, deployment_id FROM idempotency_keys WHERE key = ?", (key,)
+            ).fetchone()
+            conn.commit()
+        return IdempotencyRecord(*row) if row else None
+
+    def replace_key(self, key, expected_deployment_id, fingerprint, deployment_id, expires_at) -> bool:
+        with self._write_lock:
+            conn = self._conn()
+            cur = conn.execute(
+                "UPDATE idempotency_keys SET fingerprint = ?, deployment_id = ?, expires_at = ? "
+                "WHERE key = ? AND deployment_id = ?",
+                (fingerprint, deployment_id, expires_at, key, expected_deployment_id),
+            )
+            conn.commit()
+        return cur.rowcount == 1
+
+    def release_key(self, key, deployment_id) -> None:
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE key = ? AND deployment_id = ?", (key, deployment_id)
+            )
+            conn.commit()
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_store(url: Optional[str] = None) -> DeploymentStore:
+    """
+    Store for ``url``: ``memory://`` or ``sqlite:///path/to/file.db``
+
+    Defaults to ``APM_STORE_URL``, then ``sqlite:///apm_deployments.db``.
+    """
+    url = url or os.getenv("APM_STORE_URL", "sqlite:///apm_deployments.db")
+    if url.startswith("memory"):
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported deployment store '{url}'")
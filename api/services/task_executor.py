@@ -0,0 +1,874 @@
+"""
+Native task-file executor for F5 BIG-IP APM playbooks
+Runs the uri/set_fact/debug playbooks in-process, without forking a module per task
+"""
+import logging
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import yaml
+
+from ..models import TaskResult, TrackedObject
+from .addresses import AVAILABLE_PATH, AddressAllocator
+from .as3 import DECLARE_PATH, AS3Batcher, declaration_parts, parse_declaration
+from .certificates import CERT_PATH, CertificateItem, CertificateService
+from .device_info import DeviceInfoCache
+from .f5_client import AS3_INFO_PATH, ClientPool, F5Client, response_body
+from .gslb import GTMTopologyCache
+from .policy_apply import PolicyApplyCoordinator, apply_target
+from .resources import record_resource, track_object
+from .templating import TemplateError, VariableScope, templar, to_bool, wrap_unsafe
+from .transactions import (
+    COORDINATION_HEADER, DEFAULT_STAGING_CONCURRENCY, StagedCommand, Transaction, TransactionError,
+    commit_transaction_id, describe_commit_failure,
+)
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+
+# Task keywords that are not module names
+TASK_KEYWORDS = {
+    "name", "when", "register", "loop", "loop_control", "with_items", "vars",
+    "ignore_errors", "failed_when", "changed_when", "delegate_to", "tags",
+    "args", "no_log", "become", "run_once", "environment", "connection",
+    "rescue", "always", "until", "retries", "delay",
+}
+
+# ansible-playbook's uri module default
+URI_DEFAULT_TIMEOUT = 30
+
+
+class ExecutorError(Exception):
+    """Task file could not be executed (unsupported construct, bad YAML)"""
+
+
+class TaskFailed(Exception):
+    """A task failed and was not ignored - aborts the play like Ansible does"""
+
+    def __init__(self, task_name: str, message: str):
+        super().__init__(f"{task_name}: {message}")
+        self.task_name = task_name
+        self.message = message
+
+
+@dataclass
+class ExecutionResult:
+    """Outcome of a native playbook/task-file run"""
+    tasks: List[TaskResult] = field(default_factory=list)
+    created_resources: Dict[str, List[str]] = field(default_factory=dict)
+    deleted_resources: Dict[str, List[str]] = field(default_factory=dict)
+    tracked_objects: Dict[str, TrackedObject] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+    failed: bool = False
+    request_count: int = 0
+    duration: float = 0.0
+
+
+class _YAMLCache:
+    """Parsed task files keyed by path and mtime"""
+
+    def __init__(self):
+        self._entries: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: Path) -> Any:
+        key = str(path)
+        mtime = path.stat().st_mtime
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == mtime:
+                return entry[1]
+        with open(path) as handle:
+            data = yaml.safe_load(handle)
+        with self._lock:
+            self._entries[key] = (mtime, data)
+        return data
+
+
+yaml_cache = _YAMLCache()
+
+
+class TaskExecutor:
+    """
+    In-process runner for the playbooks in this repository
+
+    Supports the subset of Ansible the task files use: ``uri``, ``set_fact``,
+    ``debug``, ``include_tasks``/``import_tasks``, ``block``/``rescue``/
+    ``always``, ``assert``, ``fail``, ``pause`` and ``bigip_certificates``,
+    with ``when``, ``loop``/``loop_control``, ``register``, ``status_code``,
+    ``failed_when``, ``changed_when`` and ``ignore_errors``. The YAML stays
+    the source of truth; BIG-IP calls go through the pooled token client.
+    Extra vars, host vars and registered results are data: they are unsafe
+    and never templated, and nothing runs commands or touches files on the
+    API host.
+
+    ``uri`` calls carrying ``X-F5-REST-Coordination-Id`` are staged into their
+    transaction ``staging_concurrency`` at a time without waiting for each
+    response; they are flushed (and failures reported against their task)
+    before the next non-staged call, at the end of each block and at the end
+    of the run, and put back in staging order right before the commit.
+    ``staging_concurrency=1`` restores strictly sequential calls.
+
+    With an ``as3`` batcher, plain AS3 deploy POSTs are merged with other
+    deployments' declarations for the same device; ``blocking`` (if given)
+    wraps the wait for the AS3 result, letting the engine hand the device to
+    the next job meanwhile, and ``exclusive`` (given with ``blocking``) takes
+    the device back for the AS3 run itself; ``as3_token`` is the name the declaration was
+    announced under (``AS3Batcher.expect``). With a ``device_info`` cache, the "verify
+    connectivity" GETs of the AS3 info endpoint are answered from it; with a
+    ``gtm`` cache, GTM topology reads and creates of GTM objects that already
+    exist are answered from it.
+    ``anonymous_transport`` carries the calls made without BIG-IP
+    credentials (address manager and the like); with an ``addresses``
+    allocator, address manager lookups are answered from its per-scope pool
+    and addresses this run took but never checked out are returned at the
+    end. ``bigip_certificates`` tasks install through ``certificates``
+    (pre-generated keys); without one, keys are generated inline. With an
+    ``applies`` coordinator, access policy applies (``generationAction:
+    increment`` PATCHes) are applied together with the device's other
+    pending applies, waiting through ``blocking`` and ``exclusive`` like AS3
+    results.
+    """
+
+    def __init__(
+        self,
+        clients: ClientPool,
+        project_dir: Path = PROJECT_DIR,
+        event_handler: Optional[Callable[[Dict[str, Any]], None]] = None,
+        honor_pauses: bool = False,
+        staging_concurrency: int = DEFAULT_STAGING_CONCURRENCY,
+        as3: Optional[AS3Batcher] = None,
+        blocking: Optional[Callable[[Callable[[], Any]], Any]] = None,
+        exclusive: Optional[Callable[[], ContextManager[None]]] = None,
+        device_info: Optional[DeviceInfoCache] = None,
+        anonymous_transport: Optional[httpx.BaseTransport] = None,
+        as3_token: Optional[str] = None,
+        gtm: Optional[GTMTopologyCache] = None,
+        addresses: Optional[AddressAllocator] = None,
+        certificates: Optional[CertificateService] = None,
+        applies: Optional[PolicyApplyCoordinator] = None,
+    ):
+        self.clients = clients
+        self.project_dir = Path(project_dir)
+        self.event_handler = event_handler
+        self.honor_pauses = honor_pauses
+        self.staging_concurrency = staging_concurrency
+        self.as3 = as3
+        self.blocking = blocking
+        self.exclusive = exclusive
+        self.device_info = device_info
+        self.anonymous_transport = anonymous_transport
+        self.as3_token = as3_token
+        self.gtm = gtm
+        self.addresses = addresses
+        self.certificates = certificates or CertificateService(pool_size=0)
+        self.applies = applies
+        self._taken_addresses: List[Tuple[str, str, str]] = []
+        self._anonymous: Dict[bool, httpx.Client] = {}
+        self._transactions: Dict[Tuple[int, str], Transaction] = {}
+        self.result = ExecutionResult()
+
+    # Entry points
+
+    def run_playbook(
+        self,
+        playbook: str,
+        extravars: Optional[Dict[str, Any]] = None,
+        host_vars: Optional[Dict[str, Any]] = None,
+        result: Optional[ExecutionResult] = None,
+    ) -> ExecutionResult:
+        """Run every play of ``playbook`` against a single target host"""
+        path = self._resolve(playbook, self.project_dir)
+        extravars, host_vars = wrap_unsafe(extravars or {}), wrap_unsafe(host_vars or {})
+        plays = yaml_cache.load(path)
+        if not isinstance(plays, list):
+            raise ExecutorError(f"{playbook} is not a playbook")
+
+        self.result = result or ExecutionResult()
+        started = time.monotonic()
+        try:
+            for play in plays:
+                if "import_playbook" in play:
+                    raise ExecutorError("import_playbook is not supported")
+                scope = self._play_scope(play, path.parent, extravars, host_vars)
+                for section in ("pre_tasks", "tasks", "post_tasks"):
+                    self._run_block(play.get(section) or [], scope, path.parent)
+                self._flush_staged()
+        except TaskFailed as exc:
+            self._fail(str(exc))
+        except (ExecutorError, TemplateError) as exc:
+            self._fail(str(exc))
+        finally:
+            self.result.duration = time.monotonic() - started
+            self.close()
+        return self.result
+
+    def run_tasks(
+        self,
+        task_file: str,
+        variables: Dict[str, Any],
+        result: Optional[ExecutionResult] = None,
+    ) -> ExecutionResult:
+        """Run a single task file (e.g. ``tasks/access_policy.yml``) with ``variables``"""
+        path = self._resolve(task_file, self.project_dir)
+        self.result = result or ExecutionResult()
+        scope = VariableScope(templar, [{}, {}, dict(variables)])
+        started = time.monotonic()
+        try:
+            self._run_block(yaml_cache.load(path) or [], scope, path.parent)
+            self._flush_staged()
+        except (TaskFailed, ExecutorError, TemplateError) as exc:
+            self._fail(str(exc))
+        finally:
+            self.result.duration = time.monotonic() - started
+            self.close()
+        return self.result
+
+    def close(self) -> None:
+        for url, scope, address in self._taken_addresses:
+            self.addresses.release(url, scope, [address])
+        self._taken_addresses.clear()
+        for transaction in self._transactions.values():
+            transaction.close()
+        self._transactions.clear()
+        for client in self._anonymous.values():
+            client.close()
+        self._anonymous.clear()
+
+    # Scope handling
+
+    def _play_scope(
+        self, play: Dict[str, Any], base_dir: Path,
+        extravars: Dict[str, Any], host_vars: Dict[str, Any],
+    ) -> VariableScope:
+        magic = {
+            "playbook_dir": str(base_dir),
+            "inventory_hostname": host_vars.get("ansible_host", "localhost"),
+            "ansible_playbook_python": sys.executable,
+            "omit": "__omit_place_holder__",
+        }
+        facts: Dict[str, Any] = {}
+        files_vars: Dict[str, Any] = {}
+        scope = VariableScope(templar, [
+            dict(extravars), facts, files_vars, dict(play.get("vars") or {}),
+            dict(host_vars), magic,
+        ], facts=facts)
+        for vars_file in play.get("vars_files") or []:
+            name = templar.template(vars_file, scope)
+            files_vars.update(yaml_cache.load(self._resolve(name, base_dir)) or {})
+        return scope
+
+    def _resolve(self, name: str, base_dir: Path) -> Path:
+        for candidate in (base_dir / name, self.project_dir / name, self.project_dir / "tasks" / name):
+            if candidate.is_file():
+                return candidate
+        raise ExecutorError(f"Could not find task file '{name}'")
+
+    # Task execution
+
+    def _run_block(self, tasks: List[Dict[str, Any]], scope: VariableScope, base_dir: Path) -> None:
+        for task in tasks:
+            self._run_task(task, scope, base_dir)
+
+    def _run_task(self, task: Dict[str, Any], scope: VariableScope, base_dir: Path) -> None:
+        if task.get("vars"):
+            scope = scope.child(dict(task["vars"]))
+
+        if "block" in task:
+            self._run_block_task(task, scope, base_dir)
+            return
+
+        module = self._module_name(task)
+        args = task[module]
+        name = self._task_name(task.get("name") or module, scope)
+        try:
+            items = self._loop_items(task, scope)
+        except (TemplateError, ExecutorError) as exc:
+            # Like Ansible, a bad loop only matters if the task would run
+            if self._when_or_error(task, scope) is False:
+                self._record(name, "skipped")
+                return
+            self._finish(task, {"failed": True, "msg": str(exc)}, scope, name, overrides_done=True)
+            return
+
+        if items is None:
+            run = self._when_or_error(task, scope)
+            if run is False:
+                self._record(name, "skipped")
+                return
+            if isinstance(run, str):
+                self._finish(task, {"failed": True, "msg": run}, scope, name, overrides_done=True)
+                return
+            result = self._execute(module, args, task, scope, base_dir, name)
+            self._finish(task, result, scope, name)
+            return
+
+        loop_control = task.get("loop_control") or {}
+        loop_var = loop_control.get("loop_var", "item")
+        index_var = loop_control.get("index_var")
+        results = []
+        for index, item in enumerate(items):
+            item_vars = {loop_var: item, "ansible_loop_var": loop_var}
+            if index_var:
+                item_vars[index_var] = index
+            item_scope = scope.child(item_vars)
+            run = self._when_or_error(task, item_scope)
+            if run is False:
+                results.append({"skipped": True, "changed": False, loop_var: item})
+                continue
+            if isinstance(run, str):
+                results.append({"failed": True, "changed": False, "msg": run, loop_var: item})
+                continue
+            item_result = self._execute(module, args, task, item_scope, base_dir, name)
+            if item_result is None:
+                continue
+            item_result[loop_var] = item
+            item_result["ansible_loop_var"] = loop_var
+            self._evaluate_overrides(task, item_result, item_scope)
+            results.append(item_result)
+
+        if module in ("include_tasks", "import_tasks"):
+            return
+        aggregate = {
+            "results": results,
+            "changed": any(r.get("changed") for r in results),
+            "msg": "All items completed",
+        }
+        if results and all(r.get("skipped") for r in results):
+            aggregate["skipped"] = True
+        if any(r.get("failed") for r in results):
+            aggregate["failed"] = True
+            aggregate["msg"] = "One or more items failed"
+        self._finish(task, aggregate, scope, name, overrides_done=True)
+
+    def _run_block_task(self, task: Dict[str, Any], scope: VariableScope, base_dir: Path) -> None:
+        if not self._when(task, scope):
+            self._record(self._task_name(task.get("name", "block"), scope), "skipped")
+            return
+        try:
+            self._run_block(task["block"] or [], scope, base_dir)
+            self._flush_staged()
+        except TaskFailed:
+            if not task.get("rescue"):
+                raise
+            self._run_block(task["rescue"], scope, base_dir)
+        finally:
+            if task.get("always"):
+                self._run_block(task["always"], scope, base_dir)
+
+    def _module_name(self, task: Dict[str, Any]) -> str:
+        for key in task:
+            if key not in TASK_KEYWORDS:
+                return key
+        raise ExecutorError(f"Task '{task.get('name', '?')}' has no module")
+
+    def _loop_items(self, task: Dict[str, Any], scope: VariableScope) -> Optional[List[Any]]:
+        loop = task.get("loop", task.get("with_items"))
+        if loop is None:
+            return None
+        items = templar.template(loop, scope)
+        if isinstance(items, str) or not isinstance(items, list):
+            raise ExecutorError(
+                f"Invalid data passed to 'loop', it requires a list, got this instead: {items!r}"
+            )
+        return items
+
+    def _when(self, task: Dict[str, Any], scope: VariableScope) -> bool:
+        if "when" not in task:
+            return True
+        return templar.conditional(task["when"], scope)
+
+    def _when_or_error(self, task: Dict[str, Any], scope: VariableScope):
+        """``when`` result, or the error message if the conditional cannot be evaluated"""
+        try:
+            return self._when(task, scope)
+        except TemplateError as exc:
+            return f"The conditional check '{task['when']}' failed: {exc}"
+
+    @staticmethod
+    def _task_name(name: Any, scope: VariableScope) -> str:
+        try:
+            return str(templar.template(name, scope))
+        except TemplateError:
+            return str(name)
+
+    def _execute(
+        self, module: str, args: Any, task: Dict[str, Any],
+        scope: VariableScope, base_dir: Path, name: str,
+    ) -> Optional[Dict[str, Any]]:
+        """Run one module invocation; returns its result dict (None for includes)"""
+        short = module.rsplit(".", 1)[-1]
+        if short in ("include_tasks", "import_tasks"):
+            file_name = args.get("file") if isinstance(args, dict) else args
+            path = self._resolve(templar.template(file_name, scope), base_dir)
+            self._run_block(yaml_cache.load(path) or [], scope, path.parent)
+            return None
+
+        handler = getattr(self, f"_module_{short}", None)
+        if handler is None:
+            raise ExecutorError(f"Module '{module}' is not supported by the native executor")
+
+        self._emit({"event": "task_start", "task": name, "module": short})
+        started = time.monotonic()
+        try:
+            result = handler(args, task, scope)
+        except TemplateError as exc:
+            result = {"failed": True, "msg": str(exc)}
+        result["duration"] = time.monotonic() - started
+        return result
+
+    def _evaluate_overrides(self, task: Dict[str, Any], result: Dict[str, Any], scope: VariableScope) -> None:
+        """Apply failed_when/changed_when the way Ansible does (against the registered var)"""
+        if "failed_when" not in task and "changed_when" not in task:
+            return
+        check_scope = scope.child({task["register"]: wrap_unsafe(result)}) if task.get("register") else scope
+        if "changed_when" in task:
+            result["changed"] = templar.conditional(task["changed_when"], check_scope)
+        if "failed_when" in task:
+            failed = templar.conditional(task["failed_when"], check_scope)
+            result["failed_when_result"] = failed
+            result["failed"] = failed
+
+    def _finish(
+        self, task: Dict[str, Any], result: Optional[Dict[str, Any]],
+        scope: VariableScope, name: str, overrides_done: bool = False,
+    ) -> None:
+        if result is None:
+            return
+        if not overrides_done:
+            self._evaluate_overrides(task, result, scope)
+
+        if task.get("register"):
+            # Module results echo device and request data; like Ansible, never template them
+            scope.facts[task["register"]] = wrap_unsafe(result)
+
+        if result.get("skipped"):
+            status = "skipped"
+        elif result.get("failed"):
+            ignore = to_bool(templar.template(task.get("ignore_errors", False), scope))
+            status = "ignored" if ignore else "failed"
+        else:
+            status = "changed" if result.get("changed") else "ok"
+
+        details = {
+            "duration": round(result.get("duration", 0.0), 3),
+            "module": self._module_name(task).rsplit(".", 1)[-1],
+        }
+        if "status" in result:
+            details["status_code"] = result["status"]
+        self._record(name, status, result.get("msg"), details)
+
+        if status == "failed":
+            raise TaskFailed(name, str(result.get("msg", "Task failed")))
+
+    def _record(self, name: str, status: str, message: Optional[str] = None,
+                details: Optional[Dict[str, Any]] = None) -> None:
+        self.result.tasks.append(TaskResult(
+            task_name=name, status=status, message=message, details=details
+        ))
+        self._emit({"event": "task_end", "task": name, "status": status, **(details or {})})
+
+    def _fail(self, message: str) -> None:
+        self.result.failed = True
+        self.result.errors.append(message)
+
+    def _emit(self, event: Dict[str, Any]) -> None:
+        if self.event_handler is not None:
+            try:
+                self.event_handler(event)
+            except Exception:
+                logger.exception("Executor event handler failed")
+
+    # Modules
+
+    def _module_uri(self, args: Dict[str, Any], task: Dict[str, Any], scope: VariableScope) -> Dict[str, Any]:
+        args = _strip_omitted(templar.template(args, scope))
+        url = args["url"]
+        method = str(args.get("method", "GET")).upper()
+        status_codes = args.get("status_code", [200])
+        if not isinstance(status_codes, list):
+            status_codes = [status_codes]
+        status_codes = [int(code) for code in status_codes]
+
+        body = args.get("body")
+        body_format = args.get("body_format", "raw")
+        headers = {str(k): str(v) for k, v in (args.get("headers") or {}).items()}
+        kwargs: Dict[str, Any] = {"headers": headers}
+        if body is not None:
+            if body_format == "json" and not isinstance(body, str):
+                kwargs["json"] = body
+            else:
+                kwargs["content"] = body if isinstance(body, str) else str(body)
+                if body_format == "json":
+                    headers.setdefault("Content-Type", "application/json")
+        timeout = float(args.get("timeout", URI_DEFAULT_TIMEOUT))
+        validate_certs = to_bool(args.get("validate_certs", True))
+        user = args.get("user", args.get("url_username"))
+        password = args.get("password", args.get("url_password"))
+
+        self.result.request_count += 1
+        if user and method != "GET" and self._stageable(task, headers):
+            client = self.clients.for_url(url, user, password or "", validate_certs)
+            return self._stage(client, headers, method, url, status_codes, timeout, kwargs, task, scope)
+        self._flush_staged()
+
+        if user and self.device_info is not None and method == "GET" and F5Client._path(url) == AS3_INFO_PATH:
+            client = self.clients.for_url(url, user, password or "", validate_certs)
+            cached = self._cached_as3_info(client, url, status_codes)
+            if cached is not None:
+                return cached
+
+        gtm = bool(user and self.gtm is not None and GTMTopologyCache.handles(F5Client._path(url)))
+        if gtm:
+            client = self.clients.for_url(url, user, password or "", validate_certs)
+            cached = self._cached_gtm(client, method, url, kwargs.get("json"), status_codes)
+            if cached is not None:
+                return cached
+
+        if user and self.as3 is not None and method == "POST" and F5Client._path(url) == DECLARE_PATH:
+            declaration = parse_declaration(kwargs)
+            if declaration_parts(declaration) is not None:
+                client = self.clients.for_url(url, user, password or "", validate_certs)
+                return self._as3_declare(client, url, declaration, status_codes)
+
+        profile = apply_target(method, F5Client._path(url), kwargs.get("json"))
+        if user and self.applies is not None and profile is not None:
+            client = self.clients.for_url(url, user, password or "", validate_certs)
+            return self._apply_policy(client, url, profile, status_codes)
+
+        allocating = bool(not user and self.addresses is not None and AddressAllocator.handles(method, url))
+        if allocating and method == "GET":
+            allocated = self._allocated_address(url, validate_certs, timeout)
+            if allocated is not None:
+                return allocated
+
+        trans_id = commit_transaction_id(method, url, kwargs.get("json")) if user else None
+        if trans_id:
+            client = self.clients.for_url(url, user, password or "", validate_certs)
+            staged = self._transactions.get((id(client), trans_id))
+            try:
+                if staged is not None:
+                    staged.restore_order()
+            except TransactionError as exc:
+                self._transactions.pop((id(client), trans_id)).close()
+                return {
+                    "failed": True, "status": exc.status_code or -1, "url": url, "changed": False,
+                    "msg": f"Not committed: {exc}",
+                }
+
+        started = time.monotonic()
+        try:
+            if user:
+                client = self.clients.for_url(url, user, password or "", validate_certs)
+                response = client.request(method, url, timeout=timeout, **kwargs)
+            else:
+                response = self._anonymous_client(validate_certs).request(
+                    method, url, timeout=timeout, **kwargs
+                )
+        except Exception as exc:  # connection/TLS/timeout/auth errors
+            if gtm:
+                self.gtm.record(client, method, F5Client._path(url), kwargs.get("json"), None)
+            if allocating:
+                self.addresses.checked_out(url, kwargs.get("json"), None, None)
+            return {
+                "failed": True, "status": -1, "url": url, "changed": False,
+                "msg": f"Status code was -1 and not {status_codes}: Request failed: {exc}",
+            }
+        elapsed = time.monotonic() - started
+        if gtm:
+            self.gtm.record(client, method, F5Client._path(url), kwargs.get("json"), response.status_code)
+
+        payload = response_body(response)
+        if allocating:
+            self.addresses.checked_out(url, kwargs.get("json"), response.status_code, payload)
+        result: Dict[str, Any] = {
+            "status": response.status_code,
+            "url": url,
+            "changed": False,
+            "elapsed": round(elapsed, 3),
+            "method": method,
+        }
+        if payload is not None:
+            result["json"] = payload
+        else:
+            result["content"] = response.text
+
+        if response.status_code in status_codes:
+            result["msg"] = f"OK ({len(response.content)} bytes)"
+            target = self.result.deleted_resources if method == "DELETE" else self.result.created_resources
+            record_resource(target, method, url, response.status_code,
+                            kwargs.get("json"), payload)
+            track_object(self.result.tracked_objects, method, url, response.status_code,
+                         kwargs.get("json"), payload)
+        else:
+            result["failed"] = True
+            result["msg"] = (
+                f"Status code was {response.status_code} and not {status_codes}: "
+                f"{response.text[:500]}"
+            )
+
+        if trans_id:
+            staged = self._transactions.pop((id(client), trans_id), None)
+            if response.status_code != 200:
+                message = payload.get("message", response.text) if isinstance(payload, dict) else response.text
+                result["command_errors"] = describe_commit_failure(
+                    client, trans_id, message, staged.staged if staged else None
+                )
+                culprits = [
+                    f"{err['method']} {err['name'] or err['uri']}" for err in result["command_errors"]
+                    if not err["error"].startswith("not applied")
+                ]
+                if culprits:
+                    result["msg"] += f" (failing commands: {', '.join(culprits)})"
+            if staged:
+                staged.close()
+        return result
+
+    def _cached_as3_info(self, client, url: str, status_codes: List[int]) -> Optional[Dict[str, Any]]:
+        """AS3 info from the device info cache; None sends the request to the device"""
+        try:
+            as3_info = self.device_info.get(client).get("as3Info")
+        except Exception:  # let the live request report the failure
+            return None
+        if as3_info is None or 200 not in status_codes:
+            return None
+        return {
+            "status": 200,
+            "url": url,
+            "changed": False,
+            "elapsed": 0.0,
+            "method": "GET",
+            "json": as3_info,
+            "msg": "OK (cached)",
+        }
+
+    def _cached_gtm(self, client, method: str, url: str, body: Any,
+                    status_codes: List[int]) -> Optional[Dict[str, Any]]:
+        """GTM call settled by the topology cache; None sends the request to the device"""
+        try:
+            answer = self.gtm.answer(client, method, F5Client._path(url), body, status_codes)
+        except Exception:  # let the live request report the failure
+            return None
+        if answer is None:
+            return None
+        status_code, payload = answer
+        return {
+            "status": status_code,
+            "url": url,
+            "changed": False,
+            "elapsed": 0.0,
+            "method": method,
+            "json": payload,
+            "msg": "OK (cached)",
+        }
+
+    def _allocated_address(self, url: str, validate_certs: bool, timeout: float) -> Optional[Dict[str, Any]]:
+        """Address manager lookup answered by the allocator; None sends the request to the manager"""
+        try:
+            answer = self.addresses.answer(self._anonymous_client(validate_certs), "GET", url, None, timeout)
+        except httpx.HTTPError:  # let the live request report the failure
+            return None
+        if answer is None:
+            return None
+        status_code, payload = answer
+        if status_code == 200 and urlsplit(url).path.rstrip("/") == AVAILABLE_PATH:
+            scope = (parse_qs(urlsplit(url).query).get("scope") or [""])[-1]
+            self._taken_addresses.append((url, scope, payload["address"]))
+        return {
+            "status": status_code,
+            "url": url,
+            "changed": False,
+            "elapsed": 0.0,
+            "method": "GET",
+            "json": payload,
+            "msg": "OK (address pool)",
+        }
+
+    def _as3_declare(self, client, url: str, declaration: Dict[str, Any],
+                     status_codes: List[int]) -> Dict[str, Any]:
+        """Deploy through the AS3 batcher and report this declaration's tenants"""
+        started = time.monotonic()
+        future = self.as3.submit(client, declaration, token=self.as3_token, exclusive=self.exclusive)
+        status_code, payload = self.blocking(future.result) if self.blocking else future.result()
+        result: Dict[str, Any] = {
+            "status": status_code,
+            "url": url,
+            "changed": False,
+            "elapsed": round(time.monotonic() - started, 3),
+            "method": "POST",
+        }
+        if payload is not None:
+            result["json"] = payload
+        if status_code in status_codes:
+            result["msg"] = "OK (AS3 task)"
+            record_resource(self.result.created_resources, "POST", url, status_code, declaration, payload)
+        else:
+            result["failed"] = True
+            result["msg"] = f"Status code was {status_code} and not {status_codes}: {str(payload)[:500]}"
+        return result
+
+    def _apply_policy(self, client, url: str, profile: str, status_codes: List[int]) -> Dict[str, Any]:
+        """Apply an access profile's policy through the coordinator, with the device's other pending applies"""
+        started = time.monotonic()
+        future = self.applies.submit(client, profile, exclusive=self.exclusive)
+        status_code, payload = self.blocking(future.result) if self.blocking else future.result()
+        result: Dict[str, Any] = {
+            "status": status_code,
+            "url": url,
+            "changed": False,
+            "elapsed": round(time.monotonic() - started, 3),
+            "method": "PATCH",
+            "json": payload,
+        }
+        if status_code in status_codes:
+            result["msg"] = "OK (coalesced policy apply)"
+        else:
+            result["failed"] = True
+            result["msg"] = f"Status code was {status_code} and not {status_codes}: {str(payload)[:500]}"
+        return result
+
+    # Transaction staging
+
+    def _stageable(self, task: Dict[str, Any], headers: Dict[str, str]) -> bool:
+        """Staging calls whose response nothing in the task file looks at"""
+        if self.staging_concurrency <= 1:
+            return False
+        if not any(key.lower() == COORDINATION_HEADER.lower() for key in headers):
+            return False
+        return not any(key in task for key in ("register", "failed_when", "changed_when", "until"))
+
+    def _stage(
+        self, client, headers: Dict[str, str], method: str, url: str, status_codes: List[int],
+        timeout: float, kwargs: Dict[str, Any], task: Dict[str, Any], scope: VariableScope,
+    ) -> Dict[str, Any]:
+        trans_id = next(v for k, v in headers.items() if k.lower() == COORDINATION_HEADER.lower())
+        key = (id(client), trans_id)
+        transaction = self._transactions.get(key)
+        if transaction is None:
+            transaction = Transaction(client, trans_id, self.staging_concurrency)
+            self._transactions[key] = transaction
+        ignore = to_bool(templar.template(task.get("ignore_errors", False), scope))
+        transaction.stage(
+            method, url, json=kwargs.get("json"), content=kwargs.get("content"),
+            expected_status=status_codes, timeout=timeout,
+            tag=(self._task_name(task.get("name") or "uri", scope), ignore),
+        )
+        return {
+            "changed": True, "url": url, "method": method,
+            "msg": f"Staged in transaction {trans_id}",
+        }
+
+    def _flush_staged(self) -> None:
+        """Wait for staged calls and report failures against the task that staged them"""
+        failures: List[StagedCommand] = []
+        for transaction in list(self._transactions.values()):
+            transaction.flush()
+            for command in transaction.staged:
+                if command.extra.get("reported"):
+                    continue
+                command.extra["reported"] = True
+                if command.ok:
+                    target = self.result.deleted_resources if command.method == "DELETE" else self.result.created_resources
+                    record_resource(target, command.method, command.path, command.status_code,
+                                    command.body if isinstance(command.body, dict) else None,
+                                    command.response)
+                    track_object(self.result.tracked_objects, command.method, command.path,
+                                 command.status_code, command.body, command.response)
+                else:
+                    failures.append(command)
+        for command in failures:
+            name, ignore = command.tag
+            self._record(name, "ignored" if ignore else "failed", command.error,
+                         {"status_code": command.status_code if command.status_code is not None else -1})
+            if not ignore:
+                raise TaskFailed(name, command.error or "Staging call failed")
+
+    def _anonymous_client(self, validate_certs: bool) -> httpx.Client:
+        """Keep-alive client for calls without BIG-IP credentials (address manager)"""
+        client = self._anonymous.get(validate_certs)
+        if client is None:
+            client = httpx.Client(verify=validate_certs, transport=self.anonymous_transport)
+            self._anonymous[validate_certs] = client
+        return client
+
+    def _module_set_fact(self, args: Dict[str, Any], task: Dict[str, Any], scope: VariableScope) -> Dict[str, Any]:
+        facts = {k: templar.template(v, scope) for k, v in args.items() if k != "cacheable"}
+        scope.facts.update(facts)
+        return {"changed": False, "ansible_facts": facts}
+
+    def _module_debug(self, args: Dict[str, Any], task: Dict[str, Any], scope: VariableScope) -> Dict[str, Any]:
+        args = args or {}
+        if "var" in args:
+            name = args["var"]
+            try:
+                value = templar.evaluate(name, scope)
+            except TemplateError:
+                value = "VARIABLE IS NOT DEFINED!"
+            return {"changed": False, "msg": str(value), name: value}
+        return {"changed": False, "msg": str(templar.template(args.get("msg", "Hello world!"), scope))}
+
+    def _module_pause(self, args: Dict[str, Any], task: Dict[str, Any], scope: VariableScope) -> Dict[str, Any]:
+        args = templar.template(args or {}, scope)
+        seconds = float(args.get("seconds", 0)) + 60 * float(args.get("minutes", 0))
+        if self.honor_pauses and seconds:
+            time.sleep(seconds)
+        return {"changed": False, "msg": f"Paused for {seconds if self.honor_pauses else 0}s"}
+
+    def _module_assert(self, args: Dict[str, Any], task: Dict[str, Any], scope: VariableScope) -> Dict[str, Any]:
+        that = args.get("that", [])
+        for condition in that if isinstance(that, list) else [that]:
+            if not templar.conditional(condition, scope):
+                message = args.get("fail_msg", args.get("msg", f"Assertion failed: {condition}"))
+                return {"failed": True, "changed": False, "msg": str(templar.template(message, scope))}
+        message = args.get("success_msg", "All assertions passed")
+        return {"changed": False, "msg": str(templar.template(message, scope))}
+
+    def _module_fail(self, args: Dict[str, Any], task: Dict[str, Any], scope: VariableScope) -> Dict[str, Any]:
+        message = (args or {}).get("msg", "Failed as requested from task")
+        return {"failed": True, "changed": False, "msg": str(templar.template(message, scope))}
+
+    def _module_bigip_certificates(self, args: Dict[str, Any], task: Dict[str, Any],
+                                   scope: VariableScope) -> Dict[str, Any]:
+        args = templar.template(args, scope)
+        self._flush_staged()
+        try:
+            items = [CertificateItem.from_args(entry) for entry in args.get("certificates") or []]
+        except (TypeError, ValueError) as exc:
+            return {"failed": True, "changed": False, "msg": str(exc)}
+        client = self.clients.for_url(
+            args["url"], args["user"], args.get("password") or "", to_bool(args.get("validate_certs", True))
+        )
+        self.result.request_count += 1
+        try:
+            results = self.certificates.install(
+                client, items, partition=args.get("partition", "Common"), timeout=float(args.get("timeout", 60))
+            )
+        except Exception as exc:  # F5Error, connection/TLS/timeout errors
+            return {"failed": True, "changed": False, "status": getattr(exc, "status_code", None) or -1,
+                    "msg": f"Installing certificates failed: {exc}"}
+        installed = [name for name, state in results.items() if state == "installed"]
+        for name in installed:
+            record_resource(self.result.created_resources, "POST", CERT_PATH, 200,
+                            {"name": name, "partition": args.get("partition", "Common")}, None)
+        return {
+            "changed": bool(installed),
+            "status": 200,
+            "certificates": results,
+            "msg": f"{len(installed)} installed, {len(results) - len(installed)} already on the device",
+        }
+
+
+def _strip_omitted(value: Any) -> Any:
+    """Drop arguments templated to ``omit``"""
+    if isinstance(value, dict):
+        return {k: _strip_omitted(v) for k, v in value.items() if v != "__omit_place_holder__"}
+    if isinstance(value, list):
+        return [_strip_omitted(v) for v in value if v != "__omit_place_holder__"]
+    return value
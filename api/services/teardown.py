@@ -0,0 +1,294 @@
+"""
+Dependency-graph teardown for F5 BIG-IP APM solutions
+Deletes the objects a delete_apm_* playbook removes, level by level and concurrently
+"""
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import httpx
+
+from ..models import TaskResult
+from .as3 import DECLARE_PATH
+from .f5_client import ClientPool, F5Error, response_body
+from .planner import IDENTITY_FIELDS, Change, Plan, Planner, split_object_path
+from .resources import is_secret, record_resource
+from .task_executor import PROJECT_DIR, ExecutionResult
+
+logger = logging.getLogger(__name__)
+
+# Deletes in flight per level
+DEFAULT_TEARDOWN_CONCURRENCY = 8
+
+# Status codes that mean the object is gone
+DELETED_STATUS = (200, 202, 204, 404)
+
+# Fields that refer to one kind of object (collection path prefixes); a name
+# in any other field may refer to an object of any kind
+REFERENCE_FIELDS = {
+    "accessPolicy": ("/mgmt/tm/apm/policy/access-policy",),
+    "profileAccess": ("/mgmt/tm/apm/profile/access",),
+    "items": ("/mgmt/tm/apm/policy/policy-item",),
+    "startItem": ("/mgmt/tm/apm/policy/policy-item",),
+    "defaultEnding": ("/mgmt/tm/apm/policy/policy-item",),
+    "nextItem": ("/mgmt/tm/apm/policy/policy-item",),
+    "agents": ("/mgmt/tm/apm/policy/agent/",),
+    "customizationGroup": ("/mgmt/tm/apm/policy/customization-group",),
+}
+
+# Fields naming the object's owner: the owner refers to it and goes first
+OWNER_FIELDS = {
+    "/mgmt/tm/apm/policy/policy-item": {"accessPolicy"},
+}
+
+# Keys of AS3 pointers ({"bigip": "/Common/x"}); the reference belongs to the enclosing field
+_AS3_POINTERS = ("bigip", "use")
+
+_LINK_PATH = re.compile(r"(/mgmt/(?:tm|shared)/[^?\s\"']+)")
+
+
+@dataclass
+class TeardownNode:
+    """One object to delete and the objects that must be deleted before it"""
+    change: Change
+    order: int
+    after: Set[int] = field(default_factory=set)
+
+    @property
+    def key(self) -> Tuple[int, str]:
+        return id(self.change.client), self.change.path
+
+
+class TeardownGraph:
+    """
+    Objects to delete with "referenced-by" edges
+
+    An object can only be deleted once nothing references it any more, so
+    every object the current config of X refers to (by fullPath, name or
+    REST link) is deleted after X. Fields in ``REFERENCE_FIELDS`` only
+    match objects of their kind, owner fields and secrets are not
+    references, and names in other fields match objects of any kind. Levels are the topological layers of that
+    graph; everything in one level is independent and deleted concurrently.
+    Writes that are not deletes act as barriers and keep their playbook
+    position.
+    """
+
+    def __init__(self, plan: Plan):
+        self.plan = plan
+        self.nodes: List[TeardownNode] = []
+        self.barriers: List[Tuple[int, Change]] = []
+        for order, change in enumerate(plan.pending):
+            if change.action == "delete":
+                self.nodes.append(TeardownNode(change, order))
+            else:
+                self.barriers.append((order, change))
+        self._link()
+
+    @property
+    def skipped(self) -> List[Change]:
+        """Objects already gone - found absent by the collection reads"""
+        return [change for change in self.plan.changes if change.action == "noop"]
+
+    def _link(self) -> None:
+        by_key = {node.key: node for node in self.nodes}
+        by_name: Dict[Tuple[int, str], List[TeardownNode]] = {}
+        for node in self.nodes:
+            if node.change.path.startswith(DECLARE_PATH):
+                continue  # an AS3 tenant is not referred to by name
+            for alias in _aliases(node.change.name):
+                by_name.setdefault((id(node.change.client), alias), []).append(node)
+
+        for node in self.nodes:
+            client_id = id(node.change.client)
+            owners = OWNER_FIELDS.get(split_object_path(node.change.path)[0], set())
+            for field_name, ref in _references(node.change.current):
+                if field_name in owners:
+                    continue
+                targets: List[TeardownNode] = []
+                if ref.startswith("/mgmt/"):
+                    target = by_key.get((client_id, ref))
+                    if target is not None:
+                        targets.append(target)
+                else:
+                    kinds = REFERENCE_FIELDS.get(field_name)
+                    targets.extend(
+                        target for target in by_name.get((client_id, ref), [])
+                        if kinds is None or target.change.path.startswith(kinds)
+                    )
+                for target in targets:
+                    if target is not node:
+                        # node refers to target: target goes after node
+                        target.after.add(node.order)
+
+    def levels(self) -> List[List[TeardownNode]]:
+        """Delete order: lists of nodes that can go concurrently"""
+        levels: List[List[TeardownNode]] = []
+        barrier_orders = [order for order, _ in self.barriers]
+        segments: List[List[TeardownNode]] = []
+        start = -1
+        for stop in barrier_orders + [len(self.plan.pending)]:
+            segments.append([node for node in self.nodes if start < node.order < stop])
+            start = stop
+        for segment in segments:
+            levels.extend(self._layer(segment))
+        return levels
+
+    @staticmethod
+    def _layer(nodes: List[TeardownNode]) -> List[List[TeardownNode]]:
+        remaining = {node.order: node for node in nodes}
+        layers = []
+        while remaining:
+            ready = [
+                node for node in remaining.values()
+                if not (node.after & remaining.keys())
+            ]
+            if not ready:
+                # Reference cycle - fall back to playbook order for one object
+                ready = [remaining[min(remaining)]]
+                logger.warning("Reference cycle at %s, deleting in playbook order", ready[0].change.path)
+            ready.sort(key=lambda node: node.order)
+            layers.append(ready)
+            for node in ready:
+                del remaining[node.order]
+        return layers
+
+    def steps(self) -> Iterator[Tuple[Optional[Change], List[TeardownNode]]]:
+        """Interleave barrier writes with the delete levels between them"""
+        barrier_iter = iter(self.barriers)
+        pending_barrier = next(barrier_iter, None)
+        for level in self.levels():
+            while pending_barrier and pending_barrier[0] < level[0].order:
+                yield pending_barrier[1], []
+                pending_barrier = next(barrier_iter, None)
+            yield None, level
+        while pending_barrier:
+            yield pending_barrier[1], []
+            pending_barrier = next(barrier_iter, None)
+
+    def describe(self) -> List[List[str]]:
+        return [[node.change.name or node.change.path for node in level] for level in self.levels()]
+
+
+class Teardown:
+    """
+    Graph-driven replacement for the sequential delete playbooks
+
+    The playbook is planned first (one read per collection it deletes from),
+    so subtrees that are already gone cost no further requests; the
+    remaining deletes run level by level, ``concurrency`` at a time. When a
+    delete fails, the objects it still references are left alone instead of
+    failing one by one with "in use" errors.
+    """
+
+    def __init__(self, clients: ClientPool, project_dir: Path = PROJECT_DIR,
+                 concurrency: int = DEFAULT_TEARDOWN_CONCURRENCY):
+        self.clients = clients
+        self.project_dir = project_dir
+        self.concurrency = concurrency
+
+    def plan(
+        self,
+        playbook: str,
+        extravars: Optional[Dict[str, Any]] = None,
+        host_vars: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[TeardownGraph, ExecutionResult]:
+        plan, planned = Planner(self.clients, self.project_dir).plan(playbook, extravars, host_vars)
+        return TeardownGraph(plan), planned
+
+    def run(self, graph: TeardownGraph, result: Optional[ExecutionResult] = None) -> ExecutionResult:
+        """Delete everything in ``graph``"""
+        result = result or ExecutionResult()
+        blocked: Set[int] = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="apm-teardown") as pool:
+            for barrier, level in graph.steps():
+                if barrier is not None:
+                    Planner._record(barrier, result, *self._send(barrier))
+                    continue
+                runnable = []
+                for node in level:
+                    if node.after & blocked:
+                        blocked.add(node.order)
+                        result.tasks.append(TaskResult(
+                            task_name=f"delete {node.change.name or node.change.path}",
+                            status="skipped",
+                            message="Still referenced by an object that could not be deleted",
+                        ))
+                    else:
+                        runnable.append(node)
+                outcomes = list(pool.map(lambda node: self._send(node.change), runnable))
+                result.request_count += len(runnable)
+                for node, (status, message, status_code, payload) in zip(runnable, outcomes):
+                    if status == "failed":
+                        blocked.add(node.order)
+                    self._record(node.change, result, status, message, status_code)
+        for change in graph.skipped:
+            if change.method == "DELETE":
+                result.tasks.append(TaskResult(
+                    task_name=f"delete {change.name or change.path}", status="skipped",
+                    message="Already absent",
+                ))
+        return result
+
+    @staticmethod
+    def _send(change: Change) -> Tuple[str, str, Optional[int], Any]:
+        try:
+            response = change.client.request(change.method, change.path)
+        except (F5Error, httpx.HTTPError) as exc:
+            return "failed", f"Request failed: {exc}", None, None
+        if response.status_code not in DELETED_STATUS and change.method == "DELETE":
+            return "failed", f"Status code was {response.status_code}: {response.text[:500]}", response.status_code, None
+        if change.method != "DELETE" and response.status_code not in (200, 201, 202):
+            return "failed", f"Status code was {response.status_code}: {response.text[:500]}", response.status_code, None
+        message = "Already absent" if response.status_code == 404 else change.reason
+        return "changed", message, response.status_code, response_body(response)
+
+    @staticmethod
+    def _record(change: Change, result: ExecutionResult, status: str, message: str,
+                status_code: Optional[int]) -> None:
+        task_name = f"delete {change.name or change.path}"
+        result.tasks.append(TaskResult(
+            task_name=task_name, status=status, message=message,
+            details={"status_code": status_code} if status_code is not None else None,
+        ))
+        if status == "failed":
+            result.failed = True
+            result.errors.append(f"{task_name}: {message}")
+        elif status_code != 404:
+            record_resource(result.deleted_resources, "DELETE", change.path, status_code or 200)
+
+
+def _aliases(full_path: Optional[str]) -> List[str]:
+    """Ways a config may refer to ``/Partition/name``"""
+    if not full_path:
+        return []
+    return list({full_path, full_path.rsplit("/", 1)[-1]})
+
+
+def _references(obj: Any, key: Optional[str] = None) -> Iterator[Tuple[Optional[str], str]]:
+    """``(field, reference)`` for every name, fullPath and REST path mentioned in an object's config"""
+    if isinstance(obj, dict):
+        if key in REFERENCE_FIELDS and isinstance(obj.get("name"), str):
+            # {"name": ..., "partition": ...} entries of items and agents name an object
+            partition = obj.get("partition")
+            yield key, f"/{partition}/{obj['name']}" if partition else obj["name"]
+        for child_key, value in obj.items():
+            if child_key in IDENTITY_FIELDS or is_secret(child_key):
+                continue
+            yield from _references(value, key if child_key in _AS3_POINTERS else child_key)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from _references(value, key)
+    elif isinstance(obj, str):
+        match = _LINK_PATH.search(obj)
+        if match:
+            path = match.group(1).rstrip("/")
+            collection, full_path = split_object_path(path)
+            if full_path is not None:
+                yield key, f"{collection}/{full_path.replace('/', '~')}"
+            return
+        yield key, obj
+        if obj.startswith("/"):
+            yield key, obj.rsplit("/", 1)[-1]
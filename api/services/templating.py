@@ -0,0 +1,468 @@
+"""
+Ansible-compatible Jinja2 templating for the native task executor
+Implements the filters, tests and lazy variable resolution the task files rely on
+"""
+import ast
+import base64
+import json
+import os
+import re
+import threading
+from collections.abc import ItemsView, Iterator as IteratorABC, KeysView, Mapping, ValuesView
+from typing import Any, Dict, Iterator, List, Optional
+
+import yaml
+from jinja2 import Environment, StrictUndefined, Undefined
+from jinja2.nativetypes import NativeEnvironment
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+# "{{ expr }}" with nothing around it - evaluated to a native value
+SINGLE_EXPRESSION = re.compile(r"^\{\{\s*(?P<expr>.*?)\s*\}\}$", re.DOTALL)
+
+
+class TemplateError(Exception):
+    """A template or conditional could not be evaluated"""
+
+
+class UnsafeText(str):
+    """
+    Text that is never templated (Ansible's ``AnsibleUnsafeText``)
+
+    Extra vars and host vars arrive from API requests; a password or domain
+    containing ``{{`` is data, not a template.
+    """
+
+    __slots__ = ()
+
+
+def wrap_unsafe(value: Any) -> Any:
+    """Mark every string in ``value`` (recursively) as unsafe"""
+    if isinstance(value, UnsafeText):
+        return value
+    if isinstance(value, str):
+        return UnsafeText(value)
+    if isinstance(value, dict):
+        return {wrap_unsafe(k): wrap_unsafe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [wrap_unsafe(item) for item in value]
+    return value
+
+
+def is_unsafe(value: Any) -> bool:
+    """Whether ``value`` is or contains unsafe text"""
+    if isinstance(value, UnsafeText):
+        return True
+    if isinstance(value, dict):
+        return any(is_unsafe(k) or is_unsafe(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return any(is_unsafe(item) for item in value)
+    return False
+
+
+# Filters
+
+def to_bool(value: Any) -> bool:
+    """Boolean module argument (``validate_certs``, ``ignore_errors``) as Ansible converts it"""
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, str):
+        return value.strip().lower() in ("yes", "on", "1", "true", "y", "t")
+    return value == 1
+
+
+def bool_filter(value: Any) -> bool:
+    """Ansible ``bool`` filter: narrower than module arguments ("y" and "t" are false)"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.lower() in ("yes", "on", "1", "true")
+    return value == 1
+
+
+def combine(*dicts: Dict[str, Any], recursive: bool = False, list_merge: str = "replace") -> Dict[str, Any]:
+    """Ansible ``combine`` filter"""
+    result: Dict[str, Any] = {}
+    for item in dicts:
+        for source in (item if isinstance(item, list) else [item]):
+            result = _merge(result, source, recursive, list_merge)
+    return result
+
+
+def _merge(base: Dict[str, Any], other: Dict[str, Any], recursive: bool, list_merge: str) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in other.items():
+        current = merged.get(key)
+        if recursive and isinstance(current, dict) and isinstance(value, dict):
+            merged[key] = _merge(current, value, recursive, list_merge)
+        elif list_merge == "append" and isinstance(current, list) and isinstance(value, list):
+            merged[key] = current + value
+        elif list_merge == "prepend" and isinstance(current, list) and isinstance(value, list):
+            merged[key] = value + current
+        else:
+            merged[key] = value
+    return merged
+
+
+def regex_replace(value: Any, pattern: str = "", replacement: str = "",
+                  ignorecase: bool = False, multiline: bool = False) -> str:
+    flags = (re.I if ignorecase else 0) | (re.M if multiline else 0)
+    return re.sub(pattern, replacement, str(value), flags=flags)
+
+
+def regex_search(value: Any, pattern: str, ignorecase: bool = False, multiline: bool = False) -> Optional[str]:
+    flags = (re.I if ignorecase else 0) | (re.M if multiline else 0)
+    match = re.search(pattern, str(value), flags=flags)
+    return match.group(0) if match else None
+
+
+class _YAMLDumper(yaml.SafeDumper):
+    """Safe dumper that writes unsafe text as plain strings"""
+
+
+_YAMLDumper.add_representer(UnsafeText, _YAMLDumper.represent_str)
+
+
+def to_yaml(value: Any, default_flow_style: Optional[bool] = None, **kw) -> str:
+    """Ansible ``to_yaml``: terse flow style unless asked otherwise"""
+    return yaml.dump(value, Dumper=_YAMLDumper, allow_unicode=True, default_flow_style=default_flow_style, **kw)
+
+
+def ternary(value: Any, true_val: Any, false_val: Any, none_val: Any = None) -> Any:
+    if value is None and none_val is not None:
+        return none_val
+    return true_val if value else false_val
+
+
+def mandatory(value: Any, msg: Optional[str] = None) -> Any:
+    if isinstance(value, Undefined):
+        raise TemplateError(msg or "Mandatory variable not defined")
+    return value
+
+
+def dict2items(value: Dict[str, Any], key_name: str = "key", value_name: str = "value") -> List[Dict[str, Any]]:
+    return [{key_name: k, value_name: v} for k, v in value.items()]
+
+
+def items2dict(value: List[Dict[str, Any]], key_name: str = "key", value_name: str = "value") -> Dict[str, Any]:
+    return {item[key_name]: item[value_name] for item in value}
+
+
+def flatten(value: List[Any], levels: Optional[int] = None) -> List[Any]:
+    result: List[Any] = []
+    for item in value:
+        if isinstance(item, list) and (levels is None or levels > 0):
+            result.extend(flatten(item, None if levels is None else levels - 1))
+        else:
+            result.append(item)
+    return result
+
+
+def unique(value: List[Any]) -> List[Any]:
+    """Ansible's ``unique``, also for dicts and lists (compared by content, in one pass)"""
+    seen, result = set(), []
+    for item in value:
+        key = ("json", json.dumps(item, sort_keys=True, default=str)) if isinstance(item, (dict, list)) else item
+        if key not in seen:
+            seen.add(key)
+            result.append(item)
+    return result
+
+
+FILTERS = {
+    "bool": bool_filter,
+    "combine": combine,
+    "regex_replace": regex_replace,
+    "regex_search": regex_search,
+    "ternary": ternary,
+    "mandatory": mandatory,
+    "dict2items": dict2items,
+    "items2dict": items2dict,
+    "flatten": flatten,
+    "unique": unique,
+    "to_json": lambda value, **kw: json.dumps(value, **kw),
+    "to_nice_json": lambda value, indent=4, **kw: json.dumps(value, indent=indent, sort_keys=True, **kw),
+    "from_json": lambda value: json.loads(value),
+    "to_yaml": to_yaml,
+    "to_nice_yaml": lambda value, indent=4, default_flow_style=False, **kw: to_yaml(
+        value, indent=indent, default_flow_style=default_flow_style, **kw
+    ),
+    "from_yaml": lambda value: yaml.safe_load(value),
+    "b64encode": lambda value: base64.b64encode(str(value).encode()).decode(),
+    "b64decode": lambda value: base64.b64decode(str(value)).decode(),
+    "basename": lambda value: os.path.basename(value),
+    "dirname": lambda value: os.path.dirname(value),
+    "quote": lambda value: "'" + str(value).replace("'", "'\"'\"'") + "'",
+}
+
+TESTS = {
+    "match": lambda value, pattern: re.match(pattern, str(value)) is not None,
+    "search": lambda value, pattern: re.search(pattern, str(value)) is not None,
+    "regex": lambda value, pattern: re.search(pattern, str(value)) is not None,
+    "failed": lambda result: bool(result.get("failed")),
+    "success": lambda result: not result.get("failed"),
+    "succeeded": lambda result: not result.get("failed"),
+    "changed": lambda result: bool(result.get("changed")),
+    "skipped": lambda result: bool(result.get("skipped")),
+}
+
+
+def lookup(plugin: str, *terms: str, **kwargs) -> Any:
+    """Lookup plugins read the API host's files and environment, so none are available"""
+    raise TemplateError(f"lookup('{plugin}') is not supported by the native executor")
+
+
+def _finalize(value: Any) -> Any:
+    return "" if value is None else value
+
+
+def _escape_backslashes(source: str, env: Environment) -> str:
+    """
+    Double backslashes inside string literals of {{ }} expressions
+
+    Ansible does this before templating so regex backreferences such as
+    ``'\\1'`` written in YAML reach the filter intact.
+    """
+    if "\\" not in source or "{{" not in source:
+        return source
+    parts = []
+    in_variable = False
+    for _, token, value in env.lex(env.preprocess(source)):
+        if token == "variable_begin":
+            in_variable = True
+        elif token == "variable_end":
+            in_variable = False
+        elif in_variable and token == "string":
+            value = value.replace("\\", "\\\\")
+        parts.append(value)
+    return "".join(parts)
+
+
+def _literal(text: str) -> Any:
+    """Ansible converts rendered text that looks like a list/dict/bool back into data"""
+    stripped = text.strip()
+    if stripped.startswith(("{", "[")) or stripped in ("True", "False"):
+        try:
+            return ast.literal_eval(stripped)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return text
+    return text
+
+
+def _ansible_value(value: Any) -> Any:
+    """Shape a single-expression result the way non-native Ansible templating does"""
+    if value is None:
+        return ""
+    if isinstance(value, (bool, list, dict)):
+        return value
+    if isinstance(value, UnsafeText):
+        return value
+    if isinstance(value, str):
+        return _literal(value)
+    if isinstance(value, (tuple, IteratorABC, KeysView, ValuesView, ItemsView)):
+        # reverse/map/select and dict views come back as lazy iterables
+        return list(value)
+    return str(value)
+
+
+class _SandboxedNativeEnvironment(NativeEnvironment, ImmutableSandboxedEnvironment):
+    """Native-typed rendering with the sandbox's attribute and call checks"""
+
+
+class Templar:
+    """
+    Renders strings/structures against a variable mapping
+
+    Compiled templates are cached by source text, so the same task file
+    rendered for many tenants only pays for parsing once. Both environments
+    are sandboxed; unsafe values are returned as they are, and anything
+    rendered from one is unsafe too, so request data is never evaluated.
+    """
+
+    def __init__(self):
+        self.text_env = ImmutableSandboxedEnvironment(
+            undefined=StrictUndefined, finalize=_finalize, keep_trailing_newline=True
+        )
+        self.native_env = _SandboxedNativeEnvironment(undefined=StrictUndefined)
+        for env in (self.text_env, self.native_env):
+            env.filters.update(FILTERS)
+            env.tests.update(TESTS)
+            env.globals.update(lookup=lookup, query=lookup)
+        self._cache: Dict[Any, Any] = {}
+        self._lock = threading.Lock()
+
+    def _compile(self, env: Environment, source: str):
+        key = (id(env), source)
+        template = self._cache.get(key)
+        if template is None:
+            with self._lock:
+                template = self._cache.get(key)
+                if template is None:
+                    template = env.from_string(_escape_backslashes(source, env))
+                    self._cache[key] = template
+        return template
+
+    def evaluate(self, expression: str, variables: Mapping) -> Any:
+        """Evaluate a bare Jinja expression and return its native value"""
+        template = self._compile(self.native_env, "{{ " + expression + " }}")
+        scope = _with_globals(variables, self.native_env)
+        context = template.new_context(scope, shared=True)
+        try:
+            values = list(template.root_render_func(context))
+        except TemplateError:
+            raise
+        except Exception as exc:
+            raise TemplateError(f"Error evaluating '{expression}': {exc}") from exc
+        value = values[0] if len(values) == 1 else "".join(str(v) for v in values)
+        if isinstance(value, Undefined):
+            try:
+                str(value)
+            except Exception as exc:
+                raise TemplateError(f"Error evaluating '{expression}': {exc}") from exc
+        return wrap_unsafe(value) if scope.unsafe else value
+
+    def render_text(self, source: str, variables: Mapping) -> str:
+        template = self._compile(self.text_env, source)
+        scope = _with_globals(variables, self.text_env)
+        context = template.new_context(scope, shared=True)
+        try:
+            text = "".join(template.root_render_func(context))
+        except TemplateError:
+            raise
+        except Exception as exc:
+            raise TemplateError(f"Error rendering '{source[:80]}': {exc}") from exc
+        return UnsafeText(text) if scope.unsafe else text
+
+    def template(self, value: Any, variables: Mapping) -> Any:
+        """Recursively render ``value`` the way Ansible renders module arguments"""
+        if isinstance(value, str):
+            if isinstance(value, UnsafeText) or ("{{" not in value and "{%" not in value):
+                return value
+            match = SINGLE_EXPRESSION.match(value)
+            if match and "{{" not in match.group("expr") and "}}" not in match.group("expr"):
+                return _ansible_value(self.evaluate(match.group("expr"), variables))
+            text = self.render_text(value, variables)
+            return text if isinstance(text, UnsafeText) else _literal(text)
+        if isinstance(value, dict):
+            return {
+                self.template(k, variables): self.template(v, variables)
+                for k, v in value.items()
+            }
+        if isinstance(value, list):
+            return [self.template(item, variables) for item in value]
+        return value
+
+    def conditional(self, condition: Any, variables: Mapping) -> bool:
+        """Evaluate a ``when``/``failed_when``/``changed_when`` expression"""
+        if isinstance(condition, list):
+            return all(self.conditional(item, variables) for item in condition)
+        if isinstance(condition, bool):
+            return condition
+        if condition is None:
+            return True
+        if isinstance(condition, UnsafeText):
+            raise TemplateError(f"Conditional '{condition[:80]}' comes from request data and is not evaluated")
+        text = str(condition).strip()
+        if "{{" in text:
+            text = self.template(text, variables)
+            if isinstance(text, UnsafeText):
+                raise TemplateError(f"Conditional '{text[:80]}' comes from request data and is not evaluated")
+            text = str(text)
+        value = self.evaluate(text, variables)
+        if isinstance(value, str):
+            return to_bool(value) if value in ("True", "False") else bool(value)
+        return bool(value)
+
+
+class _with_globals(Mapping):
+    """
+    Expose environment globals (range, lookup, ...) next to task variables
+
+    ``unsafe`` is set once a template reads an unsafe value, like Ansible's
+    ``AnsibleContext``; the rendered result is then unsafe as well.
+    """
+
+    __slots__ = ("variables", "env_globals", "unsafe")
+
+    def __init__(self, variables: Mapping, env: Environment):
+        self.variables = variables
+        self.env_globals = env.globals
+        self.unsafe = False
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.variables:
+            value = self.variables[key]
+            if not self.unsafe and is_unsafe(value):
+                self.unsafe = True
+            return value
+        return self.env_globals[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.variables or key in self.env_globals
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.variables
+        yield from self.env_globals
+
+    def __len__(self) -> int:
+        return len(self.variables) + len(self.env_globals)
+
+
+class VariableScope(Mapping):
+    """
+    Layered, lazily templated variables
+
+    ``layers`` are ordered highest precedence first (extra vars, loop/task
+    vars, facts, vars_files, play vars, host vars). Values are templated on
+    access, so ``bigip_mgmt: "{{ ansible_host }}"`` resolves like in Ansible.
+    ``facts`` defaults to the layer right below extra vars.
+    """
+
+    def __init__(self, templar: Templar, layers: List[Dict[str, Any]],
+                 facts: Optional[Dict[str, Any]] = None):
+        self.templar = templar
+        self.layers = layers
+        # Where set_fact/register write; must be one of ``layers``
+        self.facts = facts if facts is not None else (layers[1] if len(layers) > 1 else layers[0])
+        self._resolving: List[str] = []
+
+    def child(self, *layers: Dict[str, Any]) -> "VariableScope":
+        """New scope with ``layers`` placed just below extra vars"""
+        return VariableScope(
+            self.templar, self.layers[:1] + list(layers) + self.layers[1:], self.facts
+        )
+
+    def raw(self, key: str) -> Any:
+        for layer in self.layers:
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.raw(key)
+        if key in self._resolving:
+            raise TemplateError(f"Recursive loop detected in template for variable '{key}'")
+        self._resolving.append(key)
+        try:
+            return self.templar.template(value, self)
+        finally:
+            self._resolving.pop()
+
+    def __contains__(self, key: object) -> bool:
+        return any(key in layer for layer in self.layers)
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        for layer in self.layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self) -> int:
+        return len(set().union(*self.layers)) if self.layers else 0
+
+
+# Shared templar - compiled templates are reused across executions
+templar = Templar()
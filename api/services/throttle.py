@@ -0,0 +1,183 @@
+"""
+Adaptive request concurrency for F5 BIG-IP
+Per-device AIMD limit driven by latency and errors, plus jittered retries of idempotent calls
+"""
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests a device may have in flight before its limit has been measured, and the bounds
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 20
+
+# Share of the limit kept after an overload signal
+DEFAULT_BACKOFF = 0.5
+
+# A call slower than this many times its endpoint's usual latency counts as overload
+DEFAULT_LATENCY_TOLERANCE = 3.0
+
+# Latencies below this never count as overload, however fast the endpoint usually is
+MIN_OVERLOAD_LATENCY = 0.5
+
+# Samples of an endpoint before its latency is judged, and weight of each new one
+BASELINE_SAMPLES = 5
+BASELINE_WEIGHT = 0.05
+
+# Answers restjavad gives when it is overloaded (or a proxy in front of it is)
+OVERLOAD_STATUSES = (429, 502, 503, 504)
+
+# Methods whose repetition has no further effect on the device
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class AdaptiveLimiter:
+    """
+    Requests in flight to one BIG-IP, bounded by a limit found by AIMD
+
+    Every answered call raises the limit by ``1/limit`` (one more slot per
+    round of calls) up to ``max_limit``. An overload signal - an
+    ``OVERLOAD_STATUSES`` answer, a failed connection or timeout, or a call
+    much slower than its endpoint usually is - cuts it
+    to ``backoff`` times its value, never below ``min_limit``. Only calls
+    sent after the last cut can cut it again, so one burst of failures
+    halves the limit once. Callers over the limit wait for a slot.
+    """
+
+    def __init__(
+        self,
+        device: str,
+        initial: int = DEFAULT_INITIAL_CONCURRENCY,
+        min_limit: int = DEFAULT_MIN_CONCURRENCY,
+        max_limit: int = DEFAULT_MAX_CONCURRENCY,
+        backoff: float = DEFAULT_BACKOFF,
+        latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE,
+    ):
+        self.device = device
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.decreases = 0
+        self._baselines: Dict[str, Tuple[float, int]] = {}  # endpoint -> (usual latency, samples)
+        self._decreased_at = float("-inf")
+        self._changed = threading.Condition()
+        metrics.DEVICE_CONCURRENCY.labels(device=device).set(int(self.limit))
+
+    def acquire(self) -> float:
+        """Wait for a slot; returns when the call may be sent (``time.monotonic()``)"""
+        with self._changed:
+            while self.in_flight >= int(self.limit):
+                self._changed.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started: float, endpoint: str, status_code: Optional[int]) -> None:
+        """Give the slot of a call sent at ``started`` back and adjust the limit (``status_code`` None: it failed)"""
+        with self._changed:
+            self.in_flight -= 1
+            now = time.monotonic()
+            seconds = now - started
+            if self._overloaded(endpoint, seconds, status_code):
+                if started >= self._decreased_at:
+                    self._decreased_at = now
+                    self.decreases += 1
+                    previous = self.limit
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    logger.info(
+                        "%s looks overloaded (%s %s in %.2fs): concurrency %d -> %d",
+                        self.device, endpoint, status_code if status_code is not None else "error",
+                        seconds, previous, self.limit,
+                    )
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            metrics.DEVICE_CONCURRENCY.labels(device=self.device).set(int(self.limit))
+            self._changed.notify_all()
+
+    def _overloaded(self, endpoint: str, seconds: float, status_code: Optional[int]) -> bool:
+        """Lock held"""
+        if status_code is None or status_code in OVERLOAD_STATUSES:
+            return True
+        baseline, samples = self._baselines.get(endpoint, (seconds, 0))
+        slow = (
+            samples >= BASELINE_SAMPLES and seconds > MIN_OVERLOAD_LATENCY
+            and seconds > baseline * self.latency_tolerance
+        )
+        if not slow:
+            # Faster calls pull the baseline down at once; slower ones drift it up
+            baseline = seconds if seconds < baseline else baseline + (seconds - baseline) * BASELINE_WEIGHT
+        self._baselines[endpoint] = (baseline, samples + 1)
+        return slow
+
+
+class DeviceLimiters:
+    """One ``AdaptiveLimiter`` per device (``host:port``), whoever logs in to it"""
+
+    def __init__(self, **limiter_kwargs):
+        self.limiter_kwargs = limiter_kwargs
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, device: str) -> AdaptiveLimiter:
+        with self._lock:
+            limiter = self._limiters.get(device)
+            if limiter is None:
+                limiter = self._limiters[device] = AdaptiveLimiter(device, **self.limiter_kwargs)
+            return limiter
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Current limit, calls in flight and decreases per device"""
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {
+            limiter.device: {
+                "limit": int(limiter.limit), "in_flight": limiter.in_flight, "decreases": limiter.decreases,
+            }
+            for limiter in limiters
+        }
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Retries of calls restjavad turned away
+
+    Idempotent calls are retried after an ``OVERLOAD_STATUSES`` answer, a
+    timeout or a failed connection; other calls only when the connection
+    could not be made (the device never saw them). Waits use full jitter
+    (``uniform(0, base_delay * 2**attempt)``, capped at ``max_delay``) unless
+    the device sent ``Retry-After``.
+    """
+    retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 10.0
+
+    def retry_status(self, method: str, status_code: int, attempt: int) -> bool:
+        return attempt < self.retries and method in IDEMPOTENT_METHODS and status_code in OVERLOAD_STATUSES
+
+    def retry_error(self, method: str, error: Exception, attempt: int) -> bool:
+        if attempt >= self.retries:
+            return False
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return True
+        return method in IDEMPOTENT_METHODS and isinstance(error, (httpx.TimeoutException, httpx.NetworkError))
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), self.max_delay)
+            except ValueError:
+                pass  # an HTTP date: fall back to jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
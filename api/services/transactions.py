@@ -0,0 +1,369 @@
+"""
+iControl REST transactions for F5 BIG-IP
+Pipelined staging of coordinated calls, evalOrder repair before commit and per-command commit errors
+"""
+import logging
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+
+from .f5_client import F5Client, F5Error, response_body
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_PATH = "/mgmt/tm/transaction"
+COORDINATION_HEADER = "X-F5-REST-Coordination-Id"
+
+# Staging calls in flight per transaction
+DEFAULT_STAGING_CONCURRENCY = 8
+
+_TRANSACTION_URL = re.compile(r"/mgmt/tm/transaction/(\d+)/?$")
+
+
+class TransactionError(F5Error):
+    """Transaction commit failed; ``command_errors`` names the offending commands"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 command_errors: Optional[List[Dict[str, Any]]] = None):
+        super().__init__(message, status_code)
+        self.command_errors = command_errors or []
+
+
+@dataclass
+class StagedCommand:
+    """One call staged under a coordination ID and the device's answer to it"""
+    sequence: int
+    method: str
+    path: str
+    body: Any = None
+    expected_status: Sequence[int] = (200,)
+    tag: Any = None
+    status_code: Optional[int] = None
+    response: Any = None
+    error: Optional[str] = None
+    command_id: Optional[int] = None
+    batch: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code in self.expected_status
+
+    @property
+    def name(self) -> Optional[str]:
+        if isinstance(self.body, dict):
+            return self.body.get("fullPath") or self.body.get("name")
+        return None
+
+
+def commit_transaction_id(method: str, path: str, body: Any) -> Optional[str]:
+    """Transaction ID when ``method path body`` commits a transaction, else None"""
+    match = _TRANSACTION_URL.search(F5Client._path(path))
+    if method.upper() not in ("PUT", "PATCH") or not match:
+        return None
+    if isinstance(body, dict) and body.get("state") == "VALIDATING":
+        return match.group(1)
+    return None
+
+
+class Transaction:
+    """
+    Pipelined staging into one iControl REST transaction
+
+    Staging calls only queue commands on the device and never depend on each
+    other's responses, so ``stage()`` sends them ``concurrency`` at a time and
+    returns immediately. ``flush()`` waits for them; ``restore_order()``
+    puts commands that concurrent arrival reordered back in staging order,
+    once, right before the commit. ``commit()`` flushes, restores the order,
+    commits once and turns a failed commit into a ``TransactionError``
+    listing the commands the device rejected.
+    """
+
+    def __init__(self, client: F5Client, trans_id: Any,
+                 concurrency: int = DEFAULT_STAGING_CONCURRENCY):
+        self.client = client
+        self.trans_id = str(trans_id)
+        self.concurrency = concurrency
+        self._pool = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix=f"f5-trans-{self.trans_id}"
+        )
+        self._lock = threading.Lock()
+        self._pending: List[Future] = []
+        self._batch = 0
+        self.staged: List[StagedCommand] = []
+
+    @classmethod
+    def begin(cls, client: F5Client, concurrency: int = DEFAULT_STAGING_CONCURRENCY) -> "Transaction":
+        """Open a new transaction on the device"""
+        response = client.post(TRANSACTION_PATH, json={})
+        if response.status_code not in (200, 201):
+            raise F5Error(
+                f"Could not create transaction on {client.host}: HTTP {response.status_code}",
+                response.status_code,
+            )
+        return cls(client, response.json()["transId"], concurrency)
+
+    def __enter__(self) -> "Transaction":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.close()
+
+    @property
+    def path(self) -> str:
+        return f"{TRANSACTION_PATH}/{self.trans_id}"
+
+    # Staging
+
+    def stage(
+        self,
+        method: str,
+        path: str,
+        json: Any = None,
+        content: Optional[str] = None,
+        expected_status: Sequence[int] = (200,),
+        timeout: Optional[float] = None,
+        tag: Any = None,
+    ) -> "Future[StagedCommand]":
+        """Queue a call in this transaction without waiting for its response"""
+        with self._lock:
+            command = StagedCommand(
+                sequence=len(self.staged), method=method.upper(), path=F5Client._path(path),
+                body=json if json is not None else content,
+                expected_status=tuple(expected_status), tag=tag, batch=self._batch,
+            )
+            self.staged.append(command)
+            future = self._pool.submit(self._send, command, json, content, timeout)
+            self._pending.append(future)
+        return future
+
+    def _send(self, command: StagedCommand, json: Any, content: Optional[str],
+              timeout: Optional[float]) -> StagedCommand:
+        try:
+            response = self.client.request(
+                command.method, command.path, json=json, content=content,
+                headers={COORDINATION_HEADER: self.trans_id}, timeout=timeout,
+            )
+        except (F5Error, httpx.HTTPError) as exc:
+            command.error = f"Request failed: {exc}"
+            return command
+        command.status_code = response.status_code
+        command.response = response_body(response)
+        if isinstance(command.response, dict):
+            command.command_id = command.response.get("commandId")
+        if command.status_code not in command.expected_status:
+            command.error = (
+                f"Status code was {command.status_code} and not {list(command.expected_status)}: "
+                f"{response.text[:500]}"
+            )
+        return command
+
+    def flush(self) -> List[StagedCommand]:
+        """Wait for in-flight staging calls; returns the ones that failed"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                self._batch += 1
+        if not pending:
+            return []
+        done = [future.result() for future in pending]
+        return [command for command in done if not command.ok]
+
+    def commands(self) -> List[Dict[str, Any]]:
+        """Commands currently queued in the transaction, in ``evalOrder``"""
+        items = self.client.get_json(f"{self.path}/commands").get("items", [])
+        return sorted(items, key=lambda cmd: cmd.get("evalOrder", 0))
+
+    def restore_order(self) -> int:
+        """
+        Make the commands run in staging order; returns the commands moved
+
+        Calls staged together may reach the device in any order, while calls
+        made between flushes arrive in place. The queue is read once: each
+        flush's commands are put back in staging order within the slots they
+        took, by PATCHing the ``evalOrder`` of each misplaced command (BIG-IP
+        moves it there and renumbers the others). If anything moved, the
+        queue is read again, and a transaction still out of order raises
+        ``TransactionError`` instead of being committed.
+        """
+        if self.concurrency <= 1 or sum(command.ok for command in self.staged) < 2:
+            return 0
+        moved = 0
+        for _ in range(2):
+            try:
+                queued = self.commands()
+            except (F5Error, httpx.HTTPError, ValueError) as exc:
+                raise TransactionError(
+                    f"Could not read the commands of transaction {self.trans_id} to check their order: {exc}",
+                    getattr(exc, "status_code", None),
+                ) from exc
+            desired = self._desired_order(queued)
+            current = [cmd.get("commandId") for cmd in queued]
+            if current == desired:
+                return moved
+            slots = [cmd.get("evalOrder", position + 1) for position, cmd in enumerate(queued)]
+            for position, command_id in enumerate(desired):
+                if current[position] == command_id:
+                    continue
+                response = self.client.patch(
+                    f"{self.path}/commands/{command_id}", json={"evalOrder": slots[position]}
+                )
+                if response.status_code != 200:
+                    raise TransactionError(
+                        f"Could not reorder command {command_id} of transaction {self.trans_id}: "
+                        f"HTTP {response.status_code}",
+                        response.status_code,
+                    )
+                current.remove(command_id)
+                current.insert(position, command_id)
+                moved += 1
+        raise TransactionError(f"Commands of transaction {self.trans_id} stay out of staging order")
+
+    def _desired_order(self, queued: List[Dict[str, Any]]) -> List[Any]:
+        """Command IDs of ``queued`` with each flush's staged commands in staging order"""
+        by_id = {cmd.get("commandId"): cmd for cmd in queued}
+        ok = [command for command in self.staged if command.ok]
+        staged_ids = {}
+        batches: Dict[int, List[Any]] = {}
+        for command, cmd in zip(ok, self._match(queued, by_id)):
+            if cmd is not None:
+                staged_ids[cmd.get("commandId")] = command.batch
+                batches.setdefault(command.batch, []).append(cmd.get("commandId"))
+        remaining = {batch: iter(ids) for batch, ids in batches.items()}
+        return [
+            next(remaining[staged_ids[cmd.get("commandId")]]) if cmd.get("commandId") in staged_ids
+            else cmd.get("commandId")
+            for cmd in queued
+        ]
+
+    def _match(self, queued: List[Dict[str, Any]], by_id: Dict[Any, Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Queued command for each successfully staged call, in staging order"""
+        unclaimed = [cmd for cmd in queued if cmd.get("commandId") not in
+                     {c.command_id for c in self.staged if c.command_id is not None}]
+        matched = []
+        for command in self.staged:
+            if not command.ok:
+                continue
+            if command.command_id in by_id:
+                matched.append(by_id[command.command_id])
+                continue
+            found = None
+            for cmd in unclaimed:
+                if _same_command(cmd, command):
+                    found = cmd
+                    break
+            if found is not None:
+                unclaimed.remove(found)
+            matched.append(found)
+        return matched
+
+    # Commit
+
+    def commit(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Flush, commit once and return the transaction state"""
+        failed = self.flush()
+        if failed:
+            self.close()
+            raise TransactionError(
+                f"{len(failed)} staged command(s) failed in transaction {self.trans_id}",
+                failed[0].status_code,
+                [_command_error(command, command.error) for command in failed],
+            )
+        try:
+            self.restore_order()
+            response = self.client.put(self.path, json={"state": "VALIDATING"}, timeout=timeout)
+            body = response_body(response) or {}
+            if response.status_code != 200:
+                message = body.get("message", response.text[:500]) if isinstance(body, dict) else response.text[:500]
+                raise TransactionError(
+                    f"Commit of transaction {self.trans_id} failed: {message}",
+                    response.status_code,
+                    self.command_errors(message),
+                )
+            return body
+        finally:
+            self.close()
+
+    def command_errors(self, message: str) -> List[Dict[str, Any]]:
+        """Map a commit error message onto the queued commands it refers to"""
+        return describe_commit_failure(self.client, self.trans_id, message, self.staged)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+def describe_commit_failure(
+    client: F5Client, trans_id: Any, message: str,
+    staged: Optional[List[StagedCommand]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Per-command report for a failed commit
+
+    BIG-IP validates the whole transaction and returns one message naming the
+    object it choked on; the command list tells which staged call that was.
+    """
+    try:
+        queued = client.get_json(f"{TRANSACTION_PATH}/{trans_id}/commands").get("items", [])
+    except (F5Error, httpx.HTTPError, ValueError):
+        queued = []
+    if not queued and staged:
+        queued = [
+            {"commandId": c.command_id, "method": c.method, "uri": c.path, "body": c.body}
+            for c in staged if c.ok
+        ]
+    errors = []
+    for cmd in queued:
+        name = _command_name(cmd)
+        if name and _mentions(message, name):
+            errors.append(_command_error(cmd, message))
+    if not errors and queued:
+        # Could not pin it down - report the whole batch as not applied
+        errors = [_command_error(cmd, f"not applied: {message}") for cmd in queued]
+    return errors
+
+
+def _command_name(cmd: Dict[str, Any]) -> Optional[str]:
+    body = cmd.get("body")
+    if isinstance(body, dict):
+        name = body.get("fullPath") or body.get("name")
+        if name:
+            return str(name)
+    uri = str(cmd.get("uri", "")).rstrip("/")
+    segment = uri.rsplit("/", 1)[-1]
+    return segment.replace("~", "/") if segment.startswith("~") else None
+
+
+def _mentions(message: str, name: str) -> bool:
+    short = name.rsplit("/", 1)[-1]
+    return bool(re.search(rf"(^|[^\w-]){re.escape(short)}($|[^\w-])", message))
+
+
+def _command_error(cmd: Any, error: Optional[str]) -> Dict[str, Any]:
+    if isinstance(cmd, StagedCommand):
+        return {
+            "commandId": cmd.command_id, "method": cmd.method, "uri": cmd.path,
+            "name": cmd.name, "error": error,
+        }
+    return {
+        "commandId": cmd.get("commandId"),
+        "method": str(cmd.get("method", cmd.get("command", ""))).upper(),
+        "uri": F5Client._path(str(cmd.get("uri", ""))),
+        "name": _command_name(cmd),
+        "error": error,
+    }
+
+
+def _same_command(queued: Dict[str, Any], command: StagedCommand) -> bool:
+    if F5Client._path(str(queued.get("uri", ""))).rstrip("/") != command.path.rstrip("/"):
+        return False
+    if command.name is None:
+        return True
+    body = queued.get("body")
+    return isinstance(body, dict) and command.name in (body.get("fullPath"), body.get("name"))
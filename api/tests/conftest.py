@@ -0,0 +1,79 @@
+"""
+Shared fixtures: an in-memory MockBigIP reached through an httpx transport
+"""
+import json
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+import httpx
+import pytest
+
+from api.mock_bigip import MockBigIP, MockConfig
+from api.services.f5_client import ClientPool
+
+BIGIP = "https://bigip.example"
+
+
+class MockTransport(httpx.BaseTransport):
+    """
+    Answers requests from a ``MockBigIP`` in-process
+
+    ``delay(request)`` may return seconds to hold a request before the
+    device sees it (to make concurrent calls arrive out of order);
+    ``intercept(request)`` may return a response instead of the device's.
+    ``calls`` counts ``(method, path)`` pairs.
+    """
+
+    def __init__(self, device: MockBigIP):
+        self.device = device
+        self.delay: Optional[Callable[[httpx.Request], float]] = None
+        self.intercept: Optional[Callable[[httpx.Request], Optional[httpx.Response]]] = None
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.calls[request.method, request.url.path] += 1
+        if self.delay is not None:
+            time.sleep(self.delay(request))
+        if self.intercept is not None:
+            response = self.intercept(request)
+            if response is not None:
+                return response
+        body = None
+        if request.content:
+            try:
+                body = json.loads(request.content)
+            except ValueError:
+                body = request.content.decode()
+        headers = {key.lower(): value for key, value in request.headers.items()}
+        status_code, payload = self.device.handle(request.method, str(request.url), headers, body)
+        return httpx.Response(status_code, json=payload, request=request)
+
+    def count(self, method: str, prefix: str = "") -> int:
+        with self._lock:
+            return sum(n for (m, path), n in self.calls.items() if m == method and path.startswith(prefix))
+
+
+@pytest.fixture
+def device():
+    return MockBigIP(MockConfig(as3_duration=0.0))
+
+
+@pytest.fixture
+def transport(device):
+    return MockTransport(device)
+
+
+@pytest.fixture
+def pool(transport):
+    pool = ClientPool(transport=transport)
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def client(pool):
+    return pool.for_url(BIGIP, "admin", "admin")
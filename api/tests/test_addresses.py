@@ -0,0 +1,118 @@
+"""
+AddressAllocator: parallel deploys get distinct VIPs from one scope
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import httpx
+import pytest
+
+from api.services.addresses import AddressAllocator
+
+IPAM = "https://ipam.example"
+
+
+class AddressManager:
+    """Scope-status/available/checkout of one scope; ``block`` False answers one address per call"""
+
+    def __init__(self, addresses: List[str], block: bool = True):
+        self.addresses = addresses
+        self.block = block
+        self.checked_out: Dict[str, str] = {}  # name -> address
+        self._lock = threading.Lock()
+
+    def __call__(self, request: httpx.Request) -> Optional[httpx.Response]:
+        if request.url.host != "ipam.example":
+            return None
+        with self._lock:
+            taken = set(self.checked_out.values())
+            free = [address for address in self.addresses if address not in taken]
+            if request.url.path == "/addr/scope-status":
+                if not self.checked_out:
+                    return httpx.Response(404, json={"message": "no assignments"})
+                return httpx.Response(200, json=[
+                    {"Description": name, "IPAddress": {"IPAddressToString": address}}
+                    for name, address in self.checked_out.items()
+                ])
+            if request.url.path == "/addr/available":
+                if not free:
+                    return httpx.Response(200, json={})
+                if self.block:
+                    return httpx.Response(200, json={"addresses": free[:int(request.url.params["count"])]})
+                return httpx.Response(200, json={"address": free[0]})
+        return httpx.Response(404, json={})
+
+    def checkout(self, allocator: AddressAllocator, name: str, address: str) -> None:
+        body = {"scope": "web", "name": name, "address": address}
+        with self._lock:
+            self.checked_out[name] = address
+        allocator.checked_out(f"{IPAM}/addr/checkout", body, 200, {"status": "Success"})
+
+
+@pytest.fixture
+def ipam_client(transport):
+    with httpx.Client(transport=transport) as client:
+        yield client
+
+
+def take(allocator: AddressAllocator, client: httpx.Client):
+    return allocator.answer(client, "GET", f"{IPAM}/addr/available?scope=web", None)
+
+
+def test_parallel_takes_get_distinct_addresses_from_one_refill(transport, ipam_client):
+    transport.intercept = AddressManager([f"10.0.0.{n}" for n in range(1, 21)])
+    allocator = AddressAllocator(block_size=16)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        answers = list(executor.map(lambda _: take(allocator, ipam_client), range(8)))
+
+    assert all(status == 200 for status, _ in answers)
+    assert len({payload["address"] for _, payload in answers}) == 8
+    assert transport.count("GET", "/addr/available") == 1
+
+
+def test_single_address_manager_waits_for_the_previous_checkout(transport, ipam_client):
+    manager = transport.intercept = AddressManager(["10.0.0.1", "10.0.0.2"], block=False)
+    allocator = AddressAllocator()
+    status, first = take(allocator, ipam_client)
+    assert (status, first["address"]) == (200, "10.0.0.1")
+
+    threading.Timer(0.2, manager.checkout, (allocator, "app1", "10.0.0.1")).start()
+    status, second = take(allocator, ipam_client)
+
+    assert (status, second["address"]) == (200, "10.0.0.2")
+    status, assigned = allocator.answer(ipam_client, "GET", f"{IPAM}/addr/scope-status?scope=web", None)
+    assert status == 200 and assigned[0]["Description"] == "app1"
+
+
+def test_held_pool_fails_fast_instead_of_waiting_out_the_hold(transport, ipam_client):
+    transport.intercept = AddressManager(["10.0.0.1"], block=False)
+    allocator = AddressAllocator(hold_timeout=600.0, hold_wait=0.2)
+    assert take(allocator, ipam_client)[0] == 200
+
+    started = time.monotonic()
+    status, payload = take(allocator, ipam_client)
+
+    assert status == 503 and "exhausted" in payload["message"]
+    assert time.monotonic() - started < 5
+
+
+def test_released_address_goes_back_to_the_pool(transport, ipam_client):
+    transport.intercept = AddressManager(["10.0.0.1"], block=False)
+    allocator = AddressAllocator(hold_wait=0.0)
+    _, payload = take(allocator, ipam_client)
+
+    allocator.release(f"{IPAM}/addr/available?scope=web", "web", [payload["address"]])
+
+    assert take(allocator, ipam_client) == (200, {"address": "10.0.0.1"})
+
+
+def test_exhausted_scope_passes_the_manager_answer_through(transport, ipam_client):
+    manager = transport.intercept = AddressManager(["10.0.0.1"])
+    allocator = AddressAllocator(status_ttl=0.0)
+    _, payload = take(allocator, ipam_client)
+    manager.checkout(allocator, "app1", payload["address"])
+
+    assert take(allocator, ipam_client) == (200, {})
@@ -0,0 +1,95 @@
+"""
+AS3Batcher: merged per-device runs, per-tenant results, bisecting rejected merges and held runs
+"""
+import threading
+
+import httpx
+import pytest
+
+from api.services.as3 import DECLARE_PATH, AS3Batcher, declaration_parts
+from api.services.f5_client import ClientPool
+
+from .conftest import BIGIP
+
+TIMEOUT = 5.0
+
+
+def declaration(*tenants):
+    adc = {"class": "ADC", "schemaVersion": "3.20.0", "id": "test"}
+    adc.update({tenant: {"class": "Tenant", "app": {"class": "Application"}} for tenant in tenants})
+    return {"class": "AS3", "action": "deploy", "persist": True, "declaration": adc}
+
+
+@pytest.fixture
+def batcher():
+    batcher = AS3Batcher(batch_window=0.05, poll_interval=0.01, max_poll_interval=0.01)
+    yield batcher
+    batcher.shutdown()
+
+
+def declare_posts(transport):
+    return transport.count("POST", DECLARE_PATH)
+
+
+def test_pending_declarations_share_one_run(device, transport, client, batcher):
+    futures = [batcher.submit(client, declaration(f"t{index}")) for index in range(5)]
+    answers = [future.result(TIMEOUT) for future in futures]
+    assert declare_posts(transport) == 1
+    assert batcher.runs == 1 and batcher.declarations == 5
+    assert sorted(device.tenants) == [f"t{index}" for index in range(5)]
+    for index, (status_code, body) in enumerate(answers):
+        assert status_code == 200
+        assert [result["tenant"] for result in body["results"]] == [f"t{index}"]
+        assert body["batch"]["declarations"] == 5
+    assert batcher._queues == {}
+
+
+def test_same_tenant_waits_for_the_next_run(transport, client, batcher):
+    futures = [batcher.submit(client, declaration("t1")), batcher.submit(client, declaration("t1", "t2")),
+               batcher.submit(client, declaration("t3"))]
+    assert [future.result(TIMEOUT)[0] for future in futures] == [200, 200, 200]
+    assert batcher.runs == 2
+
+
+def test_rejected_merge_is_split_until_the_bad_declaration_is_alone(transport, client, batcher):
+    def reject_bad(request):
+        if request.method == "POST" and request.url.path == DECLARE_PATH and b'"bad"' in request.content:
+            return httpx.Response(422, json={"code": 422, "message": "declaration is invalid"}, request=request)
+        return None
+    transport.intercept = reject_bad
+
+    futures = [batcher.submit(client, declaration(tenant)) for tenant in ("a", "b", "bad", "c")]
+    assert [future.result(TIMEOUT)[0] for future in futures] == [200, 200, 422, 200]
+    assert batcher.runs == 5  # a+b+bad+c, a+b, bad+c, bad, c
+
+
+def test_declarations_of_one_account_share_a_run(transport, client, batcher):
+    other_pool = ClientPool(transport=transport)
+    try:
+        same_account = other_pool.for_url(BIGIP, "admin", "admin")
+        futures = [batcher.submit(client, declaration("t1")), batcher.submit(same_account, declaration("t2"))]
+        assert [future.result(TIMEOUT)[0] for future in futures] == [200, 200]
+        assert batcher.runs == 1
+    finally:
+        other_pool.close_all()
+
+
+def test_expected_declarations_hold_the_run(transport, client, batcher):
+    batcher.expect(client, ["job1", "job2", "job3"])
+    first = batcher.submit(client, declaration("t1"), token="job1")
+    assert not first.done()
+    arrived = threading.Timer(0.1, lambda: batcher.submit(client, declaration("t2"), token="job2"))
+    arrived.start()
+    threading.Timer(0.2, batcher.withdraw, ["job3"]).start()  # job3 ended without declaring
+    assert first.result(TIMEOUT)[0] == 200
+    arrived.join(TIMEOUT)
+    assert batcher.runs == 1
+    assert batcher._queues == {} and batcher._expected == {}
+
+
+def test_only_plain_tenant_deploys_are_batched(client, batcher):
+    assert declaration_parts(declaration("t1"))[1].keys() == {"t1"}
+    assert declaration_parts({**declaration("t1"), "action": "remove"}) is None
+    assert declaration_parts({"class": "ADC", "updateMode": "complete", **declaration("t1")["declaration"]}) is None
+    with pytest.raises(ValueError):
+        batcher.submit(client, {"class": "AS3", "action": "dry-run", "declaration": {"class": "ADC"}})
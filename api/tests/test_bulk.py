@@ -0,0 +1,93 @@
+"""
+BulkRunner: validation up front, one device check per device and unreachable devices failing their items
+"""
+import time
+
+import httpx
+import pytest
+
+from api.models import BIGIPCredentials, BulkDeployItem, BulkDeployRequest, DeploymentStatus, SolutionType
+from api.services.bulk import BulkRunner, BulkValidationError, bulk_requests
+from api.services.deployment_engine import DeploymentEngine, EngineBusyError
+from api.services.store import create_store
+
+CREDENTIALS = BIGIPCredentials(host="bigip.example", password="admin")
+
+
+def vpn(name, **extra):
+    return BulkDeployItem(solution_type=SolutionType.VPN, solution={
+        "solution_name": name,
+        "ad_config": {"ip": "10.1.20.7", "domain": "f5lab.local", "admin_user": "admin", "admin_password": "x"},
+        "vpn_config": {"lease_pool_start": "10.1.50.1", "lease_pool_end": "10.1.50.10"},
+        **extra,
+    })
+
+
+@pytest.fixture
+def engine(pool):
+    engine = DeploymentEngine(create_store("memory://"), max_workers=4, max_pending=4, clients=pool)
+    yield engine
+    engine.shutdown(wait=False)
+
+
+@pytest.fixture
+def bulk(engine):
+    runner = BulkRunner(engine, max_concurrency=2)
+    yield runner
+    runner.shutdown(wait=False)
+
+
+def finished(bulk, batch_id, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        batch = bulk.get(batch_id)
+        if batch.status in (DeploymentStatus.COMPLETED, DeploymentStatus.FAILED):
+            return batch
+        time.sleep(0.05)
+    raise AssertionError(f"Batch {batch_id} still {bulk.get(batch_id).status}")
+
+
+def test_every_item_is_validated_before_anything_runs():
+    request = BulkDeployRequest(credentials=CREDENTIALS, items=[
+        vpn("vpn1"), vpn("vpn1"), BulkDeployItem(solution_type=SolutionType.VPN, solution={"solution_name": "x"}),
+    ])
+    with pytest.raises(BulkValidationError) as caught:
+        bulk_requests(request)
+    assert [error.split(":")[0] for error in caught.value.errors] == ["items[1]", "items[2]"]
+    assert "already deployed to bigip.example by items[0]" in caught.value.errors[0]
+
+
+def test_batch_larger_than_the_queue_is_refused(bulk):
+    request = BulkDeployRequest(credentials=CREDENTIALS, items=[vpn(f"vpn{n}") for n in range(5)])
+    with pytest.raises(EngineBusyError, match="room for 4 jobs, the batch has 5"):
+        bulk.submit(request)
+
+
+def test_items_of_one_device_share_one_device_check(bulk, transport):
+    batch = bulk.submit(BulkDeployRequest(credentials=CREDENTIALS, items=[vpn("vpn1"), vpn("vpn2")]))
+    assert (batch.total, batch.devices) == (2, 1)
+
+    batch = finished(bulk, batch.batch_id)
+
+    assert batch.status == DeploymentStatus.COMPLETED, [item.message for item in batch.items]
+    assert all(item.deployment_id for item in batch.items)
+    assert transport.count("POST", "/mgmt/shared/authn/login") == 1
+
+
+def test_unreachable_device_fails_its_items_without_queuing_them(bulk, transport, engine):
+    def down(request):
+        if request.url.host == "down.example":
+            raise httpx.ConnectError("connection refused", request=request)
+        return None
+    transport.intercept = down
+    offline = BIGIPCredentials(host="down.example", password="admin").model_dump()
+
+    batch = bulk.submit(BulkDeployRequest(credentials=CREDENTIALS, items=[
+        vpn("vpn1"), vpn("vpn2", credentials=offline),
+    ]))
+    batch = finished(bulk, batch.batch_id)
+
+    assert [item.status for item in batch.items] == ["completed", "failed"]
+    assert batch.items[1].deployment_id is None
+    assert batch.items[1].message.startswith("Device check on down.example failed")
+    assert (batch.succeeded, batch.failed, batch.status) == (1, 1, DeploymentStatus.FAILED)
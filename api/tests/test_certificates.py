@@ -0,0 +1,79 @@
+"""
+CertificateService: one upload and one tmsh install per batch, skipped re-installs and the REST fallback
+"""
+import httpx
+import pytest
+
+from api.services.certificates import (
+    BASH_PATH, CERT_PATH, KEY_PATH, UPLOAD_PATH, CertificateItem, CertificateService, cert_fingerprint,
+    generate_key, self_signed_cert,
+)
+
+KEY = generate_key(1024)
+CERT = self_signed_cert(KEY, "pinned.example")
+
+
+@pytest.fixture
+def certificates():
+    service = CertificateService(pool_size=0, key_bits=1024)
+    yield service
+    service.shutdown(wait=False)
+
+
+def items():
+    return [
+        CertificateItem(name="idp", common_name="idp.example"),
+        CertificateItem(name="pinned", cert=CERT, key=KEY),
+    ]
+
+
+def test_batch_is_one_upload_and_one_install(certificates, client, transport, device):
+    assert certificates.install(client, items()) == {"idp": "installed", "pinned": "installed"}
+
+    assert transport.count("POST", UPLOAD_PATH) == 1
+    assert transport.count("POST", BASH_PATH) == 2  # the util/bash probe and the install
+    assert sorted(device.objects[KEY_PATH]) == ["/Common/idp", "/Common/pinned"]
+    assert device.objects[CERT_PATH]["/Common/pinned"]["fingerprint"] == cert_fingerprint(CERT)
+
+
+def test_reinstall_keeps_what_the_device_has(certificates, client, transport):
+    certificates.install(client, items())
+    uploads = transport.count("POST", UPLOAD_PATH)
+
+    assert certificates.install(client, items()) == {"idp": "exists", "pinned": "exists"}
+    assert transport.count("POST", UPLOAD_PATH) == uploads
+
+
+def test_changed_certificate_is_reinstalled(certificates, client, device):
+    certificates.install(client, items())
+    renewed = self_signed_cert(KEY, "pinned.example", days=30)
+
+    result = certificates.install(client, [CertificateItem(name="pinned", cert=renewed)])
+
+    assert result == {"pinned": "installed"}
+    assert device.objects[CERT_PATH]["/Common/pinned"]["fingerprint"] == cert_fingerprint(renewed)
+
+
+def test_account_without_shell_installs_each_file_over_rest(certificates, client, transport, pool):
+    def denied(request):
+        if request.url.path == BASH_PATH:
+            return httpx.Response(403, json={"message": "not authorized"}, request=request)
+        return None
+    transport.intercept = denied
+
+    assert certificates.install(client, items()) == {"idp": "installed", "pinned": "installed"}
+    assert transport.count("POST", UPLOAD_PATH) == 4  # a key and a certificate each
+    assert transport.count("POST", KEY_PATH) == 2 and transport.count("POST", CERT_PATH) == 2
+
+    # The probe is remembered per account, not per client object
+    pool.close_all()
+    certificates.install(pool.for_url("https://bigip.example", "admin", "admin"),
+                         [CertificateItem(name="other", common_name="other.example")])
+    assert transport.count("POST", BASH_PATH) == 1
+
+
+def test_invalid_names_are_refused():
+    with pytest.raises(ValueError, match="Invalid certificate name"):
+        CertificateItem.from_args({"name": "a b; rm -rf /", "common_name": "x"})
+    with pytest.raises(ValueError, match="needs cert content or a common_name"):
+        CertificateItem.from_args({"name": "empty"})
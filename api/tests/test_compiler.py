@@ -0,0 +1,94 @@
+"""
+PlanCompiler: offline compiles of the shipped solutions, the plan cache and reference validation
+"""
+import pytest
+
+from api.services.compiler import CompiledCall, PlanCompiler, mask_secrets, validate_references
+from api.services.deployment_engine import SOLUTION_PLAYBOOKS
+
+ITEMS = "/mgmt/tm/apm/policy/policy-item"
+POLICIES = "/mgmt/tm/apm/policy/access-policy"
+PROFILES = "/mgmt/tm/apm/profile/access"
+
+PLAYBOOK = """
+- hosts: bigip
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Create node {{ node_name }}
+      uri:
+        url: "https://{{ bigip_mgmt }}/mgmt/tm/ltm/node"
+        method: POST
+        user: "{{ bigip_username }}"
+        password: "{{ bigip_password }}"
+        body_format: json
+        body:
+          name: "{{ node_name }}"
+          partition: Common
+          address: 10.0.0.1
+        status_code: [200, 409]
+"""
+
+
+@pytest.fixture(scope="module")
+def compiler():
+    return PlanCompiler()
+
+
+@pytest.mark.parametrize("solution", sorted(SOLUTION_PLAYBOOKS))
+def test_shipped_solutions_compile_without_errors(compiler, solution):
+    plan = compiler.compile(SOLUTION_PLAYBOOKS[solution][0])
+    assert plan.valid, plan.problems()
+    assert plan.summary()["writes"] > 0
+
+
+def test_plans_are_cached_by_variables_and_sources(tmp_path):
+    (tmp_path / "deploy.yml").write_text(PLAYBOOK)
+    compiler = PlanCompiler(tmp_path)
+
+    plan = compiler.compile("deploy.yml", {"node_name": "web1", "bigip_mgmt": "bigip.example"})
+    assert [(call.method, call.path, call.task) for call in plan.calls] == [
+        ("POST", "/mgmt/tm/ltm/node", "Create node web1"),
+    ]
+    assert compiler.compile("deploy.yml", {"node_name": "web1", "bigip_mgmt": "other.example"}).cached
+    assert not compiler.compile("deploy.yml", {"node_name": "web2"}).cached
+    assert (compiler.hits, compiler.misses) == (1, 2)
+
+    (tmp_path / "tasks").mkdir()
+    (tmp_path / "tasks" / "extra.yml").write_text("[]")
+    assert not compiler.compile("deploy.yml", {"node_name": "web1"}).cached
+
+
+def post(index, collection, body):
+    return CompiledCall(index=index, method="POST", path=collection, body=body, status_code=200)
+
+
+def test_references_the_plan_does_not_create_are_errors():
+    calls = [
+        post(1, ITEMS, {"name": "ent", "rules": [{"nextItem": "allow"}]}),
+        post(2, POLICIES, {"name": "vpn", "startItem": "ent", "items": [{"name": "ent"}]}),
+        post(3, PROFILES, {"name": "vpn_ap", "accessPolicy": "/Common/other"}),
+    ]
+    issues = [(issue.severity, issue.call, issue.field, issue.target) for issue in validate_references(calls)]
+    assert issues == [
+        ("error", 1, "rules.nextItem", "/Common/allow"),
+        ("error", 3, "accessPolicy", "/Common/other"),
+    ]
+
+
+def test_unreachable_items_and_foreign_as3_pointers_are_warnings():
+    calls = [
+        post(1, ITEMS, {"name": "ent", "rules": []}),
+        post(2, ITEMS, {"name": "orphan"}),
+        post(3, POLICIES, {"name": "vpn", "startItem": "ent", "items": [{"name": "ent"}, {"name": "orphan"}]}),
+        post(4, "/mgmt/shared/appsvcs/declare", {"t": {"a": {"profile": {"bigip": "/Common/vpn_ap"},
+                                                              "cert": {"bigip": "/Common/default.crt"}}}}),
+    ]
+    issues = [(issue.severity, issue.call, issue.target) for issue in validate_references(calls)]
+    assert issues == [("warning", 3, "/Common/orphan"), ("warning", 4, "/Common/vpn_ap")]
+
+
+def test_secrets_are_masked_in_plans():
+    body = {"name": "radius", "secret": "s3cr3t", "servers": [{"password": "p", "port": 1812}]}
+    assert mask_secrets(body) == {"name": "radius", "secret": "********",
+                                  "servers": [{"password": "********", "port": 1812}]}
@@ -0,0 +1,78 @@
+"""
+DeploymentEngine: bounded worker threads, the pending limit for queued and in-thread jobs, task metrics
+"""
+import threading
+import uuid
+
+import pytest
+from prometheus_client import REGISTRY
+
+from api.models import BIGIPCredentials, DeploymentResponse, DeploymentStatus, SolutionType, TaskResult
+from api.services.deployment_engine import DeploymentEngine, EngineBusyError, deployment_job
+from api.services.scheduler import JobPriority, device_key
+from api.services.store import create_store
+
+CREDENTIALS = BIGIPCredentials(host="bigip.example", password="admin")
+
+
+@pytest.fixture
+def engine(pool):
+    engine = DeploymentEngine(create_store("memory://"), max_workers=2, max_pending=1, max_suspended=2,
+                              clients=pool)
+    yield engine
+    engine.shutdown(wait=False)
+
+
+def new_job(name="vpn1"):
+    record = DeploymentResponse(
+        deployment_id=str(uuid.uuid4()), solution_type=SolutionType.VPN, solution_name=name,
+        status=DeploymentStatus.PENDING, message="", target_host=CREDENTIALS.host,
+    )
+    return deployment_job(record, CREDENTIALS, {})
+
+
+def test_threads_do_not_grow_with_the_queue(engine):
+    assert engine._executor._max_workers == 4  # running jobs plus as many suspended ones
+    big = DeploymentEngine(create_store("memory://"), max_workers=8, max_pending=500)
+    try:
+        assert big._executor._max_workers == 40
+    finally:
+        big.shutdown(wait=False)
+
+
+def test_execute_counts_against_max_pending(engine):
+    holding, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=engine.scheduler.run, args=(
+        device_key(CREDENTIALS), JobPriority.DEPLOY, lambda: (holding.set(), release.wait(5.0)),
+    ))
+    holder.start()
+    try:
+        assert holding.wait(5.0)
+        queued = engine.submit(new_job("vpn1"))  # waits behind the holder: the queue is now full
+        assert queued.status == DeploymentStatus.PENDING
+        with pytest.raises(EngineBusyError):
+            engine.submit(new_job("vpn2"))
+        with pytest.raises(EngineBusyError):
+            engine.execute(new_job("vpn3"))
+        assert engine.active_jobs == 1
+    finally:
+        engine.scheduler.close(cancel=True)
+        release.set()
+        holder.join(5.0)
+
+
+def test_task_latency_is_labelled_by_module_not_task_name(engine):
+    job = new_job()
+    job.record.tasks = [
+        TaskResult(task_name=f"Create virtual server app{n}", status="ok", details={"duration": 0.1, "module": "uri"})
+        for n in range(3)
+    ]
+    before = REGISTRY.get_sample_value(
+        "apm_task_duration_seconds_count", {"operation": job.record.operation.value, "module": "uri"}
+    ) or 0
+
+    engine._publish_tasks(job.record)
+
+    assert REGISTRY.get_sample_value(
+        "apm_task_duration_seconds_count", {"operation": job.record.operation.value, "module": "uri"}
+    ) == before + 3
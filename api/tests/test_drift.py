@@ -0,0 +1,111 @@
+"""
+DriftMonitor: generation polls, re-reads of changed objects only, missing objects and redeploys
+"""
+import uuid
+
+import httpx
+import pytest
+
+from api.models import (
+    BIGIPCredentials, DeploymentResponse, DeploymentStatus, OperationType, SolutionType, TrackedObject
+)
+from api.services.drift import DriftMonitor
+from api.services.scheduler import device_key
+from api.services.store import create_store
+
+CREDENTIALS = BIGIPCredentials(host="bigip.example", password="admin")
+NODES = "/mgmt/tm/ltm/node"
+
+
+@pytest.fixture
+def store():
+    return create_store("memory://")
+
+
+@pytest.fixture
+def drift(store, pool):
+    monitor = DriftMonitor(store, pool, concurrency=2)
+    yield monitor
+    monitor.shutdown(wait=False)
+
+
+def node(client, name, description="v1"):
+    body = {"name": name, "partition": "Common", "address": "10.0.0.1", "description": description}
+    assert client.post(NODES, json=body).status_code == 200
+    return f"{NODES}/~Common~{name}"
+
+
+def deployed(*paths, operation=OperationType.DEPLOY, solution_name="vpn1", description="v1"):
+    return DeploymentResponse(
+        deployment_id=str(uuid.uuid4()), solution_type=SolutionType.VPN, solution_name=solution_name,
+        status=DeploymentStatus.COMPLETED, message="", target_host=CREDENTIALS.host, operation=operation,
+        tracked_objects={path: TrackedObject(declared={"description": description}) for path in paths},
+    )
+
+
+def test_unchanged_objects_cost_one_poll_per_collection(drift, client, transport):
+    web1, web2 = node(client, "web1"), node(client, "web2")
+    drift.observe(deployed(web1, web2), CREDENTIALS)
+
+    assert drift.run_once() == {"in_sync": 1, "drifted": 0, "errors": 0}
+    assert transport.count("GET", f"{NODES}/") == 2  # each object read once
+    assert drift.run_once()["in_sync"] == 1
+
+    assert transport.count("GET", f"{NODES}/") == 2
+    assert transport.count("GET", NODES) == 4  # plus one collection poll per pass
+
+
+def test_changed_and_missing_objects_are_reported(drift, client, transport):
+    web1, web2 = node(client, "web1"), node(client, "web2")
+    record = deployed(web1, web2)
+    drift.observe(record, CREDENTIALS)
+    drift.run_once()
+
+    client.patch(web1, json={"description": "edited by hand"})
+    client.delete(web2)
+    reads = transport.count("GET", f"{NODES}/")
+    assert drift.run_once()["drifted"] == 1
+
+    report = drift.report(record.deployment_id)
+    assert [(item.path, item.change) for item in report.drifted] == [(web1, "modified"), (web2, "missing")]
+    assert report.drifted[0].fields == {"description": {"declared": "v1", "actual": "edited by hand"}}
+    assert transport.count("GET", f"{NODES}/") - reads == 1  # only the object whose generation moved
+
+
+def test_failed_poll_reports_an_error_not_drift(drift, client, transport):
+    drift.observe(deployed(node(client, "web1")), CREDENTIALS)
+
+    def failing(request):
+        if request.url.path == NODES:
+            return httpx.Response(500, json={"message": "restjavad restarting"}, request=request)
+        return None
+    transport.intercept = failing
+
+    (report,) = drift.check_device(device_key(CREDENTIALS))
+
+    assert report.error and "HTTP 500" in report.error
+    assert not report.in_sync and report.drifted == []
+
+
+def test_redeploy_keeps_earlier_objects_and_delete_stops_the_watch(drift, client):
+    web1, web2 = node(client, "web1"), node(client, "web2", description="v2")
+    drift.observe(deployed(web1), CREDENTIALS)
+    redeploy = deployed(web2, description="v2")  # a diff-mode deploy that only wrote web2
+    drift.observe(redeploy, CREDENTIALS)
+
+    assert sorted(redeploy.tracked_objects) == [web1, web2]
+    assert drift.run_once()["in_sync"] == 1
+
+    drift.observe(deployed(operation=OperationType.DELETE), CREDENTIALS)
+    assert drift.summary()["solutions"] == 0 and drift.run_once() == {"in_sync": 0, "drifted": 0, "errors": 0}
+
+
+def test_adopt_watches_what_the_store_says_is_deployed(drift, store, client):
+    web1 = node(client, "web1")
+    store.save(deployed(web1, solution_name="vpn1"))
+    store.save(deployed(node(client, "web2"), solution_name="vpn2"))
+    store.save(deployed(solution_name="vpn2", operation=OperationType.DELETE))
+
+    reports = drift.adopt(CREDENTIALS)
+
+    assert [(report.solution_name, report.in_sync) for report in reports] == [("vpn1", True)]
@@ -0,0 +1,104 @@
+"""
+F5Client and ClientPool: token cache keys, refused logins and retired clients
+"""
+import threading
+
+import httpx
+import pytest
+
+from api.services import f5_client
+from api.services.f5_client import ClientPool, F5AuthError, F5Client, F5Error, TokenCache
+
+PASSWORD = "right"
+
+
+class Device:
+    """iControl REST login and one readable object; ``refusals`` logins fail before the password counts"""
+
+    def __init__(self, password=PASSWORD, refusals=0):
+        self.password = password
+        self.refusals = refusals
+        self.logins = 0
+        self.tokens = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            if request.url.path == f5_client.LOGIN_PATH:
+                self.logins += 1
+                password = httpx.Response(200, content=request.content).json()["password"]
+                if self.refusals or password != self.password:
+                    self.refusals = max(self.refusals - 1, 0)
+                    return httpx.Response(401, json={"code": 401, "message": "Authentication failed."})
+                token = f"token-{self.logins}"
+                self.tokens.add(token)
+                return httpx.Response(200, json={"token": {"token": token, "timeout": 1200}})
+            if request.url.path.startswith(f5_client.TOKENS_PATH):
+                return httpx.Response(200, json={})
+            if request.headers.get("X-F5-Auth-Token") not in self.tokens:
+                return httpx.Response(401, json={"code": 401})
+            return httpx.Response(200, json={"name": "ok"})
+
+
+@pytest.fixture(autouse=True)
+def no_login_delay(monkeypatch):
+    monkeypatch.setattr(f5_client, "LOGIN_RETRY_DELAY", 0.0)
+
+
+def test_wrong_password_does_not_reuse_a_cached_token():
+    device, cache = Device(), TokenCache()
+    transport = httpx.MockTransport(device)
+    right = F5Client("bigip", password=PASSWORD, token_cache=cache, transport=transport)
+    wrong = F5Client("bigip", password="wrong", token_cache=cache, transport=transport)
+    assert right.get_json("/mgmt/tm/sys/version") == {"name": "ok"}
+    with pytest.raises(F5AuthError):
+        wrong.get("/mgmt/tm/sys/version")
+    assert device.logins == 3  # one for the right password, two refusals
+
+
+def test_refused_login_is_tried_once_more():
+    device = Device(refusals=1)
+    client = F5Client("bigip", password=PASSWORD, transport=httpx.MockTransport(device))
+    assert client.get("/mgmt/tm/sys/version").status_code == 200
+    assert device.logins == 2
+
+
+def test_retired_client_keeps_serving_its_holders():
+    device = Device()
+    pool = ClientPool(transport=httpx.MockTransport(device))
+    old = pool.get("bigip", password="old")
+    device.password = "old"
+    assert old.get("/mgmt/tm/sys/version").status_code == 200
+
+    device.password = PASSWORD
+    current = pool.get("bigip", password=PASSWORD)
+    assert current.get("/mgmt/tm/sys/version").status_code == 200
+    # "old" is retired but its token still works for the job holding it
+    assert old.get("/mgmt/tm/sys/version").status_code == 200
+    assert pool.get("bigip", password="old") is not old
+    pool.close_all()
+
+
+def test_refused_client_is_replaced_without_failing_its_holder():
+    device = Device()
+    pool = ClientPool(transport=httpx.MockTransport(device))
+    client = pool.get("bigip", password=PASSWORD)
+    assert client.get("/mgmt/tm/sys/version").status_code == 200
+    device.password = "rotated"
+    with pytest.raises(F5AuthError):
+        client.token(force_refresh=True)
+    assert pool.get("bigip", password=PASSWORD) is not client
+    assert client.get("/mgmt/tm/sys/version").status_code == 200  # still holds a valid token
+    pool.close_all()
+
+
+def test_idle_retired_clients_are_closed():
+    device = Device()
+    pool = ClientPool(retired_idle_close=0.0, transport=httpx.MockTransport(device))
+    old = pool.get("bigip", password="old")
+    with pytest.raises(F5AuthError):
+        old.get("/mgmt/tm/sys/version")
+    pool.get("bigip", password=PASSWORD)
+    with pytest.raises(F5Error, match="retired"):
+        old.get("/mgmt/tm/sys/version")
+    pool.close_all()
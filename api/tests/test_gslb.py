@@ -0,0 +1,82 @@
+"""
+GTMTopologyCache: one topology read per DNS server, local 409s and one create for concurrent jobs
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api.services.gslb import DATACENTER_PATH, SERVER_PATH, GTMTopologyCache
+
+VIRTUAL_SERVERS = f"{SERVER_PATH}/~Common~bigip1/virtual-servers"
+
+
+@pytest.fixture
+def gtm():
+    return GTMTopologyCache()
+
+
+def send(gtm, client, method, path, body=None, status_codes=(200, 409)):
+    """What the executor does: ask the cache, else send the call and fold its answer in"""
+    answer = gtm.answer(client, method, path, body, status_codes)
+    if answer is not None:
+        return answer
+    response = client.request(method, path, json=body)
+    gtm.record(client, method, path, body, response.status_code)
+    return response.status_code, response.json()
+
+
+def test_topology_is_read_once(gtm, client, transport):
+    client.post(DATACENTER_PATH, json={"name": "dc1", "partition": "Common"})
+
+    for _ in range(3):
+        status, body = send(gtm, client, "GET", DATACENTER_PATH)
+        assert status == 200 and [dc["name"] for dc in body["items"]] == ["dc1"]
+        send(gtm, client, "GET", SERVER_PATH)
+
+    assert transport.count("GET", DATACENTER_PATH) == 1
+    assert transport.count("GET", SERVER_PATH) == 1
+    assert (gtm.hits, gtm.misses) == (5, 1)
+
+
+def test_existing_objects_are_answered_409_where_the_task_accepts_it(gtm, client, transport):
+    client.post(DATACENTER_PATH, json={"name": "dc1", "partition": "Common"})
+    body = {"name": "dc1", "partition": "Common"}
+
+    assert gtm.answer(client, "POST", DATACENTER_PATH, body, (200, 409))[0] == 409
+    assert gtm.answer(client, "POST", DATACENTER_PATH, body, (200,)) is None
+    assert transport.count("POST", DATACENTER_PATH) == 1
+
+
+def test_creates_are_added_to_the_cached_topology(gtm, client, transport):
+    send(gtm, client, "GET", SERVER_PATH)
+    assert send(gtm, client, "POST", SERVER_PATH, {"name": "bigip1", "datacenter": "/Common/dc1"})[0] == 200
+    assert send(gtm, client, "POST", VIRTUAL_SERVERS, {"name": "vs1", "destination": "10.0.0.1:443"})[0] == 200
+
+    assert send(gtm, client, "POST", SERVER_PATH, {"name": "bigip1"})[0] == 409
+    assert send(gtm, client, "POST", VIRTUAL_SERVERS, {"name": "vs1"})[0] == 409
+    assert transport.count("POST", SERVER_PATH) == 2
+    assert transport.count("GET", SERVER_PATH) == 1
+
+
+def test_concurrent_creates_of_one_object_send_one_post(gtm, client, transport):
+    send(gtm, client, "GET", DATACENTER_PATH)
+    transport.delay = lambda request: 0.2 if request.method == "POST" else 0.0
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        statuses = list(executor.map(
+            lambda _: send(gtm, client, "POST", DATACENTER_PATH, {"name": "dc1", "partition": "Common"})[0],
+            range(4),
+        ))
+
+    assert sorted(statuses) == [200, 409, 409, 409]
+    assert transport.count("POST", DATACENTER_PATH) == 1
+
+
+def test_other_writes_drop_the_cached_topology(gtm, client, transport):
+    client.post(DATACENTER_PATH, json={"name": "dc1", "partition": "Common"})
+    send(gtm, client, "GET", DATACENTER_PATH)
+
+    send(gtm, client, "PATCH", f"{DATACENTER_PATH}/~Common~dc1", {"description": "moved"})
+    send(gtm, client, "GET", DATACENTER_PATH)
+
+    assert transport.count("GET", DATACENTER_PATH) == 2
@@ -0,0 +1,127 @@
+"""
+IdempotencyGuard: Idempotency-Key replay, mismatch, purged deployments and in-flight coalescing
+"""
+import uuid
+
+import pytest
+
+from api.models import DeploymentResponse, DeploymentStatus, SolutionType
+from api.services import idempotency
+from api.services.idempotency import (
+    IdempotencyConflict, IdempotencyGone, IdempotencyGuard, request_fingerprint,
+)
+from api.services.store import create_store
+
+ENDPOINT = "/api/v1/deploy/solution1"
+BODY = {"solution_name": "vpn1", "credentials": {"host": "10.0.0.1"}, "vpn_config": {"dns": ["10.1.20.6"]}}
+
+
+@pytest.fixture
+def store():
+    return create_store("memory://")
+
+
+@pytest.fixture
+def guard(store):
+    return IdempotencyGuard(store, ttl=60)
+
+
+def new_record(status=DeploymentStatus.PENDING):
+    return DeploymentResponse(
+        deployment_id=str(uuid.uuid4()), solution_type=SolutionType.VPN, solution_name="vpn1",
+        status=status, message="", target_host="10.0.0.1",
+    )
+
+
+def submit(guard, store, body=BODY, key=None, status=DeploymentStatus.PENDING):
+    """Claim like the API does and save the record when it is a new deployment"""
+    record = new_record(status)
+    claim = guard.claim(ENDPOINT, body, record, key)
+    if claim.existing is None:
+        store.save(record)
+        return record, claim
+    return claim.existing, claim
+
+
+def test_fingerprint_ignores_key_order():
+    reordered = {key: BODY[key] for key in reversed(list(BODY))}
+    assert request_fingerprint(ENDPOINT, BODY) == request_fingerprint(ENDPOINT, reordered)
+    assert request_fingerprint(ENDPOINT, BODY) != request_fingerprint("/api/v1/deploy/solution2", BODY)
+
+
+def test_same_key_replays_the_deployment(guard, store):
+    first, claim = submit(guard, store, key="retry-1", status=DeploymentStatus.COMPLETED)
+    assert claim.existing is None
+    assert len(claim.keys) == 2  # the key and the in-flight key
+    replayed, claim = submit(guard, store, key="retry-1")
+    assert claim.existing is not None
+    assert replayed.deployment_id == first.deployment_id
+    assert claim.keys == []
+
+
+def test_finished_deploys_replay_by_key_only(guard, store):
+    first, _ = submit(guard, store, key="a", status=DeploymentStatus.COMPLETED)
+    second, claim = submit(guard, store, key="b")
+    assert claim.existing is None
+    assert second.deployment_id != first.deployment_id
+
+
+def test_key_reused_for_a_different_request(guard, store):
+    submit(guard, store, key="retry-1")
+    other = dict(BODY, solution_name="vpn2")
+    with pytest.raises(IdempotencyConflict):
+        guard.claim(ENDPOINT, other, new_record(), "retry-1")
+    with pytest.raises(IdempotencyConflict):
+        guard.claim("/api/v1/deploy/solution2", BODY, new_record(), "retry-1")
+
+
+@pytest.mark.parametrize("key", ["", "k" * (idempotency.MAX_KEY_LENGTH + 1)])
+def test_key_length_is_checked(guard, key):
+    with pytest.raises(IdempotencyConflict):
+        guard.claim(ENDPOINT, BODY, new_record(), key)
+
+
+def test_purged_deployment_is_gone(guard, store, monkeypatch):
+    monkeypatch.setattr(idempotency, "RECORD_WAIT", 0.1)
+    record = new_record()
+    guard.claim(ENDPOINT, BODY, record, "retry-1")  # claimed, but the record never reaches the store
+    with pytest.raises(IdempotencyGone):
+        guard.claim(ENDPOINT, BODY, new_record(), "retry-1")
+
+
+def test_identical_inflight_request_is_coalesced(guard, store):
+    first, _ = submit(guard, store)
+    second, claim = submit(guard, store)
+    assert claim.existing is not None
+    assert second.deployment_id == first.deployment_id
+    _, claim = submit(guard, store, body=dict(BODY, solution_name="vpn2"))
+    assert claim.existing is None
+
+
+def test_finished_deploy_is_not_coalesced(guard, store):
+    first, _ = submit(guard, store)
+    first.status = DeploymentStatus.COMPLETED
+    store.save(first)
+    second, claim = submit(guard, store)
+    assert claim.existing is None
+    assert second.deployment_id != first.deployment_id
+    third, claim = submit(guard, store)  # the new deploy now owns the in-flight key
+    assert third.deployment_id == second.deployment_id
+
+
+def test_coalesced_key_replays_the_job_it_joined(guard, store):
+    first, _ = submit(guard, store)
+    joined, _ = submit(guard, store, key="retry-1")
+    assert joined.deployment_id == first.deployment_id
+    replayed, claim = submit(guard, store, key="retry-1")
+    assert claim.existing is not None
+    assert replayed.deployment_id == first.deployment_id
+
+
+def test_release_frees_the_keys(guard, store):
+    record = new_record()
+    claim = guard.claim(ENDPOINT, BODY, record, "retry-1")
+    guard.release(claim, record)  # the engine refused the job
+    again, claim = submit(guard, store, key="retry-1")
+    assert claim.existing is None
+    assert again.deployment_id != record.deployment_id
@@ -0,0 +1,93 @@
+"""
+Planner: diffing a playbook's writes against the device, reads that fail and partition-qualified names
+"""
+import httpx
+import pytest
+
+from api.services.planner import Planner, equivalent
+
+NODES = "/mgmt/tm/ltm/node"
+
+PLAYBOOK = """
+- hosts: bigip
+  connection: local
+  gather_facts: no
+  vars:
+    node_monitor: /Common/icmp
+  tasks:
+    - name: Create node
+      uri:
+        url: "https://bigip.example/mgmt/tm/ltm/node"
+        method: POST
+        user: admin
+        password: admin
+        body_format: json
+        body:
+          name: web1
+          partition: Common
+          address: 10.0.0.1
+          monitor: "{{ node_monitor }}"
+        status_code: [200, 409]
+"""
+
+
+@pytest.fixture
+def planner(pool, tmp_path):
+    (tmp_path / "deploy.yml").write_text(PLAYBOOK)
+    return Planner(pool, tmp_path)
+
+
+def test_plan_creates_then_settles(device, planner):
+    plan, result = planner.plan("deploy.yml")
+    assert not result.failed
+    assert result.tasks[0].details["module"] == "uri"
+    assert [(change.action, change.name) for change in plan.pending] == [("create", "/Common/web1")]
+    assert NODES not in device.objects or not device.objects[NODES]  # planning writes nothing
+
+    assert not planner.apply(plan).failed
+    plan, result = planner.plan("deploy.yml")
+    assert not result.failed
+    assert plan.pending == []
+    assert plan.summary()["noop"] == 1
+
+
+def test_object_in_another_partition_is_an_update(device, planner, client):
+    client.post(NODES, json={"name": "web1", "partition": "Common", "address": "10.0.0.1",
+                             "monitor": "/Other/icmp"})
+    plan, _ = planner.plan("deploy.yml")
+    assert [(change.action, change.body) for change in plan.pending] == [("update", {"monitor": "/Common/icmp"})]
+
+
+@pytest.mark.parametrize("status_code", [401, 403, 503])
+def test_failed_read_fails_the_plan(transport, planner, status_code):
+    def unavailable(request):
+        if request.method == "GET" and request.url.path == NODES:
+            return httpx.Response(status_code, json={"code": status_code}, request=request)
+        return None
+    transport.intercept = unavailable
+
+    plan, result = planner.plan("deploy.yml")
+    assert result.failed
+    assert f"returned HTTP {status_code}" in " ".join(result.errors)
+    assert plan.pending == []  # not planned as a create
+
+
+def test_missing_collection_reads_as_empty(transport, planner):
+    def missing(request):
+        if request.method == "GET" and request.url.path == NODES:
+            return httpx.Response(404, json={"code": 404}, request=request)
+        return None
+    transport.intercept = missing
+
+    plan, result = planner.plan("deploy.yml")
+    assert not result.failed
+    assert [change.action for change in plan.pending] == ["create"]
+
+
+def test_names_compare_with_their_partition():
+    assert equivalent("web1", "/Common/web1")
+    assert equivalent("/Common/web1", "/Common/web1")
+    assert not equivalent("/Common/web1", "/Other/web1")
+    assert not equivalent("web1", "/Other/web1")
+    assert equivalent(["a", "/Common/b"], ["/Common/b", "/Common/a"])
+    assert not equivalent([{"name": "/Common/a"}], [{"name": "/Other/a"}])
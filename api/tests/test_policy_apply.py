@@ -0,0 +1,107 @@
+"""
+PolicyApplyCoordinator: one tmsh run per device batch, REST fallback and coalescing across suspended jobs
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from api.services.f5_client import ClientPool
+from api.services.policy_apply import ACCESS_PROFILE_PATH, PolicyApplyCoordinator
+from api.services.scheduler import DeviceScheduler, JobPriority
+
+from .conftest import BIGIP
+
+BASH = "/mgmt/tm/util/bash"
+TIMEOUT = 5.0
+
+
+@pytest.fixture
+def profiles(device):
+    names = [f"/Common/ap{index}" for index in range(4)]
+    device.objects[ACCESS_PROFILE_PATH] = {name: {"fullPath": name, "generation": 1} for name in names}
+    return names
+
+
+@pytest.fixture
+def coordinator():
+    coordinator = PolicyApplyCoordinator(window=0.05)
+    yield coordinator
+    coordinator.shutdown()
+
+
+def generations(device):
+    return {name: item["generation"] for name, item in device.objects[ACCESS_PROFILE_PATH].items()}
+
+
+def test_pending_profiles_are_applied_in_one_run(device, transport, client, coordinator, profiles):
+    futures = [coordinator.submit(client, name) for name in profiles + profiles[:1]]
+    assert [future.result(TIMEOUT)[0] for future in futures] == [200] * 5
+    assert coordinator.runs == 1 and coordinator.applies == 4  # a repeated profile is applied once
+    assert transport.count("POST", BASH) == 1
+    assert transport.count("PATCH", ACCESS_PROFILE_PATH) == 0
+    assert set(generations(device).values()) == {2}
+
+
+def test_missing_profile_fails_only_its_callers(client, coordinator, profiles):
+    ok, missing = coordinator.submit(client, profiles[0]), coordinator.submit(client, "/Common/gone")
+    assert ok.result(TIMEOUT)[0] == 200
+    assert missing.result(TIMEOUT)[0] == 404
+
+
+def test_single_profile_and_shell_denied_use_rest(transport, client, coordinator, profiles):
+    assert coordinator.submit(client, profiles[0]).result(TIMEOUT)[0] == 200
+    assert transport.count("POST", BASH) == 0
+    assert transport.count("PATCH", ACCESS_PROFILE_PATH) == 1
+
+    transport.intercept = lambda request: (
+        httpx.Response(401, json={"code": 401}, request=request) if request.url.path == BASH else None
+    )
+    futures = [coordinator.submit(client, name) for name in profiles[1:]]
+    assert [future.result(TIMEOUT)[0] for future in futures] == [200] * 3
+    assert transport.count("PATCH", ACCESS_PROFILE_PATH) == 4
+    denied = transport.count("POST", BASH)
+    futures = [coordinator.submit(client, name) for name in profiles[:2]]
+    assert [future.result(TIMEOUT)[0] for future in futures] == [200] * 2
+    assert transport.count("POST", BASH) == denied  # the account is not asked again
+
+
+def test_queues_are_per_account_and_dropped_when_done(transport, client, coordinator, profiles):
+    other_pool = ClientPool(transport=transport)
+    try:
+        same_account = other_pool.for_url(BIGIP, "admin", "admin")
+        assert same_account is not client
+        futures = [coordinator.submit(client, profiles[0]), coordinator.submit(same_account, profiles[1])]
+        assert [future.result(TIMEOUT)[0] for future in futures] == [200, 200]
+        assert coordinator.runs == 1
+        assert coordinator._queues == {}
+    finally:
+        other_pool.close_all()
+
+
+def test_jobs_queued_on_the_device_join_one_apply(device, client, coordinator, profiles):
+    """Suspended jobs' applies take the device behind the jobs queued on it, so all of them share one run"""
+    executor = ThreadPoolExecutor(max_workers=8)
+    scheduler = DeviceScheduler(executor, max_running=2)
+    answers = []
+    lock = threading.Lock()
+
+    def deploy(name):
+        time.sleep(0.03)  # the deploy's writes: together longer than the window
+        future = coordinator.submit(client, name, exclusive=lambda: scheduler.exclusive("bigip:443"))
+        answer = scheduler.suspend("bigip:443", lambda: future.result(TIMEOUT))
+        with lock:
+            answers.append(answer[0])
+
+    try:
+        for index, name in enumerate(profiles):
+            scheduler.submit("bigip:443", JobPriority.DEPLOY, deploy, name, group=f"solution{index}")
+        assert scheduler.join(TIMEOUT)
+    finally:
+        scheduler.close()
+        executor.shutdown()
+    assert answers == [200] * 4
+    assert coordinator.runs == 1
+    assert set(generations(device).values()) == {2}
@@ -0,0 +1,229 @@
+"""
+DeviceScheduler: per-device ordering, serialisation and suspend
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api.services.scheduler import DeviceScheduler, JobPriority
+
+TIMEOUT = 5.0
+
+
+@pytest.fixture
+def scheduler():
+    executor = ThreadPoolExecutor(max_workers=8)
+    scheduler = DeviceScheduler(executor, max_running=8)
+    yield scheduler
+    scheduler.close(cancel=True)
+    executor.shutdown(wait=True)
+
+
+def blocker(scheduler, key, group=None):
+    """Occupy ``key`` until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(TIMEOUT)
+
+    scheduler.submit(key, JobPriority.DEPLOY, hold, label="blocker", group=group)
+    assert started.wait(TIMEOUT)
+    return release
+
+
+def test_priority_then_fifo_per_device(scheduler):
+    order = []
+    release = blocker(scheduler, "bigip1:443")
+    for name, priority in [("deploy-a", JobPriority.DEPLOY), ("delete-b", JobPriority.DELETE),
+                           ("deploy-c", JobPriority.DEPLOY), ("rollback-d", JobPriority.ROLLBACK),
+                           ("delete-e", JobPriority.DELETE)]:
+        scheduler.submit("bigip1:443", priority, order.append, name, label=name)
+    assert scheduler.ahead("bigip1:443", JobPriority.DELETE) == 4  # running + rollback + 2 deletes
+    release.set()
+    assert scheduler.join(TIMEOUT)
+    assert order == ["rollback-d", "delete-b", "delete-e", "deploy-a", "deploy-c"]
+
+
+def test_one_job_per_device_and_devices_in_parallel(scheduler):
+    active = {"bigip1:443": 0, "bigip2:443": 0}
+    overlaps = []
+    both_running = threading.Barrier(2, timeout=TIMEOUT)
+    lock = threading.Lock()
+
+    def job(key, meet):
+        with lock:
+            active[key] += 1
+            overlaps.append(active[key])
+        if meet:
+            both_running.wait()  # raises BrokenBarrierError if the devices were serialised
+        time.sleep(0.01)
+        with lock:
+            active[key] -= 1
+
+    for index in range(5):
+        for key in active:
+            scheduler.submit(key, JobPriority.DEPLOY, job, key, index == 0)
+    assert scheduler.join(TIMEOUT)
+    assert max(overlaps) == 1
+    assert scheduler.stats()["completed"] == 10
+
+
+def test_run_waits_for_the_device(scheduler):
+    release = blocker(scheduler, "bigip1:443")
+    results = []
+    caller = threading.Thread(
+        target=lambda: results.append(scheduler.run("bigip1:443", JobPriority.DEPLOY, lambda: "ran"))
+    )
+    caller.start()
+    time.sleep(0.05)
+    assert results == []
+    release.set()
+    caller.join(TIMEOUT)
+    assert results == ["ran"]
+
+
+def test_suspend_only_lets_other_groups_in(scheduler):
+    log = []
+    waiting, done_waiting = threading.Event(), threading.Event()
+
+    def suspended_job():
+        log.append("s1-start")
+        scheduler.suspend("bigip1:443", lambda: (waiting.set(), done_waiting.wait(TIMEOUT)))
+        log.append("s1-resumed")
+
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, suspended_job, group="solution1")
+    assert waiting.wait(TIMEOUT)
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, log.append, "s1-second", group="solution1")
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, log.append, "ungrouped")
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, log.append, "s2", group="solution2")
+    deadline = time.monotonic() + TIMEOUT
+    while "s2" not in log and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert log == ["s1-start", "s2"]  # same group and ungrouped jobs keep waiting
+    done_waiting.set()
+    assert scheduler.join(TIMEOUT)
+    assert log == ["s1-start", "s2", "s1-resumed", "s1-second", "ungrouped"]
+
+
+def test_resume_goes_ahead_of_queued_jobs(scheduler):
+    log = []
+    waiting, done_waiting = threading.Event(), threading.Event()
+
+    def suspended_job():
+        scheduler.suspend("bigip1:443", lambda: (waiting.set(), done_waiting.wait(TIMEOUT)))
+        log.append("resumed")
+
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, suspended_job, group="solution1")
+    assert waiting.wait(TIMEOUT)
+    release = blocker(scheduler, "bigip1:443", group="solution2")  # another solution takes the device
+    scheduler.submit("bigip1:443", JobPriority.ROLLBACK, log.append, "rollback", group="solution3")
+    done_waiting.set()
+    time.sleep(0.05)
+    release.set()
+    assert scheduler.join(TIMEOUT)
+    assert log == ["resumed", "rollback"]
+
+
+def test_writes_for_a_suspended_job_take_the_device_back(scheduler):
+    log = []
+    write_queued, written = threading.Event(), threading.Event()
+
+    def write():
+        with scheduler.exclusive("bigip1:443"):
+            log.append("write-start")
+            time.sleep(0.05)
+            log.append("write-end")
+            written.set()
+
+    def suspended_job():
+        scheduler.suspend("bigip1:443", lambda: (write_queued.wait(TIMEOUT), written.wait(TIMEOUT)))
+        log.append("s1-resumed")
+
+    release = blocker(scheduler, "bigip1:443", group="solution1")
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, suspended_job, group="solution2")
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, log.append, "s3-queued-before", group="solution3")
+    writer = threading.Thread(target=write)
+    writer.start()
+    time.sleep(0.05)
+    write_queued.set()
+    release.set()
+    deadline = time.monotonic() + TIMEOUT
+    while "write-start" not in log and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.submit("bigip1:443", JobPriority.DEPLOY, log.append, "s4-queued-during", group="solution4")
+    writer.join(TIMEOUT)
+    assert scheduler.join(TIMEOUT)
+    # Jobs queued before the write run first; nothing runs while it is made
+    assert log[:3] == ["s3-queued-before", "write-start", "write-end"]
+    assert sorted(log[3:]) == ["s1-resumed", "s4-queued-during"]
+    assert scheduler.stats()["completed"] == 4
+
+
+def test_suspended_jobs_keep_their_slot_beyond_max_suspended():
+    executor = ThreadPoolExecutor(max_workers=2)  # max_running + max_suspended
+    scheduler = DeviceScheduler(executor, max_running=1, max_suspended=1)
+    started, release = [], threading.Event()
+    two_suspended = threading.Barrier(3, timeout=TIMEOUT)
+
+    def job(name):
+        started.append(name)
+        if name != "third":
+            scheduler.suspend(f"{name}:443", lambda: (two_suspended.wait(), release.wait(TIMEOUT)))
+
+    try:
+        for name in ("first", "second", "third"):
+            scheduler.submit(f"{name}:443", JobPriority.DEPLOY, job, name)
+        two_suspended.wait()
+        time.sleep(0.05)
+        # first gave its slot to second; second kept it, so third waits for a slot
+        assert started == ["first", "second"]
+        assert scheduler.stats()["suspended"] == 2
+        release.set()
+        assert scheduler.join(TIMEOUT)
+        assert started == ["first", "second", "third"]
+        assert scheduler.stats()["completed"] == 3
+    finally:
+        scheduler.close()
+        executor.shutdown(wait=False)  # a deadlock fails the join instead of hanging here
+
+
+def test_job_that_kept_its_slot_resumes_ahead_of_one_waiting_for_a_slot():
+    executor = ThreadPoolExecutor(max_workers=2)
+    scheduler = DeviceScheduler(executor, max_running=1, max_suspended=1)
+    suspended = {name: threading.Event() for name in ("parked", "slotted")}
+    release = {name: threading.Event() for name in ("parked", "slotted")}
+    log = []
+
+    def job(name):
+        scheduler.suspend("bigip1:443", lambda: (suspended[name].set(), release[name].wait(TIMEOUT)))
+        log.append(name)
+
+    try:
+        scheduler.submit("bigip1:443", JobPriority.DEPLOY, job, "parked", group="solution1")
+        assert suspended["parked"].wait(TIMEOUT)
+        scheduler.submit("bigip1:443", JobPriority.DEPLOY, job, "slotted", group="solution2")
+        assert suspended["slotted"].wait(TIMEOUT)
+        release["parked"].set()  # resumes first but needs the slot "slotted" still holds
+        time.sleep(0.05)
+        release["slotted"].set()
+        assert scheduler.join(TIMEOUT)
+        assert log == ["slotted", "parked"]
+    finally:
+        scheduler.close()
+        executor.shutdown(wait=False)  # a deadlock fails the join instead of hanging here
+
+
+def test_close_cancel_drops_queued_jobs(scheduler):
+    release = blocker(scheduler, "bigip1:443")
+    ran = []
+    for index in range(3):
+        scheduler.submit("bigip1:443", JobPriority.DEPLOY, ran.append, index)
+    assert scheduler.close(cancel=True) == 3
+    with pytest.raises(RuntimeError):
+        scheduler.submit("bigip1:443", JobPriority.DEPLOY, ran.append, "late")
+    release.set()
+    assert scheduler.join(TIMEOUT)
+    assert ran == []
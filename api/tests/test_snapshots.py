@@ -0,0 +1,85 @@
+"""
+Snapshots: rollback diffs (re-create, patch, delete) and deleted objects that carry secrets
+"""
+import pytest
+
+from api.services.planner import Planner
+from api.services.snapshots import RollbackError, SnapshotService, secret_fields
+
+NODES = "/mgmt/tm/ltm/node"
+RADIUS = "/mgmt/tm/apm/aaa/radius"
+
+
+@pytest.fixture
+def snapshots():
+    return SnapshotService()
+
+
+@pytest.fixture
+def planner(pool, tmp_path):
+    return Planner(pool, tmp_path)
+
+
+def node(client, name, **fields):
+    response = client.post(NODES, json={"name": name, "partition": "Common", "address": "10.0.0.1", **fields})
+    assert response.status_code == 200
+    return f"{NODES}/~Common~{name}"
+
+
+def changes(plan):
+    return [(change.action, change.name) for change in plan.pending]
+
+
+def test_rollback_recreates_patches_and_deletes(client, snapshots, planner):
+    web1, web2 = node(client, "web1", description="v1"), node(client, "web2")
+    snapshot = snapshots.take(client, [web1, web2])
+    client.delete(web2)
+    client.patch(web1, json={"description": "v2"})
+    web3 = node(client, "web3")
+
+    plan = snapshots.plan_rollback(client, snapshot, [web1, web2, web3])
+
+    assert changes(plan) == [("create", "/Common/web2"), ("update", "/Common/web1"), ("delete", "/Common/web3")]
+    assert plan.pending[1].body == {"description": "v1"}
+    assert not planner.apply(plan).failed
+    assert client.get(web1).json()["description"] == "v1"
+    assert client.get(web2).status_code == 200
+    assert client.get(web3).status_code == 404
+    assert snapshots.plan_rollback(client, snapshot, [web1, web2]).pending == []
+
+
+def test_unchanged_device_plans_nothing(client, snapshots):
+    web1 = node(client, "web1")
+    snapshot = snapshots.take(client, [web1])
+
+    plan = snapshots.plan_rollback(client, snapshot, [web1])
+
+    assert plan.pending == [] and plan.summary()["noop"] == 1
+
+
+def test_deleted_object_with_a_secret_fails_the_plan(client, snapshots):
+    server = f"{RADIUS}/~Common~radius1"
+    assert client.post(RADIUS, json={"name": "radius1", "partition": "Common",
+                                     "server": {"address": "10.0.0.9", "secret": "$M$encrypted"}}).status_code == 200
+    snapshot = snapshots.take(client, [server])
+    client.delete(server)
+
+    with pytest.raises(RollbackError, match=r"/Common/radius1 \(server\.secret\)"):
+        snapshots.plan_rollback(client, snapshot, [server])
+
+
+def test_existing_object_with_a_secret_is_patched_without_it(client, snapshots):
+    server = f"{RADIUS}/~Common~radius1"
+    client.post(RADIUS, json={"name": "radius1", "partition": "Common", "description": "v1",
+                              "secret": "$M$encrypted"})
+    snapshot = snapshots.take(client, [server])
+    client.patch(server, json={"description": "v2", "secret": "$M$rotated"})
+
+    plan = snapshots.plan_rollback(client, snapshot, [server])
+
+    assert [change.body for change in plan.pending if change.action == "update"] == [{"description": "v1"}]
+
+
+def test_secret_fields_finds_nested_secrets():
+    body = {"name": "idp", "password": "x", "servers": [{"address": "a", "sharedSecret": "y"}], "mode": "z"}
+    assert secret_fields(body) == ["password", "servers.sharedSecret"]
@@ -0,0 +1,168 @@
+"""
+Deployment stores: cursor pagination, filters, retention and idempotency keys
+"""
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from api.models import DeploymentResponse, DeploymentStatus, OperationType, SolutionType, TaskResult
+from api.services.store import RetentionPolicy, SQLiteStore, create_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = create_store("memory://") if request.param == "memory" else SQLiteStore(str(tmp_path / "apm.db"))
+    yield store
+    store.close()
+
+
+def record(name="s1", status=DeploymentStatus.COMPLETED, host="10.0.0.1", age_days=0.0,
+           operation=OperationType.DEPLOY, tasks=0):
+    return DeploymentResponse(
+        deployment_id=str(uuid.uuid4()),
+        solution_type=SolutionType.VPN,
+        solution_name=name,
+        status=status,
+        message="",
+        operation=operation,
+        target_host=host,
+        created_at=datetime.now(timezone.utc) - timedelta(days=age_days),
+        tasks=[TaskResult(task_name=f"task {index}", status="ok") for index in range(tasks)],
+    )
+
+
+def test_pages_walk_newest_first(store):
+    saved = [record(name=f"s{index}") for index in range(7)]
+    for item in saved:
+        store.save(item)
+    seen, cursor = [], None
+    while True:
+        page = store.list(limit=3, cursor=cursor)
+        assert page.total == 7
+        seen.append([item.deployment_id for item in page.items])
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    newest_first = [item.deployment_id for item in reversed(saved)]
+    assert seen == [newest_first[0:3], newest_first[3:6], newest_first[6:]]
+
+
+def test_exact_last_page_has_no_cursor(store):
+    for index in range(4):
+        store.save(record(name=f"s{index}"))
+    first = store.list(limit=2)
+    second = store.list(limit=2, cursor=first.next_cursor)
+    assert len(second.items) == 2
+    assert second.next_cursor is None
+
+
+def test_saving_again_keeps_position(store):
+    first, second = record(name="a"), record(name="b")
+    store.save(first)
+    store.save(second)
+    first.status = DeploymentStatus.FAILED
+    store.save(first)
+    page = store.list()
+    assert [item.solution_name for item in page.items] == ["b", "a"]
+    assert page.items[1].status == DeploymentStatus.FAILED
+
+
+def test_filters_combine_with_pagination(store):
+    for index in range(6):
+        store.save(record(name="s1", host="10.0.0.1" if index % 2 else "10.0.0.2",
+                          status=DeploymentStatus.FAILED if index == 5 else DeploymentStatus.COMPLETED))
+    page = store.list(limit=2, host="10.0.0.1")
+    assert page.total == 3
+    rest = store.list(limit=2, cursor=page.next_cursor, host="10.0.0.1")
+    assert len(page.items) + len(rest.items) == 3
+    assert all(item.target_host == "10.0.0.1" for item in page.items + rest.items)
+    assert store.list(host="10.0.0.1", status=DeploymentStatus.FAILED).total == 1
+    assert store.latest(solution_name="s1", status="failed").status == DeploymentStatus.FAILED
+    with pytest.raises(ValueError):
+        store.list(colour="blue")
+
+
+def test_created_window(store):
+    store.save(record(name="old", age_days=10))
+    store.save(record(name="new"))
+    cutoff = datetime.now(timezone.utc) - timedelta(days=1)
+    assert [item.solution_name for item in store.list(created_after=cutoff).items] == ["new"]
+    assert [item.solution_name for item in store.list(created_before=cutoff).items] == ["old"]
+
+
+def test_invalid_cursor(store):
+    with pytest.raises(ValueError):
+        store.list(cursor="not a cursor!")
+
+
+def test_retention_deletes_old_finished_records(store):
+    old = record(name="old", age_days=100)
+    running = record(name="running", age_days=100, status=DeploymentStatus.IN_PROGRESS)
+    recent = record(name="recent", age_days=1)
+    for item in (old, running, recent):
+        store.save(item)
+    stats = store.apply_retention(RetentionPolicy(max_age_days=90, max_records=None, compact_after_days=None))
+    assert stats["deleted"] == 1
+    assert store.get(old.deployment_id) is None
+    assert store.get(running.deployment_id) is not None
+    assert store.get(recent.deployment_id) is not None
+
+
+def test_retention_keeps_newest_records(store):
+    saved = [record(name=f"s{index}") for index in range(5)]
+    for item in saved:
+        store.save(item)
+    store.apply_retention(RetentionPolicy(max_age_days=None, max_records=3, compact_after_days=None))
+    kept = [item.deployment_id for item in store.list().items]
+    assert kept == [item.deployment_id for item in reversed(saved[2:])]
+
+
+def test_retention_compacts_task_detail(store):
+    old = record(name="old", age_days=10, tasks=3)
+    recent = record(name="recent", tasks=3)
+    store.save(old)
+    store.save(recent)
+    stats = store.apply_retention(RetentionPolicy(max_age_days=None, max_records=None, compact_after_days=7))
+    assert stats["compacted"] == 1
+    assert store.get(old.deployment_id).tasks == []
+    assert len(store.get(recent.deployment_id).tasks) == 3
+
+
+def test_retention_expires_idempotency_keys(store):
+    store.claim_key("expired", "f1", "d1", time.time() - 1)
+    store.claim_key("live", "f2", "d2", time.time() + 60)
+    stats = store.apply_retention(RetentionPolicy(max_age_days=None, max_records=None, compact_after_days=None))
+    assert stats["expired_keys"] == 1
+    assert store.claim_key("live", "f3", "d3", time.time() + 60).deployment_id == "d2"
+
+
+def test_claim_replace_release_key(store):
+    expires = time.time() + 60
+    assert store.claim_key("k", "f1", "d1", expires) is None
+    existing = store.claim_key("k", "f2", "d2", expires)
+    assert (existing.fingerprint, existing.deployment_id) == ("f1", "d1")
+    assert not store.replace_key("k", "other", "f2", "d2", expires)
+    assert store.replace_key("k", "d1", "f2", "d2", expires)
+    store.release_key("k", "d1")  # not the key's deployment any more: kept
+    assert store.claim_key("k", "f3", "d3", expires).deployment_id == "d2"
+    store.release_key("k", "d2")
+    assert store.claim_key("k", "f3", "d3", expires) is None
+
+
+def test_expired_key_can_be_claimed_again(store):
+    store.claim_key("k", "f1", "d1", time.time() - 1)
+    assert store.claim_key("k", "f2", "d2", time.time() + 60) is None
+    assert store.claim_key("k", "f3", "d3", time.time() + 60).deployment_id == "d2"
+
+
+def test_sqlite_records_survive_reopening(tmp_path):
+    path = str(tmp_path / "apm.db")
+    first = SQLiteStore(path)
+    saved = record(name="persisted")
+    first.save(saved)
+    first.close()
+    reopened = SQLiteStore(path)
+    assert reopened.get(saved.deployment_id).solution_name == "persisted"
+    reopened.close()
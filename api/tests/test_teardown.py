@@ -0,0 +1,81 @@
+"""
+Teardown: delete levels from references, reference cycles, barriers and failed deletes
+"""
+import httpx
+import pytest
+
+from api.services.planner import Change, Plan
+from api.services.teardown import Teardown, TeardownGraph
+
+PROFILES = "/mgmt/tm/apm/profile/access"
+POLICIES = "/mgmt/tm/apm/policy/access-policy"
+ITEMS = "/mgmt/tm/apm/policy/policy-item"
+NODES = "/mgmt/tm/ltm/node"
+
+
+def create(client, collection, name, **fields):
+    body = {"name": name, "partition": "Common", **fields}
+    assert client.post(collection, json=body).status_code == 200
+    return client.get(f"{collection}/~Common~{name}").json()
+
+
+def delete(client, collection, current):
+    return Change("delete", "DELETE", f"{collection}/~Common~{current['name']}", None,
+                  f"/Common/{current['name']}", False, "deleted by the playbook", client, current)
+
+
+@pytest.fixture
+def solution(client):
+    """Deletes in playbook order (items first), though the profile refers to the policy, which refers to the items"""
+    item = create(client, ITEMS, "vpn_ent", accessPolicy="/Common/vpn")
+    policy = create(client, POLICIES, "vpn", startItem="vpn_ent", items=[{"name": "vpn_ent", "partition": "Common"}])
+    profile = create(client, PROFILES, "vpn_ap", accessPolicy="/Common/vpn")
+    return [delete(client, ITEMS, item), delete(client, POLICIES, policy), delete(client, PROFILES, profile)]
+
+
+def test_levels_delete_referrers_first(solution):
+    graph = TeardownGraph(Plan(changes=solution))
+    assert graph.describe() == [["/Common/vpn_ap"], ["/Common/vpn"], ["/Common/vpn_ent"]]
+
+
+def test_independent_objects_share_a_level(client):
+    changes = [delete(client, NODES, create(client, NODES, f"web{n}", address=f"10.0.0.{n}")) for n in range(3)]
+    assert TeardownGraph(Plan(changes=changes)).describe() == [["/Common/web0", "/Common/web1", "/Common/web2"]]
+
+
+def test_reference_cycle_falls_back_to_playbook_order(client):
+    first = create(client, NODES, "a", address="10.0.0.1", description="/Common/b")
+    second = create(client, NODES, "b", address="10.0.0.2", description="/Common/a")
+    graph = TeardownGraph(Plan(changes=[delete(client, NODES, first), delete(client, NODES, second)]))
+    assert graph.describe() == [["/Common/a"], ["/Common/b"]]
+
+
+def test_barrier_keeps_its_playbook_position(client, solution):
+    barrier = Change("send", "PATCH", f"{PROFILES}/~Common~other", {"generationAction": "increment"},
+                     "/Common/other", False, "apply access policy", client)
+    graph = TeardownGraph(Plan(changes=[solution[2], barrier, solution[0], solution[1]]))
+    steps = [(step.action if step else None, [node.change.name for node in level]) for step, level in graph.steps()]
+    assert steps == [(None, ["/Common/vpn_ap"]), ("send", []), (None, ["/Common/vpn"]), (None, ["/Common/vpn_ent"])]
+
+
+def test_run_deletes_everything(client, pool, device, solution):
+    result = Teardown(pool).run(TeardownGraph(Plan(changes=solution)))
+    assert not result.failed
+    assert [task.task_name for task in result.tasks] == ["delete /Common/vpn_ap", "delete /Common/vpn",
+                                                         "delete /Common/vpn_ent"]
+    assert not any(device.objects.get(collection) for collection in (ITEMS, POLICIES, PROFILES))
+
+
+def test_failed_delete_leaves_what_it_references(client, pool, transport, device, solution):
+    def in_use(request):
+        if request.method == "DELETE" and request.url.path.startswith(PROFILES):
+            return httpx.Response(400, json={"message": "in use by a virtual server"}, request=request)
+        return None
+    transport.intercept = in_use
+
+    result = Teardown(pool).run(TeardownGraph(Plan(changes=solution)))
+
+    assert result.failed
+    assert [task.status for task in result.tasks] == ["failed", "skipped", "skipped"]
+    assert transport.count("DELETE") == 1
+    assert device.objects[POLICIES] and device.objects[ITEMS]
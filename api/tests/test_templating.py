@@ -0,0 +1,192 @@
+"""
+Native templating: filter parity with Ansible and Ansible's templating rules
+"""
+import jinja2
+import pytest
+import yaml
+
+from api.services.templating import (
+    FILTERS, TemplateError, UnsafeText, VariableScope, templar, to_bool, wrap_unsafe,
+)
+
+# (filter, positional arguments, keyword arguments) compared with Ansible's own filter plugins
+PARITY_CASES = [
+    ("bool", ("yes",), {}),
+    ("bool", ("On",), {}),
+    ("bool", ("1",), {}),
+    ("bool", (1,), {}),
+    ("bool", ("no",), {}),
+    ("bool", ("y",), {}),
+    ("bool", ("t",), {}),
+    ("bool", (0,), {}),
+    ("bool", (None,), {}),
+    ("combine", ({"a": 1, "b": {"x": 1}}, {"b": {"y": 2}}), {}),
+    ("combine", ({"a": 1, "b": {"x": 1}}, {"b": {"y": 2}}), {"recursive": True}),
+    ("combine", ({"a": [1]}, {"a": [2]}), {"list_merge": "append"}),
+    ("combine", ({"a": [1]}, {"a": [2]}), {"list_merge": "prepend"}),
+    ("combine", ([{"a": 1}, {"b": 2}],), {}),
+    ("regex_replace", ("abc-def", "-(\\w+)", "_\\1"), {}),
+    ("regex_replace", ("ABC", "b", "x"), {"ignorecase": True}),
+    ("regex_replace", ("a\nb", "^", "> "), {"multiline": True}),
+    ("regex_search", ("abc123", "\\d+"), {}),
+    ("regex_search", ("abc", "\\d+"), {}),
+    ("ternary", (True, "a", "b"), {}),
+    ("ternary", ("", "a", "b"), {}),
+    ("ternary", (None, "a", "b", "n"), {}),
+    ("ternary", (None, "a", "b"), {}),
+    ("dict2items", ({"a": 1, "b": 2},), {}),
+    ("dict2items", ({"a": 1},), {"key_name": "name", "value_name": "val"}),
+    ("items2dict", ([{"key": "a", "value": 1}],), {}),
+    ("items2dict", ([{"name": "a", "val": 1}],), {"key_name": "name", "value_name": "val"}),
+    ("flatten", ([1, [2, [3, [4]]]],), {}),
+    ("flatten", ([1, [2, [3, [4]]]],), {"levels": 1}),
+    ("unique", ([1, 2, 1, "a", "a"],), {}),
+    ("unique", ([{"a": 1}, {"a": 1}, [1], [1]],), {}),
+    ("b64encode", ("hé",), {}),
+    ("b64decode", ("aMOp",), {}),
+    ("basename", ("/a/b.txt",), {}),
+    ("dirname", ("/a/b.txt",), {}),
+    ("quote", ("it's",), {}),
+    ("to_json", ({"a": 1},), {}),
+    ("to_nice_json", ({"b": 1, "a": [1]},), {}),
+    ("from_json", ('{"a": 1}',), {}),
+    ("to_yaml", ({"a": 1, "b": [1, 2]},), {}),
+    ("to_yaml", ({"name": "café"},), {}),
+    ("to_nice_yaml", ({"a": {"b": 1}},), {}),
+    ("to_nice_yaml", ({"a": {"b": 1}},), {"indent": 2}),
+    ("from_yaml", ("a: [1, 2]",), {}),
+]
+
+
+@pytest.fixture(scope="module")
+def ansible_filters():
+    core = pytest.importorskip("ansible.plugins.filter.core")
+    mathstuff = pytest.importorskip("ansible.plugins.filter.mathstuff")
+    filters = {**core.FilterModule().filters(), **mathstuff.FilterModule().filters()}
+    environment = jinja2.Environment()
+
+    def unique(value, *args, **kwargs):  # Ansible passes the Jinja environment first
+        return mathstuff.unique(environment, value, *args, **kwargs)
+
+    filters["unique"] = unique
+    return filters
+
+
+@pytest.mark.parametrize("name, args, kwargs", PARITY_CASES,
+                         ids=[f"{case[0]}-{index}" for index, case in enumerate(PARITY_CASES)])
+def test_filter_matches_ansible(ansible_filters, name, args, kwargs):
+    assert FILTERS[name](*args, **kwargs) == ansible_filters[name](*args, **kwargs)
+
+
+def test_module_arguments_accept_more_booleans_than_the_filter():
+    assert to_bool("y") and to_bool("t") and to_bool(" True ")
+    assert not FILTERS["bool"]("y")
+
+
+def test_single_expression_keeps_native_types():
+    variables = {"items": [1, 2], "config": {"a": 1}, "flag": True, "count": 3}
+    assert templar.template("{{ items }}", variables) == [1, 2]
+    assert templar.template("{{ config }}", variables) == {"a": 1}
+    assert templar.template("{{ flag }}", variables) is True
+    assert templar.template("{{ count + 1 }}", variables) == "4"  # numbers come back as text
+    assert templar.template("{{ none_value }}", {"none_value": None}) == ""
+
+
+def test_rendered_text_that_looks_like_data_is_converted():
+    assert templar.template("[{{ a }}, {{ b }}]", {"a": 1, "b": 2}) == [1, 2]
+    assert templar.template("{{ a }}-{{ b }}", {"a": 1, "b": 2}) == "1-2"
+
+
+def test_structures_are_rendered_recursively():
+    value = {"{{ key }}": ["{{ a }}", {"nested": "{{ a | upper }}"}], "plain": 1}
+    assert templar.template(value, {"key": "k", "a": "x"}) == {"k": ["x", {"nested": "X"}], "plain": 1}
+
+
+def test_backslashes_in_expressions_reach_the_filter():
+    # What YAML hands over for regex_replace('\\.', '-') and a '\\1' backreference
+    assert templar.template("{{ 'a.b' | regex_replace('\\.', '-') }}", {}) == "a-b"
+    assert templar.template("{{ 'ab' | regex_replace('(a)', '\\1\\1') }}", {}) == "aab"
+
+
+def test_undefined_variables_raise():
+    with pytest.raises(TemplateError):
+        templar.template("{{ missing }}", {})
+    with pytest.raises(TemplateError):
+        templar.template("{{ missing | mandatory }}", {})
+    assert templar.template("{{ missing | default('d') }}", {}) == "d"
+
+
+def test_conditionals():
+    variables = {"flag": "yes", "result": {"failed": False, "changed": True, "status": 409}}
+    assert templar.conditional("flag | bool", variables)
+    assert templar.conditional(["result is changed", "result is success"], variables)
+    assert templar.conditional("result.status in [200, 409]", variables)
+    assert not templar.conditional("result is failed", variables)
+    assert not templar.conditional("{{ 'False' }}", variables)
+    assert templar.conditional(None, variables)
+    assert templar.conditional("'10.1.20.6' is match('10\\.1\\.')", variables)
+
+
+def test_variable_scope_templates_lazily_by_precedence():
+    extra = {"vs1_name": "from-extra"}
+    facts = {}
+    play = {"vs1_name": "from-play", "profile": "{{ vs1_name }}-psp"}
+    scope = VariableScope(templar, [extra, facts, play])
+    assert scope["profile"] == "from-extra-psp"
+    child = scope.child({"item": "{{ profile }}"})
+    assert child["item"] == "from-extra-psp"
+
+
+def test_variable_scope_detects_recursion():
+    scope = VariableScope(templar, [{}, {}, {"a": "{{ b }}", "b": "{{ a }}"}])
+    with pytest.raises(TemplateError):
+        scope["a"]
+
+
+PAYLOAD = "{{ cycler.__init__.__globals__.os.popen('echo PWNED').read() }}"
+
+
+def request_scope(**play_vars):
+    extra = wrap_unsafe({"ad_domain": PAYLOAD, "password": "pa{{ss", "ad_config": {"domain": PAYLOAD}})
+    return VariableScope(templar, [extra, {}, play_vars])
+
+
+def test_request_values_are_never_templated():
+    scope = request_scope(domain="{{ ad_domain }}", realm="{{ ad_domain | upper }}.{{ ad_config.domain }}",
+                          password="{{ password }}")
+    assert scope["ad_domain"] == PAYLOAD
+    assert scope["domain"] == PAYLOAD
+    assert scope["password"] == "pa{{ss"
+    assert scope["realm"] == PAYLOAD.upper() + "." + PAYLOAD
+    assert templar.template({"body": {"domain": "{{ ad_config.domain }}"}}, scope) == {"body": {"domain": PAYLOAD}}
+
+
+def test_values_rendered_from_request_data_stay_unsafe():
+    scope = request_scope(fqdn="pre-{{ ad_domain }}")
+    fact = scope["fqdn"]
+    assert isinstance(fact, UnsafeText)
+    # a set_fact of the rendered value is not evaluated when read back
+    assert templar.template(fact, scope) == "pre-" + PAYLOAD
+    assert yaml.safe_load(templar.template("{{ fact | to_yaml }}", {"fact": fact})) == "pre-" + PAYLOAD
+
+
+def test_conditionals_from_request_data_are_refused():
+    with pytest.raises(TemplateError):
+        templar.conditional("{{ ad_domain }}", request_scope())
+    assert templar.conditional("ad_domain | length > 0", request_scope())
+
+
+def test_templates_are_sandboxed():
+    with pytest.raises(TemplateError):
+        templar.template(PAYLOAD, {})
+    with pytest.raises(TemplateError):
+        templar.template("x {{ ''.__class__.__mro__[1].__subclasses__() }}", {})
+    with pytest.raises(TemplateError):
+        templar.template("{{ items.append(1) }}", {"items": []})
+
+
+@pytest.mark.parametrize("source", ["{{ lookup('file', '/etc/passwd') }}", "{{ lookup('env', 'HOME') }}",
+                                    "{{ query('file', '/etc/passwd') }}"])
+def test_lookups_are_not_available(source):
+    with pytest.raises(TemplateError):
+        templar.template(source, {})
@@ -0,0 +1,113 @@
+"""
+AdaptiveLimiter and RetryPolicy: AIMD limits, one backoff per burst and jittered retries
+"""
+import threading
+import time
+
+import httpx
+import pytest
+
+from api.services.f5_client import ClientPool
+from api.services.throttle import AdaptiveLimiter, DeviceLimiters, RetryPolicy
+
+from .conftest import BIGIP
+
+
+def call(limiter, status_code=200, seconds=0.001, endpoint="/mgmt/tm/ltm/node"):
+    started = limiter.acquire()
+    limiter.release(started - seconds, endpoint, status_code)
+
+
+def test_answered_calls_raise_the_limit_additively():
+    limiter = AdaptiveLimiter("bigip:443", initial=4, max_limit=6)
+    for _ in range(4):
+        call(limiter)
+    assert 4.9 < limiter.limit < 5.0  # one slot per round of calls
+    for _ in range(50):
+        call(limiter)
+    assert limiter.limit == 6
+
+
+@pytest.mark.parametrize("status_code", [503, 429, None])
+def test_overload_halves_the_limit(status_code):
+    limiter = AdaptiveLimiter("bigip:443", initial=8)
+    call(limiter, status_code)
+    assert (limiter.limit, limiter.decreases) == (4, 1)
+
+
+def test_one_burst_of_failures_backs_off_once():
+    limiter = AdaptiveLimiter("bigip:443", initial=8)
+    burst = [limiter.acquire() for _ in range(6)]
+    for started in burst:
+        limiter.release(started, "/mgmt/tm/ltm/node", 503)
+    assert (limiter.limit, limiter.decreases) == (4, 1)
+
+    call(limiter, 503, seconds=0.0)  # sent after the cut
+    assert (limiter.limit, limiter.decreases) == (2, 2)
+    for _ in range(5):
+        call(limiter, 503, seconds=0.0)
+    assert limiter.limit == limiter.min_limit == 1
+
+
+def test_call_much_slower_than_its_endpoint_counts_as_overload():
+    limiter = AdaptiveLimiter("bigip:443", initial=8, max_limit=8)
+    for _ in range(5):
+        call(limiter, seconds=0.05)
+    call(limiter, seconds=0.4)  # slow, but under MIN_OVERLOAD_LATENCY
+    assert limiter.decreases == 0
+    call(limiter, seconds=2.0)
+    assert (limiter.limit, limiter.decreases) == (4, 1)
+    call(limiter, seconds=2.0, endpoint="/mgmt/tm/sys/config")  # no baseline yet for this endpoint
+    assert limiter.decreases == 1
+
+
+def test_callers_over_the_limit_wait_for_a_slot():
+    limiter = AdaptiveLimiter("bigip:443", initial=1)
+    started = limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+
+    limiter.release(started, "/mgmt/tm/ltm/node", 200)
+    waiter.join(1.0)
+    assert not waiter.is_alive() and limiter.in_flight == 1
+
+
+def test_retry_policy_only_repeats_what_is_safe():
+    policy = RetryPolicy(retries=2)
+    assert policy.retry_status("GET", 503, 0) and not policy.retry_status("GET", 503, 2)
+    assert not policy.retry_status("POST", 503, 0) and not policy.retry_status("GET", 500, 0)
+    assert policy.retry_error("POST", httpx.ConnectError("refused"), 0)
+    assert not policy.retry_error("POST", httpx.ReadTimeout("slow"), 0)
+    assert policy.retry_error("DELETE", httpx.ReadTimeout("slow"), 0)
+
+
+def test_retry_delay_is_jittered_and_honours_retry_after():
+    policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+    delays = [policy.delay(attempt) for attempt in range(6) for _ in range(20)]
+    assert all(0 <= delay <= 3.0 for delay in delays) and len(set(delays)) > 1
+    assert policy.delay(0, httpx.Response(503, headers={"Retry-After": "2"})) == 2.0
+    assert policy.delay(0, httpx.Response(503, headers={"Retry-After": "120"})) == 3.0
+
+
+def test_client_retries_overloaded_reads_and_backs_off(transport):
+    answers = iter([503, 503])
+
+    def overloaded(request):
+        if request.url.path == "/mgmt/tm/ltm/node":
+            status_code = next(answers, None)
+            if status_code is not None:
+                return httpx.Response(status_code, json={"message": "busy"}, request=request)
+        return None
+    transport.intercept = overloaded
+    limiters = DeviceLimiters(initial=8)
+    pool = ClientPool(limiters=limiters, transport=transport, retry=RetryPolicy(base_delay=0.01))
+    try:
+        started = time.monotonic()
+        response = pool.for_url(BIGIP, "admin", "admin").get("/mgmt/tm/ltm/node")
+        assert response.status_code == 200 and time.monotonic() - started < 1.0
+        assert transport.count("GET", "/mgmt/tm/ltm/node") == 3
+        assert limiters.snapshot()["bigip.example:443"]["decreases"] == 2
+    finally:
+        pool.close_all()
@@ -0,0 +1,110 @@
+"""
+Transaction: pipelined staging, evalOrder repair before commit and per-command commit errors
+"""
+import httpx
+import pytest
+
+from api.services.transactions import COORDINATION_HEADER, Transaction, TransactionError
+
+NODES = "/mgmt/tm/ltm/node"
+
+
+def node(name):
+    return {"name": name, "partition": "Common", "address": "10.0.0.1"}
+
+
+def queued_names(device, transaction):
+    commands = sorted(device.transactions[transaction.trans_id], key=lambda cmd: cmd["evalOrder"])
+    return [cmd["body"]["name"] for cmd in commands]
+
+
+def hold(*names, seconds=0.1):
+    """Transport delay making the staging calls for ``names`` arrive after the others"""
+    def delay(request):
+        return seconds if any(f'"{name}"'.encode() in request.content for name in names) else 0.0
+    return delay
+
+
+def test_staged_commands_are_committed(device, transport, client):
+    with Transaction.begin(client, concurrency=4) as transaction:
+        for index in range(6):
+            transaction.stage("POST", NODES, json=node(f"n{index}"))
+    assert sorted(device.objects[NODES]) == [f"/Common/n{index}" for index in range(6)]
+    assert transport.count("PATCH", "/mgmt/tm/transaction/") == 0
+
+
+def test_in_order_arrival_costs_one_read(device, transport, client):
+    transaction = Transaction.begin(client, concurrency=1)
+    transaction.concurrency = 4  # staged one by one, so arrival matches staging order
+    for name in ("a", "b", "c"):
+        transaction.stage("POST", NODES, json=node(name)).result()
+    transaction.flush()
+    assert transaction.restore_order() == 0
+    assert transport.count("GET", "/mgmt/tm/transaction/") == 1
+    transaction.close()
+
+
+def test_out_of_order_arrival_is_repaired_before_commit(device, transport, client):
+    transport.delay = hold("a")
+    transaction = Transaction.begin(client, concurrency=4)
+    for name in ("a", "b", "c", "d"):
+        transaction.stage("POST", NODES, json=node(name))
+    transaction.flush()
+    assert queued_names(device, transaction) == ["b", "c", "d", "a"]
+    assert transaction.restore_order() == 1
+    assert queued_names(device, transaction) == ["a", "b", "c", "d"]
+    assert transport.count("PATCH", "/mgmt/tm/transaction/") == 1
+    assert transport.count("GET", "/mgmt/tm/transaction/") == 2  # read, then confirm
+    transaction.commit()
+    assert len(device.objects[NODES]) == 4
+
+
+def test_calls_between_flushes_keep_their_place(device, transport, client):
+    transport.delay = hold("a", "d")
+    transaction = Transaction.begin(client, concurrency=4)
+    transaction.stage("POST", NODES, json=node("a"))
+    transaction.stage("POST", NODES, json=node("b"))
+    transaction.flush()
+    client.post(NODES, json=node("c"), headers={COORDINATION_HEADER: transaction.trans_id})
+    transaction.stage("POST", NODES, json=node("d"))
+    transaction.stage("POST", NODES, json=node("e"))
+    transaction.flush()
+    assert queued_names(device, transaction) == ["b", "a", "c", "e", "d"]
+    transaction.restore_order()
+    assert queued_names(device, transaction) == ["a", "b", "c", "d", "e"]
+    transaction.close()
+
+
+def test_order_that_does_not_stick_is_not_committed(device, transport, client):
+    transport.delay = hold("a")
+    transport.intercept = lambda request: (
+        httpx.Response(200, json={}) if request.method == "PATCH" and "/commands/" in request.url.path else None
+    )
+    transaction = Transaction.begin(client, concurrency=4)
+    for name in ("a", "b"):
+        transaction.stage("POST", NODES, json=node(name))
+    with pytest.raises(TransactionError, match="out of staging order"):
+        transaction.commit()
+    assert transport.count("PUT", "/mgmt/tm/transaction/") == 0
+    assert NODES not in device.objects
+
+
+def test_failed_staging_call_is_reported(device, client):
+    transaction = Transaction.begin(client, concurrency=4)
+    transaction.stage("POST", NODES, json=node("a"))
+    transaction.stage("POST", NODES, json=node("c"), expected_status=(201,))
+    with pytest.raises(TransactionError) as raised:
+        transaction.commit()
+    assert [error["name"] for error in raised.value.command_errors] == ["c"]
+    assert NODES not in device.objects
+
+
+def test_commit_error_names_the_rejected_command(device, client):
+    client.post(NODES, json=node("exists"))
+    transaction = Transaction.begin(client, concurrency=4)
+    for name in ("new1", "exists", "new2"):
+        transaction.stage("POST", NODES, json=node(name))
+    with pytest.raises(TransactionError) as raised:
+        transaction.commit()
+    assert [error["name"] for error in raised.value.command_errors] == ["exists"]
+    assert sorted(device.objects[NODES]) == ["/Common/exists"]
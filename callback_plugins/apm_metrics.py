@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+apm_metrics callback plugin
+
+Records playbook task durations and iControl REST answers for CLI runs and
+writes them as a Prometheus textfile (node_exporter textfile collector).
+"""
+import os
+import sys
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = '''
+    name: apm_metrics
+    type: aggregate
+    short_description: Prometheus textfile metrics for APM playbook runs
+    description:
+      - Task durations and iControl REST status codes per endpoint, written when the play ends.
+    requirements:
+      - prometheus_client
+    options:
+      textfile:
+        description: Path of the .prom file to write
+        default: ./apm_metrics.prom
+        env:
+          - name: APM_METRICS_TEXTFILE
+        ini:
+          - section: callback_apm_metrics
+            key: textfile
+'''
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Histogram, write_to_textfile
+    HAS_PROMETHEUS = True
+except ImportError:
+    HAS_PROMETHEUS = False
+
+# The endpoint normalisation lives in the API package at the repository root
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+if HAS_PROMETHEUS:
+    from api.services.metrics import CALL_BUCKETS, endpoint_path  # noqa: E402
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'apm_metrics'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self.disabled = not HAS_PROMETHEUS
+        if self.disabled:
+            self._display.warning("apm_metrics callback needs prometheus_client; metrics are not written")
+            return
+        self._started = {}
+        self._registry = CollectorRegistry()
+        self._task_latency = Histogram(
+            'apm_task_duration_seconds', 'Playbook task duration', ['playbook', 'task'],
+            buckets=CALL_BUCKETS, registry=self._registry,
+        )
+        self._task_results = Counter(
+            'apm_task_results_total', 'Playbook task results', ['playbook', 'status'],
+            registry=self._registry,
+        )
+        self._bigip_requests = Counter(
+            'apm_bigip_requests_total', 'iControl REST answers by endpoint and status',
+            ['endpoint', 'status'], registry=self._registry,
+        )
+        self._bigip_latency = Histogram(
+            'apm_bigip_request_duration_seconds', 'iControl REST call latency by endpoint',
+            ['method', 'endpoint'], buckets=CALL_BUCKETS, registry=self._registry,
+        )
+        self._playbook = ''
+
+    def v2_playbook_on_start(self, playbook):
+        self._playbook = os.path.basename(playbook._file_name)
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._started[task._uuid] = time.monotonic()
+
+    def v2_runner_on_ok(self, result):
+        self._record(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result, 'ignored' if ignore_errors else 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._record(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._record(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        path = os.path.expanduser(self.get_option('textfile'))
+        try:
+            write_to_textfile(path, self._registry)
+        except OSError as exc:
+            self._display.warning("apm_metrics could not write %s: %s" % (path, exc))
+
+    def _record(self, result, status):
+        task = result._task
+        started = self._started.get(task._uuid)
+        if started is not None:
+            self._task_latency.labels(playbook=self._playbook, task=task.get_name()).observe(
+                time.monotonic() - started
+            )
+        self._task_results.labels(playbook=self._playbook, status=status).inc()
+        # Loop results carry one uri/bigip_rest answer per item
+        for answer in result._result.get('results') or [result._result]:
+            if isinstance(answer, dict):
+                self._record_call(answer)
+
+    def _record_call(self, answer):
+        url = answer.get('url')
+        if not url or '/mgmt/' not in url:
+            return
+        endpoint = endpoint_path('/mgmt/' + url.split('/mgmt/', 1)[1])
+        status = answer.get('status')
+        self._bigip_requests.labels(
+            endpoint=endpoint, status=str(status) if status not in (None, -1) else 'error'
+        ).inc()
+        elapsed = answer.get('elapsed')
+        if isinstance(elapsed, (int, float)):
+            method = (answer.get('invocation', {}).get('module_args', {}).get('method') or 'GET').upper()
+            self._bigip_latency.labels(method=method, endpoint=endpoint).observe(elapsed)
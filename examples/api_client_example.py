@@ -180,6 +180,37 @@ def check_deployment_status(deployment_id: str):
         print(f"Failed to get status: {response.status_code}")
 
 
+def follow_deployment(deployment_id: str):
+    """Stream task progress over Server-Sent Events until the deployment ends"""
+    print(f"\nFollowing deployment: {deployment_id}")
+
+    last_event_id = None
+    while True:
+        headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+        try:
+            with requests.get(f"{API_BASE_URL}/deploy/{deployment_id}/events",
+                              headers=headers, stream=True, timeout=60) as response:
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("id: "):
+                        last_event_id = line[4:]
+                    elif line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: "):
+                        data = json.loads(line[6:])
+                        if event == "task_end":
+                            print(f"  - {data['task']}: {data['status']} "
+                                  f"({data.get('duration') or 0:.2f}s, HTTP {data.get('status_code') or '-'})")
+                        elif event in ("status", "end"):
+                            print(f"Status: {data['status']} - {data.get('message')}")
+                        if event == "end":
+                            return
+        except requests.RequestException as exc:
+            # Reconnect; Last-Event-ID resumes where the stream stopped
+            print(f"Stream interrupted ({exc}), reconnecting...")
+            time.sleep(1)
+
+
 def delete_solution(solution_name: str):
     """Delete a deployed solution"""
     print(f"\nDeleting solution: {solution_name}")
@@ -255,8 +286,7 @@ def main():
     vpn_deployment = deploy_vpn_solution()
 
     if vpn_deployment:
-        time.sleep(1)
-        check_deployment_status(vpn_deployment['deployment_id'])
+        follow_deployment(vpn_deployment['deployment_id'])
 
     # Example 2: Deploy Portal solution
     portal_deployment = deploy_portal_solution()
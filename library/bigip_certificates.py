@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+bigip_certificates - batched certificate and key install
+
+Documentation stub: the work is done on the controller by
+action_plugins/bigip_certificates.py, which shares
+api/services/certificates.py with the REST API service.
+"""
+
+DOCUMENTATION = r'''
+---
+module: bigip_certificates
+short_description: Install certificates and keys on a BIG-IP in one upload and one tmsh run
+description:
+  - Replaces the generate / upload / upload / install / install task sequence.
+  - Reads the device's certificates once and skips those already there (same
+    name and fingerprint, or any existing certificate of that name for
+    self-signed entries).
+  - Uploads the remaining certificates and keys as one bundle file and installs
+    them with a single C(util/bash) call running C(tmsh install sys crypto).
+  - Self-signed entries get an RSA key (pre-generated by the API service) and a
+    certificate for C(common_name).
+  - Runs on the controller via the C(bigip_certificates) action plugin.
+options:
+  url:
+    description: Base URL of the device, e.g. C(https://{{ bigip_mgmt }}:{{ bigip_port }}).
+    required: true
+    type: str
+  user:
+    description: BIG-IP username.
+    required: true
+    type: str
+  password:
+    description: BIG-IP password.
+    required: true
+    type: str
+  validate_certs:
+    description: Validate the device TLS certificate.
+    default: false
+    type: bool
+  certificates:
+    description:
+      - Certificates to have on the device. Each has a C(name) and either
+        C(cert) (or C(content)) PEM, optionally with a C(key), or a
+        C(common_name) (and C(days)) to self-sign.
+    required: true
+    type: list
+    elements: dict
+  partition:
+    description: Partition the objects are installed in.
+    default: Common
+    type: str
+  timeout:
+    description: Request timeout in seconds.
+    default: 60
+    type: int
+  token_cache:
+    description: Path of the shared token cache file.
+    default: ~/.ansible/tmp/bigip_rest_tokens.json
+    type: path
+'''
+
+EXAMPLES = r'''
+- name: Install SAML signing certificate
+  bigip_certificates:
+    url: "https://{{ bigip_mgmt }}:{{ bigip_port }}"
+    user: "{{ bigip_username }}"
+    password: "{{ bigip_password }}"
+    certificates:
+      - name: "{{ vs1_name }}-saml"
+        common_name: "{{ dns1_name }}"
+      - name: "ca.f5lab.local"
+        content: "{{ ca_pem }}"
+  register: result
+'''
+
+RETURN = r'''
+status:
+  description: 200 when every certificate is on the device.
+  returned: always
+  type: int
+certificates:
+  description: C(installed) or C(exists) per certificate name.
+  returned: success
+  type: dict
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+def main():
+    module = AnsibleModule(argument_spec=dict(), bypass_checks=True)
+    module.fail_json(msg="bigip_certificates must run through its action plugin (action_plugins/bigip_certificates.py)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+bigip_rest - token-authenticated iControl REST call
+
+Documentation stub: the work is done on the controller by
+action_plugins/bigip_rest.py, which shares api/services/f5_client.py with
+the REST API service.
+"""
+
+DOCUMENTATION = r'''
+---
+module: bigip_rest
+short_description: Send an iControl REST request using a pooled, token-authenticated client
+description:
+  - Drop-in replacement for the C(uri) tasks that talk to a BIG-IP.
+  - Logs in once for an C(X-F5-Auth-Token) and reuses it (and its keep-alive
+    connections) instead of sending HTTP basic auth on a new TLS connection per call.
+  - Tokens are shared between tasks through a token cache file, so a playbook
+    run performs one login per token lifetime.
+  - Runs on the controller via the C(bigip_rest) action plugin.
+options:
+  url:
+    description: Full iControl REST URL, e.g. C(https://{{ bigip_mgmt }}:{{ bigip_port }}/mgmt/tm/apm/policy/policy-item).
+    required: true
+    type: str
+  method:
+    description: HTTP method.
+    default: GET
+    type: str
+  user:
+    description: BIG-IP username.
+    required: true
+    type: str
+  password:
+    description: BIG-IP password.
+    required: true
+    type: str
+  validate_certs:
+    description: Validate the device TLS certificate.
+    default: false
+    type: bool
+  body:
+    description: Request body. Dicts/lists are sent as JSON, strings are sent as-is.
+    type: raw
+  body_format:
+    description: Accepted for C(uri) compatibility; only C(json) is supported.
+    default: json
+    type: str
+  headers:
+    description: Extra request headers, e.g. C(X-F5-REST-Coordination-Id).
+    type: dict
+  status_code:
+    description: Status codes that count as success.
+    default: [200]
+    type: list
+    elements: int
+  timeout:
+    description: Request timeout in seconds.
+    default: 60
+    type: int
+  token_cache:
+    description: Path of the shared token cache file.
+    default: ~/.ansible/tmp/bigip_rest_tokens.json
+    type: path
+'''
+
+EXAMPLES = r'''
+- name: Create access policy item
+  bigip_rest:
+    url: "https://{{ bigip_mgmt }}:{{ bigip_port }}/mgmt/tm/apm/policy/policy-item/"
+    method: POST
+    user: "{{ bigip_username }}"
+    password: "{{ bigip_password }}"
+    validate_certs: "{{ bigip_validate_certs }}"
+    headers:
+      X-F5-REST-Coordination-Id: "{{ trans_id }}"
+    body:
+      name: "{{ vs1_name }}-psp_end_deny"
+      partition: "Common"
+    status_code: [200, 201, 409]
+  register: result
+'''
+
+RETURN = r'''
+status:
+  description: HTTP status code.
+  returned: always
+  type: int
+url:
+  description: Requested URL.
+  returned: always
+  type: str
+json:
+  description: Decoded JSON response body.
+  returned: when the response is JSON
+  type: raw
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+def main():
+    module = AnsibleModule(argument_spec=dict(), bypass_checks=True)
+    module.fail_json(msg="bigip_rest must run through its action plugin (action_plugins/bigip_rest.py)")
+
+
+if __name__ == '__main__':
+    main()